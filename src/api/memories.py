@@ -1,17 +1,41 @@
 """記憶 API 路由"""
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import and_, or_, insert, select, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from uuid import UUID
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+from uuid import UUID, uuid4
+import os
+from pydantic import BaseModel, field_validator
 from datetime import datetime
+from src.core.permissions import PermissionManager
 from src.utils.auth import get_current_agent
+from src.utils.auth_cache import AgentSnapshot
 from src.services.embedding_service import EmbeddingService
+from src.services.model_registry import get_embedding_service
+from src.services.vector_index import VectorIndexManager, get_vector_index_manager
+from src.services.embedding_jobs import (
+    enqueue_embedding, write_behind_enabled, EMBEDDING_PENDING, EMBEDDING_READY, JOB_QUEUED
+)
+from src.utils.pagination import encode_cursor, decode_cursor
 from src.db.database import get_db
-from src.models.models import Memory, Agent
+from src.models.models import (
+    Memory, MemoryEmbedding, EmbeddingJob, ACTIVE_EMBEDDING_MODEL, MEMORY_LIGHT, memory_shared_agents
+)
 
 router = APIRouter(prefix="/memories", tags=["memories"])
 
+# 列表接口的默認和最大分頁大小
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = int(os.getenv("MEMORIES_MAX_PAGE_SIZE", "200"))
+
+# 批量創建：單次請求的最大條數、每次 encode 的文本數和每個事務插入的行數
+MAX_BULK_ITEMS = int(os.getenv("MEMORIES_MAX_BULK_ITEMS", "5000"))
+BULK_EMBEDDING_BATCH_SIZE = int(os.getenv("MEMORIES_BULK_EMBEDDING_BATCH_SIZE", "64"))
+BULK_INSERT_CHUNK_SIZE = int(os.getenv("MEMORIES_BULK_INSERT_CHUNK_SIZE", "500"))
+
 
 class MemoryCreate(BaseModel):
     """創建記憶的請求"""
@@ -21,6 +45,11 @@ class MemoryCreate(BaseModel):
     visibility: str = "private"
 
 
+class MemoryBulkCreate(BaseModel):
+    """批量創建記憶的請求"""
+    items: List[MemoryCreate]
+
+
 class MemoryUpdate(BaseModel):
     """更新記憶的請求"""
     content: str
@@ -36,16 +65,48 @@ class MemoryResponse(BaseModel):
     visibility: str
     created_at: datetime
     updated_at: datetime
+    embedding_status: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+    @field_validator("id", mode="before")
+    @classmethod
+    def _id_to_str(cls, value):
+        """ORM 的 id 是 UUID，響應中返回字符串"""
+        return str(value)
+
+
+async def embed_or_enqueue(
+    db: AsyncSession,
+    memory: Memory,
+    embedding_service: EmbeddingService
+) -> None:
+    """為記憶生成嵌入，寫後模式或生成失敗時加入後台嵌入任務
+
+    Args:
+        db: 數據庫會話
+        memory: 記憶（內容已設置）
+        embedding_service: 嵌入服務
+    """
+    if write_behind_enabled():
+        await db.run_sync(enqueue_embedding, memory)
+        return
+    try:
+        memory.embeddings = await embedding_service.get_embeddings(memory.content)
+        memory.embedding_status = EMBEDDING_READY
+    except Exception:
+        # 嵌入失敗時仍然保存記憶，由後台任務重試
+        await db.run_sync(enqueue_embedding, memory)
+
 
 @router.post("", status_code=201)
 async def create_memory(
     memory_data: MemoryCreate,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
+    index_manager: VectorIndexManager = Depends(get_vector_index_manager)
 ) -> MemoryResponse:
     """創建新記憶"""
     memory = Memory(
@@ -57,39 +118,311 @@ async def create_memory(
         visibility=memory_data.visibility
     )
 
-    # 生成嵌入
-    try:
-        embedding_service = EmbeddingService()
-        embeddings = await embedding_service.get_embeddings(memory_data.content)
-        memory.embeddings = embeddings
-        memory.embedding_updated_at = datetime.utcnow()
-    except Exception as e:
-        # 如果嵌入失敗，仍然創建記憶但不設置嵌入
-        pass
+    # 生成嵌入；寫後模式或嵌入失敗時交給後台任務
+    await embed_or_enqueue(db, memory, embedding_service)
 
     db.add(memory)
-    db.commit()
-    db.refresh(memory)
+    await db.commit()
+    await db.refresh(memory)
+    index_manager.upsert(memory)
 
     return MemoryResponse.model_validate(memory)
 
 
+async def embed_in_batches(
+    embedding_service: EmbeddingService,
+    texts: List[str],
+    batch_size: int = BULK_EMBEDDING_BATCH_SIZE
+) -> List[Optional[List[float]]]:
+    """按長度排序後分批生成嵌入
+
+    長度相近的文本放在同一批，減少 encode 時的填充浪費。
+    某一批失敗時只影響該批，對應位置返回 None。
+
+    Args:
+        embedding_service: 嵌入服務
+        texts: 文本列表
+        batch_size: 每批文本數
+
+    Returns:
+        與 texts 一一對應的嵌入列表
+    """
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        try:
+            batch = await embedding_service.batch_embeddings(
+                [texts[i] for i in indices], batch_size=batch_size
+            )
+        except Exception:
+            # 與單條創建一致：嵌入失敗時仍然保存記憶
+            continue
+        for i, embedding in zip(indices, batch):
+            embeddings[i] = embedding
+    return embeddings
+
+
+def _insert_rows(db: Session, rows: List[Dict]) -> None:
+    """插入記憶行、向量行及 pending 行的嵌入任務（不提交）
+
+    行字典中的 embeddings 寫入 memory_embedding，其餘列寫入 memory。
+    """
+    db.execute(insert(Memory), [
+        {key: value for key, value in row.items() if key != "embeddings"} for row in rows
+    ])
+    vectors = [
+        {"memory_id": row["id"], "model_name": ACTIVE_EMBEDDING_MODEL,
+         "embeddings": row["embeddings"], "updated_at": row.get("updated_at") or datetime.utcnow()}
+        for row in rows if row.get("embeddings") is not None
+    ]
+    if vectors:
+        db.execute(insert(MemoryEmbedding), vectors)
+    jobs = [
+        {"memory_id": row["id"], "status": JOB_QUEUED}
+        for row in rows if row.get("embedding_status") == EMBEDDING_PENDING
+    ]
+    if jobs:
+        db.execute(insert(EmbeddingJob), jobs)
+
+
+def insert_in_chunks(
+    db: Session,
+    rows: List[Dict],
+    chunk_size: int = BULK_INSERT_CHUNK_SIZE
+) -> Dict[int, str]:
+    """分塊批量插入記憶，每塊一個事務
+
+    pending 狀態的記憶在同一事務中加入嵌入任務。
+    某塊失敗時回滾並逐行重試，只有出錯的行被跳過。
+
+    Args:
+        db: 數據庫會話
+        rows: Memory 列值字典列表
+        chunk_size: 每個事務的行數
+
+    Returns:
+        {行下標: 錯誤信息}
+    """
+    errors: Dict[int, str] = {}
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            _insert_rows(db, chunk)
+            db.commit()
+            continue
+        except SQLAlchemyError:
+            db.rollback()
+
+        for offset, row in enumerate(chunk):
+            try:
+                _insert_rows(db, [row])
+                db.commit()
+            except SQLAlchemyError as e:
+                db.rollback()
+                errors[start + offset] = str(e.orig if getattr(e, "orig", None) else e)
+    return errors
+
+
+@router.post("/bulk")
+async def create_memories_bulk(
+    request: MemoryBulkCreate,
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
+    index_manager: VectorIndexManager = Depends(get_vector_index_manager)
+):
+    """批量創建記憶
+
+    邏輯：
+        1. 校驗每一條，內容為空的條目直接報錯
+        2. 按內容長度排序分批調用 batch_embeddings（寫後模式跳過）
+        3. 分塊批量插入，每塊一個事務；未嵌入的條目同時加入後台嵌入任務
+        4. 同步常駐向量索引
+
+    Returns:
+        results: 每條的 index、id（失敗時為 None）、embedded、embedding_status 和 error
+    """
+    if len(request.items) > MAX_BULK_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"單次最多創建 {MAX_BULK_ITEMS} 條記憶"
+        )
+
+    results = [
+        {"index": i, "id": None, "embedded": False, "embedding_status": None, "error": None}
+        for i in range(len(request.items))
+    ]
+    valid = []
+    for i, item in enumerate(request.items):
+        if not item.content or not item.content.strip():
+            results[i]["error"] = "內容不能為空"
+        else:
+            valid.append(i)
+
+    if write_behind_enabled():
+        embeddings = [None] * len(valid)
+    else:
+        embeddings = await embed_in_batches(
+            embedding_service,
+            [request.items[i].content for i in valid],
+            batch_size=BULK_EMBEDDING_BATCH_SIZE
+        )
+
+    now = datetime.utcnow()
+    rows = []
+    for i, embedding in zip(valid, embeddings):
+        item = request.items[i]
+        rows.append({
+            "id": uuid4(),
+            "workspace_id": current_agent.workspace_id,
+            "created_by_agent_id": current_agent.id,
+            "type": item.type,
+            "category": item.category,
+            "content": item.content,
+            "visibility": item.visibility,
+            "is_deleted": False,
+            "created_at": now,
+            "updated_at": now,
+            "embeddings": embedding,
+            "embedding_status": EMBEDDING_READY if embedding is not None else EMBEDDING_PENDING,
+        })
+
+    errors = await db.run_sync(insert_in_chunks, rows, BULK_INSERT_CHUNK_SIZE)
+    for row_index, (i, row) in enumerate(zip(valid, rows)):
+        if row_index in errors:
+            results[i]["error"] = errors[row_index]
+            continue
+        results[i]["id"] = str(row["id"])
+        results[i]["embedded"] = row["embeddings"] is not None
+        results[i]["embedding_status"] = row["embedding_status"]
+        index_manager.upsert(Memory(**row))
+
+    created = sum(1 for r in results if r["id"] is not None)
+    return {
+        "results": results,
+        "created": created,
+        "failed": len(results) - created
+    }
+
+
+class MemoryLookup(BaseModel):
+    """按 ID 批量讀取記憶的請求"""
+    ids: List[UUID]
+
+
+@router.post("/lookup")
+async def lookup_memories(
+    request: MemoryLookup,
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    """按 ID 批量讀取記憶
+
+    讀取權限用 PermissionManager.filter_readable 一次判定，
+    不逐條查詢共享關係。
+
+    Returns:
+        memories（按請求順序）、not_found 和 forbidden
+    """
+    ids = list(dict.fromkeys(request.ids))
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"單次最多讀取 {MAX_PAGE_SIZE} 條記憶"
+        )
+
+    found = {
+        m.id: m for m in (await db.scalars(
+            select(Memory).options(*MEMORY_LIGHT).where(
+                Memory.id.in_(ids),
+                Memory.is_deleted == False
+            )
+        )).all()
+    }
+    ordered = [found[memory_id] for memory_id in ids if memory_id in found]
+    readable = await PermissionManager.filter_readable(current_agent.id, ordered, db)
+    readable_ids = {m.id for m in readable}
+
+    return {
+        "memories": [MemoryResponse.model_validate(m) for m in readable],
+        "not_found": [str(memory_id) for memory_id in ids if memory_id not in found],
+        "forbidden": [str(m.id) for m in ordered if m.id not in readable_ids]
+    }
+
+
+@router.get("/shared-with-me")
+async def list_shared_with_me(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    cursor: Optional[str] = None,
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
+):
+    """按創建時間倒序分頁列出其他 Agent 共享給自己的記憶（可跨工作區）
+
+    通過 memory_shared_agents 的 (agent_id, memory_id) 索引定位共享行，
+    分頁方式與 list_memories 相同。
+
+    Args:
+        limit: 每頁數量，超過 MAX_PAGE_SIZE 時按 MAX_PAGE_SIZE 返回
+        cursor: 上一頁返回的 next_cursor（可選）
+
+    Returns:
+        memories、next_cursor（沒有下一頁時為 None）和 limit
+    """
+    limit = min(limit, MAX_PAGE_SIZE)
+    query = (
+        select(Memory)
+        .options(*MEMORY_LIGHT)
+        .join(memory_shared_agents, memory_shared_agents.c.memory_id == Memory.id)
+        .where(
+            memory_shared_agents.c.agent_id == current_agent.id,
+            Memory.is_deleted == False
+        )
+    )
+    if cursor:
+        try:
+            created_at, memory_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(or_(
+            Memory.created_at < created_at,
+            and_(Memory.created_at == created_at, Memory.id < memory_id)
+        ))
+
+    memories = (await db.scalars(query.order_by(
+        Memory.created_at.desc(), Memory.id.desc()
+    ).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(memories) > limit:
+        memories = memories[:limit]
+        last = memories[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return {
+        "memories": [MemoryResponse.model_validate(m) for m in memories],
+        "next_cursor": next_cursor,
+        "limit": limit
+    }
+
+
 @router.get("/{memory_id}")
 async def get_memory(
     memory_id: UUID,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
 ) -> MemoryResponse:
     """獲取記憶"""
-    memory = db.query(Memory).filter(Memory.id == memory_id).first()
+    memory = await db.scalar(
+        select(Memory).options(*MEMORY_LIGHT).where(Memory.id == memory_id)
+    )
 
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
 
-    # 檢查讀取權限
-    if (memory.created_by_agent_id != current_agent.id and
-            current_agent not in memory.shared_with_agents and
-            memory.visibility != "public"):
+    # 檢查讀取權限（所有者和公開記憶不查詢共享關係）
+    if not await PermissionManager.filter_readable(current_agent.id, [memory], db):
         raise HTTPException(status_code=403, detail="Not authorized")
 
     return MemoryResponse.model_validate(memory)
@@ -99,11 +432,13 @@ async def get_memory(
 async def update_memory(
     memory_id: UUID,
     memory_data: MemoryUpdate,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
+    index_manager: VectorIndexManager = Depends(get_vector_index_manager)
 ) -> MemoryResponse:
     """更新記憶"""
-    memory = db.query(Memory).filter(Memory.id == memory_id).first()
+    memory = await db.scalar(select(Memory).where(Memory.id == memory_id))
 
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
@@ -115,17 +450,16 @@ async def update_memory(
     if memory_data.visibility:
         memory.visibility = memory_data.visibility
 
-    # 更新嵌入
-    try:
-        embedding_service = EmbeddingService()
-        embeddings = await embedding_service.get_embeddings(memory_data.content)
-        memory.embeddings = embeddings
-        memory.embedding_updated_at = datetime.utcnow()
-    except Exception as e:
-        pass
+    # 更新嵌入；寫後模式或生成失敗時由後台任務重新生成
+    await embed_or_enqueue(db, memory, embedding_service)
 
-    db.commit()
-    db.refresh(memory)
+    await db.commit()
+    await db.refresh(memory)
+    if memory.embedding_status == EMBEDDING_READY:
+        index_manager.upsert(memory)
+    else:
+        # 索引中的舊向量不再對應新內容，先移出；嵌入任務完成後由 EmbeddingWorker 寫回
+        index_manager.remove(memory.workspace_id, memory.id)
 
     return MemoryResponse.model_validate(memory)
 
@@ -133,11 +467,14 @@ async def update_memory(
 @router.delete("/{memory_id}")
 async def delete_memory(
     memory_id: UUID,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    index_manager: VectorIndexManager = Depends(get_vector_index_manager)
 ):
     """刪除記憶"""
-    memory = db.query(Memory).filter(Memory.id == memory_id).first()
+    memory = await db.scalar(
+        select(Memory).options(*MEMORY_LIGHT).where(Memory.id == memory_id)
+    )
 
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
@@ -146,23 +483,68 @@ async def delete_memory(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     memory.is_deleted = True
-    db.commit()
+    await db.commit()
+    index_manager.remove(memory.workspace_id, memory.id)
 
     return {"success": True}
 
 
 @router.get("")
 async def list_memories(
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
 ):
-    """列出記憶"""
-    memories = db.query(Memory).filter(
+    """按創建時間倒序分頁列出記憶
+
+    使用 (created_at, id) 鍵集分頁：游標記錄上一頁最後一條記憶，
+    下一頁從它之後繼續，不受翻頁深度影響。
+
+    Args:
+        limit: 每頁數量，超過 MAX_PAGE_SIZE 時按 MAX_PAGE_SIZE 返回
+        cursor: 上一頁返回的 next_cursor（可選）
+        include_total: 是否計算工作區記憶總數（需要額外的 COUNT 查詢）
+
+    Returns:
+        memories、next_cursor（沒有下一頁時為 None）、limit 和 total
+    """
+    limit = min(limit, MAX_PAGE_SIZE)
+    base_filter = and_(
         Memory.workspace_id == current_agent.workspace_id,
         Memory.is_deleted == False
-    ).all()
+    )
+
+    query = select(Memory).options(*MEMORY_LIGHT).where(base_filter)
+    if cursor:
+        try:
+            created_at, memory_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(or_(
+            Memory.created_at < created_at,
+            and_(Memory.created_at == created_at, Memory.id < memory_id)
+        ))
+
+    # 多讀一條判斷是否還有下一頁
+    memories = (await db.scalars(query.order_by(
+        Memory.created_at.desc(), Memory.id.desc()
+    ).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(memories) > limit:
+        memories = memories[:limit]
+        last = memories[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    total = None
+    if include_total:
+        total = await db.scalar(select(func.count(Memory.id)).where(base_filter))
 
     return {
         "memories": [MemoryResponse.model_validate(m) for m in memories],
-        "total": len(memories)
+        "next_cursor": next_cursor,
+        "limit": limit,
+        "total": total
     }
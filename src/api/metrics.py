@@ -0,0 +1,69 @@
+"""運行指標 API"""
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.db.database import get_db, engine, async_engine
+from src.db.pool import pool_stats
+from src.services.model_registry import model_registry
+from src.services.vector_index import vector_index_manager
+from src.services.vector_backends import configured_backend
+from src.services.access_sets import access_set_manager
+from src.services.embedding_jobs import embedding_worker
+from src.utils.auth_cache import agent_auth_cache
+from src.utils.timing import latency_recorder
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/embedding")
+async def embedding_metrics():
+    """獲取嵌入推理池的隊列深度、飽和度和緩存命中情況"""
+    return {
+        "models": model_registry.stats(),
+        "cache": model_registry.cache.stats() if model_registry.cache else None
+    }
+
+
+@router.get("/vector-index")
+async def vector_index_metrics():
+    """獲取常駐向量索引的內存佔用和淘汰統計"""
+    return vector_index_manager.stats()
+
+
+@router.get("/vector-backend")
+async def vector_backend_metrics():
+    """獲取配置的向量搜索後端（inprocess 或 pgvector）及其索引參數"""
+    return configured_backend(vector_index_manager).stats()
+
+
+@router.get("/latency")
+async def latency_metrics():
+    """獲取按路由和階段聚合的延遲直方圖"""
+    return latency_recorder.stats()
+
+
+@router.get("/embedding-jobs")
+async def embedding_job_metrics(db: AsyncSession = Depends(get_db)):
+    """獲取後台嵌入任務隊列各狀態的任務數"""
+    return await db.run_sync(embedding_worker.stats)
+
+
+@router.get("/db-pool")
+async def db_pool_metrics():
+    """獲取同步和異步引擎連接池的佔用、溢出和等待時間"""
+    return {
+        "sync": pool_stats(engine),
+        "async": pool_stats(async_engine.sync_engine)
+    }
+
+
+@router.get("/auth-cache")
+async def auth_cache_metrics():
+    """獲取 Agent 認證緩存的命中率和容量"""
+    return agent_auth_cache.stats()
+
+
+@router.get("/access-sets")
+async def access_set_metrics():
+    """獲取搜索訪問集合的緩存 Agent 數和共享條目數"""
+    return access_set_manager.stats()
@@ -1,17 +1,35 @@
 """搜索 API 路由"""
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from uuid import UUID
 from pydantic import BaseModel
 from src.utils.auth import get_current_agent
+from src.utils.auth_cache import AgentSnapshot
 from src.services.search_service import SearchService
 from src.services.embedding_service import EmbeddingService
+from src.services.model_registry import get_embedding_service
+from src.services.micro_batcher import EmbeddingQueueFullError
+from src.services.vector_index import PUBLIC_SCOPE
+from src.services.vector_backends import VectorBackend, get_vector_backend
+from src.services.access_sets import AccessSetManager, get_access_set_manager
+from src.services.query_planner import QueryPlanner, get_query_planner, STRATEGY_SCAN, STRATEGY_ANN
+from src.services.embedding_jobs import pending_unscored_count, EMBEDDING_PENDING, EMBEDDING_FAILED
+from src.utils.timing import StageTimer, get_stage_timer
 from src.db.database import get_db
-from src.models.models import Memory, Agent
+from src.models.models import Memory, active_vectors, has_embedding
+from src.core.permissions import PermissionManager
 
 router = APIRouter(prefix="/memories", tags=["search"])
 
+# 按 ID 讀取記憶時每條查詢的 ID 數（SQLite 默認最多 999 個綁定參數）
+ID_CHUNK_SIZE = 500
+
+# 計入 search_time_ms 的階段（不含認證、查詢嵌入和序列化）
+SEARCH_STAGES = ("index", "plan", "db_fetch", "scoring", "top_k")
+
 
 class SearchRequest(BaseModel):
     """搜索請求"""
@@ -19,80 +37,244 @@ class SearchRequest(BaseModel):
     limit: int = 10
     offset: int = 0
     similarity_threshold: float = 0.3
+    type: Optional[str] = None
+    category: Optional[str] = None
+    explain: bool = False
+    include_shared: bool = True
+    include_public: bool = True
 
 
 @router.post("/search")
 async def search_memories(
     request: SearchRequest,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
+    backend: VectorBackend = Depends(get_vector_backend),
+    planner: QueryPlanner = Depends(get_query_planner),
+    timer: StageTimer = Depends(get_stage_timer),
+    access_sets: AccessSetManager = Depends(get_access_set_manager)
 ):
     """進行語義搜索
 
     邏輯：
         1. 驗證查詢合法性
-        2. 獲取當前 Agent 可訪問的所有記憶
-        3. 使用 SearchService 進行語義搜索
-        4. 返回排序結果
+        2. 通過向量後端打開當前 Agent 工作區的索引
+        3. 進程內後端按工作區規模、過濾選擇率和 limit 選擇策略：
+           直接掃描、精確矩陣評分或 HNSW 近似搜索；pgvector 後端在數據庫中計算 top-k
+        4. 評分時按 Agent 的訪問集合只保留自己創建、公開或共享給自己的記憶，
+           讀取候選記憶後精確排序
+        5. 合併其他工作區共享給自己的記憶（include_shared）和公開索引中
+           所有工作區的公開記憶（include_public）
+        6. 返回排序結果、各階段耗時和未能評分的 pending 記憶數；
+           explain 為真時附帶查詢計劃
     """
     if not request.query or not request.query.strip():
         raise HTTPException(status_code=400, detail="查詢不能為空")
 
+    filters = {
+        field: value
+        for field, value in (("type", request.type), ("category", request.category))
+        if value is not None
+    }
+    workspace_id = current_agent.workspace_id
+    search_service = SearchService(embedding_service)
+
     try:
-        # 獲取所有可訪問的記憶
-        accessible_memories = db.query(Memory).filter(
-            Memory.workspace_id == current_agent.workspace_id,
-            Memory.is_deleted == False
-        ).all()
-
-        embedding_service = EmbeddingService()
-        search_service = SearchService(embedding_service)
-        results = await search_service.semantic_search(
-            request.query,
-            accessible_memories,
-            top_k=request.limit,
-            similarity_threshold=request.similarity_threshold
-        )
+        with timer.stage("index"):
+            index = await backend.open(db, workspace_id)
+            # 訪問集合的構建沿用同步接口，在異步會話的連接上執行
+            access = await db.run_sync(
+                lambda session: access_sets.get(current_agent.id, session)
+            )
+            scope = access.scope(workspace_id)
+
+        with timer.stage("plan"):
+            if backend.in_process:
+                readable = scope.mask(index)
+                plan = planner.plan(
+                    len(index),
+                    index.selectivity(filters) * (readable.mean() if len(index) else 0.0),
+                    request.limit,
+                    filtered=bool(filters) or not readable.all(),
+                    ann_ef=index.ann.ef_search if index.ann is not None else None
+                )
+            else:
+                # 權限和過濾條件作為 SQL 條件與 top-k 一起下推
+                readable = None
+                plan = QueryPlanner.pushdown(request.limit, backend.stats())
+
+        with timer.stage("query_embedding"):
+            query_embedding = await embedding_service.get_embeddings(request.query)
+
+        filter_criteria = [getattr(Memory, field) == value for field, value in filters.items()]
+        # 訪問集合是進程內緩存，可能落後於其他進程的撤銷；讀取時在 SQL 中確認權限
+        readable_clause = PermissionManager.readable_clause(current_agent.id)
+
+        async def fetch_memories(memory_ids, *criteria):
+            memory_ids = list(memory_ids)
+            memories = []
+            for start in range(0, len(memory_ids), ID_CHUNK_SIZE):
+                memories.extend((await db.scalars(select(Memory).options(active_vectors()).where(
+                    Memory.id.in_(memory_ids[start:start + ID_CHUNK_SIZE]),
+                    Memory.is_deleted == False,
+                    *criteria
+                ))).all())
+            return memories
+
+        if plan.strategy == STRATEGY_SCAN:
+            with timer.stage("db_fetch"):
+                query = select(Memory).options(active_vectors()).where(
+                    Memory.workspace_id == workspace_id,
+                    Memory.is_deleted == False,
+                    has_embedding(),
+                    readable_clause,
+                    *filter_criteria
+                )
+                memories = (await db.scalars(query)).all()
+            results = await search_service.semantic_search(
+                request.query,
+                memories,
+                top_k=request.limit,
+                similarity_threshold=request.similarity_threshold,
+                timer=timer,
+                query_embedding=query_embedding
+            )
+        else:
+            async def load_memories(memory_ids):
+                # 索引中的權限列和共享集合都可能落後於數據庫，只把它們當作候選
+                return await fetch_memories(memory_ids, readable_clause)
 
-        return {
-            "results": [
-                {
-                    "memory_id": str(r[0].id),
-                    "content": r[0].content,
-                    "relevance_score": r[1],
-                    "type": r[0].type,
-                    "category": r[0].category
+            results = await search_service.search_index(
+                request.query,
+                index,
+                load_memories,
+                top_k=request.limit,
+                similarity_threshold=request.similarity_threshold,
+                use_ann=plan.strategy == STRATEGY_ANN,
+                filters=filters,
+                timer=timer,
+                query_embedding=query_embedding,
+                scope=scope
+            )
+        result_lists = [results]
+
+        # 其他工作區共享給我的記憶：數量受共享條目限制，按 ID 讀取後精確評分
+        shared_elsewhere = access.shared_outside(workspace_id) if request.include_shared else ()
+        if shared_elsewhere:
+            with timer.stage("db_fetch"):
+                shared_memories = await fetch_memories(
+                    shared_elsewhere,
+                    PermissionManager.shared_clause(current_agent.id),
+                    has_embedding(),
+                    *filter_criteria
+                )
+            result_lists.append(await search_service.semantic_search(
+                request.query,
+                shared_memories,
+                top_k=request.limit,
+                similarity_threshold=request.similarity_threshold,
+                timer=timer,
+                query_embedding=query_embedding
+            ))
+
+        # 所有工作區的公開記憶：使用公開索引
+        public_index = None
+        if request.include_public:
+            with timer.stage("index"):
+                public_index = await backend.open(db, PUBLIC_SCOPE)
+
+            async def load_public(memory_ids):
+                return await fetch_memories(memory_ids, Memory.visibility == "public")
+
+            result_lists.append(await search_service.search_index(
+                request.query,
+                public_index,
+                load_public,
+                top_k=request.limit,
+                similarity_threshold=request.similarity_threshold,
+                filters=filters,
+                timer=timer,
+                query_embedding=query_embedding
+            ))
+
+        with timer.stage("top_k"):
+            results = SearchService.merge_results(result_lists, request.limit)
+
+        with timer.stage("db_fetch"):
+            # 等待後台嵌入、尚無向量的記憶不參與評分
+            pending_unscored = await db.run_sync(
+                pending_unscored_count, current_agent.workspace_id
+            )
+
+        with timer.stage("serialization"):
+            response = {
+                "results": [
+                    {
+                        "memory_id": str(r[0].id),
+                        "content": r[0].content,
+                        "relevance_score": r[1],
+                        "type": r[0].type,
+                        "category": r[0].category
+                    }
+                    for r in results
+                ],
+                "total": len(results),
+                "limit": request.limit,
+                "offset": request.offset,
+                "pending_unscored": pending_unscored
+            }
+            if request.explain:
+                response["plan"] = plan.to_dict()
+                response["scope"] = {
+                    "readable_in_workspace": int(readable.sum()) if readable is not None else None,
+                    "shared_in_workspace": len(scope.shared_ids),
+                    "shared_elsewhere": len(shared_elsewhere),
+                    "public_indexed": (
+                        len(public_index) if public_index is not None and backend.in_process else None
+                    )
                 }
-                for r in results
-            ],
-            "total": len(results),
-            "limit": request.limit,
-            "offset": request.offset
-        }
+
+        response["query_embedding_time_ms"] = round(timer.total("query_embedding"), 3)
+        response["search_time_ms"] = round(timer.total(*SEARCH_STAGES), 3)
+        response["timings_ms"] = timer.as_dict()
+        return response
+    except EmbeddingQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/search/stats")
 async def search_stats(
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
 ):
     """獲取搜索統計信息"""
-    total_memories = db.query(Memory).filter(
+    total_memories = await db.scalar(select(func.count(Memory.id)).where(
         Memory.workspace_id == current_agent.workspace_id,
         Memory.is_deleted == False
-    ).count()
+    ))
 
-    memories_with_embeddings = db.query(Memory).filter(
+    memories_with_embeddings = await db.scalar(select(func.count(Memory.id)).where(
         Memory.workspace_id == current_agent.workspace_id,
         Memory.is_deleted == False,
-        Memory.embeddings != None
-    ).count()
+        has_embedding()
+    ))
+
+    status_counts = dict((await db.execute(
+        select(Memory.embedding_status, func.count(Memory.id)).where(
+            Memory.workspace_id == current_agent.workspace_id,
+            Memory.is_deleted == False,
+            Memory.embedding_status.in_([EMBEDDING_PENDING, EMBEDDING_FAILED])
+        ).group_by(Memory.embedding_status)
+    )).all())
 
     return {
         "total_memories": total_memories,
         "searchable_memories": memories_with_embeddings,
+        "pending_embeddings": status_counts.get(EMBEDDING_PENDING, 0),
+        "failed_embeddings": status_counts.get(EMBEDDING_FAILED, 0),
         "embedding_coverage": (
             memories_with_embeddings / total_memories
             if total_memories > 0 else 0.0
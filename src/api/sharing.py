@@ -1,12 +1,16 @@
 """共享管理 API"""
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 from pydantic import BaseModel
 from src.utils.auth import get_current_agent
+from src.utils.auth_cache import AgentSnapshot
 from src.db.database import get_db
-from src.models.models import Memory, Agent
+from src.models.models import Memory, Agent, MEMORY_LIGHT, memory_shared_agents
+from src.services.access_sets import AccessSetManager, get_access_set_manager
 
 router = APIRouter(prefix="/memories", tags=["sharing"])
 
@@ -16,15 +20,26 @@ class ShareRequest(BaseModel):
     agent_id: UUID
 
 
+async def _share_exists(db: AsyncSession, memory_id: UUID, agent_id: UUID) -> bool:
+    """按複合主鍵檢查共享關係，不載入完整的共享列表"""
+    return await db.scalar(
+        select(memory_shared_agents.c.agent_id).where(
+            memory_shared_agents.c.memory_id == memory_id,
+            memory_shared_agents.c.agent_id == agent_id
+        )
+    ) is not None
+
+
 @router.post("/{memory_id}/share")
 async def share_memory(
     memory_id: UUID,
     request: ShareRequest,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    access_sets: AccessSetManager = Depends(get_access_set_manager)
 ):
-    """與另一個 Agent 共享記憶"""
-    memory = db.query(Memory).filter(Memory.id == memory_id).first()
+    """與另一個 Agent 共享記憶，並更新對方的搜索訪問集合"""
+    memory = await db.get(Memory, memory_id, options=MEMORY_LIGHT)
 
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
@@ -32,13 +47,20 @@ async def share_memory(
     if memory.created_by_agent_id != current_agent.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    target_agent = db.query(Agent).filter(Agent.id == request.agent_id).first()
+    target_agent = await db.get(Agent, request.agent_id)
     if not target_agent:
         raise HTTPException(status_code=404, detail="Agent not found")
 
-    if target_agent not in memory.shared_with_agents:
-        memory.shared_with_agents.append(target_agent)
-        db.commit()
+    if not await _share_exists(db, memory.id, target_agent.id):
+        try:
+            await db.execute(insert(memory_shared_agents).values(
+                memory_id=memory.id, agent_id=target_agent.id
+            ))
+            await db.commit()
+        except IntegrityError:
+            # 並發的相同共享已經寫入，主鍵保證只保留一行
+            await db.rollback()
+        access_sets.grant(target_agent.id, memory.id, memory.workspace_id)
 
     return {"success": True, "memory_id": str(memory_id)}
 
@@ -46,18 +68,24 @@ async def share_memory(
 @router.get("/{memory_id}/shared-with")
 async def get_shared_with(
     memory_id: UUID,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db)
 ):
     """查詢一個記憶與誰共享"""
-    memory = db.query(Memory).filter(Memory.id == memory_id).first()
+    memory = await db.get(Memory, memory_id, options=MEMORY_LIGHT)
 
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
 
+    agent_ids = (await db.scalars(
+        select(memory_shared_agents.c.agent_id).where(
+            memory_shared_agents.c.memory_id == memory_id
+        )
+    )).all()
+
     return {
         "memory_id": str(memory_id),
-        "shared_with": [str(agent.id) for agent in memory.shared_with_agents]
+        "shared_with": [str(agent_id) for agent_id in agent_ids]
     }
 
 
@@ -65,11 +93,12 @@ async def get_shared_with(
 async def revoke_sharing(
     memory_id: UUID,
     agent_id: UUID,
-    current_agent: Agent = Depends(get_current_agent),
-    db: Session = Depends(get_db)
+    current_agent: AgentSnapshot = Depends(get_current_agent),
+    db: AsyncSession = Depends(get_db),
+    access_sets: AccessSetManager = Depends(get_access_set_manager)
 ):
-    """撤銷與某個 Agent 的共享"""
-    memory = db.query(Memory).filter(Memory.id == memory_id).first()
+    """撤銷與某個 Agent 的共享，並從對方的搜索訪問集合中移除"""
+    memory = await db.get(Memory, memory_id, options=MEMORY_LIGHT)
 
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
@@ -77,9 +106,12 @@ async def revoke_sharing(
     if memory.created_by_agent_id != current_agent.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    target_agent = db.query(Agent).filter(Agent.id == agent_id).first()
-    if target_agent in memory.shared_with_agents:
-        memory.shared_with_agents.remove(target_agent)
-        db.commit()
+    result = await db.execute(delete(memory_shared_agents).where(
+        memory_shared_agents.c.memory_id == memory_id,
+        memory_shared_agents.c.agent_id == agent_id
+    ))
+    if result.rowcount:
+        await db.commit()
+        access_sets.revoke(agent_id, memory_id)
 
     return {"success": True}
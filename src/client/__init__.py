@@ -26,7 +26,7 @@ AgentMem Python 客户端库
 """
 
 from .client import AgentMemClient
-from .models import Memory, SearchResult, SearchResponse, SearchStats, Agent
+from .models import Memory, MemoryPage, BulkCreateResult, SearchResult, SearchResponse, SearchStats, Agent
 from .exceptions import (
     AgentMemException,
     AuthenticationError,
@@ -40,6 +40,8 @@ __version__ = "0.1.0"
 __all__ = [
     "AgentMemClient",
     "Memory",
+    "MemoryPage",
+    "BulkCreateResult",
     "SearchResult",
     "SearchResponse",
     "SearchStats",
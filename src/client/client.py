@@ -3,10 +3,12 @@ AgentMem Python 客户端库
 
 简化的 API 接口，让用户轻松使用 AgentMem
 """
+import itertools
 import requests
 import uuid
-from typing import List, Optional, Dict, Any
-from .models import Memory, SearchResult, SearchResponse, SearchStats
+import warnings
+from typing import Iterator, List, Optional, Dict, Any
+from .models import Memory, MemoryPage, BulkCreateResult, SearchResult, SearchResponse, SearchStats
 from .exceptions import (
     AuthenticationError,
     NotFoundError,
@@ -106,6 +108,47 @@ class AgentMemClient:
         response = self._request("POST", "/memories", json=payload)
         return Memory(**response)
 
+    def create_memories(
+        self,
+        items: List[Dict[str, Any]],
+        chunk_size: int = 1000,
+    ) -> List[BulkCreateResult]:
+        """
+        批量创建记忆
+
+        参数:
+            items: 记忆字典列表，每项包含 content，可选 type/category/visibility
+            chunk_size: 每个请求发送的条数（不超过服务器的单次上限）
+
+        返回:
+            与 items 一一对应的 BulkCreateResult 列表
+        """
+        results: List[BulkCreateResult] = []
+        for start in range(0, len(items), chunk_size):
+            payload = {
+                "items": [
+                    {
+                        "content": item["content"],
+                        "type": item.get("type", "knowledge"),
+                        "category": item.get("category", "general"),
+                        "visibility": item.get("visibility", "private"),
+                    }
+                    for item in items[start:start + chunk_size]
+                ]
+            }
+            response = self._request("POST", "/memories/bulk", json=payload)
+            results.extend(
+                BulkCreateResult(
+                    index=start + r["index"],
+                    id=r.get("id"),
+                    embedded=r.get("embedded", False),
+                    embedding_status=r.get("embedding_status"),
+                    error=r.get("error"),
+                )
+                for r in response.get("results", [])
+            )
+        return results
+
     def get_memory(self, memory_id: str) -> Memory:
         """
         获取记忆详情
@@ -119,21 +162,87 @@ class AgentMemClient:
         response = self._request("GET", f"/memories/{memory_id}")
         return Memory(**response)
 
-    def list_memories(self, limit: int = 100, offset: int = 0) -> List[Memory]:
+    def list_memories(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        offset: Optional[int] = None,
+    ) -> List[Memory]:
         """
-        列出所有记忆
+        列出一页记忆（按创建时间倒序）
 
         参数:
-            limit: 返回数量限制
-            offset: 偏移量
+            limit: 返回数量限制（服务器会限制最大页大小）
+            cursor: 上一页的 next_cursor（可选）
+            offset: 已弃用，请改用 cursor 或 iter_memories。传入时发出
+                DeprecationWarning，并按游标逐页跳过前 offset 条
 
         返回:
             Memory 对象列表
+
+        异常:
+            ValueError: 同时传入 offset 和 cursor
         """
-        response = self._request(
-            "GET", "/memories", params={"limit": limit, "offset": offset}
+        if offset is not None:
+            warnings.warn(
+                "list_memories 的 offset 参数已弃用，请改用 cursor 或 iter_memories",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            if cursor:
+                raise ValueError("offset 不能与 cursor 同时使用")
+            if offset:
+                return list(itertools.islice(
+                    self.iter_memories(page_size=limit), offset, offset + limit
+                ))
+        return self.list_memories_page(limit=limit, cursor=cursor).memories
+
+    def list_memories_page(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        include_total: bool = False,
+    ) -> MemoryPage:
+        """
+        获取一页记忆及下一页游标
+
+        参数:
+            limit: 返回数量限制
+            cursor: 上一页的 next_cursor（可选）
+            include_total: 是否返回工作区记忆总数
+
+        返回:
+            MemoryPage 对象
+        """
+        params: Dict[str, Any] = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        if include_total:
+            params["include_total"] = "true"
+        response = self._request("GET", "/memories", params=params)
+        return MemoryPage(
+            memories=[Memory(**item) for item in response.get("memories", [])],
+            next_cursor=response.get("next_cursor"),
+            total=response.get("total"),
         )
-        return [Memory(**item) for item in response.get("memories", [])]
+
+    def iter_memories(self, page_size: int = 100) -> Iterator[Memory]:
+        """
+        按页遍历工作区的全部记忆
+
+        参数:
+            page_size: 每页数量
+
+        返回:
+            Memory 对象迭代器
+        """
+        cursor = None
+        while True:
+            page = self.list_memories_page(limit=page_size, cursor=cursor)
+            yield from page.memories
+            if not page.next_cursor:
+                return
+            cursor = page.next_cursor
 
     def update_memory(
         self,
@@ -212,7 +321,7 @@ class AgentMemClient:
             SearchResult(
                 memory_id=item["memory_id"],
                 content=item["content"],
-                similarity_score=item["similarity_score"],
+                similarity_score=item.get("similarity_score", item.get("relevance_score", 0.0)),
                 type=item.get("type", "unknown"),
                 category=item.get("category", "unknown"),
                 visibility=item.get("visibility", "private"),
@@ -225,6 +334,7 @@ class AgentMemClient:
             total=response.get("total", 0),
             query_embedding_time_ms=response.get("query_embedding_time_ms", 0),
             search_time_ms=response.get("search_time_ms", 0),
+            pending_unscored=response.get("pending_unscored", 0),
         )
 
     def get_search_stats(self) -> SearchStats:
@@ -265,6 +375,27 @@ class AgentMemClient:
         response = self._request("GET", f"/memories/{memory_id}/shared-with")
         return response.get("shared_with_agents", [])
 
+    def list_shared_with_me(self, limit: int = 50, cursor: Optional[str] = None) -> MemoryPage:
+        """
+        获取一页其他 Agent 共享给自己的记忆（按创建时间倒序）
+
+        参数:
+            limit: 返回数量限制
+            cursor: 上一页的 next_cursor（可选）
+
+        返回:
+            MemoryPage 对象（total 为 None）
+        """
+        params: Dict[str, Any] = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = self._request("GET", "/memories/shared-with-me", params=params)
+        return MemoryPage(
+            memories=[Memory(**item) for item in response.get("memories", [])],
+            next_cursor=response.get("next_cursor"),
+            total=None,
+        )
+
     def revoke_sharing(self, memory_id: str, agent_id: str) -> bool:
         """
         撤销共享
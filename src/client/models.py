@@ -20,11 +20,44 @@ class Memory:
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     created_by_agent_id: Optional[str] = None
+    embedding_status: Optional[str] = None
 
     def __repr__(self) -> str:
         return f"Memory(id={self.id}, type={self.type}, category={self.category})"
 
 
+@dataclass
+class BulkCreateResult:
+    """批量创建中单条记忆的结果"""
+
+    index: int
+    id: Optional[str] = None
+    embedded: bool = False
+    embedding_status: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.id is not None
+
+    def __repr__(self) -> str:
+        if self.ok:
+            return f"BulkCreateResult(index={self.index}, id={self.id})"
+        return f"BulkCreateResult(index={self.index}, error={self.error})"
+
+
+@dataclass
+class MemoryPage:
+    """记忆分页对象"""
+
+    memories: List[Memory]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f"MemoryPage(memories={len(self.memories)}, has_next={self.next_cursor is not None})"
+
+
 @dataclass
 class SearchResult:
     """搜索结果对象"""
@@ -48,6 +81,7 @@ class SearchResponse:
     total: int
     query_embedding_time_ms: float
     search_time_ms: float
+    pending_unscored: int = 0
 
     def __repr__(self) -> str:
         return f"SearchResponse(total={self.total}, results={len(self.results)})"
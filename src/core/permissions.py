@@ -1,18 +1,180 @@
 """權限管理系統"""
 
+from sqlalchemy import and_, exists, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Union
 from uuid import UUID
-from src.models.models import Memory, Agent
+import inspect
+from src.models.models import Memory, memory_shared_agents
+
+AnySession = Union[Session, AsyncSession]
+
+
+async def _execute(db: AnySession, statement):
+    """在同步或異步會話上執行查詢"""
+    result = db.execute(statement)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
 
 
 class PermissionManager:
-    """管理記憶的存取權限"""
+    """管理記憶的存取權限
+
+    單條檢查（can_read_memory 等）和批量檢查（can_read_many 等）規則相同：
+    - 所有者可以讀、寫和共享
+    - 共享對象和公開記憶可以讀
+    批量接口用一條 SQL 判定 N 條記憶，共享關係通過與 memory_shared_agents
+    的連接得到，不載入完整的共享列表。
+    """
+
+    @staticmethod
+    def shared_clause(agent_id: UUID):
+        """記憶共享給 Agent 的 SQL 條件（memory_shared_agents 上的 EXISTS 子查詢）
+
+        Args:
+            agent_id: Agent ID
+
+        Returns:
+            可用於 Memory 查詢 where 的條件
+        """
+        return exists().where(
+            memory_shared_agents.c.memory_id == Memory.id,
+            memory_shared_agents.c.agent_id == agent_id
+        )
+
+    @staticmethod
+    def readable_clause(agent_id: UUID):
+        """Agent 可讀記憶的 SQL 條件：所有者、公開或共享對象
+
+        Args:
+            agent_id: Agent ID
+
+        Returns:
+            可用於 Memory 查詢 where 的條件
+        """
+        return or_(
+            Memory.created_by_agent_id == agent_id,
+            Memory.visibility == "public",
+            PermissionManager.shared_clause(agent_id)
+        )
+
+    @staticmethod
+    async def can_read_many(
+        agent_id: UUID,
+        memory_ids: Iterable[UUID],
+        db: AnySession
+    ) -> Dict[UUID, bool]:
+        """批量檢查 Agent 是否可以讀取記憶
+
+        Args:
+            agent_id: Agent ID
+            memory_ids: Memory ID 列表
+            db: 數據庫會話（同步或異步）
+
+        Returns:
+            {memory_id: 是否有讀取權限}；不存在的記憶為 False
+        """
+        memory_ids = list(dict.fromkeys(memory_ids))
+        access = {memory_id: False for memory_id in memory_ids}
+        if not memory_ids:
+            return access
+
+        # 左連接只匹配當前 Agent 的共享行，shared_agent_id 非空即為共享對象
+        statement = (
+            select(
+                Memory.id,
+                Memory.created_by_agent_id,
+                Memory.visibility,
+                memory_shared_agents.c.agent_id.label("shared_agent_id")
+            )
+            .outerjoin(
+                memory_shared_agents,
+                and_(
+                    memory_shared_agents.c.memory_id == Memory.id,
+                    memory_shared_agents.c.agent_id == agent_id
+                )
+            )
+            .where(Memory.id.in_(memory_ids))
+        )
+        for memory_id, owner_id, visibility, shared_agent_id in await _execute(db, statement):
+            access[memory_id] = access[memory_id] or (
+                owner_id == agent_id
+                or shared_agent_id is not None
+                or visibility == "public"
+            )
+        return access
+
+    @staticmethod
+    async def can_write_many(
+        agent_id: UUID,
+        memory_ids: Iterable[UUID],
+        db: AnySession
+    ) -> Dict[UUID, bool]:
+        """批量檢查 Agent 是否可以編輯記憶
+
+        Args:
+            agent_id: Agent ID
+            memory_ids: Memory ID 列表
+            db: 數據庫會話（同步或異步）
+
+        Returns:
+            {memory_id: 是否有編輯權限}；不存在的記憶為 False
+        """
+        memory_ids = list(dict.fromkeys(memory_ids))
+        access = {memory_id: False for memory_id in memory_ids}
+        if not memory_ids:
+            return access
+
+        statement = select(Memory.id).where(
+            Memory.id.in_(memory_ids),
+            Memory.created_by_agent_id == agent_id
+        )
+        for (memory_id,) in await _execute(db, statement):
+            access[memory_id] = True
+        return access
+
+    @staticmethod
+    async def filter_readable(
+        agent_id: UUID,
+        memories: List[Memory],
+        db: AnySession
+    ) -> List[Memory]:
+        """過濾出 Agent 可以讀取的記憶，保持原有順序
+
+        所有者和公開記憶直接判定，其餘記憶用一條查詢檢查共享關係。
+
+        Args:
+            agent_id: Agent ID
+            memories: 已載入的記憶
+            db: 數據庫會話（同步或異步）
+
+        Returns:
+            可讀的記憶列表
+        """
+        undecided = [
+            m.id for m in memories
+            if m.created_by_agent_id != agent_id and m.visibility != "public"
+        ]
+        shared = set()
+        if undecided:
+            statement = select(memory_shared_agents.c.memory_id).where(
+                memory_shared_agents.c.agent_id == agent_id,
+                memory_shared_agents.c.memory_id.in_(undecided)
+            )
+            shared = {memory_id for (memory_id,) in await _execute(db, statement)}
+
+        return [
+            m for m in memories
+            if m.created_by_agent_id == agent_id or m.visibility == "public" or m.id in shared
+        ]
 
     @staticmethod
     async def can_read_memory(
         agent_id: UUID,
         memory_id: UUID,
-        db: Session
+        db: AnySession
     ) -> bool:
         """檢查 Agent 是否可以讀取記憶
 
@@ -24,31 +186,14 @@ class PermissionManager:
         Returns:
             bool: 是否有讀取權限
         """
-        memory = db.query(Memory).filter(Memory.id == memory_id).first()
-
-        if not memory:
-            return False
-
-        # 所有者可以讀
-        if memory.created_by_agent_id == agent_id:
-            return True
-
-        # 共享對象可以讀
-        agent = db.query(Agent).filter(Agent.id == agent_id).first()
-        if agent and agent in memory.shared_with_agents:
-            return True
-
-        # 公開記憶可以讀
-        if memory.visibility == "public":
-            return True
-
-        return False
+        access = await PermissionManager.can_read_many(agent_id, [memory_id], db)
+        return access[memory_id]
 
     @staticmethod
     async def can_write_memory(
         agent_id: UUID,
         memory_id: UUID,
-        db: Session
+        db: AnySession
     ) -> bool:
         """檢查 Agent 是否可以編輯記憶
 
@@ -60,19 +205,14 @@ class PermissionManager:
         Returns:
             bool: 是否有編輯權限
         """
-        memory = db.query(Memory).filter(Memory.id == memory_id).first()
-
-        if not memory:
-            return False
-
-        # 只有所有者可以寫
-        return memory.created_by_agent_id == agent_id
+        access = await PermissionManager.can_write_many(agent_id, [memory_id], db)
+        return access[memory_id]
 
     @staticmethod
     async def can_share_memory(
         agent_id: UUID,
         memory_id: UUID,
-        db: Session
+        db: AnySession
     ) -> bool:
         """檢查 Agent 是否可以共享記憶
 
@@ -84,10 +224,5 @@ class PermissionManager:
         Returns:
             bool: 是否有共享權限
         """
-        memory = db.query(Memory).filter(Memory.id == memory_id).first()
-
-        if not memory:
-            return False
-
         # 只有所有者可以共享
-        return memory.created_by_agent_id == agent_id
+        return await PermissionManager.can_write_memory(agent_id, memory_id, db)
@@ -1,26 +1,67 @@
-"""數據庫配置"""
+"""數據庫配置
+
+API 路由通過異步驅動（SQLite 用 aiosqlite，PostgreSQL 用 asyncpg）訪問數據庫，
+查詢等待期間不阻塞事件循環。同步引擎保留給建表、遷移和後台腳本。
+"""
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from typing import AsyncIterator
 import os
 
+from src.db.pool import configure_engine, pool_options
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# 同步驅動到異步驅動的映射
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    """把同步數據庫 URL 轉換為對應的異步驅動 URL
+
+    Args:
+        url: 數據庫 URL，如 sqlite:///./test.db
+
+    Returns:
+        str: 異步驅動 URL，已經是異步驅動時原樣返回
+    """
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# 連接池和 SQLite 連接參數見 src/db/pool.py
+engine = configure_engine(create_engine(DATABASE_URL, **pool_options(DATABASE_URL)))
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, is_async=True)
+)
+configure_engine(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 Base = declarative_base()
 
 
-def get_db():
-    """獲取數據庫會話"""
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """獲取異步數據庫會話"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_sync_db():
+    """獲取同步數據庫會話（用於腳本和後台任務）"""
     db = SessionLocal()
     try:
         yield db
@@ -0,0 +1,284 @@
+"""數據庫遷移
+
+應用啟動時在 create_all 之後執行。每個遷移只執行一次，
+已執行的遷移記錄在 schema_migrations 表中。
+
+多個 uvicorn 工作進程同時啟動時，建表和遷移在數據庫級鎖下串行執行
+（PostgreSQL 用事務級 advisory lock，SQLite 用 BEGIN IMMEDIATE），
+後拿到鎖的進程重新讀取 schema_migrations，跳過已執行的遷移。
+所有遷移在同一個連接的同一個事務中執行。
+"""
+
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+from datetime import datetime
+import json
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.engine import Connection, Engine
+import sqlalchemy.types as types
+
+from src.models.models import ACTIVE_EMBEDDING_MODEL, HOT_PATH_INDEXES, EmbeddingJob, MemoryEmbedding
+from src.utils.embedding import pack_vector
+
+CHUNK_SIZE = 500
+
+# pg_advisory_xact_lock 的鍵（任意固定的 64 位整數）
+MIGRATION_LOCK_KEY = 0x61676D656D
+
+# HOT_PATH_INDEXES 的鍵列和部分索引條件引用的列（向量已拆分到 memory_embedding，
+# 索引不再依賴 memory.embeddings）
+HOT_PATH_COLUMNS = {
+    "id", "workspace_id", "is_deleted", "created_at", "embedding_status"
+}
+
+
+def _pack_embeddings(conn: Connection) -> None:
+    """把 memory.embeddings 從 JSON 列轉換為二進制 float32 列"""
+    inspector = inspect(conn)
+    if "memory" not in inspector.get_table_names():
+        return
+
+    columns = {c["name"]: c["type"] for c in inspector.get_columns("memory")}
+    column_type = columns.get("embeddings")
+    if column_type is None or isinstance(column_type, types.LargeBinary):
+        return
+
+    binary_type = "BYTEA" if conn.dialect.name == "postgresql" else "BLOB"
+    conn.execute(text(f"ALTER TABLE memory ADD COLUMN embeddings_packed {binary_type}"))
+
+    memory_ids = [
+        row[0] for row in conn.execute(
+            text("SELECT id FROM memory WHERE embeddings IS NOT NULL")
+        )
+    ]
+    select_chunk = text(
+        "SELECT id, embeddings FROM memory WHERE id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+
+    for start in range(0, len(memory_ids), CHUNK_SIZE):
+        rows = conn.execute(
+            select_chunk, {"ids": memory_ids[start:start + CHUNK_SIZE]}
+        ).fetchall()
+        params = []
+        for memory_id, value in rows:
+            if isinstance(value, str):
+                value = json.loads(value)
+            if not value:
+                continue
+            params.append({"id": memory_id, "packed": pack_vector(value)})
+        if params:
+            conn.execute(
+                text("UPDATE memory SET embeddings_packed = :packed WHERE id = :id"),
+                params
+            )
+
+    conn.execute(text("ALTER TABLE memory DROP COLUMN embeddings"))
+    conn.execute(text("ALTER TABLE memory RENAME COLUMN embeddings_packed TO embeddings"))
+
+
+def _add_embedding_status(conn: Connection) -> None:
+    """添加 memory.embedding_status 列並回填
+
+    已有嵌入的記憶標記為 ready。沒有嵌入的記憶是過去嵌入失敗後
+    被靜默保存的：未刪除的標記為 pending 並在同一事務中加入嵌入任務，
+    由後台工作者補全；已刪除的標記為 failed。
+    """
+    inspector = inspect(conn)
+    if "memory" not in inspector.get_table_names():
+        return
+
+    columns = {c["name"] for c in inspector.get_columns("memory")}
+    if "embedding_status" not in columns:
+        conn.execute(text("ALTER TABLE memory ADD COLUMN embedding_status VARCHAR(20)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_memory_embedding_status "
+            "ON memory (embedding_status)"
+        ))
+    live = "is_deleted = :deleted" if "is_deleted" in columns else ":deleted = :deleted"
+    conn.execute(text(
+        "UPDATE memory SET embedding_status = 'pending' "
+        f"WHERE embedding_status IS NULL AND embeddings IS NULL AND {live}"
+    ).bindparams(deleted=False))
+    EmbeddingJob.__table__.create(conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT INTO embedding_job (memory_id, status, attempts, available_at, created_at, updated_at) "
+        "SELECT id, 'queued', 0, :now, :now, :now FROM memory "
+        f"WHERE embedding_status = 'pending' AND {live} AND NOT EXISTS ("
+        "SELECT 1 FROM embedding_job WHERE embedding_job.memory_id = memory.id "
+        "AND embedding_job.status IN ('queued', 'running'))"
+    ).bindparams(
+        bindparam("now", datetime.utcnow(), type_=types.DateTime), deleted=False
+    ))
+    conn.execute(text(
+        "UPDATE memory SET embedding_status = CASE "
+        "WHEN embeddings IS NULL THEN 'failed' ELSE 'ready' END "
+        "WHERE embedding_status IS NULL"
+    ))
+
+
+def _key_shared_agents(conn: Connection) -> None:
+    """為 memory_shared_agents 添加複合主鍵和 agent_id 反向索引
+
+    舊表沒有主鍵，可能累積了重複行。SQLite 不能給已有表添加主鍵，
+    因此新建帶主鍵的表，去重複製數據後替換舊表。
+    """
+    inspector = inspect(conn)
+    if "memory_shared_agents" not in inspector.get_table_names():
+        return
+
+    primary_key = inspector.get_pk_constraint("memory_shared_agents")
+    if not primary_key.get("constrained_columns"):
+        conn.execute(text(
+            "CREATE TABLE memory_shared_agents_keyed ("
+            "memory_id VARCHAR(32) NOT NULL REFERENCES memory (id), "
+            "agent_id VARCHAR(32) NOT NULL REFERENCES agent (id), "
+            "PRIMARY KEY (memory_id, agent_id))"
+        ))
+        conn.execute(text(
+            "INSERT INTO memory_shared_agents_keyed (memory_id, agent_id) "
+            "SELECT DISTINCT memory_id, agent_id FROM memory_shared_agents "
+            "WHERE memory_id IS NOT NULL AND agent_id IS NOT NULL"
+        ))
+        conn.execute(text("DROP TABLE memory_shared_agents"))
+        conn.execute(text(
+            "ALTER TABLE memory_shared_agents_keyed RENAME TO memory_shared_agents"
+        ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_memory_shared_agents_agent_id "
+        "ON memory_shared_agents (agent_id, memory_id)"
+    ))
+
+
+def _add_hot_path_indexes(conn: Connection) -> None:
+    """為 memory 表添加熱點查詢的複合索引和部分索引
+
+    索引定義在 models.HOT_PATH_INDEXES，按方言生成 DDL（部分索引的
+    WHERE 條件在 SQLite 和 PostgreSQL 上寫法不同）。缺少索引列的
+    舊表結構跳過。
+    """
+    inspector = inspect(conn)
+    if "memory" not in inspector.get_table_names():
+        return
+
+    columns = {c["name"] for c in inspector.get_columns("memory")}
+    if not HOT_PATH_COLUMNS <= columns:
+        return
+    for index in HOT_PATH_INDEXES:
+        index.create(conn, checkfirst=True)
+
+
+def _split_embeddings(conn: Connection) -> None:
+    """把向量從 memory 行移到 memory_embedding 表
+
+    - 按 (memory_id, model_name) 複製已有向量，模型名取自舊的 embedding_model 列
+    - 清空 memory.embeddings，行寬立即縮小（SQLite 需要 VACUUM 才會歸還文件空間）
+    - 刪除依賴該列的部分索引 ix_memory_workspace_searchable
+
+    舊的 embedding_model、embedding_updated_at 列不再映射，保留在表中以便回滾；
+    遷移後由舊版本進程寫入 memory.embeddings 的向量通過雙讀仍可讀取。
+    """
+    inspector = inspect(conn)
+    if "memory" not in inspector.get_table_names():
+        return
+
+    columns = {c["name"] for c in inspector.get_columns("memory")}
+    indexes = {index["name"] for index in inspector.get_indexes("memory")}
+    model_name = "COALESCE(m.embedding_model, :model)" if "embedding_model" in columns else ":model"
+    updated_at = (
+        "m.embedding_updated_at" if "embedding_updated_at" in columns else "CURRENT_TIMESTAMP"
+    )
+    MemoryEmbedding.__table__.create(conn, checkfirst=True)
+    # 沒有遺留向量時不執行複製（pgvector 後端的新庫上兩列類型不同，不能直接 INSERT ... SELECT）
+    if "embeddings" in columns and conn.execute(
+        text("SELECT 1 FROM memory WHERE embeddings IS NOT NULL LIMIT 1")
+    ).first():
+        conn.execute(text(
+            "INSERT INTO memory_embedding (memory_id, model_name, embeddings, updated_at) "
+            f"SELECT m.id, {model_name}, m.embeddings, {updated_at} FROM memory m "
+            "WHERE m.embeddings IS NOT NULL AND NOT EXISTS ("
+            "SELECT 1 FROM memory_embedding e "
+            f"WHERE e.memory_id = m.id AND e.model_name = {model_name})"
+        ), {"model": ACTIVE_EMBEDDING_MODEL})
+        conn.execute(text("UPDATE memory SET embeddings = NULL WHERE embeddings IS NOT NULL"))
+    if "ix_memory_workspace_searchable" in indexes:
+        conn.execute(text("DROP INDEX ix_memory_workspace_searchable"))
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_pack_embeddings", _pack_embeddings),
+    ("0002_embedding_status", _add_embedding_status),
+    ("0003_key_shared_agents", _key_shared_agents),
+    ("0004_hot_path_indexes", _add_hot_path_indexes),
+    ("0005_split_embeddings", _split_embeddings),
+]
+
+
+@contextmanager
+def migration_lock(engine: Engine) -> Iterator[Connection]:
+    """在數據庫級鎖下打開一個事務，退出時提交（異常時回滾）
+
+    - PostgreSQL：pg_advisory_xact_lock，事務結束時自動釋放
+    - SQLite：BEGIN IMMEDIATE 取得寫鎖，其他進程的 BEGIN IMMEDIATE 等待 busy_timeout
+
+    Args:
+        engine: 數據庫引擎
+
+    Yields:
+        Connection: 持有鎖的連接，建表和遷移都應在該連接上執行
+    """
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            yield conn
+        return
+
+    # pysqlite 默認只在 DML 前隱式 BEGIN（DEFERRED），這裡改為手動管理事務
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+
+
+def run_migrations(bind: Union[Engine, Connection], until: Optional[str] = None) -> List[str]:
+    """執行所有尚未執行的遷移
+
+    傳入引擎時自行在 migration_lock 下執行；傳入連接時調用方應已持有該鎖。
+
+    Args:
+        bind: 數據庫引擎，或 migration_lock 返回的連接
+        until: 只執行到該遷移為止（包括該遷移），None 表示全部執行
+
+    Returns:
+        本次執行的遷移名稱列表
+    """
+    if isinstance(bind, Engine):
+        with migration_lock(bind) as conn:
+            return run_migrations(conn, until)
+
+    conn = bind
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "name VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP)"
+    ))
+    applied = {
+        row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))
+    }
+
+    executed = []
+    for name, migration in MIGRATIONS:
+        if name not in applied:
+            migration(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :at)"),
+                {"name": name, "at": datetime.utcnow()}
+            )
+            executed.append(name)
+        if name == until:
+            break
+    return executed
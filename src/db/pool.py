@@ -0,0 +1,172 @@
+"""數據庫連接池配置和指標
+
+連接池大小、溢出、回收和超時由環境變量配置；SQLite 連接建立時設置
+WAL、synchronous、mmap 和 busy_timeout，減少突發寫入時的 "database is locked"。
+連接池記錄獲取連接的等待時間和超時次數，供 /metrics/db-pool 查詢。
+"""
+
+from typing import Dict
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from src.utils.timing import LatencyHistogram
+
+# 連接池配置
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# SQLite 連接參數
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# 獲取連接等待時間的直方圖桶（毫秒），大部分獲取在亞毫秒級完成
+POOL_WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000, 30000)
+
+
+class _TimedPoolMixin:
+    """記錄獲取連接的等待時間和超時次數"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_histogram = LatencyHistogram(POOL_WAIT_BUCKETS_MS)
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._wait_lock:
+                self.wait_histogram.observe(elapsed_ms)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """帶等待時間統計的 QueuePool"""
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """帶等待時間統計的 AsyncAdaptedQueuePool"""
+
+
+def is_sqlite(url: str) -> bool:
+    """是否 SQLite URL"""
+    return url.startswith("sqlite")
+
+
+def is_sqlite_memory(url: str) -> bool:
+    """是否 SQLite 內存數據庫（每個連接一個獨立數據庫，不能使用連接池）"""
+    database = url.partition("://")[2].lstrip("/")
+    return is_sqlite(url) and (database in ("", ":memory:") or "mode=memory" in url)
+
+
+def pool_options(
+    url: str,
+    is_async: bool = False,
+    pool_size: int = None,
+    max_overflow: int = None,
+    pool_recycle: int = None,
+    pool_timeout: float = None
+) -> Dict:
+    """按數據庫類型生成 create_engine / create_async_engine 的連接池參數
+
+    pool_size <= 0 時不使用連接池（NullPool）。SQLite 內存數據庫沿用
+    SQLAlchemy 默認的單連接池。
+
+    Args:
+        url: 數據庫 URL
+        is_async: 是否異步引擎
+        pool_size: 常駐連接數，默認 DB_POOL_SIZE
+        max_overflow: 允許超出常駐連接的連接數，默認 DB_MAX_OVERFLOW
+        pool_recycle: 連接最長復用秒數，默認 DB_POOL_RECYCLE
+        pool_timeout: 等待空閒連接的秒數，默認 DB_POOL_TIMEOUT
+
+    Returns:
+        引擎關鍵字參數
+    """
+    pool_size = DB_POOL_SIZE if pool_size is None else pool_size
+    max_overflow = DB_MAX_OVERFLOW if max_overflow is None else max_overflow
+    pool_recycle = DB_POOL_RECYCLE if pool_recycle is None else pool_recycle
+    pool_timeout = DB_POOL_TIMEOUT if pool_timeout is None else pool_timeout
+
+    options: Dict = {}
+    if is_sqlite(url):
+        if not is_async:
+            options["connect_args"] = {"check_same_thread": False}
+        if is_sqlite_memory(url):
+            return options
+    else:
+        options["pool_pre_ping"] = True
+
+    if pool_size <= 0:
+        options["poolclass"] = NullPool
+        return options
+
+    options.update(
+        poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+        pool_timeout=pool_timeout,
+    )
+    return options
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """新建 SQLite 連接時設置 WAL、synchronous、mmap 和 busy_timeout"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine: Engine) -> Engine:
+    """為 SQLite 引擎註冊連接參數（異步引擎傳入 async_engine.sync_engine）"""
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+
+def pool_stats(engine: Engine) -> Dict:
+    """返回連接池的佔用、溢出和等待時間
+
+    Args:
+        engine: 同步引擎（異步引擎傳入 async_engine.sync_engine）
+
+    Returns:
+        pool_class、size、checked_out、checked_in、overflow、timeouts 和 wait
+    """
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            # overflow() 在常駐連接未用滿時為負數
+            overflow=max(0, pool.overflow()),
+            timeout_seconds=pool.timeout(),
+        )
+    histogram = getattr(pool, "wait_histogram", None)
+    stats["timeouts"] = getattr(pool, "timeouts", 0)
+    stats["wait"] = histogram.stats() if histogram is not None else None
+    return stats
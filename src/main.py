@@ -1,21 +1,52 @@
 """FastAPI 應用主文件"""
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from src.db.database import Base, engine
+from src.db.database import Base, engine, async_engine
+from src.db.migrations import migration_lock, run_migrations
 from contextlib import asynccontextmanager
-from src.api import memories, search, sharing
+import time
+from src.api import memories, search, sharing, metrics
+from src.services.model_registry import model_registry, configured_models
+from src.services.vector_index import vector_index_manager
+from src.services.vector_backends import configured_backend
+from src.services.vector_segments import SegmentIndexManager
+from src.services.embedding_jobs import embedding_worker
+from src.utils.timing import StageTimer, latency_recorder
 
-# 建立數據庫表
-Base.metadata.create_all(bind=engine)
+# 建立數據庫表並執行遷移（pgvector 後端需要在建表前創建擴展，遷移後創建 ANN 索引）
+# 多個工作進程同時啟動時在數據庫鎖下依次執行，後執行的進程跳過已完成的步驟
+vector_backend = configured_backend(vector_index_manager)
+with migration_lock(engine) as conn:
+    vector_backend.prepare_schema(conn)
+    Base.metadata.create_all(bind=conn)
+    run_migrations(conn)
+    vector_backend.prepare_index(conn)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 啟動事件
     print("應用啟動...")
+    # 預載入嵌入模型，所有請求共享同一個已預熱的實例
+    await model_registry.preload(configured_models())
+    print(f"已載入嵌入模型: {', '.join(model_registry.loaded_models())}")
+    # 啟動後台嵌入工作者
+    embedding_worker.start()
+    # 磁盤向量段的後台合併
+    if isinstance(vector_index_manager, SegmentIndexManager):
+        vector_index_manager.start()
     yield
     # 關閉事件
+    await embedding_worker.stop()
+    if isinstance(vector_index_manager, SegmentIndexManager):
+        await vector_index_manager.stop()
+    else:
+        vector_index_manager.close()
+    vector_index_manager.persist()
+    model_registry.clear()
+    # 關閉連接池中的異步連接（aiosqlite 每個連接佔用一個線程）
+    await async_engine.dispose()
     print("應用關閉...")
 
 
@@ -35,10 +66,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """為每個請求放置階段計時器，寫入 Server-Timing 頭並按路由聚合延遲"""
+    timer = StageTimer()
+    request.state.timer = timer
+    start = time.perf_counter()
+    response = await call_next(request)
+    total_ms = (time.perf_counter() - start) * 1000
+
+    route = request.scope.get("route")
+    if route is not None:
+        latency_recorder.record(f"{request.method} {route.path}", timer, total_ms)
+    response.headers["Server-Timing"] = timer.server_timing(total_ms)
+    return response
+
+
 # 包含路由
 app.include_router(memories.router)
 app.include_router(search.router)
 app.include_router(sharing.router)
+app.include_router(metrics.router)
 
 
 @app.get("/health")
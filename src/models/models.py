@@ -1,12 +1,15 @@
 """數據庫模型"""
 
-from sqlalchemy import Column, String, DateTime, Boolean, Integer, ForeignKey, Table, JSON, Float, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, DateTime, Boolean, Integer, ForeignKey, Index, Table, JSON, Float, Text, LargeBinary, and_, exists, func, or_, select
+from sqlalchemy.orm import attribute_keyed_dict, load_only, raiseload, relationship, selectinload
 from sqlalchemy.dialects.postgresql import UUID as pgUUID
 from src.db.database import Base
+from src.utils.embedding import format_pgvector, pack_vector, unpack_vector
 from datetime import datetime
+import numpy as np
 import uuid
 import json
+import os
 from uuid import UUID
 
 
@@ -36,12 +39,89 @@ class GUID(types.TypeDecorator):
             return uuid.UUID(value)
         return value
 
+
+# 向量搜索後端：inprocess（進程內索引）或 pgvector（PostgreSQL 中計算 top-k）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "inprocess")
+
+
+class PgVector(types.UserDefinedType):
+    """pgvector 擴展的 vector 類型
+
+    不指定維度時一列可以存放不同模型的向量，ANN 索引按模型建在
+    帶維度轉換的表達式上。
+    """
+    cache_ok = True
+
+    def __init__(self, dim: int = None):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return f"vector({self.dim})" if self.dim else "vector"
+
+
+class Vector(types.TypeDecorator):
+    """以小端 float32 二進制存儲的向量類型
+
+    寫入接受列表或 numpy 數組；讀取通過 np.frombuffer 零拷貝返回
+    只讀 float32 數組。遷移前遺留的 JSON 文本值也可以讀取。
+    pgvector=True 的列在 VECTOR_BACKEND=pgvector 且數據庫為 PostgreSQL 時
+    使用 vector 類型，以 pgvector 文本格式讀寫。
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, pgvector: bool = False):
+        super().__init__()
+        self.pgvector = pgvector
+
+    def is_native(self, dialect) -> bool:
+        """該方言上是否使用 pgvector 的 vector 類型"""
+        return self.pgvector and VECTOR_BACKEND == "pgvector" and dialect.name == "postgresql"
+
+    def load_dialect_impl(self, dialect):
+        if self.is_native(dialect):
+            return dialect.type_descriptor(PgVector())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        if self.is_native(dialect):
+            return format_pgvector(value)
+        return pack_vector(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        if isinstance(value, str):
+            # 遺留 JSON 文本和 pgvector 文本格式（'[1,2,3]'）
+            return np.array(json.loads(value), dtype=np.float32)
+        if isinstance(value, list):
+            return np.array(value, dtype=np.float32)
+        return unpack_vector(bytes(value) if isinstance(value, memoryview) else value)
+
+    def compare_values(self, x, y):
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(np.asarray(x), np.asarray(y))
+
+# 讀寫向量時使用的模型，與 model_registry 的默認模型一致（EMBEDDING_MODELS 的第一個）
+ACTIVE_EMBEDDING_MODEL = (
+    [name.strip() for name in os.getenv("EMBEDDING_MODELS", "all-MiniLM-L6-v2").split(",") if name.strip()]
+    or ["all-MiniLM-L6-v2"]
+)[0]
+# 雙讀：memory_embedding 沒有向量時回退讀取遷移前的 memory.embeddings 列
+EMBEDDING_DUAL_READ = os.getenv("EMBEDDING_DUAL_READ", "1") not in ("0", "false", "False")
+
 # 關聯表：記憶與 Agent 共享
+# 複合主鍵 (memory_id, agent_id) 防止重複共享，並支持「與誰共享」查詢；
+# (agent_id, memory_id) 反向索引支持「共享給我」查詢
 memory_shared_agents = Table(
     'memory_shared_agents',
     Base.metadata,
-    Column('memory_id', GUID, ForeignKey('memory.id')),
-    Column('agent_id', GUID, ForeignKey('agent.id'))
+    Column('memory_id', GUID, ForeignKey('memory.id'), primary_key=True),
+    Column('agent_id', GUID, ForeignKey('agent.id'), primary_key=True),
+    Index('ix_memory_shared_agents_agent_id', 'agent_id', 'memory_id')
 )
 
 
@@ -73,10 +153,11 @@ class Memory(Base):
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    # 嵌入相關欄位
-    embeddings = Column(JSON, nullable=True)  # 存儲為 JSON
-    embedding_model = Column(String(50), default="all-MiniLM-L6-v2")
-    embedding_updated_at = Column(DateTime, nullable=True)
+    # 遷移前存放在 memory 行上的向量（列名 embeddings）。向量已移到 memory_embedding，
+    # 此列只在雙讀期間作為回退讀取，寫入新向量時清空
+    legacy_embeddings = Column("embeddings", Vector, nullable=True)
+    # ready: 嵌入已是最新；pending: 等待後台生成；failed: 重試耗盡
+    embedding_status = Column(String(20), default="ready", index=True)
 
     # 關係
     creator = relationship("Agent", back_populates="memories")
@@ -85,3 +166,184 @@ class Memory(Base):
         secondary=memory_shared_agents,
         backref="shared_memories"
     )
+    # {model_name: MemoryEmbedding}，遷移期間一條記憶可以同時有多個模型的向量
+    vectors = relationship(
+        "MemoryEmbedding",
+        collection_class=attribute_keyed_dict("model_name"),
+        cascade="all, delete-orphan",
+        lazy="selectin"
+    )
+
+    @property
+    def embeddings(self):
+        """當前模型的向量
+
+        memory_embedding 中沒有時回退到遷移前的 memory.embeddings 列（雙讀），
+        EMBEDDING_DUAL_READ=0 時不回退。
+        """
+        vector = self.vectors.get(ACTIVE_EMBEDDING_MODEL)
+        if vector is not None:
+            return vector.embeddings
+        return self.legacy_embeddings if EMBEDDING_DUAL_READ else None
+
+    @embeddings.setter
+    def embeddings(self, value):
+        """寫入當前模型的向量（None 表示刪除），同時清空遷移前的列"""
+        if value is None:
+            self.vectors.pop(ACTIVE_EMBEDDING_MODEL, None)
+        elif ACTIVE_EMBEDDING_MODEL in self.vectors:
+            vector = self.vectors[ACTIVE_EMBEDDING_MODEL]
+            vector.embeddings = value
+            vector.updated_at = datetime.utcnow()
+        else:
+            self.vectors[ACTIVE_EMBEDDING_MODEL] = MemoryEmbedding(
+                model_name=ACTIVE_EMBEDDING_MODEL, embeddings=value
+            )
+        self.legacy_embeddings = None
+
+
+class MemoryEmbedding(Base):
+    """記憶的向量，按 (memory_id, model_name) 存放
+
+    向量與記憶元數據分表，列表和元數據掃描不再讀取多 KB 的向量，
+    向量掃描只讀取這張窄表。
+    """
+    __tablename__ = "memory_embedding"
+
+    memory_id = Column(GUID, ForeignKey("memory.id", ondelete="CASCADE"), primary_key=True)
+    model_name = Column(String(100), primary_key=True)
+    # 小端 float32 二進制；pgvector 後端在 PostgreSQL 上為 vector 類型
+    embeddings = Column(Vector(pgvector=True), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def _active_vector_join():
+    return and_(
+        MemoryEmbedding.memory_id == Memory.id,
+        MemoryEmbedding.model_name == ACTIVE_EMBEDDING_MODEL
+    )
+
+
+def has_embedding():
+    """SQL 條件：記憶有當前模型的向量（雙讀時包括遷移前的列）"""
+    clause = exists().where(_active_vector_join())
+    if EMBEDDING_DUAL_READ:
+        clause = or_(clause, Memory.legacy_embeddings != None)
+    return clause
+
+
+def select_vectors(*columns):
+    """查詢 Memory 列和當前模型的向量（結果列名 embeddings），只返回有向量的記憶
+
+    Args:
+        columns: 需要一起讀取的 Memory 列
+
+    Returns:
+        Select 語句，可繼續添加 where 條件
+    """
+    if EMBEDDING_DUAL_READ:
+        vector = func.coalesce(MemoryEmbedding.embeddings, Memory.legacy_embeddings)
+        return (
+            select(*columns, vector.label("embeddings"))
+            .select_from(Memory)
+            .outerjoin(MemoryEmbedding, _active_vector_join())
+            .where(vector != None)
+        )
+    return (
+        select(*columns, MemoryEmbedding.embeddings)
+        .select_from(Memory)
+        .join(MemoryEmbedding, _active_vector_join())
+    )
+
+
+def active_vectors():
+    """載入選項：只預載入當前模型的向量"""
+    return selectinload(
+        Memory.vectors.and_(MemoryEmbedding.model_name == ACTIVE_EMBEDDING_MODEL)
+    )
+
+
+# 熱點查詢的複合索引和部分索引（已有數據庫由遷移 0004 創建）
+_live = Memory.is_deleted == False
+HOT_PATH_INDEXES = (
+    # 列表分頁和記憶總數：等值過濾後按 (created_at, id) 有序讀取，不需要排序
+    Index(
+        "ix_memory_workspace_live_created",
+        Memory.workspace_id, Memory.is_deleted, Memory.created_at, Memory.id
+    ),
+    # 嵌入狀態統計和 pending 計數
+    Index(
+        "ix_memory_workspace_live_status",
+        Memory.workspace_id, Memory.embedding_status,
+        sqlite_where=_live, postgresql_where=_live
+    ),
+)
+
+
+# 列載入配置：按用途只讀取需要的 Memory 列
+# - light：列表、單條讀取、權限和元數據查詢，不讀取向量
+# - vector：向量索引構建，只讀取 ID 和索引元數據，向量來自 memory_embedding
+MEMORY_COLUMN_PROFILES = {
+    "light": (
+        "id", "workspace_id", "created_by_agent_id", "type", "category", "content",
+        "visibility", "is_deleted", "created_at", "updated_at", "embedding_status"
+    ),
+    "vector": (
+        "id", "workspace_id", "created_by_agent_id", "visibility", "type", "category"
+    ),
+}
+
+
+def memory_columns(profile: str) -> tuple:
+    """返回配置中的 Memory 列屬性，用於只查詢列元組的場景
+
+    Args:
+        profile: 配置名稱（light 或 vector）
+
+    Returns:
+        列屬性元組
+
+    Raises:
+        KeyError: 如果配置不存在
+    """
+    return tuple(getattr(Memory, name) for name in MEMORY_COLUMN_PROFILES[profile])
+
+
+def memory_load_profile(profile: str):
+    """返回只載入配置中列的查詢選項
+
+    訪問未載入的列會拋出異常，而不是隱式發起查詢（異步會話中
+    隱式查詢同樣會失敗），這樣配置缺列能在測試中立即暴露。
+
+    Args:
+        profile: 配置名稱（light 或 vector）
+
+    Returns:
+        載入選項元組，用 select().options(*profile) 或 Session.get(options=profile) 傳入
+    """
+    if profile == "vector":
+        # 雙讀回退需要遷移前的向量列
+        return (
+            load_only(*memory_columns(profile), Memory.legacy_embeddings, raiseload=True),
+            active_vectors()
+        )
+    return (load_only(*memory_columns(profile), raiseload=True), raiseload(Memory.vectors))
+
+
+MEMORY_LIGHT = memory_load_profile("light")
+MEMORY_VECTOR = memory_load_profile("vector")
+
+
+class EmbeddingJob(Base):
+    """後台嵌入任務（持久化隊列）"""
+    __tablename__ = "embedding_job"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    memory_id = Column(GUID, ForeignKey("memory.id"), index=True)
+    status = Column(String(20), default="queued", index=True)  # queued, running, done, dead
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow, index=True)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
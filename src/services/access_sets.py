@@ -0,0 +1,207 @@
+"""Agent 訪問集合 - 預先計算每個 Agent 被共享的記憶，供搜索在評分時過濾"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Optional
+from uuid import UUID
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from src.models.models import Memory, memory_shared_agents
+
+
+@dataclass
+class AgentAccessSet:
+    """單個 Agent 的訪問集合
+
+    所有者和公開記憶由索引的元數據列直接判定，這裡只保存
+    共享給該 Agent 的記憶：{memory_id: workspace_id}。
+    """
+    agent_id: UUID
+    shared: Dict[UUID, UUID] = field(default_factory=dict)
+    loaded_at: float = 0.0
+
+    def shared_in(self, workspace_id: UUID) -> FrozenSet[UUID]:
+        """工作區內共享給該 Agent 的記憶"""
+        return frozenset(m for m, ws in self.shared.items() if ws == workspace_id)
+
+    def shared_outside(self, workspace_id: UUID) -> FrozenSet[UUID]:
+        """其他工作區共享給該 Agent 的記憶"""
+        return frozenset(m for m, ws in self.shared.items() if ws != workspace_id)
+
+    def scope(self, workspace_id: UUID) -> "AccessScope":
+        """在某個工作區索引上使用的訪問範圍"""
+        return AccessScope(self.agent_id, self.shared_in(workspace_id))
+
+
+@dataclass(frozen=True)
+class AccessScope:
+    """索引評分時的訪問範圍：所有者、公開記憶或共享 ID 之一即可讀"""
+    agent_id: UUID
+    shared_ids: FrozenSet[UUID] = frozenset()
+
+    def mask(self, index) -> np.ndarray:
+        """返回索引中可讀行的掩碼"""
+        return index.access_mask(self.agent_id, self.shared_ids)
+
+    def allows(self, memory) -> bool:
+        """判定已載入的記憶是否可讀（不查詢數據庫）"""
+        return (
+            memory.created_by_agent_id == self.agent_id
+            or memory.visibility == "public"
+            or memory.id in self.shared_ids
+        )
+
+
+class AccessSetManager:
+    """按 Agent 緩存訪問集合，共享和撤銷操作增量維護
+
+    集合在首次搜索時從 memory_shared_agents 按 agent_id 讀取；
+    超過 ttl 後重新讀取，以收斂其他進程的共享變更。
+
+    集合只用於生成候選：撤銷只更新本進程的緩存，其他進程在 ttl 內仍可能
+    保留已撤銷的 ID，因此搜索讀取記憶時必須在 SQL 中再確認共享關係
+    （PermissionManager.readable_clause / shared_clause）。
+
+    構建期間發生 grant、revoke 或 invalidate 的集合只返回給本次調用，
+    不寫入緩存，避免構建時讀到的舊共享覆蓋構建期間的撤銷。
+    """
+
+    def __init__(
+        self,
+        max_agents: int = 10000,
+        ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """初始化管理器
+
+        Args:
+            max_agents: 最多緩存的 Agent 數，超出時按 LRU 淘汰
+            ttl: 集合的有效秒數，0 表示不過期
+            clock: 單調時鐘（測試時可替換）
+
+        Raises:
+            ValueError: 如果 max_agents 無效
+        """
+        if max_agents < 1:
+            raise ValueError("max_agents 必須大於 0")
+
+        self.max_agents = max_agents
+        self.ttl = ttl
+        self.clock = clock
+        self._sets: "OrderedDict[UUID, AgentAccessSet]" = OrderedDict()
+        # 正在構建的 Agent：[進行中的構建數, 構建期間的變更計數]
+        self._inflight: Dict[UUID, List[int]] = {}
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._hits = 0
+
+    def get(self, agent_id: UUID, db: Session) -> AgentAccessSet:
+        """獲取 Agent 的訪問集合，不存在或過期時從數據庫讀取
+
+        Args:
+            agent_id: Agent ID
+            db: 數據庫會話
+
+        Returns:
+            AgentAccessSet
+        """
+        now = self.clock()
+        with self._lock:
+            access = self._sets.get(agent_id)
+            if access is not None and (not self.ttl or now - access.loaded_at < self.ttl):
+                self._sets.move_to_end(agent_id)
+                self._hits += 1
+                return access
+            inflight = self._inflight.setdefault(agent_id, [0, 0])
+            inflight[0] += 1
+            seen = inflight[1]
+
+        try:
+            access = self.build(agent_id, db)
+        finally:
+            with self._lock:
+                inflight[0] -= 1
+                if not inflight[0]:
+                    del self._inflight[agent_id]
+        access.loaded_at = now
+        with self._lock:
+            self._builds += 1
+            if inflight[1] != seen:
+                return access
+            self._sets[agent_id] = access
+            self._sets.move_to_end(agent_id)
+            while len(self._sets) > self.max_agents:
+                self._sets.popitem(last=False)
+        return access
+
+    @staticmethod
+    def build(agent_id: UUID, db: Session) -> AgentAccessSet:
+        """從共享表讀取共享給 Agent 的未刪除記憶"""
+        rows = db.query(memory_shared_agents.c.memory_id, Memory.workspace_id).join(
+            Memory, Memory.id == memory_shared_agents.c.memory_id
+        ).filter(
+            memory_shared_agents.c.agent_id == agent_id,
+            Memory.is_deleted == False
+        ).all()
+        return AgentAccessSet(agent_id, {memory_id: workspace_id for memory_id, workspace_id in rows})
+
+    def _changed(self, agent_id: UUID) -> None:
+        """記錄變更，使正在進行的構建結果不寫入緩存（調用方持有鎖）"""
+        inflight = self._inflight.get(agent_id)
+        if inflight is not None:
+            inflight[1] += 1
+
+    def grant(self, agent_id: UUID, memory_id: UUID, workspace_id: UUID) -> None:
+        """共享後加入集合（Agent 未緩存時跳過）"""
+        with self._lock:
+            self._changed(agent_id)
+            access = self._sets.get(agent_id)
+            if access is not None:
+                # 寫時複製，正在搜索的請求繼續使用舊字典
+                access.shared = {**access.shared, memory_id: workspace_id}
+
+    def revoke(self, agent_id: UUID, memory_id: UUID) -> None:
+        """撤銷共享後移出本進程的集合（其他進程靠 SQL 確認過濾）"""
+        with self._lock:
+            self._changed(agent_id)
+            access = self._sets.get(agent_id)
+            if access is not None and memory_id in access.shared:
+                access.shared = {m: ws for m, ws in access.shared.items() if m != memory_id}
+
+    def invalidate(self, agent_id: Optional[UUID] = None) -> None:
+        """丟棄一個或全部 Agent 的集合"""
+        with self._lock:
+            if agent_id is None:
+                self._sets.clear()
+                for key in self._inflight:
+                    self._changed(key)
+            else:
+                self._sets.pop(agent_id, None)
+                self._changed(agent_id)
+
+    def stats(self) -> Dict:
+        """返回緩存的 Agent 數和共享條目數"""
+        with self._lock:
+            return {
+                "agents": len(self._sets),
+                "shared_entries": sum(len(access.shared) for access in self._sets.values()),
+                "max_agents": self.max_agents,
+                "builds": self._builds,
+                "hits": self._hits,
+            }
+
+
+access_set_manager = AccessSetManager(
+    max_agents=int(os.getenv("ACCESS_SET_MAX_AGENTS", "10000")),
+    ttl=float(os.getenv("ACCESS_SET_TTL_SECONDS", "300"))
+)
+
+
+def get_access_set_manager() -> AccessSetManager:
+    """FastAPI 依賴：返回進程內共享的訪問集合管理器"""
+    return access_set_manager
@@ -0,0 +1,229 @@
+"""嵌入緩存 - 按 (model_name, 文本哈希) 緩存向量，內存 LRU + 可選磁盤層
+
+磁盤層的寫入先進入緩衝，由後台寫入線程成批落盤（一次 executemany 和一次提交），
+put 在事件循環上只寫內存，不等待 SQLite。
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 寫入線程在緩衝為空時等待新寫入的秒數，超時後退出，下次寫入時重新啟動
+WRITER_IDLE_SECONDS = 1.0
+
+
+def normalize_text(text: str) -> str:
+    """規範化文本：Unicode NFC、去除首尾空白、合併連續空白"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """計算緩存鍵：模型名稱與規範化文本的 SHA-256"""
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """內容尋址的嵌入緩存
+
+    內存層為有界 LRU；提供 disk_path 時，未命中內存的查詢會讀取
+    SQLite 磁盤層，寫入由後台線程成批落盤，重啟後仍然有效。
+    """
+
+    def __init__(self, max_entries: int = 10000, disk_path: Optional[str] = None):
+        """初始化緩存
+
+        Args:
+            max_entries: 內存層最多保存的向量數
+            disk_path: SQLite 磁盤層文件路徑（可選）
+
+        Raises:
+            ValueError: 如果 max_entries 無效
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries 必須大於 0")
+
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        # 讀取連接在 _lock 下使用；寫入連接只由 flush 在 _flush_lock 下使用
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_writer: Optional[sqlite3.Connection] = None
+        # 等待落盤的寫入：鍵 -> (模型名稱, 向量)
+        self._disk_pending: Dict[str, Tuple[str, np.ndarray]] = {}
+        self._disk_changed = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._flush_lock = threading.Lock()
+        self._disk_writes = 0
+        self._disk_failures = 0
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "key TEXT PRIMARY KEY, model_name TEXT, dim INTEGER, vector BLOB)"
+            )
+            self._disk.commit()
+            self._disk_writer = sqlite3.connect(disk_path, check_same_thread=False)
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        """查詢緩存
+
+        Args:
+            model_name: 模型名稱
+            text: 原始文本
+
+        Returns:
+            float32 向量，未命中時返回 None
+        """
+        key = cache_key(model_name, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                return vector
+
+            if self._disk is not None:
+                # 已從 LRU 淘汰但還沒落盤的寫入
+                with self._disk_changed:
+                    pending = self._disk_pending.get(key)
+                if pending is not None:
+                    self._remember(key, pending[1])
+                    self._hits += 1
+                    return pending[1]
+                row = self._disk.execute(
+                    "SELECT vector FROM embedding_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype="<f4")
+                    self._remember(key, vector)
+                    self._hits += 1
+                    self._disk_hits += 1
+                    return vector
+
+            self._misses += 1
+            return None
+
+    def put(self, model_name: str, text: str, vector) -> None:
+        """寫入緩存（磁盤層的寫入交給後台寫入線程）
+
+        Args:
+            model_name: 模型名稱
+            text: 原始文本
+            vector: 嵌入向量
+        """
+        key = cache_key(model_name, text)
+        array = np.array(vector, dtype="<f4")
+        array.setflags(write=False)
+        with self._lock:
+            self._remember(key, array)
+            if self._disk is None:
+                return
+        with self._disk_changed:
+            self._disk_pending[key] = (model_name, array)
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="embedding-cache-writer", daemon=True
+                )
+                self._writer.start()
+            else:
+                self._disk_changed.notify()
+
+    def _write_loop(self) -> None:
+        """寫入線程：把緩衝中的寫入成批落盤，空閒 WRITER_IDLE_SECONDS 後退出"""
+        while True:
+            with self._disk_changed:
+                if not self._disk_pending:
+                    self._disk_changed.wait(WRITER_IDLE_SECONDS)
+                if not self._disk_pending:
+                    self._writer = None
+                    return
+            self.flush()
+
+    def flush(self) -> int:
+        """把緩衝中的寫入落盤（一次 executemany 和一次提交）
+
+        緩存可以重新計算，寫入失敗的批次記錄日誌後丟棄。
+
+        Returns:
+            寫入的向量數
+        """
+        with self._flush_lock:
+            with self._disk_changed:
+                pending, self._disk_pending = self._disk_pending, {}
+            if not pending or self._disk_writer is None:
+                return 0
+            try:
+                self._disk_writer.executemany(
+                    "INSERT OR REPLACE INTO embedding_cache (key, model_name, dim, vector) "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (key, model_name, int(array.shape[0]), array.tobytes())
+                        for key, (model_name, array) in pending.items()
+                    ]
+                )
+                self._disk_writer.commit()
+            except sqlite3.Error:
+                logger.exception("嵌入緩存寫入磁盤失敗，丟棄 %d 條", len(pending))
+                self._disk_writer.rollback()
+                self._disk_failures += 1
+                return 0
+            self._disk_writes += len(pending)
+            return len(pending)
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        """放入內存層並按 LRU 淘汰（調用方持有鎖）"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中、未命中和淘汰計數"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._memory),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "disk_enabled": self._disk is not None,
+                "disk_pending": len(self._disk_pending),
+                "disk_writes": self._disk_writes,
+                "disk_failures": self._disk_failures,
+            }
+
+    def clear(self) -> None:
+        """清空內存層（磁盤層保留）"""
+        with self._lock:
+            self._memory.clear()
+
+    def close(self) -> None:
+        """寫入緩衝中的寫入並關閉磁盤層連接"""
+        self.flush()
+        with self._flush_lock:
+            if self._disk_writer is not None:
+                self._disk_writer.close()
+                self._disk_writer = None
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
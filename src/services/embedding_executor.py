@@ -0,0 +1,159 @@
+"""嵌入推理執行器 - 在線程池或進程池中執行 CPU 密集的 encode"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Union
+import asyncio
+import multiprocessing
+import threading
+
+import numpy as np
+
+EXECUTOR_MODES = ("inline", "thread", "process")
+
+# 預熱時等待所有工作者就緒的最長秒數（包括其他工作者載入模型的時間）
+WARMUP_TIMEOUT = 600.0
+
+# 每個工作線程（或工作進程）持有自己的模型副本
+_worker_state = threading.local()
+
+
+def _get_worker_model(model_name: str):
+    """獲取當前工作者的模型副本，首次調用時載入"""
+    models = getattr(_worker_state, "models", None)
+    if models is None:
+        models = {}
+        _worker_state.models = models
+    model = models.get(model_name)
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+        models[model_name] = model
+    return model
+
+
+def _encode_in_worker(model_name: str, texts: Union[str, List[str]]) -> np.ndarray:
+    """在工作者中執行 encode"""
+    model = _get_worker_model(model_name)
+    return np.asarray(model.encode(texts), dtype=np.float32)
+
+
+def _load_worker(model_name: str) -> None:
+    """工作者初始化函數：啟動時載入並預熱模型，之後的任務直接使用"""
+    _get_worker_model(model_name).encode("warmup")
+
+
+def _warmup_worker(barrier) -> None:
+    """佔住當前工作者直到所有工作者都領到預熱任務
+
+    每個任務在屏障上等待，因此 pool_size 個任務必然分佈在 pool_size 個不同的工作者上，
+    池會啟動全部工作者（各自在初始化函數中載入模型）。
+    """
+    barrier.wait(WARMUP_TIMEOUT)
+
+
+class EmbeddingExecutor:
+    """把 encode 調度到線程池或進程池，避免阻塞 asyncio 事件循環"""
+
+    def __init__(self, model_name: str, mode: str = "thread", pool_size: int = 2):
+        """初始化執行器
+
+        Args:
+            model_name: 工作者載入的模型名稱
+            mode: 執行模式（thread 或 process）
+            pool_size: 工作者數量，每個工作者持有一個模型副本
+
+        Raises:
+            ValueError: 如果模式或池大小無效
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"不支持的執行模式: {mode}")
+        if pool_size < 1:
+            raise ValueError("pool_size 必須大於 0")
+
+        self.model_name = model_name
+        self.mode = mode
+        self.pool_size = pool_size
+        # 每個工作者啟動時在初始化函數中載入一次模型，不依賴任務如何分配
+        self._pool: Executor = (
+            ThreadPoolExecutor(
+                max_workers=pool_size, thread_name_prefix="embedding",
+                initializer=_load_worker, initargs=(model_name,)
+            )
+            if mode == "thread"
+            else ProcessPoolExecutor(
+                max_workers=pool_size, initializer=_load_worker, initargs=(model_name,)
+            )
+        )
+        self._in_flight = 0
+        self._completed = 0
+        self._peak_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    async def encode(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """在池中執行 encode 並等待結果
+
+        Args:
+            texts: 單個文本或文本列表
+
+        Returns:
+            float32 嵌入（單個文本為一維，列表為二維）
+        """
+        loop = asyncio.get_running_loop()
+        with self._counter_lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            return await loop.run_in_executor(
+                self._pool, _encode_in_worker, self.model_name, texts
+            )
+        finally:
+            with self._counter_lock:
+                self._in_flight -= 1
+                self._completed += 1
+
+    async def warmup(self) -> None:
+        """啟動全部工作者，每個工作者在初始化時載入一次模型副本
+
+        pool_size 個預熱任務在屏障上互相等待，只有全部工作者都啟動後才會返回。
+        進程池的屏障由 multiprocessing.Manager 提供。
+        """
+        if self.mode == "thread":
+            await self._run_warmup(threading.Barrier(self.pool_size))
+            return
+        manager = await asyncio.to_thread(multiprocessing.Manager)
+        try:
+            await self._run_warmup(manager.Barrier(self.pool_size))
+        finally:
+            await asyncio.to_thread(manager.shutdown)
+
+    async def _run_warmup(self, barrier) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._pool, _warmup_worker, barrier)
+            for _ in range(self.pool_size)
+        ])
+
+    def stats(self) -> Dict[str, Union[str, int, float]]:
+        """返回池的隊列深度和飽和度
+
+        Returns:
+            in_flight 為已提交未完成的任務數，queue_depth 為其中
+            等待空閒工作者的任務數，saturation 為忙碌工作者比例
+        """
+        with self._counter_lock:
+            in_flight = self._in_flight
+            completed = self._completed
+            peak = self._peak_in_flight
+        return {
+            "mode": self.mode,
+            "pool_size": self.pool_size,
+            "in_flight": in_flight,
+            "queue_depth": max(0, in_flight - self.pool_size),
+            "saturation": min(1.0, in_flight / self.pool_size),
+            "peak_in_flight": peak,
+            "completed": completed,
+        }
+
+    def shutdown(self) -> None:
+        """關閉工作池"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
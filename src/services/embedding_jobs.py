@@ -0,0 +1,305 @@
+"""後台嵌入流水線 - 持久化任務隊列和批量處理工作者"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+import asyncio
+import logging
+import os
+import uuid
+
+from sqlalchemy import func, or_, and_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.db.database import AsyncSessionLocal
+from src.models.models import EmbeddingJob, Memory, has_embedding
+from src.services.model_registry import model_registry
+from src.services.vector_index import vector_index_manager
+
+logger = logging.getLogger(__name__)
+
+# 記憶的嵌入狀態
+EMBEDDING_READY = "ready"
+EMBEDDING_PENDING = "pending"
+EMBEDDING_FAILED = "failed"
+
+# 任務狀態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_DEAD = "dead"
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_DEAD)
+
+# sync: 請求內生成嵌入（失敗時轉入後台重試）；async: 寫入後立即返回，由後台生成
+EMBEDDING_WRITE_MODE = os.getenv("EMBEDDING_WRITE_MODE", "sync")
+
+
+def write_behind_enabled() -> bool:
+    """是否啟用寫後嵌入模式"""
+    return EMBEDDING_WRITE_MODE == "async"
+
+
+def enqueue_embedding(db: Session, memory: Memory) -> None:
+    """把記憶標記為 pending 並在同一事務中加入嵌入任務
+
+    已有排隊中的任務時不重複添加。調用方負責提交事務。
+
+    Args:
+        db: 數據庫會話
+        memory: 記憶
+    """
+    if memory.id is None:
+        memory.id = uuid.uuid4()
+    memory.embedding_status = EMBEDDING_PENDING
+
+    queued = db.query(EmbeddingJob.id).filter(
+        EmbeddingJob.memory_id == memory.id,
+        EmbeddingJob.status == JOB_QUEUED
+    ).first()
+    if queued is None:
+        db.add(EmbeddingJob(memory_id=memory.id, status=JOB_QUEUED))
+
+
+def pending_unscored_count(db: Session, workspace_id) -> int:
+    """工作區內等待嵌入且還沒有舊向量、搜索無法評分的記憶數"""
+    return db.query(func.count(Memory.id)).filter(
+        Memory.workspace_id == workspace_id,
+        Memory.is_deleted == False,
+        Memory.embedding_status == EMBEDDING_PENDING,
+        ~has_embedding()
+    ).scalar() or 0
+
+
+class EmbeddingWorker:
+    """從 embedding_job 表領取任務、批量生成嵌入的後台工作者
+
+    - 每輪領取最多 batch_size 個到期任務，一次 batch_embeddings
+    - 整批失敗時逐條重試，避免一條壞數據拖累整批
+    - 失敗的任務按指數退避重新排隊，超過 max_attempts 次進入死信（dead）
+    - 租約超時的 running 任務（如進程崩潰）會被重新領取
+    - 數據庫訪問走異步會話（run_sync），等待數據庫時不阻塞事件循環
+    - 領取用條件 UPDATE（WHERE status 和 locked_at 未變）並檢查影響行數，
+      SQLite 上 FOR UPDATE 無效時多個進程也不會領取同一任務
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        get_service: Callable[[], "EmbeddingService"],
+        index_manager=None,
+        batch_size: int = 32,
+        max_attempts: int = 5,
+        retry_backoff: float = 2.0,
+        poll_interval: float = 1.0,
+        lease_timeout: float = 300.0,
+        concurrency: int = 1
+    ):
+        """初始化工作者
+
+        Args:
+            session_factory: 創建異步數據庫會話的函數
+            get_service: 返回嵌入服務的函數
+            index_manager: VectorIndexManager（可選），嵌入完成後同步索引
+            batch_size: 每輪領取的任務數
+            max_attempts: 進入死信前的最大嘗試次數
+            retry_backoff: 第一次重試的延遲秒數，之後按 2 倍遞增
+            poll_interval: 隊列為空時的輪詢間隔（秒）
+            lease_timeout: running 任務的租約時長（秒）
+            concurrency: 並發工作協程數
+        """
+        self.session_factory = session_factory
+        self.get_service = get_service
+        self.index_manager = index_manager
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self.concurrency = concurrency
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._processed = 0
+        self._failed = 0
+
+    def claim(self, db: Session) -> List[EmbeddingJob]:
+        """領取一批到期任務並標記為 running
+
+        先選出候選，再逐個用條件 UPDATE 搶佔：只有 status 和 locked_at
+        仍是選出時的值才更新，影響行數為 0 說明已被其他工作者領取。
+
+        Args:
+            db: 數據庫會話
+
+        Returns:
+            已領取的任務
+        """
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=self.lease_timeout)
+        candidates = db.query(
+            EmbeddingJob.id, EmbeddingJob.status, EmbeddingJob.locked_at
+        ).filter(or_(
+            and_(EmbeddingJob.status == JOB_QUEUED, EmbeddingJob.available_at <= now),
+            and_(EmbeddingJob.status == JOB_RUNNING, EmbeddingJob.locked_at < expired)
+        )).order_by(EmbeddingJob.id).limit(self.batch_size).with_for_update(
+            skip_locked=True
+        ).all()
+
+        claimed = []
+        for job_id, status, locked_at in candidates:
+            unchanged = (
+                EmbeddingJob.locked_at.is_(None) if locked_at is None
+                else EmbeddingJob.locked_at == locked_at
+            )
+            result = db.execute(
+                update(EmbeddingJob)
+                .where(EmbeddingJob.id == job_id, EmbeddingJob.status == status, unchanged)
+                .values(status=JOB_RUNNING, locked_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(job_id)
+        db.commit()
+        if not claimed:
+            return []
+        return db.query(EmbeddingJob).filter(
+            EmbeddingJob.id.in_(claimed)
+        ).order_by(EmbeddingJob.id).all()
+
+    @staticmethod
+    def _load_work(db: Session, jobs: List[EmbeddingJob]) -> List:
+        """讀取任務對應的記憶；記憶不存在或已刪除的任務直接完成"""
+        memories = {
+            m.id: m for m in db.query(Memory).filter(
+                Memory.id.in_([job.memory_id for job in jobs])
+            ).all()
+        }
+        work = []
+        for job in jobs:
+            memory = memories.get(job.memory_id)
+            if memory is None or memory.is_deleted:
+                job.status = JOB_DONE
+            else:
+                work.append((job, memory))
+        return work
+
+    async def run_once(self) -> int:
+        """處理一批任務
+
+        Returns:
+            本輪領取的任務數
+        """
+        async with self.session_factory() as db:
+            jobs = await db.run_sync(self.claim)
+            if not jobs:
+                return 0
+
+            work = await db.run_sync(self._load_work, jobs)
+            if work:
+                await self._embed(work)
+            await db.commit()
+
+            if self.index_manager is not None:
+                for job, memory in work:
+                    if job.status == JOB_DONE:
+                        self.index_manager.upsert(memory)
+            return len(jobs)
+
+    async def _embed(self, work: List) -> None:
+        """生成嵌入；整批失敗時逐條重試（只修改對象，由調用方提交）"""
+        service = self.get_service()
+        try:
+            embeddings = await service.batch_embeddings(
+                [memory.content for _, memory in work], batch_size=self.batch_size
+            )
+        except Exception as e:
+            if len(work) == 1:
+                self._fail(*work[0], e)
+                return
+            for item in work:
+                await self._embed([item])
+            return
+
+        for (job, memory), embedding in zip(work, embeddings):
+            memory.embeddings = embedding
+            memory.embedding_status = EMBEDDING_READY
+            job.status = JOB_DONE
+            job.attempts += 1
+            job.last_error = None
+            self._processed += 1
+
+    def _fail(self, job: EmbeddingJob, memory: Memory, error: Exception) -> None:
+        """記錄失敗：退避後重新排隊，或進入死信"""
+        job.attempts += 1
+        job.last_error = str(error)
+        self._failed += 1
+        if job.attempts >= self.max_attempts:
+            job.status = JOB_DEAD
+            memory.embedding_status = EMBEDDING_FAILED
+            logger.warning("嵌入任務 %s 重試 %s 次後進入死信: %s", job.id, job.attempts, error)
+        else:
+            job.status = JOB_QUEUED
+            job.available_at = datetime.utcnow() + timedelta(
+                seconds=self.retry_backoff * 2 ** (job.attempts - 1)
+            )
+
+    async def drain(self) -> int:
+        """處理隊列直到沒有到期任務（主要用於測試和腳本）
+
+        Returns:
+            處理的任務總數
+        """
+        total = 0
+        while True:
+            count = await self.run_once()
+            if count == 0:
+                return total
+            total += count
+
+    async def _loop(self) -> None:
+        while not self._stopping:
+            try:
+                count = await self.run_once()
+            except Exception:
+                logger.exception("嵌入工作者處理失敗")
+                count = 0
+            if count == 0:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        """在當前事件循環中啟動工作協程"""
+        if self._tasks or self.concurrency <= 0:
+            return
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        """停止工作協程（running 任務在租約超時後會被重新領取）"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self, db: Session) -> Dict:
+        """返回各狀態的任務數和本進程的處理統計"""
+        counts = dict(
+            db.query(EmbeddingJob.status, func.count(EmbeddingJob.id))
+            .group_by(EmbeddingJob.status).all()
+        )
+        return {
+            "jobs": {status: counts.get(status, 0) for status in JOB_STATUSES},
+            "workers": len(self._tasks),
+            "processed": self._processed,
+            "failed_attempts": self._failed,
+        }
+
+
+embedding_worker = EmbeddingWorker(
+    AsyncSessionLocal,
+    model_registry.get,
+    index_manager=vector_index_manager,
+    batch_size=int(os.getenv("EMBEDDING_JOB_BATCH_SIZE", "32")),
+    max_attempts=int(os.getenv("EMBEDDING_JOB_MAX_ATTEMPTS", "5")),
+    poll_interval=float(os.getenv("EMBEDDING_JOB_POLL_SECONDS", "1.0")),
+    concurrency=int(os.getenv("EMBEDDING_WORKERS", "1"))
+)
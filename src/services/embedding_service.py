@@ -1,24 +1,117 @@
 """向量嵌入服務 - 支持本地模型和 OpenAI API"""
 
 from sentence_transformers import SentenceTransformer
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 import numpy as np
+import threading
+from src.services.embedding_executor import EmbeddingExecutor
+from src.services.micro_batcher import MicroBatcher, EmbeddingQueueFullError
+from src.services.embedding_cache import EmbeddingCache
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
 
 
 class EmbeddingService:
     """向量嵌入服務，支持本地模型和 OpenAI API"""
 
-    def __init__(self, use_openai: bool = False, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        use_openai: bool = False,
+        model_name: str = DEFAULT_MODEL_NAME,
+        executor: Optional[EmbeddingExecutor] = None,
+        cache: Optional[EmbeddingCache] = None
+    ):
         """初始化嵌入服務
 
+        本地模型在首次使用（或調用 load()）時才載入，
+        以便註冊表在應用啟動時統一預熱。
+
         Args:
             use_openai: 是否使用 OpenAI API
             model_name: 本地模型名稱
+            executor: 推理執行器（可選）。提供時 encode 在工作池中執行，
+                不阻塞事件循環；否則在當前線程內聯執行
+            cache: 嵌入緩存（可選）。命中時跳過 encode
         """
         self.use_openai = use_openai
         self.model_name = model_name
-        if not use_openai:
-            self.model = SentenceTransformer(model_name)
+        self.executor = executor
+        self.cache = cache
+        self.batcher: Optional[MicroBatcher] = None
+        self._model: Optional[SentenceTransformer] = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """本地 SentenceTransformer 模型（延遲載入）"""
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self) -> None:
+        """載入並預熱本地模型，重複調用不會重新載入"""
+        if self.use_openai or self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is None:
+                model = SentenceTransformer(self.model_name)
+                model.encode("warmup")
+                self._model = model
+
+    async def warmup(self) -> None:
+        """預熱模型：有執行器時讓每個工作者載入自己的副本"""
+        if self.use_openai:
+            return
+        if self.executor is not None:
+            await self.executor.warmup()
+        else:
+            self.load()
+
+    async def _encode(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """執行 encode，有執行器時調度到工作池"""
+        if self.executor is not None:
+            return await self.executor.encode(texts)
+        return self.model.encode(texts)
+
+    def enable_micro_batching(
+        self,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 1024,
+        enqueue_timeout: Optional[float] = None
+    ) -> None:
+        """開啟微批處理：並發的 get_embeddings 調用合併為一次批量 encode
+
+        Args:
+            max_batch_size: 單批最大請求數
+            max_wait_ms: 湊批的最長等待時間（毫秒）
+            max_queue_size: 隊列容量，滿時新請求等待
+            enqueue_timeout: 隊列滿時最長等待秒數（None 表示一直等待）
+        """
+        self.batcher = MicroBatcher(
+            self._encode,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_queue_size=max_queue_size,
+            enqueue_timeout=enqueue_timeout
+        )
+
+    def stats(self) -> Dict:
+        """返回推理執行統計"""
+        if self.executor is None:
+            stats = {"mode": "inline", "model_name": self.model_name}
+        else:
+            stats = {"model_name": self.model_name, **self.executor.stats()}
+        if self.batcher is not None:
+            stats["micro_batching"] = self.batcher.stats()
+        return stats
+
+    def close(self) -> None:
+        """釋放執行器和微批處理資源"""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.executor is not None:
+            self.executor.shutdown()
 
     async def get_embeddings(
         self,
@@ -48,8 +141,21 @@ class EmbeddingService:
                 pass
             else:
                 # 本地模型實現
-                embedding = self.model.encode(text)
+                if self.cache is not None:
+                    cached = self.cache.get(self.model_name, text)
+                    if cached is not None:
+                        return cached.tolist()
+
+                if self.batcher is not None:
+                    embedding = await self.batcher.submit(text)
+                else:
+                    embedding = await self._encode(text)
+
+                if self.cache is not None:
+                    self.cache.put(self.model_name, text, embedding)
                 return embedding.tolist()
+        except EmbeddingQueueFullError:
+            raise
         except Exception as e:
             raise RuntimeError(f"嵌入生成失敗: {e}")
 
@@ -70,9 +176,28 @@ class EmbeddingService:
         if not texts:
             return []
 
-        embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = self.model.encode(batch)
-            embeddings.extend([e.tolist() for e in batch_embeddings])
+        if self.cache is None:
+            embeddings = []
+            for i in range(0, len(texts), batch_size):
+                batch = texts[i:i + batch_size]
+                batch_embeddings = await self._encode(batch)
+                embeddings.extend([e.tolist() for e in batch_embeddings])
+            return embeddings
+
+        # 只對緩存未命中的文本執行 encode
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            cached = self.cache.get(self.model_name, text)
+            if cached is not None:
+                embeddings[i] = cached.tolist()
+            else:
+                missing.append(i)
+
+        for start in range(0, len(missing), batch_size):
+            indices = missing[start:start + batch_size]
+            batch_embeddings = await self._encode([texts[i] for i in indices])
+            for i, embedding in zip(indices, batch_embeddings):
+                self.cache.put(self.model_name, texts[i], embedding)
+                embeddings[i] = embedding.tolist()
         return embeddings
@@ -0,0 +1,366 @@
+"""HNSW 近似最近鄰索引 - 基於 NumPy 的分層可導航小世界圖"""
+
+from typing import Dict, Hashable, List, Optional, Tuple
+import heapq
+import json
+import math
+import threading
+
+import numpy as np
+
+from src.utils.embedding import normalize_rows
+
+
+class HNSWIndex:
+    """餘弦相似度的 HNSW 索引
+
+    向量插入前做 L2 規範化，距離為 1 - 內積。支持增量插入和
+    墓碑刪除：被刪除的節點仍參與圖遍歷，但不會出現在結果中。
+    更新已有標籤同樣留下一個墓碑；墓碑會擴大搜索範圍，
+    deleted_ratio 過高時應重建索引（見 VectorIndexManager）。
+
+    參數：
+        M: 每層每個節點的最大連接數（第 0 層為 2 * M）
+        ef_construction: 構建時的候選列表大小
+        ef_search: 搜索時的候選列表大小
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        M: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 50,
+        seed: int = 42
+    ):
+        """初始化空索引
+
+        Args:
+            dim: 向量維度
+            M: 最大連接數
+            ef_construction: 構建時的候選列表大小
+            ef_search: 搜索時的候選列表大小
+            seed: 層級隨機數種子
+
+        Raises:
+            ValueError: 如果參數無效
+        """
+        if M < 2:
+            raise ValueError("M 必須不小於 2")
+        self.dim = dim
+        self.M = M
+        self.max_M0 = 2 * M
+        self.ef_construction = max(ef_construction, M)
+        self.ef_search = ef_search
+        self._level_mult = 1 / math.log(M)
+        self._rng = np.random.default_rng(seed)
+
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._levels: List[int] = []
+        # _links[node][level] 為該節點在該層的鄰居列表
+        self._links: List[List[List[int]]] = []
+        self._deleted: List[bool] = []
+        self._labels: List[Hashable] = []
+        self._label_to_node: Dict[Hashable, int] = {}
+        self._entry_point: Optional[int] = None
+        self._max_level = -1
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """有效（未刪除）節點數"""
+        return len(self._label_to_node)
+
+    def __contains__(self, label: Hashable) -> bool:
+        return label in self._label_to_node
+
+    def labels(self) -> List[Hashable]:
+        """返回所有有效標籤"""
+        with self._lock:
+            return list(self._label_to_node)
+
+    def vector(self, label: Hashable) -> Optional[np.ndarray]:
+        """返回標籤對應的規範化向量，不存在時返回 None"""
+        with self._lock:
+            node = self._label_to_node.get(label)
+            return None if node is None else self._vectors[node]
+
+    @property
+    def deleted_ratio(self) -> float:
+        """墓碑節點佔全部節點的比例"""
+        total = len(self._levels)
+        return (total - len(self._label_to_node)) / total if total else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        """向量和鄰接表的估算字節數"""
+        links = sum(len(level) for node in self._links for level in node)
+        return self._vectors[:len(self._levels)].nbytes + links * 8
+
+    def _distances(self, query: np.ndarray, nodes: List[int]) -> np.ndarray:
+        return 1.0 - self._vectors[nodes] @ query
+
+    def _search_layer(
+        self,
+        query: np.ndarray,
+        entry_points: List[int],
+        ef: int,
+        level: int
+    ) -> List[Tuple[float, int]]:
+        """在單層上做貪心 beam 搜索，返回 (距離, 節點) 列表"""
+        visited = set(entry_points)
+        entry_distances = self._distances(query, entry_points)
+        candidates = [(float(d), n) for d, n in zip(entry_distances, entry_points)]
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in self._links[node][level] if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for d, n in zip(self._distances(query, neighbors), neighbors):
+                d = float(d)
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, n))
+                    heapq.heappush(results, (-d, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted((-d, n) for d, n in results)
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """啟發式選擇鄰居：優先保留方向多樣的近鄰
+
+        候選按距離升序；若某候選離已選鄰居比離查詢點更近則跳過，
+        不足 m 個時再用最近的候選補齊。
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+
+        nodes = [node for _, node in candidates]
+        vectors = self._vectors[nodes]
+        pairwise = 1.0 - vectors @ vectors.T
+        # closest[i] 為候選 i 到已選鄰居的最近距離
+        closest = np.full(len(nodes), np.inf, dtype=np.float32)
+        selected: List[int] = []
+        for i, (distance, _) in enumerate(candidates):
+            if closest[i] < distance:
+                continue
+            selected.append(i)
+            if len(selected) >= m:
+                break
+            np.minimum(closest, pairwise[i], out=closest)
+
+        if len(selected) < m:
+            chosen = set(selected)
+            selected.extend(
+                [i for i in range(len(nodes)) if i not in chosen][:m - len(selected)]
+            )
+        return [nodes[i] for i in selected]
+
+    def _shrink(self, node: int, level: int) -> None:
+        """連接數超出上限時只保留最近的鄰居"""
+        max_links = self.max_M0 if level == 0 else self.M
+        links = self._links[node][level]
+        if len(links) <= max_links:
+            return
+        distances = self._distances(self._vectors[node], links)
+        candidates = sorted(zip(distances.tolist(), links))
+        self._links[node][level] = self._select_neighbors(candidates, max_links)
+
+    def _ensure_capacity(self, rows: int) -> None:
+        capacity = self._vectors.shape[0]
+        if rows <= capacity:
+            return
+        vectors = np.zeros((max(rows, capacity * 2, 16), self.dim), dtype=np.float32)
+        vectors[:capacity] = self._vectors
+        self._vectors = vectors
+
+    def add(self, label: Hashable, vector) -> None:
+        """插入向量；標籤已存在時先刪除舊節點再插入
+
+        Args:
+            label: 外部標籤（如記憶 ID）
+            vector: 向量
+
+        Raises:
+            ValueError: 如果向量維度不一致
+        """
+        query = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if query.shape[0] != self.dim:
+            raise ValueError(f"向量維度 {query.shape[0]} 與索引維度 {self.dim} 不一致")
+
+        with self._lock:
+            if label in self._label_to_node:
+                self.mark_deleted(label)
+
+            node = len(self._levels)
+            level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+            self._ensure_capacity(node + 1)
+            self._vectors[node] = query
+            self._levels.append(level)
+            self._links.append([[] for _ in range(level + 1)])
+            self._deleted.append(False)
+            self._labels.append(label)
+            self._label_to_node[label] = node
+
+            if self._entry_point is None:
+                self._entry_point = node
+                self._max_level = level
+                return
+
+            entry = [self._entry_point]
+            for lc in range(self._max_level, level, -1):
+                entry = [self._search_layer(query, entry, 1, lc)[0][1]]
+
+            for lc in range(min(level, self._max_level), -1, -1):
+                candidates = self._search_layer(query, entry, self.ef_construction, lc)
+                neighbors = self._select_neighbors(candidates, self.M)
+                self._links[node][lc] = neighbors
+                for neighbor in neighbors:
+                    self._links[neighbor][lc].append(node)
+                    self._shrink(neighbor, lc)
+                entry = [n for _, n in candidates]
+
+            if level > self._max_level:
+                self._entry_point = node
+                self._max_level = level
+
+    def mark_deleted(self, label: Hashable) -> bool:
+        """墓碑刪除
+
+        Args:
+            label: 外部標籤
+
+        Returns:
+            bool: 標籤是否存在
+        """
+        with self._lock:
+            node = self._label_to_node.pop(label, None)
+            if node is None:
+                return False
+            self._deleted[node] = True
+            return True
+
+    def search(
+        self,
+        query_vector,
+        k: int,
+        ef: Optional[int] = None
+    ) -> List[Tuple[Hashable, float]]:
+        """搜索最相似的 k 個向量
+
+        Args:
+            query_vector: 查詢向量
+            k: 返回數量
+            ef: 候選列表大小（默認 max(ef_search, k)）
+
+        Returns:
+            [(label, cosine_similarity), ...] 按相似度降序
+        """
+        with self._lock:
+            if self._entry_point is None or k <= 0:
+                return []
+            query = normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+            ef = max(ef or self.ef_search, k)
+
+            entry = [self._entry_point]
+            for lc in range(self._max_level, 0, -1):
+                entry = [self._search_layer(query, entry, 1, lc)[0][1]]
+
+            # 有墓碑時擴大候選列表，保證能返回 k 個有效結果
+            deleted = len(self._levels) - len(self._label_to_node)
+            if deleted:
+                ef = min(len(self._levels), ef + deleted)
+            candidates = self._search_layer(query, entry, ef, 0)
+
+            results = []
+            for distance, node in candidates:
+                if self._deleted[node]:
+                    continue
+                results.append((self._labels[node], 1.0 - distance))
+                if len(results) >= k:
+                    break
+            return results
+
+    def save(self, path: str) -> None:
+        """持久化到 .npz 文件
+
+        Args:
+            path: 文件路徑
+        """
+        with self._lock:
+            count = len(self._levels)
+            offsets = [0]
+            flat: List[int] = []
+            for node in self._links:
+                for neighbors in node:
+                    flat.extend(neighbors)
+                    offsets.append(len(flat))
+            params = {
+                "dim": self.dim,
+                "M": self.M,
+                "ef_construction": self.ef_construction,
+                "ef_search": self.ef_search,
+                "entry_point": self._entry_point,
+                "max_level": self._max_level,
+            }
+            np.savez(
+                path,
+                params=np.array(json.dumps(params)),
+                vectors=self._vectors[:count],
+                levels=np.array(self._levels, dtype=np.int32),
+                deleted=np.array(self._deleted, dtype=bool),
+                labels=np.array([str(label) for label in self._labels]),
+                link_offsets=np.array(offsets, dtype=np.int64),
+                link_data=np.array(flat, dtype=np.int32),
+            )
+
+    @classmethod
+    def load(cls, path: str, label_type=str) -> "HNSWIndex":
+        """從 save 生成的文件載入
+
+        Args:
+            path: 文件路徑
+            label_type: 把字符串標籤轉換回原類型的函數（如 UUID）
+
+        Returns:
+            HNSWIndex
+        """
+        with np.load(path, allow_pickle=False) as data:
+            params = json.loads(str(data["params"]))
+            index = cls(
+                params["dim"],
+                M=params["M"],
+                ef_construction=params["ef_construction"],
+                ef_search=params["ef_search"]
+            )
+            index._vectors = data["vectors"].astype(np.float32)
+            index._levels = data["levels"].tolist()
+            index._deleted = data["deleted"].tolist()
+            index._labels = [label_type(label) for label in data["labels"].tolist()]
+            offsets = data["link_offsets"].tolist()
+            flat = data["link_data"].tolist()
+
+        position = 0
+        for level in index._levels:
+            node_links = []
+            for _ in range(level + 1):
+                node_links.append(flat[offsets[position]:offsets[position + 1]])
+                position += 1
+            index._links.append(node_links)
+
+        index._label_to_node = {
+            label: node
+            for node, label in enumerate(index._labels)
+            if not index._deleted[node]
+        }
+        index._entry_point = params["entry_point"]
+        index._max_level = params["max_level"]
+        return index
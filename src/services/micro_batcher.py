@@ -0,0 +1,154 @@
+"""動態微批處理 - 合併並發的單文本嵌入請求"""
+
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+import numpy as np
+
+
+class EmbeddingQueueFullError(RuntimeError):
+    """微批處理隊列已滿"""
+    pass
+
+
+class MicroBatcher:
+    """收集並發的單文本請求，合併為一次批量 encode
+
+    worker 取到第一個請求後，最多再等待 max_wait_ms 或湊滿
+    max_batch_size 個請求，然後執行一次批量 encode 並把每一行
+    結果返回給對應的調用者。
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[List[str]], Awaitable[np.ndarray]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 1024,
+        enqueue_timeout: Optional[float] = None
+    ):
+        """初始化微批處理器
+
+        Args:
+            encode_batch: 批量 encode 函數，輸入文本列表，返回二維數組
+            max_batch_size: 單批最大請求數
+            max_wait_ms: 湊批的最長等待時間（毫秒）
+            max_queue_size: 隊列容量，滿時新請求等待（背壓）
+            enqueue_timeout: 隊列滿時最長等待秒數，None 表示一直等待，
+                0 表示立即失敗
+
+        Raises:
+            ValueError: 如果參數無效
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 必須大於 0")
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size 必須大於 0")
+
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.enqueue_timeout = enqueue_timeout
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._batches = 0
+        self._items = 0
+        self._rejected = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        """確保當前事件循環上有運行中的 worker"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = loop.create_task(self._run())
+        return self._queue
+
+    async def submit(self, text: str) -> np.ndarray:
+        """提交單個文本並等待其嵌入
+
+        Args:
+            text: 要嵌入的文本
+
+        Returns:
+            一維嵌入向量
+
+        Raises:
+            EmbeddingQueueFullError: 如果隊列在 enqueue_timeout 內仍然已滿
+        """
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        item = (text, future)
+
+        try:
+            if self.enqueue_timeout == 0:
+                queue.put_nowait(item)
+            elif self.enqueue_timeout is None:
+                await queue.put(item)
+            else:
+                await asyncio.wait_for(queue.put(item), self.enqueue_timeout)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self._rejected += 1
+            raise EmbeddingQueueFullError("嵌入隊列已滿，請稍後重試")
+
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> List[Tuple[str, asyncio.Future]]:
+        """等待第一個請求，然後在時間窗口內湊批"""
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        """worker 主循環"""
+        queue = self._queue
+        while True:
+            batch = await self._collect(queue)
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            try:
+                embeddings = await self.encode_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._batches += 1
+            self._items += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def stats(self) -> Dict[str, float]:
+        """返回批處理統計"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_size": self.max_queue_size,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            "rejected": self._rejected,
+        }
+
+    def close(self) -> None:
+        """停止 worker"""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+        self._worker = None
@@ -0,0 +1,144 @@
+"""嵌入模型註冊表 - 進程內共享已載入的 EmbeddingService"""
+
+from typing import Dict, Iterable, List, Optional
+import os
+import threading
+
+from src.services.embedding_service import EmbeddingService, DEFAULT_MODEL_NAME
+from src.services.embedding_executor import EmbeddingExecutor, EXECUTOR_MODES
+from src.services.embedding_cache import EmbeddingCache
+
+
+class EmbeddingModelRegistry:
+    """按 model_name 緩存 EmbeddingService，每個模型在進程內只載入一次"""
+
+    def __init__(
+        self,
+        default_model: str = DEFAULT_MODEL_NAME,
+        executor_mode: str = "inline",
+        pool_size: int = 2,
+        micro_batching: Optional[Dict] = None,
+        cache: Optional[EmbeddingCache] = None
+    ):
+        """初始化註冊表
+
+        Args:
+            default_model: 未指定模型名稱時使用的默認模型
+            executor_mode: 推理模式（inline、thread 或 process）
+            pool_size: thread/process 模式下每個模型的工作者數量
+            micro_batching: 微批處理參數（傳給 enable_micro_batching），
+                None 表示不開啟
+            cache: 所有模型共享的嵌入緩存（鍵中包含模型名稱）
+
+        Raises:
+            ValueError: 如果推理模式無效
+        """
+        if executor_mode not in EXECUTOR_MODES:
+            raise ValueError(f"不支持的執行模式: {executor_mode}")
+        self.default_model = default_model
+        self.executor_mode = executor_mode
+        self.pool_size = pool_size
+        self.micro_batching = micro_batching
+        self.cache = cache
+        self._services: Dict[str, EmbeddingService] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: Optional[str] = None) -> EmbeddingService:
+        """獲取指定模型的共享嵌入服務
+
+        Args:
+            model_name: 模型名稱（可選，默認使用 default_model）
+
+        Returns:
+            該模型對應的 EmbeddingService 實例
+        """
+        name = model_name or self.default_model
+        service = self._services.get(name)
+        if service is not None:
+            return service
+
+        with self._lock:
+            service = self._services.get(name)
+            if service is None:
+                executor = None
+                if self.executor_mode != "inline":
+                    executor = EmbeddingExecutor(
+                        name, mode=self.executor_mode, pool_size=self.pool_size
+                    )
+                service = EmbeddingService(
+                    model_name=name, executor=executor, cache=self.cache
+                )
+                if self.micro_batching is not None:
+                    service.enable_micro_batching(**self.micro_batching)
+                self._services[name] = service
+        return service
+
+    async def preload(self, model_names: Iterable[str]) -> None:
+        """預先載入並預熱模型（在應用啟動時調用）
+
+        Args:
+            model_names: 要載入的模型名稱列表
+        """
+        for name in model_names:
+            await self.get(name).warmup()
+
+    def loaded_models(self) -> List[str]:
+        """返回已註冊的模型名稱"""
+        return list(self._services.keys())
+
+    def stats(self) -> Dict[str, Dict]:
+        """返回每個模型的推理執行統計"""
+        return {name: service.stats() for name, service in list(self._services.items())}
+
+    def clear(self) -> None:
+        """清空註冊表並關閉工作池，寫入嵌入緩存中未落盤的向量（主要用於測試和關閉）"""
+        with self._lock:
+            for service in self._services.values():
+                service.close()
+            self._services.clear()
+        if self.cache is not None:
+            self.cache.flush()
+
+
+def configured_models() -> List[str]:
+    """從環境變量 EMBEDDING_MODELS 讀取需要預載入的模型列表"""
+    raw = os.getenv("EMBEDDING_MODELS", DEFAULT_MODEL_NAME)
+    return [name.strip() for name in raw.split(",") if name.strip()]
+
+
+def configured_micro_batching() -> Optional[Dict]:
+    """從環境變量讀取微批處理配置，EMBEDDING_MICRO_BATCH=0 時關閉"""
+    if os.getenv("EMBEDDING_MICRO_BATCH", "1") in ("0", "false", "False"):
+        return None
+    timeout = os.getenv("EMBEDDING_ENQUEUE_TIMEOUT")
+    return {
+        "max_batch_size": int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32")),
+        "max_wait_ms": float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5")),
+        "max_queue_size": int(os.getenv("EMBEDDING_MAX_QUEUE_SIZE", "1024")),
+        "enqueue_timeout": float(timeout) if timeout else None,
+    }
+
+
+def configured_cache() -> Optional[EmbeddingCache]:
+    """從環境變量讀取緩存配置，EMBEDDING_CACHE_SIZE=0 時關閉"""
+    max_entries = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+    if max_entries <= 0:
+        return None
+    return EmbeddingCache(
+        max_entries=max_entries,
+        disk_path=os.getenv("EMBEDDING_CACHE_PATH") or None
+    )
+
+
+model_registry = EmbeddingModelRegistry(
+    default_model=(configured_models() or [DEFAULT_MODEL_NAME])[0],
+    executor_mode=os.getenv("EMBEDDING_EXECUTOR", "thread"),
+    pool_size=int(os.getenv("EMBEDDING_POOL_SIZE", "2")),
+    micro_batching=configured_micro_batching(),
+    cache=configured_cache()
+)
+
+
+def get_embedding_service() -> EmbeddingService:
+    """FastAPI 依賴：返回默認模型的共享嵌入服務"""
+    return model_registry.get()
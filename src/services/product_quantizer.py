@@ -0,0 +1,240 @@
+"""乘積量化（PQ）- 基於 NumPy 的向量壓縮和非對稱距離計算"""
+
+from typing import List, Optional
+import json
+
+import numpy as np
+
+from src.utils.embedding import normalize_rows
+
+# 編碼時每批處理的行數（限制 行數 × 聚類數 的距離矩陣大小）
+ENCODE_CHUNK_SIZE = 16384
+
+# 訓練碼本時默認最多使用的向量數
+DEFAULT_TRAIN_SIZE = 10000
+
+
+class ProductQuantizer:
+    """餘弦相似度的乘積量化器
+
+    向量規範化後切分為 subvectors 個子空間，每個子空間用 k-means 訓練
+    2 ** bits 個聚類中心；每個向量編碼為每個子空間最近中心的下標（uint8）。
+    查詢不量化：先計算查詢子向量與各中心的內積得到查找表，
+    編碼向量的分數為各子空間表項之和（非對稱距離計算，ADC）。
+
+    參數：
+        subvectors: 子空間數，即每個向量的編碼字節數
+        bits: 每個子空間的編碼位數（1 ~ 8）
+        iterations: k-means 迭代次數
+        train_size: 訓練時最多使用的向量數
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        subvectors: int,
+        bits: int = 8,
+        iterations: int = 20,
+        train_size: int = DEFAULT_TRAIN_SIZE,
+        seed: int = 42
+    ):
+        """初始化未訓練的量化器
+
+        Args:
+            dim: 向量維度
+            subvectors: 子空間數
+            bits: 每個子空間的編碼位數
+            iterations: k-means 迭代次數
+            train_size: 訓練樣本上限
+            seed: 隨機數種子
+
+        Raises:
+            ValueError: 如果參數無效
+        """
+        if not 1 <= subvectors <= dim:
+            raise ValueError("subvectors 必須在 1 和向量維度之間")
+        if not 1 <= bits <= 8:
+            raise ValueError("bits 必須在 1 和 8 之間")
+        self.dim = dim
+        self.subvectors = subvectors
+        self.bits = bits
+        self.iterations = iterations
+        self.train_size = train_size
+        self.seed = seed
+        self._rng = np.random.default_rng(seed)
+        # 維度不能整除時，前 dim % subvectors 個子空間多一維
+        sizes = [dim // subvectors + (1 if i < dim % subvectors else 0) for i in range(subvectors)]
+        self._bounds = np.cumsum([0] + sizes)
+        self.codebooks: Optional[List[np.ndarray]] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    @property
+    def nbytes(self) -> int:
+        """碼本佔用的字節數"""
+        if self.codebooks is None:
+            return 0
+        return sum(codebook.nbytes for codebook in self.codebooks)
+
+    def _spans(self):
+        return zip(self._bounds[:-1], self._bounds[1:])
+
+    def train(self, vectors: np.ndarray) -> "ProductQuantizer":
+        """用向量樣本訓練各子空間的碼本
+
+        樣本少於 2 ** bits 時，聚類數等於樣本數。
+
+        Args:
+            vectors: 形狀為 (n, dim) 的向量
+
+        Returns:
+            self
+
+        Raises:
+            ValueError: 如果沒有樣本或維度不一致
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim or len(vectors) == 0:
+            raise ValueError(f"訓練樣本必須是 (n, {self.dim}) 的非空矩陣")
+        if len(vectors) > self.train_size:
+            vectors = vectors[self._rng.choice(len(vectors), self.train_size, replace=False)]
+        sample = normalize_rows(vectors)
+        clusters = min(2 ** self.bits, len(sample))
+        self.codebooks = [self._kmeans(sample[:, start:end], clusters) for start, end in self._spans()]
+        return self
+
+    def _kmeans(self, points: np.ndarray, clusters: int) -> np.ndarray:
+        """Lloyd 迭代；空聚類重新取一個隨機樣本作為中心"""
+        centroids = points[self._rng.choice(len(points), clusters, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self._assign(points, centroids)
+            counts = np.bincount(assignment, minlength=clusters)
+            sums = np.stack([
+                np.bincount(assignment, weights=points[:, j], minlength=clusters)
+                for j in range(points.shape[1])
+            ], axis=1)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            empty = int((~filled).sum())
+            if empty:
+                centroids[~filled] = points[self._rng.choice(len(points), empty)]
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def _assign(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """返回每個點最近中心的下標（||x||² 不影響 argmin，省略）"""
+        distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+        return distances.argmin(axis=1)
+
+    def _require_trained(self) -> None:
+        if self.codebooks is None:
+            raise ValueError("量化器尚未訓練")
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """把向量規範化後編碼
+
+        Args:
+            vectors: 形狀為 (n, dim) 的向量
+
+        Returns:
+            np.ndarray: 形狀為 (n, subvectors) 的 uint8 編碼
+
+        Raises:
+            ValueError: 如果量化器未訓練或維度不一致
+        """
+        self._require_trained()
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"向量必須是 (n, {self.dim}) 的矩陣")
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for chunk in range(0, len(vectors), ENCODE_CHUNK_SIZE):
+            rows = normalize_rows(vectors[chunk:chunk + ENCODE_CHUNK_SIZE])
+            for i, (start, end) in enumerate(self._spans()):
+                codes[chunk:chunk + len(rows), i] = self._assign(rows[:, start:end], self.codebooks[i])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """由編碼重建近似向量
+
+        Args:
+            codes: uint8 編碼
+
+        Returns:
+            np.ndarray: 形狀為 (n, dim) 的 float32 近似向量
+        """
+        self._require_trained()
+        return np.hstack([self.codebooks[i][codes[:, i]] for i in range(self.subvectors)])
+
+    def lookup_table(self, query_embedding) -> np.ndarray:
+        """計算規範化查詢與各子空間中心的內積
+
+        Args:
+            query_embedding: 查詢向量
+
+        Returns:
+            np.ndarray: 形狀為 (subvectors, 聚類數) 的查找表
+        """
+        self._require_trained()
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        return np.stack([
+            self.codebooks[i] @ query[start:end] for i, (start, end) in enumerate(self._spans())
+        ])
+
+    def adc_scores(self, query_embedding, codes: np.ndarray) -> np.ndarray:
+        """非對稱距離計算：查詢與編碼向量的近似余弦相似度
+
+        逐子空間累加表項，臨時內存只有一個長度為 n 的數組。
+
+        Args:
+            query_embedding: 查詢向量
+            codes: 形狀為 (n, subvectors) 的 uint8 編碼
+
+        Returns:
+            np.ndarray: float32 近似相似度
+        """
+        table = self.lookup_table(query_embedding)
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for i in range(self.subvectors):
+            scores += table[i][codes[:, i]]
+        return scores
+
+    def save(self, path: str) -> None:
+        """持久化碼本到 .npz 文件
+
+        Args:
+            path: 文件路徑
+        """
+        self._require_trained()
+        params = {
+            "dim": self.dim,
+            "subvectors": self.subvectors,
+            "bits": self.bits,
+            "iterations": self.iterations,
+            "train_size": self.train_size,
+            "seed": self.seed,
+        }
+        np.savez(
+            path,
+            params=np.array(json.dumps(params)),
+            **{f"codebook_{i}": codebook for i, codebook in enumerate(self.codebooks)}
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ProductQuantizer":
+        """從 save 生成的文件載入
+
+        Args:
+            path: 文件路徑
+
+        Returns:
+            ProductQuantizer
+        """
+        with np.load(path, allow_pickle=False) as data:
+            params = json.loads(str(data["params"]))
+            quantizer = cls(**params)
+            quantizer.codebooks = [
+                data[f"codebook_{i}"].astype(np.float32) for i in range(quantizer.subvectors)
+            ]
+        return quantizer
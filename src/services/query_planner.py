@@ -0,0 +1,195 @@
+"""搜索查詢規劃 - 按工作區規模、過濾選擇率和 limit 選擇執行策略"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import math
+import os
+
+# 執行策略
+STRATEGY_SCAN = "scan"    # 按過濾條件直接從數據庫讀取記憶並全量評分
+STRATEGY_EXACT = "exact"  # 在常駐矩陣上做一次矩陣-向量乘法
+STRATEGY_ANN = "ann"      # 在 HNSW 圖上近似搜索
+STRATEGY_PUSHDOWN = "pushdown"  # top-k 在數據庫中計算（pgvector 後端）
+STRATEGIES = (STRATEGY_SCAN, STRATEGY_EXACT, STRATEGY_ANN)
+
+
+@dataclass
+class QueryPlan:
+    """查詢計劃及其代價估算
+
+    代價以「在常駐矩陣上給一個向量評分」為單位。
+    """
+    strategy: str
+    reason: str
+    workspace_size: Optional[int]
+    selectivity: Optional[float]
+    estimated_rows: Optional[int]
+    limit: int
+    estimated_costs: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        """轉換為 explain 返回的字典"""
+        return {
+            "strategy": self.strategy,
+            "reason": self.reason,
+            "workspace_size": self.workspace_size,
+            "selectivity": round(self.selectivity, 6) if self.selectivity is not None else None,
+            "estimated_rows": self.estimated_rows,
+            "limit": self.limit,
+            "estimated_costs": {
+                name: (None if math.isinf(cost) else round(cost, 1))
+                for name, cost in self.estimated_costs.items()
+            },
+        }
+
+
+class QueryPlanner:
+    """基於代價模型選擇搜索策略
+
+    - scan: 讀取並解析每條滿足過濾條件的記憶，代價與過濾後行數成正比
+    - exact: 給工作區全部向量評分，有過濾條件時再加一次元數據掃描
+    - ann: 訪問 ef × log2(N) 量級的圖節點；有過濾條件時 ef 按
+      limit / 選擇率放大，過濾越嚴格越不划算
+    exact 和 ann 都需要按主鍵讀取 limit 條候選做精確重算。
+    """
+
+    def __init__(
+        self,
+        row_fetch_cost: float = 40.0,
+        ann_node_cost: float = 20.0,
+        filter_cost: float = 1.0
+    ):
+        """初始化規劃器
+
+        Args:
+            row_fetch_cost: 從數據庫讀取並解析一條記憶的代價
+            ann_node_cost: HNSW 訪問一個節點的代價
+            filter_cost: 在常駐元數據上檢查一行過濾條件的代價
+        """
+        self.row_fetch_cost = row_fetch_cost
+        self.ann_node_cost = ann_node_cost
+        self.filter_cost = filter_cost
+
+    def estimate_costs(
+        self,
+        workspace_size: int,
+        selectivity: float,
+        limit: int,
+        filtered: bool,
+        ann_ef: Optional[int] = None
+    ) -> Dict[str, float]:
+        """估算每種策略的代價
+
+        Args:
+            workspace_size: 工作區內帶嵌入的記憶數
+            selectivity: 過濾條件選擇率（0.0 ~ 1.0）
+            limit: 請求的結果數
+            filtered: 是否有過濾條件
+            ann_ef: HNSW 的 ef_search，未掛載 ANN 索引時為 None
+
+        Returns:
+            {策略: 代價}，不可用的策略代價為 inf
+        """
+        rows = workspace_size * selectivity
+        fetch = min(limit, rows) * self.row_fetch_cost
+
+        costs = {
+            STRATEGY_SCAN: rows * (self.row_fetch_cost + 1.0),
+            STRATEGY_EXACT: workspace_size * (1.0 + (self.filter_cost if filtered else 0.0)) + fetch,
+            STRATEGY_ANN: math.inf,
+        }
+        if ann_ef is not None and workspace_size > 1 and selectivity > 0:
+            ef = max(ann_ef, math.ceil(limit / selectivity))
+            if ef < workspace_size:
+                filter_scan = workspace_size * self.filter_cost if filtered else 0.0
+                costs[STRATEGY_ANN] = (
+                    ef * math.log2(workspace_size) * self.ann_node_cost + filter_scan + fetch
+                )
+        return costs
+
+    def plan(
+        self,
+        workspace_size: int,
+        selectivity: float,
+        limit: int,
+        filtered: bool = False,
+        ann_ef: Optional[int] = None
+    ) -> QueryPlan:
+        """選擇代價最低的策略
+
+        Args:
+            workspace_size: 工作區內帶嵌入的記憶數
+            selectivity: 過濾條件選擇率
+            limit: 請求的結果數
+            filtered: 是否有過濾條件
+            ann_ef: HNSW 的 ef_search，未掛載 ANN 索引時為 None
+
+        Returns:
+            QueryPlan
+        """
+        costs = self.estimate_costs(workspace_size, selectivity, limit, filtered, ann_ef)
+        estimated_rows = int(round(workspace_size * selectivity))
+
+        if estimated_rows == 0:
+            strategy = STRATEGY_SCAN
+            reason = "沒有滿足條件的記憶，直接掃描"
+        else:
+            # 同代價時按 exact、scan、ann 的順序優先（結果精確且不依賴數據庫往返）
+            strategy = min(
+                (STRATEGY_EXACT, STRATEGY_SCAN, STRATEGY_ANN),
+                key=lambda name: costs[name]
+            )
+            if strategy == STRATEGY_SCAN:
+                reason = f"過濾後約 {estimated_rows} 條記憶，直接掃描比給全部 {workspace_size} 個向量評分更便宜"
+            elif strategy == STRATEGY_ANN:
+                reason = f"工作區有 {workspace_size} 個向量，HNSW 近似搜索比精確評分更便宜"
+            elif ann_ef is None:
+                reason = f"工作區有 {workspace_size} 個向量，未掛載 ANN 索引，精確評分"
+            else:
+                reason = f"工作區有 {workspace_size} 個向量，精確評分比 HNSW 更便宜"
+
+        return QueryPlan(
+            strategy=strategy,
+            reason=reason,
+            workspace_size=workspace_size,
+            selectivity=selectivity,
+            estimated_rows=estimated_rows,
+            limit=limit,
+            estimated_costs=costs,
+        )
+
+    @staticmethod
+    def pushdown(limit: int, backend_stats: Dict) -> QueryPlan:
+        """數據庫計算 top-k 時的查詢計劃，工作區規模和選擇率由數據庫估算
+
+        Args:
+            limit: 請求的結果數
+            backend_stats: 向量後端的統計（index_type、index_name）
+
+        Returns:
+            QueryPlan
+        """
+        index_name = backend_stats.get("index_name")
+        if index_name:
+            reason = f"pgvector {backend_stats.get('index_type')} 索引 {index_name} 在數據庫中計算 top-k"
+        else:
+            reason = "pgvector 在數據庫中精確計算 top-k（未創建 ANN 索引）"
+        return QueryPlan(
+            strategy=STRATEGY_PUSHDOWN,
+            reason=reason,
+            workspace_size=None,
+            selectivity=None,
+            estimated_rows=None,
+            limit=limit,
+        )
+
+
+query_planner = QueryPlanner(
+    row_fetch_cost=float(os.getenv("PLANNER_ROW_FETCH_COST", "40")),
+    ann_node_cost=float(os.getenv("PLANNER_ANN_NODE_COST", "20")),
+)
+
+
+def get_query_planner() -> QueryPlanner:
+    """FastAPI 依賴：返回共享的查詢規劃器"""
+    return query_planner
@@ -1,7 +1,13 @@
 """語義搜索引擎 - 基於向量相似度"""
 
-from typing import List, Tuple, Optional
+from typing import Callable, Dict, List, Sequence, Tuple, Optional
+import inspect
 import numpy as np
+from src.utils.embedding import normalize_rows, top_k_indices
+from src.utils.timing import StageTimer, timed
+
+# float32 矩陣分數與 float64 逐條計算之間的誤差容限
+SCORE_TOLERANCE = 1e-4
 
 
 class SearchService:
@@ -20,38 +26,246 @@ class SearchService:
         query: str,
         memories: List,
         top_k: int = 10,
-        similarity_threshold: float = 0.3
+        similarity_threshold: float = 0.3,
+        timer: Optional[StageTimer] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Tuple]:
         """語義搜索記憶
 
         邏輯：
-            1. 獲取查詢的嵌入
-            2. 為每個 memory 計算相似度
-            3. 過濾相似度低於閾值的結果
-            4. 按相似度降序排序
-            5. 返回前 top_k 個結果
+            1. 獲取查詢的嵌入（經過嵌入服務的緩存）
+            2. 把候選記憶的嵌入組成規範化的 float32 矩陣
+            3. 一次矩陣-向量乘法計算全部相似度
+            4. 用 argpartition 篩出可能進入前 top_k 且不低於閾值的候選
+            5. 對候選用 cosine_similarity 精確重算，再按相似度降序取前 top_k
 
         Args:
             query: 搜索查詢文本
             memories: 記憶列表
             top_k: 返回前 K 個結果
             similarity_threshold: 相似度閾值
+            timer: 階段計時器（可選）
+            query_embedding: 已生成的查詢嵌入（可選），提供時不再調用嵌入服務
 
         Returns:
             [(memory, similarity_score), ...] 排序後的結果
         """
-        query_embedding = await self.embedding_service.get_embeddings(query)
+        if query_embedding is None:
+            with timed(timer, "query_embedding"):
+                query_embedding = await self.embedding_service.get_embeddings(query)
 
-        results = []
+        candidates = []
+        vectors = []
         for memory in memories:
-            if hasattr(memory, 'embeddings') and memory.embeddings:
-                score = self.cosine_similarity(query_embedding, memory.embeddings)
-                if score >= similarity_threshold:
-                    results.append((memory, score))
+            embeddings = getattr(memory, 'embeddings', None)
+            if embeddings is not None and len(embeddings) > 0:
+                candidates.append(memory)
+                vectors.append(embeddings)
+
+        if not candidates:
+            return []
+
+        with timed(timer, "scoring"):
+            scores = self.score_vectors(query_embedding, vectors)
+            shortlist = self.shortlist(scores, top_k, similarity_threshold)
+        with timed(timer, "top_k"):
+            exact_scores = np.array(
+                [self.cosine_similarity(query_embedding, vectors[i]) for i in shortlist],
+                dtype=np.float64
+            )
+            indices, top_scores = self.select_top_k(exact_scores, top_k, similarity_threshold)
+        return [
+            (candidates[shortlist[i]], float(score))
+            for i, score in zip(indices, top_scores)
+        ]
+
+    async def search_index(
+        self,
+        query: str,
+        index,
+        load_memories: Callable[[List], List],
+        top_k: int = 10,
+        similarity_threshold: float = 0.3,
+        use_ann: Optional[bool] = None,
+        filters: Optional[Dict] = None,
+        timer: Optional[StageTimer] = None,
+        query_embedding: Optional[List[float]] = None,
+        scope=None
+    ) -> List[Tuple]:
+        """在向量索引上搜索
+
+        索引只給出候選 ID，再通過 load_memories 按主鍵讀取這些記憶，
+        用 cosine_similarity 精確重算排序，結果與 semantic_search 一致。
+
+        Args:
+            query: 搜索查詢文本
+            index: 向量後端打開的索引（WorkspaceVectorIndex 或 PgvectorIndex），
+                shortlist 可以是協程函數
+            load_memories: 按 ID 列表讀取記憶的函數（可以是協程函數）
+            top_k: 返回前 K 個結果
+            similarity_threshold: 相似度閾值
+            use_ann: 是否使用 ANN 索引（默認在已掛載時使用）
+            filters: {元數據字段: 取值}（可選）
+            timer: 階段計時器（可選）
+            query_embedding: 已生成的查詢嵌入（可選），提供時不再調用嵌入服務
+            scope: AccessScope（可選），評分時只保留範圍內可讀的記憶
+
+        Returns:
+            [(memory, similarity_score), ...] 排序後的結果
+        """
+        if query_embedding is None:
+            with timed(timer, "query_embedding"):
+                query_embedding = await self.embedding_service.get_embeddings(query)
+        with timed(timer, "scoring"):
+            candidate_ids = index.shortlist(
+                query_embedding, top_k, similarity_threshold,
+                use_ann=use_ann, filters=filters, scope=scope
+            )
+            if inspect.isawaitable(candidate_ids):
+                candidate_ids = await candidate_ids
+        if not candidate_ids:
+            return []
+
+        with timed(timer, "db_fetch"):
+            # 按索引給出的順序排列（進程內索引為行順序，與全量掃描的同分順序相同）
+            order = {memory_id: i for i, memory_id in enumerate(candidate_ids)}
+            loaded = load_memories(candidate_ids)
+            if inspect.isawaitable(loaded):
+                loaded = await loaded
+            memories = sorted(
+                (m for m in loaded if m.embeddings is not None),
+                key=lambda m: order[m.id]
+            )
+        with timed(timer, "top_k"):
+            exact_scores = np.array(
+                [self.cosine_similarity(query_embedding, m.embeddings) for m in memories],
+                dtype=np.float64
+            )
+            indices, top_scores = self.select_top_k(exact_scores, top_k, similarity_threshold)
+        return [(memories[i], float(score)) for i, score in zip(indices, top_scores)]
+
+    @staticmethod
+    def merge_results(result_lists: List[List[Tuple]], top_k: int) -> List[Tuple]:
+        """合併多個來源的排序結果，按記憶 ID 去重後取前 top_k
+
+        Args:
+            result_lists: 每個來源的 [(memory, similarity_score), ...]
+            top_k: 返回數量
+
+        Returns:
+            按相似度降序的合併結果；同分時保持來源順序
+        """
+        merged = {}
+        for results in result_lists:
+            for memory, score in results:
+                if memory.id not in merged:
+                    merged[memory.id] = (memory, score)
+        return sorted(merged.values(), key=lambda r: -r[1])[:top_k]
+
+    @staticmethod
+    def score_vectors(query_embedding: List[float], vectors: List) -> np.ndarray:
+        """計算查詢與一組向量的余弦相似度
+
+        維度與查詢不一致的向量得分為 0.0，與 cosine_similarity 一致。
+
+        Args:
+            query_embedding: 查詢嵌入向量
+            vectors: 嵌入向量列表
 
-        # 按相似度降序排序
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:top_k]
+        Returns:
+            np.ndarray: 每個向量的相似度
+        """
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        dim = query_vec.shape[0]
+        matching = [i for i, v in enumerate(vectors) if len(v) == dim]
+
+        scores = np.zeros(len(vectors), dtype=np.float32)
+        if not matching:
+            return scores
+
+        if len(matching) == len(vectors):
+            matrix = np.vstack(vectors)
+        else:
+            matrix = np.vstack([vectors[i] for i in matching])
+        matrix = normalize_rows(matrix)
+        query_norm = normalize_rows(query_vec.reshape(1, -1))[0]
+        scores[matching] = matrix @ query_norm
+        return scores
+
+    @staticmethod
+    def score_segments(query_embedding: List[float], matrices: Sequence[np.ndarray]) -> np.ndarray:
+        """計算查詢與多個已規範化向量矩陣的余弦相似度
+
+        矩陣通常是內存映射的段文件，逐段相乘而不拼接成一個大矩陣；
+        維度與查詢不一致的段得分為 0.0，與 cosine_similarity 一致。
+
+        Args:
+            query_embedding: 查詢嵌入向量
+            matrices: 行已 L2 規範化的 float32 矩陣列表
+
+        Returns:
+            np.ndarray: 按矩陣順序拼接的相似度
+        """
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = normalize_rows(query_vec.reshape(1, -1))[0]
+        scores = [
+            matrix @ query_norm if matrix.shape[1] == query_norm.shape[0]
+            else np.zeros(matrix.shape[0], dtype=np.float32)
+            for matrix in matrices
+        ]
+        return np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+    @staticmethod
+    def shortlist(
+        scores: np.ndarray,
+        top_k: int,
+        similarity_threshold: float,
+        tolerance: float = SCORE_TOLERANCE
+    ) -> np.ndarray:
+        """篩出可能進入前 top_k 的候選下標
+
+        float32 分數與逐條計算的結果有微小誤差，因此閾值和第 k 名
+        分數都放寬 tolerance，保證精確重算後的結果不會遺漏。
+
+        Args:
+            scores: float32 相似度數組
+            top_k: 返回數量
+            similarity_threshold: 相似度閾值
+            tolerance: 分數誤差容限
+
+        Returns:
+            np.ndarray: 升序排列的候選下標
+        """
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        passing = np.nonzero(scores >= similarity_threshold - tolerance)[0]
+        if len(passing) > top_k:
+            passing_scores = scores[passing]
+            kth = -np.partition(-passing_scores, top_k - 1)[top_k - 1]
+            passing = passing[passing_scores >= kth - tolerance]
+        return passing
+
+    @staticmethod
+    def select_top_k(
+        scores: np.ndarray,
+        top_k: int,
+        similarity_threshold: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """按閾值過濾並選出前 top_k 個結果
+
+        Args:
+            scores: 相似度數組
+            top_k: 返回數量
+            similarity_threshold: 相似度閾值
+
+        Returns:
+            (下標數組, 對應分數數組)，按分數降序
+        """
+        passing = np.nonzero(scores >= similarity_threshold)[0]
+        order = top_k_indices(scores[passing], top_k)
+        indices = passing[order]
+        return indices, scores[indices]
 
     @staticmethod
     def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
@@ -65,8 +279,8 @@ class SearchService:
             相似度分數 (0.0 到 1.0)
         """
         try:
-            arr1 = np.array(vec1)
-            arr2 = np.array(vec2)
+            arr1 = np.asarray(vec1)
+            arr2 = np.asarray(vec2)
 
             norm1 = np.linalg.norm(arr1)
             norm2 = np.linalg.norm(arr2)
@@ -0,0 +1,507 @@
+"""向量搜索後端 - 進程內索引或 PostgreSQL pgvector
+
+SearchService.search_index 只要求索引提供 shortlist（返回候選記憶 ID，可以是協程），
+精確重算和排序仍由 SearchService 完成，因此兩種後端返回相同的結果：
+
+- inprocess：VectorIndexManager 管理的常駐矩陣和 HNSW 圖，查詢規劃在進程內完成
+- pgvector：memory_embedding.embeddings 在 PostgreSQL 上存為 vector 類型，
+  top-k 余弦搜索通過 HNSW 或 IVFFlat 索引在數據庫中完成，只傳回候選 ID
+
+SQLite 始終使用進程內索引。register_sqlite_functions 在 SQLite 連接上註冊
+余弦距離函數，讓 pgvector 後端的查詢可以在 SQLite 上運行，供測試使用。
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from uuid import UUID
+import logging
+import os
+import re
+
+import numpy as np
+from fastapi import Depends
+from sqlalchemy import Float, MetaData, bindparam, cast, event, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+import sqlalchemy.types as types
+
+from src.core.permissions import PermissionManager
+from src.db.database import DATABASE_URL
+from src.db.migrations import run_migrations
+from src.models.models import (
+    ACTIVE_EMBEDDING_MODEL, VECTOR_BACKEND, Memory, MemoryEmbedding, PgVector, Vector
+)
+from src.services.search_service import SCORE_TOLERANCE
+from src.services.vector_index import PUBLIC_SCOPE, VectorIndexManager, get_vector_index_manager
+from src.utils.embedding import format_pgvector, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+# 轉換已有 bytea 向量列時每批處理的行數
+CONVERT_CHUNK_SIZE = 500
+
+INDEX_TYPES = ("hnsw", "ivfflat", "none")
+# pgvector 0.8 的迭代索引掃描模式（off 表示不啟用）
+ITERATIVE_SCAN_MODES = ("off", "relaxed_order", "strict_order")
+
+
+class cosine_distance(FunctionElement):
+    """余弦距離 1 - cos(a, b)：PostgreSQL 上是 pgvector 的 <=> 運算符"""
+    type = Float()
+    name = "vector_cosine_distance"
+    inherit_cache = True
+
+
+@compiles(cosine_distance)
+def _compile_cosine_distance(element, compiler, **kw):
+    return f"vector_cosine_distance({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(cosine_distance, "postgresql")
+def _compile_pg_cosine_distance(element, compiler, **kw):
+    left, right = element.clauses
+    return f"({compiler.process(left, **kw)} <=> {compiler.process(right, **kw)})"
+
+
+def _sqlite_cosine_distance(left, right):
+    """pgvector <=> 在 SQLite 上的替身：參數是 pack_vector 格式的向量"""
+    if left is None or right is None:
+        return None
+    a, b = unpack_vector(left), unpack_vector(right)
+    if a.shape != b.shape:
+        return 1.0
+    norms = float(np.linalg.norm(a)) * float(np.linalg.norm(b))
+    if norms == 0:
+        return None
+    return 1.0 - float(np.dot(a, b)) / norms
+
+
+def register_sqlite_functions(engine: Engine) -> Engine:
+    """在 SQLite 引擎的每個連接上註冊 vector_cosine_distance 函數
+
+    Args:
+        engine: 同步引擎（異步引擎傳入 async_engine.sync_engine）
+
+    Returns:
+        同一個引擎
+    """
+    @event.listens_for(engine, "connect")
+    def _register(dbapi_connection, connection_record):
+        dbapi_connection.create_function(
+            "vector_cosine_distance", 2, _sqlite_cosine_distance, deterministic=True
+        )
+    return engine
+
+
+class VectorBackend(ABC):
+    """向量搜索後端接口
+
+    open 返回的索引提供 shortlist(query_embedding, top_k, similarity_threshold,
+    use_ann=None, filters=None, scope=None)，交給 SearchService.search_index 使用。
+    """
+    name = ""
+    # True：索引常駐進程內，支持 len、selectivity 和 access_mask，由 QueryPlanner 選擇策略；
+    # False：top-k 下推到數據庫，不在進程內規劃
+    in_process = True
+
+    @abstractmethod
+    async def open(self, db: AsyncSession, workspace_id: UUID):
+        """打開工作區（或 PUBLIC_SCOPE）的索引
+
+        Args:
+            db: 異步數據庫會話
+            workspace_id: 工作區 ID
+
+        Returns:
+            帶 shortlist 方法的索引
+        """
+
+    def prepare_schema(self, conn: Connection) -> None:
+        """建表之前準備數據庫（擴展、列類型轉換），默認不需要
+
+        在 migration_lock 的連接和事務中執行。
+        """
+
+    def prepare_index(self, conn: Connection) -> None:
+        """遷移之後創建搜索索引，默認不需要
+
+        在 migration_lock 的連接和事務中執行。
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """返回後端統計"""
+
+
+class InProcessBackend(VectorBackend):
+    """進程內後端：使用 VectorIndexManager 的常駐索引"""
+    name = "inprocess"
+    in_process = True
+
+    def __init__(self, manager: VectorIndexManager):
+        """初始化後端
+
+        Args:
+            manager: 常駐索引管理器
+        """
+        self.manager = manager
+
+    async def open(self, db: AsyncSession, workspace_id: UUID):
+        # 索引構建沿用同步接口，在異步會話的連接上執行
+        return await db.run_sync(lambda session: self.manager.get(workspace_id, session))
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, **self.manager.stats()}
+
+
+class PgvectorIndex:
+    """工作區在 pgvector 上的搜索視圖，綁定一個請求的異步會話"""
+
+    def __init__(self, backend: "PgvectorBackend", db: AsyncSession, workspace_id: UUID):
+        self.backend = backend
+        self.db = db
+        self.workspace_id = workspace_id
+
+    def _candidates(self, columns, filters: Optional[Dict] = None, scope=None):
+        """當前模型向量中，工作區（或公開範圍）內滿足權限和過濾條件的行"""
+        statement = select(*columns).select_from(MemoryEmbedding).join(
+            Memory, Memory.id == MemoryEmbedding.memory_id
+        ).where(
+            MemoryEmbedding.model_name == bindparam(
+                "model_name", ACTIVE_EMBEDDING_MODEL, literal_execute=True
+            ),
+            Memory.is_deleted == False
+        )
+        if self.workspace_id == PUBLIC_SCOPE:
+            statement = statement.where(Memory.visibility == "public")
+        else:
+            statement = statement.where(Memory.workspace_id == self.workspace_id)
+        if scope is not None:
+            # 共享關係直接在 SQL 中判定，不使用可能過期的進程內共享集合
+            statement = statement.where(PermissionManager.readable_clause(scope.agent_id))
+        for field, value in (filters or {}).items():
+            statement = statement.where(getattr(Memory, field) == value)
+        return statement
+
+    def statement(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        filters: Optional[Dict] = None,
+        scope=None,
+        dialect_name: str = "postgresql",
+        exact: bool = False
+    ):
+        """構建候選查詢：按余弦距離升序取前 top_k × candidate_factor 條
+
+        PostgreSQL 上向量轉換為帶維度的 vector，與 ANN 索引的表達式一致，
+        模型名按字面量渲染以匹配部分索引條件。exact 為 True 時使用不帶維度的
+        表達式，不匹配 ANN 索引，數據庫先按工作區和過濾條件取行再精確排序。
+        """
+        vector = MemoryEmbedding.embeddings
+        query = bindparam("query_vector", query_embedding, type_=Vector(pgvector=True))
+        if dialect_name == "postgresql" and not exact:
+            dim_type = PgVector(self.backend.dim)
+            vector, query = cast(vector, dim_type), cast(query, dim_type)
+        distance = cosine_distance(vector, query)
+
+        statement = self._candidates([Memory.id], filters, scope).where(
+            distance <= 1.0 - similarity_threshold + SCORE_TOLERANCE
+        )
+        return statement.order_by(distance).limit(top_k * self.backend.candidate_factor)
+
+    async def is_selective(self, filters: Optional[Dict] = None, scope=None) -> bool:
+        """工作區、權限和過濾條件是否只留下不超過 exact_max_rows 行
+
+        ANN 索引按全表的距離順序返回，條件在之後過濾；小租戶的行在全局
+        候選中佔比很低，索引掃描可能返回不足 top_k 條。計數最多讀取
+        exact_max_rows + 1 行，代價與精確掃描同一量級。
+        """
+        limit = self.backend.exact_max_rows
+        if not limit:
+            return False
+        rows = self._candidates([Memory.id], filters, scope).limit(limit + 1).subquery()
+        count = await self.db.scalar(select(func.count()).select_from(rows))
+        return count <= limit
+
+    async def shortlist(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        use_ann: Optional[bool] = None,
+        filters: Optional[Dict] = None,
+        scope=None
+    ) -> List[UUID]:
+        """返回可能進入前 top_k 的記憶 ID（按距離升序）
+
+        Args:
+            query_embedding: 查詢嵌入向量
+            top_k: 返回數量
+            similarity_threshold: 相似度閾值
+            use_ann: 忽略，是否走索引由 PostgreSQL 決定
+            filters: {元數據字段: 取值}（可選）
+            scope: AccessScope（可選），只返回範圍內可讀的記憶
+
+        Returns:
+            候選記憶 ID 列表，需要調用方精確重算排序
+        """
+        if top_k <= 0:
+            return []
+        if self.backend.dim is not None and len(query_embedding) != self.backend.dim:
+            return []
+        dialect_name = self.db.bind.dialect.name
+        exact = False
+        if dialect_name == "postgresql" and self.backend.index_type != "none":
+            exact = await self.is_selective(filters, scope)
+            if not exact:
+                for setting in self.backend.session_settings(top_k * self.backend.candidate_factor):
+                    await self.db.execute(text(setting))
+        rows = await self.db.execute(self.statement(
+            query_embedding, top_k, similarity_threshold, filters, scope, dialect_name, exact
+        ))
+        return list(rows.scalars())
+
+
+class PgvectorBackend(VectorBackend):
+    """pgvector 後端：top-k 余弦搜索在 PostgreSQL 中完成
+
+    memory_embedding.embeddings 不限定維度；ANN 索引按當前模型建在
+    (embeddings::vector(dim)) 表達式上並帶 model_name 部分索引條件，
+    同一列中其他維度的模型向量不影響索引。
+
+    ANN 索引是全局的，工作區、權限和過濾條件在索引返回候選之後才過濾：
+    - 滿足條件的行不超過 exact_max_rows 時改用精確計劃（不走 ANN 索引）
+    - 其餘查詢在 pgvector >= 0.8 上啟用迭代索引掃描，過濾後不足時繼續掃描索引
+    """
+    name = "pgvector"
+    in_process = False
+
+    def __init__(
+        self,
+        index_type: str = "hnsw",
+        dim: Optional[int] = None,
+        candidate_factor: int = 2,
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 64,
+        hnsw_ef_search: int = 40,
+        ivfflat_lists: int = 100,
+        ivfflat_probes: int = 10,
+        iterative_scan: str = "relaxed_order",
+        exact_max_rows: int = 10000
+    ):
+        """初始化後端
+
+        Args:
+            index_type: hnsw、ivfflat 或 none（不建 ANN 索引，數據庫內精確掃描）
+            dim: 當前模型的向量維度，None 時從已有向量檢測
+            candidate_factor: 取回 top_k 的多少倍候選做精確重算
+            hnsw_m: HNSW 每層的鄰居數
+            hnsw_ef_construction: HNSW 構建時的候選列表大小
+            hnsw_ef_search: HNSW 查詢時的候選列表大小（至少為候選數）
+            ivfflat_lists: IVFFlat 的聚類數
+            ivfflat_probes: IVFFlat 查詢時訪問的聚類數
+            iterative_scan: 迭代索引掃描模式（off、relaxed_order、strict_order；
+                IVFFlat 只支持 relaxed_order），需要 pgvector >= 0.8
+            exact_max_rows: 過濾後行數不超過此值時使用精確計劃，0 表示總是走索引
+
+        Raises:
+            ValueError: 如果索引類型或迭代掃描模式未知
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"未知的 pgvector 索引類型: {index_type}")
+        if iterative_scan not in ITERATIVE_SCAN_MODES:
+            raise ValueError(f"未知的迭代掃描模式: {iterative_scan}")
+        self.index_type = index_type
+        self.dim = dim
+        self.candidate_factor = max(1, candidate_factor)
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivfflat_lists = ivfflat_lists
+        self.ivfflat_probes = ivfflat_probes
+        self.iterative_scan = iterative_scan
+        self.exact_max_rows = max(0, exact_max_rows)
+        self.index_name: Optional[str] = None
+        # prepare_index 讀取的 pgvector 版本，低於 0.8 時不設置迭代掃描參數
+        self.extension_version: Optional[str] = None
+
+    async def open(self, db: AsyncSession, workspace_id: UUID) -> PgvectorIndex:
+        return PgvectorIndex(self, db, workspace_id)
+
+    @property
+    def supports_iterative_scan(self) -> bool:
+        """pgvector 是否支持迭代索引掃描（0.8 起）"""
+        if not self.extension_version:
+            return False
+        parts = re.findall(r"\d+", self.extension_version)[:2]
+        return tuple(int(part) for part in parts) >= (0, 8)
+
+    def session_settings(self, candidates: int) -> List[str]:
+        """每次查詢前在事務內設置的索引參數
+
+        HNSW 一次最多返回 ef_search 個結果，因此 ef_search 至少為候選數。
+        迭代掃描在過濾後結果不足時繼續讀取索引（候選由調用方精確重排，
+        relaxed_order 的輕微亂序不影響結果）。
+        """
+        settings = []
+        if self.index_type == "hnsw":
+            settings.append(f"SET LOCAL hnsw.ef_search = {int(max(self.hnsw_ef_search, candidates))}")
+        elif self.index_type == "ivfflat":
+            settings.append(f"SET LOCAL ivfflat.probes = {int(self.ivfflat_probes)}")
+        else:
+            return settings
+        if self.iterative_scan != "off" and self.supports_iterative_scan:
+            mode = self.iterative_scan if self.index_type == "hnsw" else "relaxed_order"
+            settings.append(f"SET LOCAL {self.index_type}.iterative_scan = {mode}")
+        return settings
+
+    def prepare_schema(self, conn: Connection) -> None:
+        """創建 vector 擴展，並把已有的 bytea 向量列轉換為 vector
+
+        memory 表上仍有遺留向量（遷移 0005 尚未執行）時，先建立 bytea 列的
+        memory_embedding 表並執行到遷移 0005，再統一轉換列類型。
+        按模型建表時向量列已是 vector 類型，遷移無法直接 INSERT ... SELECT bytea。
+        """
+        if conn.dialect.name != "postgresql":
+            return
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+        inspector = inspect(conn)
+        tables = inspector.get_table_names()
+        if "memory_embedding" not in tables:
+            if "memory" not in tables or "embeddings" not in {
+                c["name"] for c in inspector.get_columns("memory")
+            }:
+                return
+            legacy = conn.execute(
+                text("SELECT 1 FROM memory WHERE embeddings IS NOT NULL LIMIT 1")
+            ).first()
+            if not legacy:
+                return
+            metadata = MetaData()
+            Memory.__table__.to_metadata(metadata)
+            binary_table = MemoryEmbedding.__table__.to_metadata(metadata)
+            binary_table.c.embeddings.type = Vector()
+            binary_table.create(conn)
+            run_migrations(conn, until="0005_split_embeddings")
+            logger.info("已在轉換為 vector 列之前完成遷移 0005")
+            inspector = inspect(conn)
+
+        columns = {c["name"]: c["type"] for c in inspector.get_columns("memory_embedding")}
+        if not isinstance(columns.get("embeddings"), types.LargeBinary):
+            return
+        conn.execute(text("ALTER TABLE memory_embedding ADD COLUMN embeddings_vector vector"))
+        keys = conn.execute(text("SELECT memory_id, model_name FROM memory_embedding")).fetchall()
+        for start in range(0, len(keys), CONVERT_CHUNK_SIZE):
+            chunk = keys[start:start + CONVERT_CHUNK_SIZE]
+            rows = conn.execute(text(
+                "SELECT memory_id, model_name, embeddings FROM memory_embedding "
+                "WHERE memory_id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)), {
+                "ids": sorted({memory_id for memory_id, _ in chunk})
+            }).fetchall()
+            conn.execute(text(
+                "UPDATE memory_embedding SET embeddings_vector = CAST(:vector AS vector) "
+                "WHERE memory_id = :memory_id AND model_name = :model_name"
+            ), [
+                {"memory_id": memory_id, "model_name": model_name,
+                 "vector": format_pgvector(unpack_vector(bytes(raw)))}
+                for memory_id, model_name, raw in rows
+            ])
+        conn.execute(text("ALTER TABLE memory_embedding DROP COLUMN embeddings"))
+        conn.execute(text(
+            "ALTER TABLE memory_embedding RENAME COLUMN embeddings_vector TO embeddings"
+        ))
+        conn.execute(text("ALTER TABLE memory_embedding ALTER COLUMN embeddings SET NOT NULL"))
+
+    def index_ddl(self, dim: int) -> Optional[str]:
+        """當前模型 ANN 索引的 CREATE INDEX 語句，index_type 為 none 時返回 None"""
+        if self.index_type == "none":
+            return None
+        slug = re.sub(r"[^a-z0-9]+", "_", ACTIVE_EMBEDDING_MODEL.lower()).strip("_")
+        self.index_name = f"ix_memory_embedding_{self.index_type}_{slug}"[:63]
+        if self.index_type == "hnsw":
+            options = f"m = {int(self.hnsw_m)}, ef_construction = {int(self.hnsw_ef_construction)}"
+        else:
+            options = f"lists = {int(self.ivfflat_lists)}"
+        model = ACTIVE_EMBEDDING_MODEL.replace("'", "''")
+        return (
+            f"CREATE INDEX IF NOT EXISTS {self.index_name} ON memory_embedding "
+            f"USING {self.index_type} ((embeddings::vector({int(dim)})) vector_cosine_ops) "
+            f"WITH ({options}) WHERE model_name = '{model}'"
+        )
+
+    def prepare_index(self, conn: Connection) -> None:
+        """確定向量維度並為當前模型創建 ANN 索引
+
+        未配置維度且還沒有向量時跳過，查詢在數據庫內精確掃描，
+        下次啟動時再創建索引。
+        """
+        if conn.dialect.name != "postgresql":
+            return
+        self.extension_version = conn.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        ).scalar()
+        if self.dim is None:
+            self.dim = conn.execute(
+                text("SELECT vector_dims(embeddings) FROM memory_embedding "
+                     "WHERE model_name = :model LIMIT 1"),
+                {"model": ACTIVE_EMBEDDING_MODEL}
+            ).scalar()
+        ddl = self.index_ddl(self.dim) if self.dim else None
+        if ddl:
+            conn.execute(text(ddl))
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "index_type": self.index_type,
+            "index_name": self.index_name,
+            "dim": self.dim,
+            "model_name": ACTIVE_EMBEDDING_MODEL,
+            "candidate_factor": self.candidate_factor,
+            "iterative_scan": self.iterative_scan if self.supports_iterative_scan else "off",
+            "exact_max_rows": self.exact_max_rows,
+        }
+
+
+# VECTOR_BACKEND=pgvector 只在 PostgreSQL 上生效，SQLite 始終使用進程內索引
+PGVECTOR_ENABLED = VECTOR_BACKEND == "pgvector" and DATABASE_URL.startswith("postgresql")
+if VECTOR_BACKEND == "pgvector" and not PGVECTOR_ENABLED:
+    logger.warning("VECTOR_BACKEND=pgvector 需要 PostgreSQL，使用進程內索引")
+
+pgvector_backend = PgvectorBackend(
+    index_type=os.getenv("PGVECTOR_INDEX", "hnsw"),
+    dim=int(os.getenv("PGVECTOR_DIM", "0")) or None,
+    candidate_factor=int(os.getenv("PGVECTOR_CANDIDATE_FACTOR", "2")),
+    hnsw_m=int(os.getenv("HNSW_M", "16")),
+    hnsw_ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),
+    hnsw_ef_search=int(os.getenv("HNSW_EF_SEARCH", "50")),
+    ivfflat_lists=int(os.getenv("PGVECTOR_LISTS", "100")),
+    ivfflat_probes=int(os.getenv("PGVECTOR_PROBES", "10")),
+    iterative_scan=os.getenv("PGVECTOR_ITERATIVE_SCAN", "relaxed_order"),
+    exact_max_rows=int(os.getenv("PGVECTOR_EXACT_MAX_ROWS", "10000")),
+)
+
+
+def configured_backend(index_manager: VectorIndexManager) -> VectorBackend:
+    """按配置返回向量後端
+
+    Args:
+        index_manager: 進程內後端使用的索引管理器
+
+    Returns:
+        VectorBackend
+    """
+    return pgvector_backend if PGVECTOR_ENABLED else InProcessBackend(index_manager)
+
+
+def get_vector_backend(
+    index_manager: VectorIndexManager = Depends(get_vector_index_manager)
+) -> VectorBackend:
+    """FastAPI 依賴：返回配置的向量後端（進程內後端使用注入的索引管理器）"""
+    return configured_backend(index_manager)
@@ -0,0 +1,1245 @@
+"""常駐向量索引 - 按 workspace_id 在內存中保存規範化向量"""
+
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from uuid import UUID
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from src.models.models import Memory, has_embedding, memory_columns, select_vectors
+from src.utils.embedding import normalize_rows, top_k_indices
+from src.services.search_service import SearchService, SCORE_TOLERANCE
+from src.services.hnsw_index import HNSWIndex
+from src.services.product_quantizer import DEFAULT_TRAIN_SIZE, ProductQuantizer
+
+logger = logging.getLogger(__name__)
+# 每個條目除向量外的估算開銷（ID 和元數據）
+ENTRY_OVERHEAD_BYTES = 256
+
+METADATA_FIELDS = ("created_by_agent_id", "visibility", "type", "category")
+
+# 跨工作區的公開記憶索引使用的保留鍵
+PUBLIC_SCOPE = UUID(int=0)
+
+# ADC 分數是近似值，按閾值篩選候選時放寬的量（精確重排時再按原閾值過濾）
+PQ_THRESHOLD_SLACK = 0.05
+
+# 未配置 subvectors 時每個向量的編碼字節數為 dim / PQ_DEFAULT_BYTES_RATIO：
+# 加上 ID、元數據列和碼本，384 維時總內存約為完整索引的 1/17，精確重排後 recall@10 約 0.95
+PQ_DEFAULT_BYTES_RATIO = 16
+
+# 流式構建 PQ 索引時每批從數據庫讀取的行數
+PQ_BUILD_CHUNK_SIZE = 2000
+
+# 記憶 ID 的緊湊形式：16 字節定長字符串
+ID_BYTES = 16
+ID_DTYPE = np.dtype(f"S{ID_BYTES}")
+
+
+def id_key(memory_id: UUID) -> bytes:
+    """記憶 ID 在 S16 數組中的取值
+
+    S16 數組取出的元素會去掉末尾的零字節，字典鍵使用同樣的形式。
+    """
+    return memory_id.bytes.rstrip(b"\0")
+
+
+def key_id(key: bytes) -> UUID:
+    """id_key 的逆運算"""
+    return UUID(bytes=bytes(key).ljust(ID_BYTES, b"\0"))
+
+
+class CompactPositions:
+    """記憶 ID 到行號的緊湊映射，接口與 PQ 索引用到的 dict 方法一致
+
+    大部分條目保存在按 ID 排序的 S16 數組和 int32 行號數組中（每條 20 字節），二分查找；
+    逐條寫入的新 ID 先進入小字典，超過排序數組的 1/8 時合併。
+    刪除把行號置為 -1，已刪除條目超過一半時合併回收。
+    """
+
+    # 小字典至少容納的條目數，避免小索引頻繁合併
+    MIN_RECENT = 1024
+
+    def __init__(self):
+        self._keys = np.empty(0, dtype=ID_DTYPE)
+        self._rows = np.empty(0, dtype=np.int32)
+        self._removed = 0
+        self._recent: Dict[bytes, int] = {}
+        # extend 追加的批次，下次查找前合併
+        self._batches: List[tuple] = []
+
+    def __len__(self) -> int:
+        self._settle()
+        return len(self._keys) - self._removed + len(self._recent)
+
+    def __contains__(self, memory_id: UUID) -> bool:
+        return self.get(memory_id) is not None
+
+    def _find(self, key: bytes) -> int:
+        """返回 key 在排序數組中未刪除條目的下標，不存在時返回 -1"""
+        self._settle()
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key and self._rows[i] >= 0:
+            return i
+        return -1
+
+    def get(self, memory_id: UUID, default: Optional[int] = None) -> Optional[int]:
+        key = id_key(memory_id)
+        row = self._recent.get(key)
+        if row is not None:
+            return row
+        i = self._find(key)
+        return int(self._rows[i]) if i >= 0 else default
+
+    def __setitem__(self, memory_id: UUID, row: int) -> None:
+        key = id_key(memory_id)
+        if key in self._recent:
+            self._recent[key] = row
+            return
+        i = self._find(key)
+        if i >= 0:
+            self._rows[i] = row
+            return
+        self._recent[key] = row
+        if len(self._recent) > max(self.MIN_RECENT, len(self._keys) // 8):
+            self._compact()
+
+    def pop(self, memory_id: UUID, default: Optional[int] = None) -> Optional[int]:
+        key = id_key(memory_id)
+        row = self._recent.pop(key, None)
+        if row is not None:
+            return row
+        i = self._find(key)
+        if i < 0:
+            return default
+        row = int(self._rows[i])
+        self._rows[i] = -1
+        self._removed += 1
+        if self._removed > len(self._keys) // 2:
+            self._compact()
+        return row
+
+    def extend(self, keys: np.ndarray, rows: np.ndarray) -> None:
+        """批量加入 ID 不在映射中的條目（構建索引時使用）
+
+        Args:
+            keys: S16 ID 數組
+            rows: 對應的行號
+        """
+        self._batches.append((np.asarray(keys, dtype=ID_DTYPE), np.asarray(rows, dtype=np.int32)))
+
+    def _settle(self) -> None:
+        if self._batches:
+            self._compact()
+
+    def _compact(self) -> None:
+        """把小字典、批次和排序數組合併為一個排序數組，丟棄已刪除的條目"""
+        live = self._rows >= 0
+        keys = [self._keys[live], np.array(list(self._recent), dtype=ID_DTYPE)]
+        rows = [self._rows[live], np.fromiter(self._recent.values(), dtype=np.int32, count=len(self._recent))]
+        for batch_keys, batch_rows in self._batches:
+            keys.append(batch_keys)
+            rows.append(batch_rows)
+        keys, rows = np.concatenate(keys), np.concatenate(rows)
+        order = np.argsort(keys, kind="stable")
+        self._keys, self._rows = keys[order], rows[order]
+        self._removed = 0
+        self._recent = {}
+        self._batches = []
+
+    @property
+    def nbytes(self) -> int:
+        """排序數組的字節數加小字典的估算開銷"""
+        return (
+            self._keys.nbytes + self._rows.nbytes
+            + sum(keys.nbytes + rows.nbytes for keys, rows in self._batches)
+            + len(self._recent) * ENTRY_OVERHEAD_BYTES
+        )
+
+
+class WorkspaceVectorIndex:
+    """單個工作區的向量索引
+
+    保存記憶 ID、規範化 float32 向量矩陣和少量元數據。構建時行順序與
+    數據庫順序一致，新條目追加在末尾；刪除時把最後一行移到被刪除的位置，
+    因此刪除後行順序不再與數據庫一致。
+    """
+
+    def __init__(self, workspace_id: UUID):
+        """初始化空索引
+
+        Args:
+            workspace_id: 工作區 ID
+        """
+        self.workspace_id = workspace_id
+        self.dim: Optional[int] = None
+        self.ids: List[UUID] = []
+        self.metadata: List[Dict] = []
+        # 每個元數據字段的取值計數，供查詢規劃估算選擇率
+        self._value_counts: Dict[str, Counter] = {field: Counter() for field in METADATA_FIELDS}
+        self._positions: Dict[UUID, int] = {}
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        # 權限列：每行所有者的整數編碼和是否公開，供 access_mask 向量化判定
+        self._agent_codes: Dict[UUID, int] = {}
+        self._owner_codes = np.empty(0, dtype=np.int32)
+        self._public = np.empty(0, dtype=bool)
+        self.ann: Optional[HNSWIndex] = None
+        # attach_ann 在鎖外插入期間寫入過的記憶 ID，插入結束後在鎖內補齊
+        self._ann_dirty: Optional[set] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, memory_id: UUID) -> bool:
+        return memory_id in self._positions
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """有效行組成的向量矩陣"""
+        return self._matrix[:len(self)]
+
+    @property
+    def nbytes(self) -> int:
+        """索引佔用的估算字節數（包括 ANN 圖）"""
+        ann_bytes = self.ann.nbytes if self.ann is not None else 0
+        return self._matrix.nbytes + len(self.ids) * ENTRY_OVERHEAD_BYTES + ann_bytes
+
+    def attach_ann(self, ann: HNSWIndex) -> None:
+        """掛載 ANN 索引，並把它與當前向量對齊
+
+        ann 可以是新建的空索引，也可以是從磁盤載入的舊索引：
+        缺失或向量已變化的條目重新插入，多餘的條目標記刪除。
+        插入在索引鎖外對向量快照進行（大工作區需要數分鐘），期間搜索沿用
+        原來的路徑（精確掃描或舊的 ANN 圖）；期間寫入的條目最後在鎖內補齊，
+        然後切換到新圖。
+
+        Args:
+            ann: HNSW 索引
+        """
+        with self._lock:
+            self._ann_dirty = set()
+            ids = list(self.ids)
+            rows = self.matrix.copy()
+        try:
+            live = set(ids)
+            for label in ann.labels():
+                if label not in live:
+                    ann.mark_deleted(label)
+            for memory_id, row in zip(ids, rows):
+                self._align_ann(ann, memory_id, row)
+            with self._lock:
+                for memory_id in self._ann_dirty:
+                    position = self._positions.get(memory_id)
+                    if position is None:
+                        ann.mark_deleted(memory_id)
+                    else:
+                        self._align_ann(ann, memory_id, self._matrix[position])
+                self.ann = ann
+        finally:
+            with self._lock:
+                self._ann_dirty = None
+
+    @staticmethod
+    def _align_ann(ann: HNSWIndex, memory_id: UUID, row: np.ndarray) -> None:
+        """圖中缺少該條目或向量已變化時重新插入"""
+        stored = ann.vector(memory_id)
+        if stored is None or not np.allclose(stored, row, atol=1e-6):
+            ann.add(memory_id, row)
+
+    def _empty_rows(self, capacity: int) -> np.ndarray:
+        """創建行存儲（子類可以改為保存壓縮編碼）"""
+        return np.zeros((capacity, self.dim), dtype=np.float32)
+
+    def _encode(self, row: np.ndarray) -> np.ndarray:
+        """把規範化向量轉換為行存儲中保存的形式"""
+        return row
+
+    def _score_rows(self, query_norm: np.ndarray) -> np.ndarray:
+        """計算規範化查詢與所有有效行的相似度"""
+        return self.matrix @ query_norm
+
+    def _select(self, scores: np.ndarray, top_k: int, similarity_threshold: float) -> np.ndarray:
+        """從 _score_rows 的分數中選出候選下標（升序）"""
+        return SearchService.shortlist(scores, top_k, similarity_threshold)
+
+    def _ensure_capacity(self, rows: int) -> None:
+        """按倍數擴容矩陣"""
+        capacity = self._matrix.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, 16)
+        size = len(self)
+        matrix = self._empty_rows(new_capacity)
+        matrix[:size] = self._matrix[:size]
+        self._matrix = matrix
+        owner_codes = np.full(new_capacity, -1, dtype=np.int32)
+        owner_codes[:size] = self._owner_codes[:size]
+        self._owner_codes = owner_codes
+        public = np.zeros(new_capacity, dtype=bool)
+        public[:size] = self._public[:size]
+        self._public = public
+
+    def upsert(self, memory_id: UUID, vector, metadata: Optional[Dict] = None) -> None:
+        """插入或更新一個向量
+
+        Args:
+            memory_id: 記憶 ID
+            vector: 嵌入向量
+            metadata: 元數據（可選）
+
+        Raises:
+            ValueError: 如果向量維度與索引不一致
+        """
+        row = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        with self._lock:
+            if self.dim is None:
+                self.dim = row.shape[0]
+                self._matrix = self._empty_rows(0)
+            elif row.shape[0] != self.dim:
+                raise ValueError(f"向量維度 {row.shape[0]} 與索引維度 {self.dim} 不一致")
+
+            position = self._positions.get(memory_id)
+            if position is None:
+                position = len(self.ids)
+                self._ensure_capacity(position + 1)
+                self.ids.append(memory_id)
+                self.metadata.append(metadata or {})
+                self._positions[memory_id] = position
+                self._count_metadata(self.metadata[position], 1)
+                self._set_access_columns(position, self.metadata[position])
+            elif metadata is not None:
+                self._count_metadata(self.metadata[position], -1)
+                self.metadata[position] = metadata
+                self._count_metadata(metadata, 1)
+                self._set_access_columns(position, metadata)
+            if self.ann is not None and not np.array_equal(self._matrix[position], row):
+                self.ann.add(memory_id, row)
+            if self._ann_dirty is not None:
+                self._ann_dirty.add(memory_id)
+            self._matrix[position] = self._encode(row)
+
+    def remove(self, memory_id: UUID) -> bool:
+        """刪除一個向量：把最後一行移到被刪除的位置（O(維度)，不移動其他行）
+
+        Args:
+            memory_id: 記憶 ID
+
+        Returns:
+            bool: 是否存在並被刪除
+        """
+        with self._lock:
+            position = self._positions.pop(memory_id, None)
+            if position is None:
+                return False
+            if self.ann is not None:
+                self.ann.mark_deleted(memory_id)
+            if self._ann_dirty is not None:
+                self._ann_dirty.add(memory_id)
+            last = len(self.ids) - 1
+            self._count_metadata(self.metadata[position], -1)
+            if position != last:
+                moved_id = self.ids[last]
+                self._matrix[position] = self._matrix[last]
+                self._owner_codes[position] = self._owner_codes[last]
+                self._public[position] = self._public[last]
+                self.ids[position] = moved_id
+                self.metadata[position] = self.metadata[last]
+                self._positions[moved_id] = position
+            self.ids.pop()
+            self.metadata.pop()
+            return True
+
+    def _count_metadata(self, metadata: Dict, delta: int) -> None:
+        """增減元數據取值計數（調用方持有鎖）"""
+        for field, counts in self._value_counts.items():
+            value = metadata.get(field)
+            counts[value] += delta
+            if counts[value] <= 0:
+                del counts[value]
+
+    def _set_access_columns(self, position: int, metadata: Dict) -> None:
+        """寫入一行的權限列（調用方持有鎖）"""
+        owner = metadata.get("created_by_agent_id")
+        if owner is None:
+            self._owner_codes[position] = -1
+        else:
+            self._owner_codes[position] = self._agent_codes.setdefault(owner, len(self._agent_codes))
+        self._public[position] = metadata.get("visibility") == "public"
+
+    def access_mask(self, agent_id: UUID, shared_ids=()) -> np.ndarray:
+        """返回 Agent 可讀行的掩碼：自己創建、公開或在共享集合中
+
+        Args:
+            agent_id: Agent ID
+            shared_ids: 共享給該 Agent 的記憶 ID
+
+        Returns:
+            布爾數組，與 ids 一一對應
+        """
+        with self._lock:
+            size = len(self)
+            mask = self._public[:size].copy()
+            code = self._agent_codes.get(agent_id)
+            if code is not None:
+                mask |= self._owner_codes[:size] == code
+            for memory_id in shared_ids:
+                position = self._positions.get(memory_id)
+                if position is not None:
+                    mask[position] = True
+            return mask
+
+    def selectivity(self, filters: Optional[Dict] = None) -> float:
+        """按取值計數估算過濾條件的選擇率
+
+        多個字段按相互獨立估算（各字段比例相乘）。
+
+        Args:
+            filters: {元數據字段: 取值}
+
+        Returns:
+            float: 0.0 ~ 1.0，無過濾條件時為 1.0
+        """
+        if not filters:
+            return 1.0
+        with self._lock:
+            if not len(self):
+                return 0.0
+            selectivity = 1.0
+            for field, value in filters.items():
+                selectivity *= self._value_counts[field].get(value, 0) / len(self)
+            return selectivity
+
+    def filter_mask(self, filters: Optional[Dict] = None) -> Optional[np.ndarray]:
+        """返回滿足過濾條件的行掩碼，無過濾條件時返回 None
+
+        Args:
+            filters: {元數據字段: 取值}
+
+        Returns:
+            布爾數組，與 ids 一一對應
+        """
+        if not filters:
+            return None
+        with self._lock:
+            return np.fromiter(
+                (
+                    all(metadata.get(field) == value for field, value in filters.items())
+                    for metadata in self.metadata
+                ),
+                dtype=bool,
+                count=len(self.metadata)
+            )
+
+    def shortlist(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        use_ann: Optional[bool] = None,
+        filters: Optional[Dict] = None,
+        scope=None
+    ) -> List[UUID]:
+        """返回可能進入前 top_k 的記憶 ID（按索引行順序）
+
+        Args:
+            query_embedding: 查詢嵌入向量
+            top_k: 返回數量
+            similarity_threshold: 相似度閾值
+            use_ann: 是否使用 ANN 索引（默認在已掛載時使用）
+            filters: {元數據字段: 取值}（可選），只返回滿足條件的記憶
+            scope: AccessScope（可選），只返回範圍內可讀的記憶
+
+        Returns:
+            候選記憶 ID 列表，需要調用方精確重算排序
+        """
+        if use_ann is None:
+            use_ann = self.ann is not None
+        with self._lock:
+            if not len(self):
+                return []
+            mask = self.filter_mask(filters)
+            if scope is not None:
+                access = scope.mask(self)
+                mask = access if mask is None else mask & access
+            if use_ann and self.ann is not None:
+                return self._ann_shortlist(query_embedding, top_k, similarity_threshold, mask)
+            query = np.asarray(query_embedding, dtype=np.float32)
+            if query.shape[0] != self.dim:
+                # 與逐條計算一致：維度不匹配的得分為 0.0
+                scores = np.zeros(len(self), dtype=np.float32)
+            else:
+                query_norm = normalize_rows(query.reshape(1, -1))[0]
+                scores = self._score_rows(query_norm)
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+            positions = self._select(scores, top_k, similarity_threshold)
+            return self._ids_at(positions)
+
+    def _ids_at(self, positions: np.ndarray) -> List[UUID]:
+        """返回各行的記憶 ID"""
+        return [self.ids[i] for i in positions]
+
+    def _ann_shortlist(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        mask: Optional[np.ndarray] = None
+    ) -> List[UUID]:
+        """用 HNSW 近似搜索篩選候選
+
+        有過濾掩碼時按選擇率放大搜索數量，再丟棄不滿足條件的結果。
+        """
+        if len(query_embedding) != self.dim:
+            return []
+        k = top_k
+        if mask is not None:
+            matching = int(mask.sum())
+            if matching == 0:
+                return []
+            k = min(len(self.ids), math.ceil(top_k * len(self.ids) / matching))
+        hits = self.ann.search(query_embedding, k)
+        candidates = [
+            memory_id for memory_id, score in hits
+            if score >= similarity_threshold - SCORE_TOLERANCE
+            and memory_id in self._positions
+            and (mask is None or mask[self._positions[memory_id]])
+        ]
+        return sorted(candidates, key=self._positions.__getitem__)
+
+
+class PQWorkspaceIndex(WorkspaceVectorIndex):
+    """以乘積量化編碼保存向量的工作區索引
+
+    每行只保存 subvectors 字節的編碼（默認 dim / 16，為 float32 向量的 1/64），
+    評分用查詢查找表做非對稱距離計算。ADC 分數是近似值：shortlist 返回
+    ADC 排名前 top_k * rerank_factor 的候選，由 search_index 用數據庫中的
+    完整向量精確重排；rerank_factor 為 1 時只取 ADC 的前 top_k。
+    新寫入的向量用已有碼本編碼，碼本在重建索引時重新訓練。
+
+    編碼之外的每行數據也保存在數組中：S16 記憶 ID、每個元數據字段的 int32
+    取值編碼和 CompactPositions 映射，不為每行保存 UUID 對象和元數據字典。
+    """
+
+    def __init__(
+        self,
+        workspace_id: UUID,
+        quantizer: ProductQuantizer,
+        rerank_factor: int = 16,
+        capacity: int = 0
+    ):
+        """初始化空索引
+
+        Args:
+            workspace_id: 工作區 ID
+            quantizer: 已訓練的乘積量化器
+            rerank_factor: 精確重排的候選數倍數
+            capacity: 預先分配的行數（已知行數時避免擴容留下的空閒行）
+
+        Raises:
+            ValueError: 如果量化器未訓練
+        """
+        if not quantizer.trained:
+            raise ValueError("量化器尚未訓練")
+        # ID 和元數據不使用基類的列表，這裡只初始化用到的基類字段
+        self.workspace_id = workspace_id
+        self.quantizer = quantizer
+        self.rerank_factor = max(1, rerank_factor)
+        self.dim = quantizer.dim
+        self._size = 0
+        self._keys = np.empty(0, dtype=ID_DTYPE)
+        self._positions = CompactPositions()
+        # 元數據字段的取值編碼：{字段: {取值: 編碼}}、{字段: [取值]} 和每行的編碼列
+        self._vocab: Dict[str, Dict] = {field: {} for field in METADATA_FIELDS}
+        self._values: Dict[str, List] = {field: [] for field in METADATA_FIELDS}
+        self._codes: Dict[str, np.ndarray] = {
+            field: np.empty(0, dtype=np.int32) for field in METADATA_FIELDS
+        }
+        self._value_counts: Dict[str, Counter] = {field: Counter() for field in METADATA_FIELDS}
+        self._matrix = self._empty_rows(0)
+        self._agent_codes: Dict[UUID, int] = {}
+        self._owner_codes = np.empty(0, dtype=np.int32)
+        self._public = np.empty(0, dtype=bool)
+        self.ann = None
+        self._ann_dirty = None
+        self._lock = threading.RLock()
+        if capacity:
+            self._ensure_capacity(capacity)
+
+    @classmethod
+    def from_index(
+        cls,
+        index: WorkspaceVectorIndex,
+        quantizer: ProductQuantizer,
+        rerank_factor: int = 16
+    ) -> "PQWorkspaceIndex":
+        """把完整向量索引壓縮為 PQ 索引，保持行順序和元數據
+
+        Args:
+            index: 完整向量索引
+            quantizer: 已訓練的乘積量化器
+            rerank_factor: 精確重排的候選數倍數
+
+        Returns:
+            PQWorkspaceIndex
+        """
+        with index._lock:
+            compressed = cls(index.workspace_id, quantizer, rerank_factor, capacity=len(index))
+            compressed.extend(index.ids, quantizer.encode(index.matrix), index.metadata)
+        return compressed
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def ids(self) -> List[UUID]:
+        """有效行的記憶 ID（按行解碼為 UUID）"""
+        return self._ids_at(np.arange(self._size))
+
+    def _ids_at(self, positions: np.ndarray) -> List[UUID]:
+        return [key_id(key) for key in self._keys[positions].tolist()]
+
+    @property
+    def codes(self) -> np.ndarray:
+        """有效行的 uint8 編碼"""
+        return self._matrix[:self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """由編碼重建的近似向量矩陣"""
+        return self.quantizer.decode(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """索引佔用的估算字節數：所有按行分配的數組、ID 映射、取值字典和碼本"""
+        with self._lock:
+            arrays = [self._matrix, self._keys, self._owner_codes, self._public, *self._codes.values()]
+            values = sum(len(vocab) for vocab in self._vocab.values()) + len(self._agent_codes)
+            return (
+                sum(array.nbytes for array in arrays)
+                + self._positions.nbytes
+                + values * ENTRY_OVERHEAD_BYTES
+                + self.quantizer.nbytes
+            )
+
+    def attach_ann(self, ann: HNSWIndex) -> None:
+        raise ValueError("PQ 索引不掛載 HNSW 圖（HNSW 需要保存完整向量）")
+
+    def _empty_rows(self, capacity: int) -> np.ndarray:
+        return np.zeros((capacity, self.quantizer.subvectors), dtype=np.uint8)
+
+    def _encode(self, row: np.ndarray) -> np.ndarray:
+        return self.quantizer.encode(row.reshape(1, -1))[0]
+
+    def _ensure_capacity(self, rows: int) -> None:
+        capacity = self._matrix.shape[0]
+        super()._ensure_capacity(rows)
+        if self._matrix.shape[0] == capacity:
+            return
+        new_capacity = self._matrix.shape[0]
+        keys = np.zeros(new_capacity, dtype=ID_DTYPE)
+        keys[:self._size] = self._keys[:self._size]
+        self._keys = keys
+        for field, codes in self._codes.items():
+            grown = np.full(new_capacity, -1, dtype=np.int32)
+            grown[:self._size] = codes[:self._size]
+            self._codes[field] = grown
+
+    def _value_code(self, field: str, value) -> int:
+        vocab = self._vocab[field]
+        code = vocab.get(value)
+        if code is None:
+            code = vocab[value] = len(vocab)
+            self._values[field].append(value)
+        return code
+
+    def _row_metadata(self, position: int) -> Dict:
+        """解碼一行的元數據"""
+        return {
+            field: self._values[field][self._codes[field][position]] for field in METADATA_FIELDS
+        }
+
+    def _set_metadata(self, position: int, metadata: Dict) -> None:
+        """寫入一行的元數據編碼、取值計數和權限列（調用方持有鎖）"""
+        for field in METADATA_FIELDS:
+            self._codes[field][position] = self._value_code(field, metadata.get(field))
+        self._count_metadata(metadata, 1)
+        self._set_access_columns(position, metadata)
+
+    def extend(
+        self,
+        memory_ids: Sequence[UUID],
+        codes: np.ndarray,
+        metadata: Iterable[Dict]
+    ) -> None:
+        """批量追加已編碼的新記憶（構建索引時使用，ID 不能已在索引中）
+
+        Args:
+            memory_ids: 記憶 ID
+            codes: 與 memory_ids 對應的 uint8 編碼
+            metadata: 與 memory_ids 對應的元數據
+        """
+        with self._lock:
+            start, end = self._size, self._size + len(memory_ids)
+            self._ensure_capacity(end)
+            keys = np.array([memory_id.bytes for memory_id in memory_ids], dtype=ID_DTYPE)
+            self._keys[start:end] = keys
+            self._matrix[start:end] = codes
+            for position, row in enumerate(metadata, start):
+                self._set_metadata(position, row or {})
+            self._size = end
+            self._positions.extend(keys, np.arange(start, end))
+
+    def upsert(self, memory_id: UUID, vector, metadata: Optional[Dict] = None) -> None:
+        """插入或更新一個向量（用已有碼本編碼）
+
+        Args:
+            memory_id: 記憶 ID
+            vector: 嵌入向量
+            metadata: 元數據（可選）
+
+        Raises:
+            ValueError: 如果向量維度與碼本不一致
+        """
+        row = normalize_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if row.shape[0] != self.dim:
+            raise ValueError(f"向量維度 {row.shape[0]} 與索引維度 {self.dim} 不一致")
+        with self._lock:
+            position = self._positions.get(memory_id)
+            if position is None:
+                position = self._size
+                self._ensure_capacity(position + 1)
+                self._keys[position] = memory_id.bytes
+                self._size += 1
+                self._positions[memory_id] = position
+                self._set_metadata(position, metadata or {})
+            elif metadata is not None:
+                self._count_metadata(self._row_metadata(position), -1)
+                self._set_metadata(position, metadata)
+            self._matrix[position] = self._encode(row)
+
+    def remove(self, memory_id: UUID) -> bool:
+        """刪除一個向量：把最後一行移到被刪除的位置
+
+        Args:
+            memory_id: 記憶 ID
+
+        Returns:
+            bool: 是否存在並被刪除
+        """
+        with self._lock:
+            position = self._positions.pop(memory_id, None)
+            if position is None:
+                return False
+            last = self._size - 1
+            self._count_metadata(self._row_metadata(position), -1)
+            if position != last:
+                for column in (self._matrix, self._keys, self._owner_codes, self._public, *self._codes.values()):
+                    column[position] = column[last]
+                self._positions[key_id(self._keys[position])] = position
+            self._size = last
+            return True
+
+    def filter_mask(self, filters: Optional[Dict] = None) -> Optional[np.ndarray]:
+        """按元數據編碼列返回滿足過濾條件的行掩碼，無過濾條件時返回 None"""
+        if not filters:
+            return None
+        with self._lock:
+            mask = np.ones(self._size, dtype=bool)
+            for field, value in filters.items():
+                code = self._vocab.get(field, {}).get(value)
+                if code is None:
+                    return np.zeros(self._size, dtype=bool)
+                mask &= self._codes[field][:self._size] == code
+            return mask
+
+    def _score_rows(self, query_norm: np.ndarray) -> np.ndarray:
+        return self.quantizer.adc_scores(query_norm, self.codes)
+
+    def _select(self, scores: np.ndarray, top_k: int, similarity_threshold: float) -> np.ndarray:
+        passing = np.nonzero(scores >= similarity_threshold - PQ_THRESHOLD_SLACK)[0]
+        best = top_k_indices(scores[passing], top_k * self.rerank_factor)
+        return np.sort(passing[best])
+
+
+def memory_metadata(memory) -> Dict:
+    """提取索引保存的元數據"""
+    return {field: getattr(memory, field, None) for field in METADATA_FIELDS}
+
+
+class VectorIndexManager:
+    """管理各工作區的常駐索引，超出內存預算時按 LRU 淘汰冷工作區
+
+    索引在首次搜索時從數據庫構建，之後由記憶的增刪改增量維護。
+    構建在鎖外進行；構建期間到達的寫入先排隊，索引放入緩存前按順序重放，
+    因此構建讀取數據庫之後提交的寫入不會丟失。HNSW 圖在後台線程中構建，
+    完成前該工作區的搜索走精確路徑；墓碑比例超過 ann_rebuild_ratio 時在後台重建。
+    每個進程持有自己的索引，增量更新只作用於處理寫請求的進程。
+    PUBLIC_SCOPE 鍵下保存所有工作區的公開記憶，與工作區索引一樣按 LRU 淘汰。
+    """
+
+    def __init__(
+        self,
+        memory_budget_bytes: int = 512 * 1024 * 1024,
+        ann_min_vectors: int = 0,
+        ann_params: Optional[Dict] = None,
+        persist_dir: Optional[str] = None,
+        pq_min_vectors: int = 0,
+        pq_params: Optional[Dict] = None,
+        pq_rerank_factor: int = 16,
+        ann_rebuild_ratio: float = 0.3
+    ):
+        """初始化管理器
+
+        Args:
+            memory_budget_bytes: 所有索引的總內存預算
+            ann_min_vectors: 工作區向量數達到該值時掛載 HNSW 索引，0 表示不使用
+            ann_params: HNSWIndex 參數（M、ef_construction、ef_search）
+            persist_dir: HNSW 圖和 PQ 碼本的持久化目錄（可選）
+            pq_min_vectors: 工作區向量數達到該值時壓縮為 PQ 索引（優先於 HNSW），0 表示不使用
+            pq_params: ProductQuantizer 參數（subvectors、bits、iterations），
+                subvectors 缺省時為 dim // PQ_DEFAULT_BYTES_RATIO
+            pq_rerank_factor: PQ 索引精確重排的候選數倍數
+            ann_rebuild_ratio: HNSW 圖的墓碑比例達到該值時在後台重建
+        """
+        self.memory_budget_bytes = memory_budget_bytes
+        self.ann_min_vectors = ann_min_vectors
+        self.ann_params = ann_params or {}
+        self.persist_dir = persist_dir
+        self.pq_min_vectors = pq_min_vectors
+        self.pq_params = pq_params or {}
+        self.pq_rerank_factor = pq_rerank_factor
+        self.ann_rebuild_ratio = ann_rebuild_ratio
+        self._indexes: "OrderedDict[UUID, WorkspaceVectorIndex]" = OrderedDict()
+        # 正在構建的工作區：[進行中的構建數, 排隊的寫入 [(記憶 ID, 向量或 None, 元數據)]]
+        self._pending: Dict[UUID, list] = {}
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._evictions = 0
+        # 後台 HNSW 構建：單線程執行器和進行中的任務
+        self._ann_executor: Optional[ThreadPoolExecutor] = None
+        self._ann_jobs: Dict[UUID, Future] = {}
+        self._ann_builds = 0
+
+    def get(self, workspace_id: UUID, db: Session) -> WorkspaceVectorIndex:
+        """獲取工作區索引，不存在時從數據庫構建
+
+        Args:
+            workspace_id: 工作區 ID
+            db: 數據庫會話
+
+        Returns:
+            WorkspaceVectorIndex
+        """
+        with self._lock:
+            index = self._indexes.get(workspace_id)
+            if index is not None:
+                self._indexes.move_to_end(workspace_id)
+                return index
+            self._pending.setdefault(workspace_id, [0, []])[0] += 1
+
+        try:
+            count = self.count(workspace_id, db) if self.pq_min_vectors else 0
+            if self.pq_min_vectors and count >= self.pq_min_vectors:
+                index = self.build_pq(workspace_id, db, count)
+            else:
+                index = self.build(workspace_id, db)
+        except BaseException:
+            with self._lock:
+                self._finish_build(workspace_id)
+            raise
+
+        with self._lock:
+            writes = self._finish_build(workspace_id)
+            existing = self._indexes.get(workspace_id)
+            if existing is not None:
+                self._indexes.move_to_end(workspace_id)
+                return existing
+            # 重放構建期間的寫入（持有鎖，新寫入在索引放入緩存後直接應用）
+            for memory_id, vector, metadata in writes:
+                self._write(index, memory_id, vector, metadata)
+            self._indexes[workspace_id] = index
+            self._builds += 1
+            evicted = self._evict()
+        # 淘汰的圖和碼本在釋放鎖後寫盤，其他工作區的查詢和寫入不等待磁盤 I/O
+        if self.persist_dir:
+            for evicted_id, evicted_index in evicted:
+                self._save_trained(evicted_id, evicted_index)
+        if self._wants_ann(index):
+            self._schedule_ann(workspace_id, index)
+        return index
+
+    def _wants_ann(self, index: WorkspaceVectorIndex) -> bool:
+        return (
+            bool(self.ann_min_vectors) and not isinstance(index, PQWorkspaceIndex)
+            and len(index) >= self.ann_min_vectors
+        )
+
+    def _schedule_ann(self, workspace_id: UUID, index: WorkspaceVectorIndex, rebuild: bool = False) -> None:
+        """在後台線程中構建或重建 HNSW 圖（同一工作區同時只有一個任務）"""
+        with self._lock:
+            if workspace_id in self._ann_jobs:
+                return
+            if self._ann_executor is None:
+                self._ann_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hnsw-build")
+            future = self._ann_executor.submit(self._build_ann, workspace_id, index, rebuild)
+            self._ann_jobs[workspace_id] = future
+        future.add_done_callback(lambda done: self._ann_done(workspace_id, done))
+
+    def _build_ann(self, workspace_id: UUID, index: WorkspaceVectorIndex, rebuild: bool) -> None:
+        """構建 HNSW 圖並掛載，完成後寫入 persist_dir
+
+        從磁盤載入的舊圖對齊後墓碑仍然過多時，改為重新構建。
+        """
+        ann = HNSWIndex(index.dim, **self.ann_params) if rebuild else self._load_ann(workspace_id, index.dim)
+        index.attach_ann(ann)
+        if ann.deleted_ratio >= self.ann_rebuild_ratio:
+            index.attach_ann(HNSWIndex(index.dim, **self.ann_params))
+        if self.persist_dir:
+            self._save_trained(workspace_id, index)
+
+    def _ann_done(self, workspace_id: UUID, future: Future) -> None:
+        with self._lock:
+            self._ann_jobs.pop(workspace_id, None)
+            self._ann_builds += 1
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("工作區 %s 的 HNSW 構建失敗", workspace_id, exc_info=future.exception())
+
+    def wait_ann(self, timeout: Optional[float] = None) -> None:
+        """等待進行中的後台 HNSW 構建完成（用於測試和腳本）"""
+        with self._lock:
+            futures = list(self._ann_jobs.values())
+        wait(futures, timeout=timeout)
+
+    def close(self) -> None:
+        """取消排隊中的後台 HNSW 構建（進行中的構建在當前圖完成後結束）"""
+        with self._lock:
+            executor, self._ann_executor = self._ann_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish_build(self, workspace_id: UUID) -> list:
+        """結束一次構建，返回排隊的寫入（調用方持有鎖）
+
+        同一工作區的並發構建共享一個隊列，先完成的構建取走隊列並放入緩存，
+        之後的寫入直接應用到緩存中的索引。
+        """
+        pending = self._pending.get(workspace_id)
+        if pending is None:
+            return []
+        pending[0] -= 1
+        writes, pending[1] = pending[1], []
+        if pending[0] <= 0:
+            del self._pending[workspace_id]
+        return writes
+
+    @staticmethod
+    def _scope(workspace_id: UUID):
+        """工作區索引（或公開索引）對應的 SQL 範圍條件"""
+        if workspace_id == PUBLIC_SCOPE:
+            return Memory.visibility == "public"
+        return Memory.workspace_id == workspace_id
+
+    @staticmethod
+    def _vector_rows(workspace_id: UUID):
+        """讀取範圍內記憶的 ID、向量和元數據列的語句"""
+        # 向量來自 memory_embedding，memory 表只讀取元數據列
+        return select_vectors(*memory_columns("vector")).where(
+            VectorIndexManager._scope(workspace_id),
+            Memory.is_deleted == False
+        )
+
+    @staticmethod
+    def count(workspace_id: UUID, db: Session) -> int:
+        """統計範圍內有向量的記憶數，決定是否直接構建 PQ 索引"""
+        return db.execute(select(func.count()).select_from(Memory).where(
+            VectorIndexManager._scope(workspace_id),
+            Memory.is_deleted == False,
+            has_embedding()
+        )).scalar_one()
+
+    @staticmethod
+    def build(workspace_id: UUID, db: Session) -> WorkspaceVectorIndex:
+        """從數據庫構建索引，只讀取 ID、向量和元數據列"""
+        rows = db.execute(VectorIndexManager._vector_rows(workspace_id)).all()
+
+        index = WorkspaceVectorIndex(workspace_id)
+        for row in rows:
+            if row.embeddings is None or len(row.embeddings) == 0:
+                continue
+            try:
+                index.upsert(row.id, row.embeddings, memory_metadata(row))
+            except ValueError:
+                # 維度與多數向量不一致的舊數據不進入索引
+                continue
+        return index
+
+    def _ann_path(self, workspace_id: UUID) -> Optional[str]:
+        if not self.persist_dir:
+            return None
+        return os.path.join(self.persist_dir, f"{workspace_id}.hnsw.npz")
+
+    def _load_ann(self, workspace_id: UUID, dim: int) -> HNSWIndex:
+        """從磁盤載入 HNSW 圖，不存在或損壞時新建"""
+        path = self._ann_path(workspace_id)
+        if path and os.path.exists(path):
+            try:
+                ann = HNSWIndex.load(path, label_type=UUID)
+                if ann.dim == dim:
+                    return ann
+            except (OSError, ValueError, KeyError):
+                pass
+        return HNSWIndex(dim, **self.ann_params)
+
+    def _pq_path(self, workspace_id: UUID) -> Optional[str]:
+        if not self.persist_dir:
+            return None
+        return os.path.join(self.persist_dir, f"{workspace_id}.pq.npz")
+
+    def build_pq(
+        self,
+        workspace_id: UUID,
+        db: Session,
+        capacity: int = 0
+    ) -> Union[PQWorkspaceIndex, WorkspaceVectorIndex]:
+        """從數據庫流式構建 PQ 索引，不先構建完整向量索引
+
+        碼本從磁盤載入，或用數據庫中隨機抽取的至多 train_size 個向量訓練；
+        之後按 PQ_BUILD_CHUNK_SIZE 分批讀取向量並編碼。峰值內存是訓練樣本和
+        一批向量，而不是整個工作區的 float32 矩陣。維度與第一個向量不一致的
+        舊數據跳過。
+
+        Args:
+            workspace_id: 工作區 ID
+            db: 數據庫會話
+            capacity: 預計的行數（count 的結果），用於一次分配索引數組
+
+        Returns:
+            PQWorkspaceIndex；範圍內已沒有向量時返回空的 WorkspaceVectorIndex
+        """
+        statement = self._vector_rows(workspace_id)
+        first = db.execute(statement.limit(1)).first()
+        if first is None:
+            return WorkspaceVectorIndex(workspace_id)
+        dim = len(first.embeddings)
+
+        def sample() -> np.ndarray:
+            train_size = self.pq_params.get("train_size", DEFAULT_TRAIN_SIZE)
+            result = db.execute(statement.order_by(func.random()).limit(train_size))
+            return self._stack(self._with_dim(result, dim), dim)
+
+        quantizer = self._load_pq(workspace_id, dim, sample)
+        index = PQWorkspaceIndex(workspace_id, quantizer, self.pq_rerank_factor, capacity)
+        result = db.execute(statement.execution_options(yield_per=PQ_BUILD_CHUNK_SIZE))
+        for rows in result.partitions():
+            rows = self._with_dim(rows, dim)
+            if rows:
+                index.extend(
+                    [row.id for row in rows],
+                    quantizer.encode(self._stack(rows, dim)),
+                    [memory_metadata(row) for row in rows]
+                )
+        return index
+
+    @staticmethod
+    def _with_dim(rows, dim: int) -> list:
+        """只保留向量維度為 dim 的行"""
+        return [row for row in rows if row.embeddings is not None and len(row.embeddings) == dim]
+
+    @staticmethod
+    def _stack(rows, dim: int) -> np.ndarray:
+        """把行的向量逐行填入 float32 矩陣（不保留每行的 Python 列表副本）"""
+        matrix = np.empty((len(rows), dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            matrix[i] = row.embeddings
+        return matrix
+
+    def _load_pq(
+        self,
+        workspace_id: UUID,
+        dim: int,
+        sample: Callable[[], np.ndarray]
+    ) -> ProductQuantizer:
+        """從磁盤載入碼本，不存在、損壞或參數不符時用 sample() 返回的向量訓練"""
+        params = {"subvectors": max(1, dim // PQ_DEFAULT_BYTES_RATIO), **self.pq_params}
+        path = self._pq_path(workspace_id)
+        if path and os.path.exists(path):
+            try:
+                quantizer = ProductQuantizer.load(path)
+                if quantizer.dim == dim and all(
+                    getattr(quantizer, name) == value for name, value in params.items()
+                ):
+                    return quantizer
+            except (OSError, ValueError, KeyError):
+                pass
+        return ProductQuantizer(dim, **params).train(sample())
+
+    def _save_trained(self, workspace_id: UUID, index: WorkspaceVectorIndex) -> bool:
+        """保存索引的 HNSW 圖或 PQ 碼本（調用方已確認 persist_dir）"""
+        if isinstance(index, PQWorkspaceIndex):
+            os.makedirs(self.persist_dir, exist_ok=True)
+            index.quantizer.save(self._pq_path(workspace_id))
+            return True
+        ann = index.ann
+        if ann is not None:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            ann.save(self._ann_path(workspace_id))
+            return True
+        return False
+
+    def persist(self) -> List[UUID]:
+        """把已載入的 HNSW 圖和 PQ 碼本寫入 persist_dir
+
+        Returns:
+            已保存的工作區 ID 列表
+        """
+        if not self.persist_dir:
+            return []
+        with self._lock:
+            indexes = list(self._indexes.items())
+        return [
+            workspace_id for workspace_id, index in indexes
+            if self._save_trained(workspace_id, index)
+        ]
+
+    def _evict(self) -> List[Tuple[UUID, WorkspaceVectorIndex]]:
+        """淘汰最久未使用的工作區直到滿足預算（調用方持有鎖）
+
+        Returns:
+            被淘汰的 (工作區 ID, 索引) 列表，由調用方在釋放鎖後保存
+        """
+        evicted = []
+        total = sum(index.nbytes for index in self._indexes.values())
+        while total > self.memory_budget_bytes and len(self._indexes) > 1:
+            workspace_id, index = self._indexes.popitem(last=False)
+            total -= index.nbytes
+            evicted.append((workspace_id, index))
+            self._evictions += 1
+        return evicted
+
+    @staticmethod
+    def _write(index: WorkspaceVectorIndex, memory_id: UUID, vector, metadata: Optional[Dict]) -> None:
+        """把一次寫入應用到索引，vector 為 None 表示刪除"""
+        if vector is None:
+            index.remove(memory_id)
+            return
+        try:
+            index.upsert(memory_id, vector, metadata)
+        except ValueError:
+            index.remove(memory_id)
+
+    def _apply(self, key: UUID, memory_id: UUID, vector, metadata: Optional[Dict] = None) -> None:
+        """寫入已載入的索引；索引正在構建時排隊，未載入時跳過
+
+        寫入使 HNSW 圖的墓碑比例達到 ann_rebuild_ratio 時在後台重建圖。
+        """
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                pending = self._pending.get(key)
+                if pending is not None:
+                    pending[1].append((memory_id, vector, metadata))
+                return
+        self._write(index, memory_id, vector, metadata)
+        ann = index.ann
+        if ann is not None and ann.deleted_ratio >= self.ann_rebuild_ratio:
+            self._schedule_ann(key, index, rebuild=True)
+
+    def upsert(self, memory) -> None:
+        """記憶創建或更新後同步工作區索引和公開索引（未載入時跳過）"""
+        indexable = not (
+            memory.is_deleted or memory.embeddings is None or len(memory.embeddings) == 0
+        )
+        vector = memory.embeddings if indexable else None
+        metadata = memory_metadata(memory)
+        self._apply(memory.workspace_id, memory.id, vector, metadata)
+        public = vector if memory.visibility == "public" else None
+        self._apply(PUBLIC_SCOPE, memory.id, public, metadata)
+
+    def remove(self, workspace_id: UUID, memory_id: UUID) -> None:
+        """記憶刪除後同步工作區索引和公開索引"""
+        for key in (workspace_id, PUBLIC_SCOPE):
+            self._apply(key, memory_id, None)
+
+    def invalidate(self, workspace_id: Optional[UUID] = None) -> None:
+        """丟棄一個或全部工作區索引"""
+        with self._lock:
+            if workspace_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(workspace_id, None)
+
+    def stats(self) -> Dict:
+        """返回索引內存和淘汰統計"""
+        with self._lock:
+            return {
+                "workspaces": len(self._indexes),
+                "vectors": sum(len(index) for index in self._indexes.values()),
+                "ann_workspaces": sum(
+                    1 for index in self._indexes.values() if index.ann is not None
+                ),
+                "ann_building": len(self._ann_jobs),
+                "ann_builds": self._ann_builds,
+                "pq_workspaces": sum(
+                    1 for index in self._indexes.values() if isinstance(index, PQWorkspaceIndex)
+                ),
+                "bytes": sum(index.nbytes for index in self._indexes.values()),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "builds": self._builds,
+                "evictions": self._evictions,
+            }
+
+
+def configured_index_manager():
+    """按配置創建進程內索引管理器
+
+    設置 VECTOR_SEGMENT_DIR 時使用磁盤向量段（各工作進程共享映射），
+    否則每個進程在內存中保存自己的索引。
+    """
+    segment_dir = os.getenv("VECTOR_SEGMENT_DIR")
+    if segment_dir:
+        # vector_segments 依賴本模塊的常量，在此處延遲導入
+        from src.services.vector_segments import SegmentIndexManager
+        return SegmentIndexManager(
+            segment_dir,
+            max_segments=int(os.getenv("VECTOR_SEGMENT_MAX_SEGMENTS", "8")),
+            max_dead_ratio=float(os.getenv("VECTOR_SEGMENT_MAX_DEAD_RATIO", "0.3")),
+            merge_interval=float(os.getenv("VECTOR_SEGMENT_MERGE_INTERVAL", "30")),
+            flush_interval=float(os.getenv("VECTOR_SEGMENT_FLUSH_INTERVAL", "0.1")),
+            flush_rows=int(os.getenv("VECTOR_SEGMENT_FLUSH_ROWS", "512"))
+        )
+    return VectorIndexManager(
+        memory_budget_bytes=int(os.getenv("VECTOR_INDEX_MEMORY_MB", "512")) * 1024 * 1024,
+        ann_min_vectors=int(os.getenv("VECTOR_INDEX_ANN_MIN_VECTORS", "50000")),
+        ann_params={
+            "M": int(os.getenv("HNSW_M", "16")),
+            "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),
+            "ef_search": int(os.getenv("HNSW_EF_SEARCH", "50")),
+        },
+        # 設置時持久化 HNSW 圖和 PQ 碼本，淘汰或重啟後不需要重新構建；默認不寫盤
+        persist_dir=os.getenv("VECTOR_INDEX_DIR") or None,
+        pq_min_vectors=int(os.getenv("VECTOR_INDEX_PQ_MIN_VECTORS", "0")),
+        pq_params={
+            name: int(value) for name, value in (
+                ("subvectors", os.getenv("VECTOR_INDEX_PQ_SUBVECTORS")),
+                ("bits", os.getenv("VECTOR_INDEX_PQ_BITS")),
+            ) if value
+        },
+        pq_rerank_factor=int(os.getenv("VECTOR_INDEX_PQ_RERANK", "16")),
+        ann_rebuild_ratio=float(os.getenv("VECTOR_INDEX_ANN_REBUILD_RATIO", "0.3"))
+    )
+
+
+vector_index_manager = configured_index_manager()
+
+def get_vector_index_manager() -> VectorIndexManager:
+    """FastAPI 依賴：返回進程內共享的索引管理器"""
+    return vector_index_manager
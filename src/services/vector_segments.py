@@ -0,0 +1,1093 @@
+"""磁盤向量段 - 按工作區把規範化向量保存為可內存映射的只追加段文件
+
+段文件格式（小端）：
+    頭部 64 字節：magic "AVSG"、版本號、維度、行數
+    float32 行矩陣（行數 × 維度，已 L2 規範化）
+    記憶 ID 數組（行數 × 16 字節）
+    刪除位圖（ceil(行數 / 8) 字節，第 i 位為 1 表示第 i 行已刪除）
+
+段文件寫入後只有刪除位圖會被修改。各進程用 np.memmap 共享映射同一批文件：
+向量頁由操作系統頁緩存共享，不在每個 uvicorn 工作進程中各保存一份；
+刪除位寫入共享映射後對其他進程立即可見。工作區目錄下的 manifest.json
+記錄當前段列表，通過 os.replace 原子替換；追加和刪除在工作區的文件鎖下進行，
+合併在鎖外寫入新段、只在鎖內替換清單，讀取不加鎖。
+
+SegmentIndexManager 的寫入先進入進程內緩衝，由寫入線程按批追加為一個段，
+寫請求處理中不做文件 I/O；搜索打開工作區前先寫入本進程對該工作區未落盤的寫入。
+"""
+
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID, uuid4
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.models.models import Memory, has_embedding, memory_columns, select_vectors
+from src.utils.embedding import normalize_rows
+from src.services.search_service import SearchService
+from src.services.vector_index import (
+    ENTRY_OVERHEAD_BYTES, ID_BYTES, ID_DTYPE, METADATA_FIELDS, PUBLIC_SCOPE,
+    id_key, key_id, memory_metadata
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"AVSG"
+SEGMENT_VERSION = 1
+# magic、版本號、保留字段、維度、行數；頭部補零到 SEGMENT_HEADER_BYTES
+SEGMENT_HEADER = struct.Struct("<4sHHIQ")
+SEGMENT_HEADER_BYTES = 64
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "lock"
+
+# 段的來源：首次構建、寫入追加、後台合併
+SOURCE_BUILD = "build"
+SOURCE_APPEND = "append"
+SOURCE_MERGE = "merge"
+
+# 按 ID 查詢元數據和向量時每批的 ID 數
+QUERY_CHUNK_SIZE = 500
+
+
+class Segment:
+    """一個內存映射的段文件"""
+
+    def __init__(self, path: str, source: str = SOURCE_BUILD):
+        """映射段文件
+
+        Args:
+            path: 段文件路徑
+            source: 段的來源（build、append 或 merge）
+
+        Raises:
+            ValueError: 如果文件不是向量段或版本不支持
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self.source = source
+        self._raw = np.memmap(path, dtype=np.uint8, mode="r+")
+        magic, version, _, dim, rows = SEGMENT_HEADER.unpack(
+            self._raw[:SEGMENT_HEADER.size].tobytes()
+        )
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f"不是支持的向量段文件: {path}")
+        self.dim = dim
+        self.rows = rows
+
+        matrix_end = SEGMENT_HEADER_BYTES + rows * dim * 4
+        ids_end = matrix_end + rows * ID_BYTES
+        # 以下都是映射上的視圖，不複製數據；只有刪除位圖可寫
+        self.matrix = self._raw[SEGMENT_HEADER_BYTES:matrix_end].view("<f4").reshape(rows, dim)
+        self.matrix.flags.writeable = False
+        self.ids = self._raw[matrix_end:ids_end].view(ID_DTYPE)
+        self.ids.flags.writeable = False
+        self.tombstones = self._raw[ids_end:ids_end + (rows + 7) // 8]
+
+    @staticmethod
+    def write(path: str, parts: Sequence[Tuple[np.ndarray, np.ndarray]]) -> int:
+        """寫入新的段文件（先寫臨時文件再原子改名）
+
+        Args:
+            path: 段文件路徑
+            parts: [(S16 ID 數組, 規範化 float32 矩陣), ...]，按順序拼接為段的行
+
+        Returns:
+            寫入的行數
+
+        Raises:
+            ValueError: 如果各部分的維度不一致
+        """
+        dims = {matrix.shape[1] for _, matrix in parts if len(matrix)}
+        if len(dims) > 1:
+            raise ValueError(f"段內向量維度不一致: {sorted(dims)}")
+        dim = dims.pop() if dims else 0
+        rows = sum(len(ids) for ids, _ in parts)
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0, dim, rows)
+                    .ljust(SEGMENT_HEADER_BYTES, b"\0"))
+            for _, matrix in parts:
+                np.ascontiguousarray(matrix, dtype="<f4").tofile(f)
+            for ids, _ in parts:
+                np.asarray(ids, dtype=ID_DTYPE).tofile(f)
+            f.write(bytes((rows + 7) // 8))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return rows
+
+    def live_mask(self) -> np.ndarray:
+        """返回未刪除行的掩碼（每次從共享映射讀取）"""
+        deleted = np.unpackbits(self.tombstones, count=self.rows, bitorder="little")
+        return deleted == 0
+
+    def delete(self, row: int) -> None:
+        """在刪除位圖中標記一行"""
+        self.tombstones[row >> 3] |= np.uint8(1 << (row & 7))
+
+    def flush(self) -> None:
+        """把刪除位圖的修改同步到磁盤"""
+        self._raw.flush()
+
+    @property
+    def nbytes(self) -> int:
+        return self._raw.shape[0]
+
+
+class SegmentStore:
+    """一個工作區目錄下的段文件集合
+
+    寫入只追加新段：更新記憶時先在舊段中標記刪除，再追加一個新段。
+    小段和已刪除的行由 merge 合併回收。
+    """
+
+    def __init__(self, directory: str, max_segments: int = 8, max_dead_ratio: float = 0.3):
+        """初始化
+
+        Args:
+            directory: 工作區的段目錄
+            max_segments: 段數超過該值時合併新追加的小段
+            max_dead_ratio: 已刪除行的比例達到該值時合併所有段
+        """
+        self.directory = directory
+        self.max_segments = max_segments
+        self.max_dead_ratio = max_dead_ratio
+        self.segments: List[Segment] = []
+        self.generation = 0
+        self.merges = 0
+        self._next_seq = 0
+        self._loaded_generation: Optional[int] = None
+        # ID -> (段, 行)：每個 ID 最新寫入的行，寫入時用於標記刪除，首次寫入時構建
+        self._positions: Optional[Dict[bytes, Tuple[Segment, int]]] = None
+        self._lock = threading.RLock()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    @property
+    def dim(self) -> Optional[int]:
+        for segment in self.segments:
+            if segment.rows:
+                return segment.dim
+        return None
+
+    def exists(self) -> bool:
+        """磁盤上是否已有該工作區的段清單"""
+        return os.path.exists(self.manifest_path)
+
+    @contextmanager
+    def locked(self):
+        """持有工作區的文件鎖（跨進程互斥寫入）"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), "a+b") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def refresh(self) -> bool:
+        """清單被其他進程（或本進程）替換後重新映射段列表
+
+        清單很小，每次都讀取並比較 generation，不依賴文件時間戳的精度。
+
+        Returns:
+            段列表是否有變化
+        """
+        for _ in range(3):
+            try:
+                with open(self.manifest_path) as f:
+                    manifest = json.load(f)
+            except FileNotFoundError:
+                return False
+            with self._lock:
+                if manifest["generation"] == self._loaded_generation:
+                    return False
+                try:
+                    opened = {segment.name: segment for segment in self.segments}
+                    segments = [
+                        opened.get(entry["name"]) or Segment(
+                            os.path.join(self.directory, entry["name"]), entry["source"]
+                        )
+                        for entry in manifest["segments"]
+                    ]
+                except FileNotFoundError:
+                    # 讀取清單和映射段之間段文件被合併刪除，重新讀取新清單
+                    continue
+                self._update_positions(self.segments, segments)
+                self.segments = segments
+                self.generation = manifest["generation"]
+                self._next_seq = manifest["next_seq"]
+                self._loaded_generation = self.generation
+                return True
+        raise RuntimeError(f"無法讀取穩定的段清單: {self.manifest_path}")
+
+    def _update_positions(self, old: List[Segment], new: List[Segment]) -> None:
+        """段列表變化時增量維護位置表（調用方持有鎖）"""
+        if self._positions is None:
+            return
+        previous = {segment.name for segment in old}
+        added = [i for i, segment in enumerate(new) if segment.name not in previous]
+        if added and added[0] != len(new) - len(added):
+            # 合併段插在之後追加的段前面，增量更新會讓舊行覆蓋新行的位置，下次寫入時重建
+            self._positions = None
+            return
+        kept = {segment.name for segment in new}
+        for segment in old:
+            if segment.name in kept:
+                continue
+            for key in segment.ids.tolist():
+                location = self._positions.get(key)
+                if location is not None and location[0] is segment:
+                    del self._positions[key]
+        for segment in new:
+            if segment.name not in previous:
+                self._index_positions(segment)
+
+    def _index_positions(self, segment: Segment) -> None:
+        for row, key in enumerate(segment.ids.tolist()):
+            self._positions[key] = (segment, row)
+
+    def _position_map(self) -> Dict[bytes, Tuple[Segment, int]]:
+        with self._lock:
+            if self._positions is None:
+                self._positions = {}
+                for segment in self.segments:
+                    self._index_positions(segment)
+            return self._positions
+
+    def _commit(self, entries: List[Dict], next_seq: int) -> None:
+        """寫入新清單並重新載入（調用方持有文件鎖）"""
+        manifest = {
+            "version": SEGMENT_VERSION,
+            "generation": self.generation + 1,
+            "next_seq": next_seq,
+            "segments": entries,
+        }
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+        self.refresh()
+
+    @staticmethod
+    def _entry(segment: Segment) -> Dict:
+        return {"name": segment.name, "source": segment.source}
+
+    def _tombstone(self, keys: Iterable[bytes]) -> int:
+        """標記 ID 最新寫入的行為已刪除（調用方持有文件鎖）"""
+        positions = self._position_map()
+        deleted = 0
+        with self._lock:
+            for key in keys:
+                location = positions.pop(key, None)
+                if location is None:
+                    continue
+                segment, row = location
+                segment.delete(row)
+                deleted += 1
+        return deleted
+
+    def append(
+        self,
+        memory_ids: Sequence[UUID],
+        matrix: np.ndarray,
+        source: str = SOURCE_APPEND
+    ) -> None:
+        """追加一個新段，同 ID 的舊行標記為已刪除
+
+        Args:
+            memory_ids: 記憶 ID
+            matrix: 規範化的 float32 矩陣，與 memory_ids 一一對應
+            source: 段的來源
+
+        Raises:
+            ValueError: 如果向量維度與已有段不一致
+        """
+        if not len(memory_ids):
+            return
+        ids = np.array([memory_id.bytes for memory_id in memory_ids], dtype=ID_DTYPE)
+        with self.locked():
+            self.refresh()
+            dim = self.dim
+            if dim is not None and matrix.shape[1] != dim:
+                raise ValueError(f"向量維度 {matrix.shape[1]} 與段維度 {dim} 不一致")
+            self._tombstone(ids.tolist())
+            name = f"{self._next_seq:010d}.seg"
+            Segment.write(os.path.join(self.directory, name), [(ids, matrix)])
+            entries = [self._entry(segment) for segment in self.segments]
+            entries.append({"name": name, "source": source})
+            self._commit(entries, self._next_seq + 1)
+
+    def delete(self, memory_ids: Iterable[UUID]) -> int:
+        """把記憶標記為已刪除
+
+        Args:
+            memory_ids: 記憶 ID
+
+        Returns:
+            標記的行數
+        """
+        keys = [id_key(memory_id) for memory_id in memory_ids]
+        if not keys:
+            return 0
+        with self.locked():
+            if not self.exists():
+                return 0
+            self.refresh()
+            return self._tombstone(keys)
+
+    def live_keys(self) -> set:
+        """返回所有未刪除行的 ID 鍵"""
+        keys = set()
+        with self._lock:
+            segments = list(self.segments)
+        for segment in segments:
+            keys.update(segment.ids[segment.live_mask()].tolist())
+        return keys
+
+    def plan_merge(self, force: bool = False) -> Optional[int]:
+        """選擇需要合併的段
+
+        已刪除行比例過高（或 force）時合併所有段；段數超過 max_segments 時
+        合併最大段之後的所有小段，小段不足兩個時合併所有段。
+
+        Args:
+            force: 是否強制合併所有段
+
+        Returns:
+            合併範圍的起始下標（合併 segments[start:]），不需要合併時返回 None
+        """
+        segments = self.segments
+        if not segments:
+            return None
+        rows = [segment.rows for segment in segments]
+        total = sum(rows)
+        dead = total - sum(int(segment.live_mask().sum()) for segment in segments)
+        if force or (total and dead / total >= self.max_dead_ratio):
+            return 0 if len(segments) > 1 or dead else None
+        if len(segments) <= self.max_segments:
+            return None
+        start = int(np.argmax(rows)) + 1
+        if len(segments) - start < 2:
+            start = 0
+        return start
+
+    def merge(self, force: bool = False) -> bool:
+        """按 plan_merge 把段合併為一個新段，回收已刪除的行
+
+        新段在文件鎖外按當時的存活行寫入，期間的追加和刪除不被阻塞；
+        之後在鎖內確認被合併的段仍在清單中，把寫入期間新標記的刪除補到新段，
+        再把新段換入這些段的位置（之後追加的段保留在它後面）。
+        清單替換後才刪除舊段文件；其他進程已映射的舊段在它們重新讀取清單前仍可讀。
+
+        Args:
+            force: 是否強制合併所有段
+
+        Returns:
+            是否執行了合併（其他進程先合併了同一批段時返回 False）
+        """
+        self.refresh()
+        with self._lock:
+            start = self.plan_merge(force)
+            if start is None:
+                return False
+            merged = self.segments[start:]
+        names = [segment.name for segment in merged]
+        lives = [segment.live_mask() for segment in merged]
+        parts = [
+            (segment.ids[live], segment.matrix[live])
+            for segment, live in zip(merged, lives) if live.any()
+        ]
+        # 合併段用唯一文件名，不佔用追加段的序號
+        path = os.path.join(self.directory, f"merge-{uuid4().hex}.seg") if parts else None
+        if path is not None:
+            Segment.write(path, parts)
+
+        try:
+            with self.locked():
+                self.refresh()
+                if [segment.name for segment in self.segments[start:start + len(merged)]] != names:
+                    return False
+                entries = [self._entry(segment) for segment in self.segments[:start]]
+                if path is not None:
+                    segment = Segment(path, SOURCE_MERGE)
+                    row = 0
+                    for old, live in zip(merged, lives):
+                        for offset in np.flatnonzero(~old.live_mask()[live]).tolist():
+                            segment.delete(row + offset)
+                        row += int(live.sum())
+                    segment.flush()
+                    entries.append(self._entry(segment))
+                entries += [self._entry(s) for s in self.segments[start + len(merged):]]
+                self._commit(entries, self._next_seq)
+                path = None
+        finally:
+            if path is not None:
+                os.unlink(path)
+
+        for segment in merged:
+            try:
+                os.unlink(segment.path)
+            except FileNotFoundError:
+                pass
+        self.merges += 1
+        return True
+
+    def flush(self) -> None:
+        """把刪除位圖同步到磁盤"""
+        with self._lock:
+            for segment in self.segments:
+                segment.flush()
+
+    def stats(self) -> Dict:
+        """返回段數、行數和磁盤佔用"""
+        with self._lock:
+            segments = list(self.segments)
+        return {
+            "segments": len(segments),
+            "rows": sum(segment.rows for segment in segments),
+            "live_rows": sum(int(segment.live_mask().sum()) for segment in segments),
+            "disk_bytes": sum(segment.nbytes for segment in segments),
+            "merges": self.merges,
+        }
+
+
+class SegmentWorkspaceIndex:
+    """工作區在磁盤段上的搜索視圖，接口與 WorkspaceVectorIndex 一致
+
+    向量只存在於映射的段文件中；進程內只保存元數據和按段編碼的元數據列。
+    段列表變化時按新段中的 ID 從數據庫讀取元數據（追加段總是重新讀取，
+    因此其他進程的更新也會刷新元數據）。
+    """
+
+    def __init__(self, workspace_id: UUID, store: SegmentStore):
+        """初始化空視圖
+
+        Args:
+            workspace_id: 工作區 ID（或 PUBLIC_SCOPE）
+            store: 工作區的段集合
+        """
+        self.workspace_id = workspace_id
+        self.store = store
+        # 段上沒有 HNSW 圖，QueryPlanner 按精確掃描規劃
+        self.ann = None
+        self.metadata: Dict[bytes, Dict] = {}
+        # 元數據取值的整數編碼，-1 表示該行沒有元數據（記憶已刪除或不屬於該範圍）
+        self._vocab: Dict[str, Dict] = {field: {} for field in METADATA_FIELDS}
+        self._segment_codes: Dict[str, Dict[str, np.ndarray]] = {}
+        self._segments: Tuple[Segment, ...] = ()
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._codes: Dict[str, np.ndarray] = {
+            field: np.empty(0, dtype=np.int32) for field in METADATA_FIELDS
+        }
+        self._known = np.empty(0, dtype=bool)
+        self._lock = threading.RLock()
+
+    @property
+    def scope(self):
+        """該視圖對應的 SQL 範圍條件"""
+        if self.workspace_id == PUBLIC_SCOPE:
+            return Memory.visibility == "public"
+        return Memory.workspace_id == self.workspace_id
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.store.dim
+
+    def __len__(self) -> int:
+        return int(self.live_mask().sum())
+
+    def __contains__(self, memory_id: UUID) -> bool:
+        with self._lock:
+            segments = self._segments
+        key = id_key(memory_id)
+        return any(
+            bool(segment.live_mask()[segment.ids == key].any()) for segment in segments
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """進程內佔用的估算字節數（映射的向量頁屬於共享頁緩存，不計入）"""
+        with self._lock:
+            return (
+                len(self.metadata) * ENTRY_OVERHEAD_BYTES
+                + sum(codes.nbytes for codes in self._codes.values())
+                + self._known.nbytes
+            )
+
+    def _fetch_metadata(self, db: Session, keys: Iterable[bytes]) -> Dict[bytes, Dict]:
+        """按 ID 從數據庫讀取元數據，不屬於該範圍或已刪除的記憶不返回"""
+        keys = list(keys)
+        fetched = {}
+        for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+            rows = db.execute(select(*memory_columns("vector")).where(
+                Memory.id.in_([key_id(key) for key in keys[start:start + QUERY_CHUNK_SIZE]]),
+                self.scope,
+                Memory.is_deleted == False
+            )).all()
+            fetched.update({id_key(row.id): memory_metadata(row) for row in rows})
+        return fetched
+
+    def _encode(self, field: str, value) -> int:
+        vocab = self._vocab[field]
+        return vocab.setdefault(value, len(vocab))
+
+    def sync(self, db: Session, metadata: Optional[Dict[bytes, Dict]] = None) -> bool:
+        """段列表變化後重新映射並編碼新段的元數據列
+
+        Args:
+            db: 數據庫會話
+            metadata: 已讀取的元數據（可選），首次打開時傳入以免重複查詢
+
+        Returns:
+            是否有變化
+        """
+        self.store.refresh()
+        with self._lock:
+            segments = tuple(self.store.segments)
+            if metadata is None and [s.name for s in segments] == [s.name for s in self._segments]:
+                return False
+
+            if metadata is not None:
+                self.metadata.update(metadata)
+            new = [s for s in segments if s.name not in self._segment_codes]
+            # 追加段中的記憶剛被寫入，總是重新讀取元數據；其他段只補讀未知的 ID
+            stale = set()
+            for segment in new:
+                keys = segment.ids.tolist()
+                if segment.source == SOURCE_APPEND and metadata is None:
+                    stale.update(keys)
+                else:
+                    stale.update(key for key in keys if key not in self.metadata)
+            if stale:
+                fetched = self._fetch_metadata(db, stale)
+                for key in stale:
+                    if key in fetched:
+                        self.metadata[key] = fetched[key]
+                    else:
+                        self.metadata.pop(key, None)
+
+            for segment in new:
+                rows = [self.metadata.get(key) for key in segment.ids.tolist()]
+                codes = {
+                    field: np.fromiter(
+                        (-1 if row is None else self._encode(field, row.get(field)) for row in rows),
+                        dtype=np.int32,
+                        count=len(rows)
+                    )
+                    for field in METADATA_FIELDS
+                }
+                self._segment_codes[segment.name] = codes
+
+            names = {segment.name for segment in segments}
+            for name in list(self._segment_codes):
+                if name not in names:
+                    del self._segment_codes[name]
+
+            self._segments = segments
+            self._offsets = np.cumsum([0] + [segment.rows for segment in segments])
+            for field in METADATA_FIELDS:
+                parts = [self._segment_codes[segment.name][field] for segment in segments]
+                self._codes[field] = (
+                    np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+                )
+            self._known = self._codes[METADATA_FIELDS[0]] >= 0
+            return True
+
+    def live_mask(self) -> np.ndarray:
+        """返回未刪除且有元數據的行掩碼（按段順序拼接）"""
+        with self._lock:
+            if not self._segments:
+                return np.empty(0, dtype=bool)
+            return np.concatenate([segment.live_mask() for segment in self._segments]) & self._known
+
+    def _code_mask(self, field: str, value) -> np.ndarray:
+        code = self._vocab[field].get(value)
+        if code is None:
+            return np.zeros(len(self._known), dtype=bool)
+        return self._codes[field] == code
+
+    def access_mask(self, agent_id: UUID, shared_ids=()) -> np.ndarray:
+        """返回 Agent 可讀行的掩碼：自己創建、公開或在共享集合中
+
+        Args:
+            agent_id: Agent ID
+            shared_ids: 共享給該 Agent 的記憶 ID
+
+        Returns:
+            布爾數組，與段的行按順序一一對應
+        """
+        with self._lock:
+            mask = self._code_mask("visibility", "public") | self._code_mask(
+                "created_by_agent_id", agent_id
+            )
+            if shared_ids and self._segments:
+                keys = np.array([memory_id.bytes for memory_id in shared_ids], dtype=ID_DTYPE)
+                mask |= np.concatenate([np.isin(segment.ids, keys) for segment in self._segments])
+            return mask
+
+    def filter_mask(self, filters: Optional[Dict] = None) -> Optional[np.ndarray]:
+        """返回滿足過濾條件的行掩碼，無過濾條件時返回 None
+
+        Args:
+            filters: {元數據字段: 取值}
+
+        Returns:
+            布爾數組，與段的行按順序一一對應
+        """
+        if not filters:
+            return None
+        with self._lock:
+            mask = np.ones(len(self._known), dtype=bool)
+            for field, value in filters.items():
+                mask &= self._code_mask(field, value)
+            return mask
+
+    def selectivity(self, filters: Optional[Dict] = None) -> float:
+        """按未刪除行計算過濾條件的選擇率
+
+        Args:
+            filters: {元數據字段: 取值}
+
+        Returns:
+            float: 0.0 ~ 1.0，無過濾條件時為 1.0
+        """
+        if not filters:
+            return 1.0
+        with self._lock:
+            live = self.live_mask()
+            total = int(live.sum())
+            if total == 0:
+                return 0.0
+            return int((self.filter_mask(filters) & live).sum()) / total
+
+    def shortlist(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        use_ann: Optional[bool] = None,
+        filters: Optional[Dict] = None,
+        scope=None
+    ) -> List[UUID]:
+        """直接在映射的段上評分，返回可能進入前 top_k 的記憶 ID（按段的行順序）
+
+        Args:
+            query_embedding: 查詢嵌入向量
+            top_k: 返回數量
+            similarity_threshold: 相似度閾值
+            use_ann: 與 WorkspaceVectorIndex 保持一致的參數，段上總是精確掃描
+            filters: {元數據字段: 取值}（可選），只返回滿足條件的記憶
+            scope: AccessScope（可選），只返回範圍內可讀的記憶
+
+        Returns:
+            候選記憶 ID 列表，需要調用方精確重算排序
+        """
+        with self._lock:
+            segments = self._segments
+            if not segments:
+                return []
+            mask = self.live_mask()
+            matching = self.filter_mask(filters)
+            if matching is not None:
+                mask &= matching
+            if scope is not None:
+                mask &= scope.mask(self)
+            scores = SearchService.score_segments(
+                query_embedding, [segment.matrix for segment in segments]
+            )
+            scores = np.where(mask, scores, -np.inf)
+            positions = SearchService.shortlist(scores, top_k, similarity_threshold)
+            owners = np.searchsorted(self._offsets, positions, side="right") - 1
+            return [
+                key_id(segments[owner].ids[position - self._offsets[owner]])
+                for position, owner in zip(positions.tolist(), owners.tolist())
+            ]
+
+
+class SegmentIndexManager:
+    """按工作區管理磁盤向量段，接口與 VectorIndexManager 一致
+
+    設置 VECTOR_SEGMENT_DIR 時代替 VectorIndexManager 作為進程內後端的索引管理器。
+    所有工作進程映射同一個目錄下的段文件。upsert 和 remove 只把寫入放入緩衝後返回，
+    寫入線程在 flush_interval 內或緩衝達到 flush_rows 行時，把每個工作區的一批寫入
+    合併為一次刪除和一個追加段；本進程和其他進程在寫入落盤後的下次搜索中看到變更。
+    後台任務在線程中定期合併小段並回收已刪除的行。
+    首次打開工作區時按數據庫補齊缺失的向量、標記已刪除的記憶，
+    之後每次搜索只檢查清單是否被替換。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_segments: int = 8,
+        max_dead_ratio: float = 0.3,
+        merge_interval: float = 30.0,
+        flush_interval: float = 0.1,
+        flush_rows: int = 512
+    ):
+        """初始化管理器
+
+        Args:
+            directory: 段文件根目錄，每個工作區一個子目錄
+            max_segments: 工作區段數超過該值時合併小段
+            max_dead_ratio: 已刪除行比例達到該值時合併所有段
+            merge_interval: 後台合併的檢查間隔（秒）
+            flush_interval: 寫入緩衝最多等待的秒數
+            flush_rows: 緩衝達到該行數時立即寫入
+
+        Raises:
+            ValueError: 如果 flush_rows 無效
+        """
+        if flush_rows < 1:
+            raise ValueError("flush_rows 必須大於 0")
+
+        self.directory = directory
+        self.max_segments = max_segments
+        self.max_dead_ratio = max_dead_ratio
+        self.merge_interval = merge_interval
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self._stores: Dict[UUID, SegmentStore] = {}
+        self._indexes: Dict[UUID, SegmentWorkspaceIndex] = {}
+        self._lock = threading.Lock()
+        self._builds = 0
+        # 寫入緩衝：{工作區: {記憶 ID: 規範化向量，None 表示刪除}}，同一 ID 只保留最後一次寫入
+        self._pending: Dict[UUID, Dict[UUID, Optional[np.ndarray]]] = {}
+        self._pending_rows = 0
+        self._pending_changed = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        # 串行化批次寫入，保證先取出的批次先落盤
+        self._flush_lock = threading.Lock()
+        self._flushes = 0
+        self._failures = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def store(self, workspace_id: UUID) -> SegmentStore:
+        """返回工作區的段集合（不存在時只創建對象，不創建文件）"""
+        with self._lock:
+            store = self._stores.get(workspace_id)
+            if store is None:
+                store = SegmentStore(
+                    os.path.join(self.directory, workspace_id.hex),
+                    max_segments=self.max_segments,
+                    max_dead_ratio=self.max_dead_ratio
+                )
+                self._stores[workspace_id] = store
+            return store
+
+    def get(self, workspace_id: UUID, db: Session) -> SegmentWorkspaceIndex:
+        """獲取工作區的段視圖，首次打開時與數據庫對齊
+
+        本進程對該工作區還有未落盤的寫入時先寫入，使寫請求之後的搜索能讀到自己的寫入；
+        其他工作區的緩衝仍由寫入線程處理。
+
+        Args:
+            workspace_id: 工作區 ID
+            db: 數據庫會話
+
+        Returns:
+            SegmentWorkspaceIndex
+        """
+        if workspace_id in self._pending:
+            self.flush_writes(workspace_id)
+        with self._lock:
+            index = self._indexes.get(workspace_id)
+        if index is not None:
+            index.sync(db)
+            return index
+
+        index = SegmentWorkspaceIndex(workspace_id, self.store(workspace_id))
+        self._open(index, db)
+        with self._lock:
+            existing = self._indexes.get(workspace_id)
+            if existing is not None:
+                return existing
+            self._indexes[workspace_id] = index
+            self._builds += 1
+        return index
+
+    @staticmethod
+    def _open(index: SegmentWorkspaceIndex, db: Session) -> None:
+        """讀取範圍內記憶的元數據，補寫段中缺失的向量並標記已刪除的記憶
+
+        段不存在時相當於從數據庫構建；已存在時只讀取缺失記憶的向量。
+        """
+        store = index.store
+        rows = db.execute(select(*memory_columns("vector"), has_embedding().label("has_vector")).where(
+            index.scope,
+            Memory.is_deleted == False
+        )).all()
+        metadata = {id_key(row.id): memory_metadata(row) for row in rows}
+
+        store.refresh()
+        on_disk = store.live_keys()
+        missing = [row.id for row in rows if row.has_vector and id_key(row.id) not in on_disk]
+        if missing:
+            if on_disk:
+                vectors = []
+                for start in range(0, len(missing), QUERY_CHUNK_SIZE):
+                    vectors += db.execute(select_vectors(Memory.id).where(
+                        Memory.id.in_(missing[start:start + QUERY_CHUNK_SIZE])
+                    )).all()
+            else:
+                vectors = db.execute(select_vectors(Memory.id).where(
+                    index.scope,
+                    Memory.is_deleted == False
+                )).all()
+            SegmentIndexManager._append_rows(store, vectors, SOURCE_APPEND if on_disk else SOURCE_BUILD)
+        elif not store.exists():
+            # 空工作區也寫入清單，之後的寫入直接追加
+            with store.locked():
+                if not store.exists():
+                    store._commit([], 0)
+
+        stale = on_disk - metadata.keys()
+        if stale:
+            store.delete(key_id(key) for key in stale)
+        index.sync(db, metadata)
+
+    @staticmethod
+    def _append_rows(store: SegmentStore, rows, source: str) -> None:
+        """把 (id, embeddings) 行規範化後追加為一個段，維度與多數不一致的舊數據跳過"""
+        rows = [row for row in rows if row.embeddings is not None and len(row.embeddings)]
+        if not rows:
+            return
+        dim = store.dim or len(rows[0].embeddings)
+        rows = [row for row in rows if len(row.embeddings) == dim]
+        matrix = normalize_rows(np.vstack([np.asarray(row.embeddings) for row in rows]))
+        store.append([row.id for row in rows], matrix, source=source)
+
+    def _existing(self, workspace_id: UUID) -> Optional[SegmentStore]:
+        store = self.store(workspace_id)
+        return store if store.exists() else None
+
+    def upsert(self, memory) -> None:
+        """記憶創建或更新後寫入工作區段和公開段（放入緩衝，不阻塞調用方）
+
+        更新總是追加新行，其他進程據此重新讀取該記憶的元數據。
+        """
+        indexable = not (
+            memory.is_deleted or memory.embeddings is None or len(memory.embeddings) == 0
+        )
+        vector = None
+        if indexable:
+            vector = normalize_rows(np.asarray(memory.embeddings, dtype=np.float32).reshape(1, -1))[0]
+        self._enqueue(memory.workspace_id, memory.id, vector)
+        self._enqueue(PUBLIC_SCOPE, memory.id, vector if memory.visibility == "public" else None)
+
+    def remove(self, workspace_id: UUID, memory_id: UUID) -> None:
+        """記憶刪除後在工作區段和公開段中標記刪除（放入緩衝，不阻塞調用方）"""
+        for key in (workspace_id, PUBLIC_SCOPE):
+            self._enqueue(key, memory_id, None)
+
+    def _enqueue(self, key: UUID, memory_id: UUID, vector: Optional[np.ndarray]) -> None:
+        """把一次寫入放入緩衝，需要時啟動寫入線程"""
+        with self._pending_changed:
+            ops = self._pending.setdefault(key, {})
+            if memory_id not in ops:
+                self._pending_rows += 1
+            ops[memory_id] = vector
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="vector-segment-writer", daemon=True
+                )
+                self._writer.start()
+            elif self._pending_rows >= self.flush_rows:
+                self._pending_changed.notify()
+
+    def _write_loop(self) -> None:
+        """寫入線程：等待一個 flush_interval 收集寫入後成批落盤，緩衝為空時退出"""
+        while True:
+            with self._pending_changed:
+                deadline = time.monotonic() + self.flush_interval
+                while self._pending_rows < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._pending_changed.wait(remaining)
+                if not self._pending:
+                    self._writer = None
+                    return
+            self.flush_writes()
+
+    def flush_writes(self, workspace_id: Optional[UUID] = None) -> int:
+        """把緩衝中的寫入落盤：每個已有段的工作區一次刪除和一個追加段
+
+        磁盤上還沒有段的工作區跳過，首次打開時從數據庫補齊。
+        寫入失敗（磁盤錯誤、文件鎖失敗等）的批次記錄日誌後放回緩衝，
+        緩衝中更新的寫入優先，寫入線程在下一個 flush_interval 重試。
+
+        Args:
+            workspace_id: 只寫入該工作區的緩衝（可選），默認寫入全部
+
+        Returns:
+            寫入的記憶數
+        """
+        with self._flush_lock:
+            with self._pending_changed:
+                if workspace_id is None:
+                    pending, self._pending, self._pending_rows = self._pending, {}, 0
+                else:
+                    ops = self._pending.pop(workspace_id, None)
+                    pending = {workspace_id: ops} if ops else {}
+                    self._pending_rows -= len(ops or ())
+            written = 0
+            for key, ops in pending.items():
+                try:
+                    store = self._existing(key)
+                    if store is None:
+                        continue
+                    self._write_batch(store, ops)
+                except Exception:
+                    logger.exception("工作區 %s 的向量段寫入失敗，%d 條寫入放回緩衝", key, len(ops))
+                    self._requeue(key, ops)
+                    continue
+                written += len(ops)
+            if pending:
+                self._flushes += 1
+            return written
+
+    def _requeue(self, key: UUID, ops: Dict[UUID, Optional[np.ndarray]]) -> None:
+        """把寫入失敗的批次放回緩衝，取出後又緩衝的同 ID 寫入保留"""
+        with self._pending_changed:
+            pending = self._pending.setdefault(key, {})
+            for memory_id, vector in ops.items():
+                if memory_id not in pending:
+                    pending[memory_id] = vector
+                    self._pending_rows += 1
+            self._failures += 1
+
+    @staticmethod
+    def _write_batch(store: SegmentStore, ops: Dict[UUID, Optional[np.ndarray]]) -> None:
+        """一個工作區的一批寫入：向量追加為一個段，刪除和維度不一致的向量標記刪除"""
+        store.refresh()
+        deleted = [memory_id for memory_id, vector in ops.items() if vector is None]
+        rows = [(memory_id, vector) for memory_id, vector in ops.items() if vector is not None]
+        if rows:
+            dim = store.dim or len(rows[0][1])
+            deleted += [memory_id for memory_id, vector in rows if len(vector) != dim]
+            rows = [(memory_id, vector) for memory_id, vector in rows if len(vector) == dim]
+            try:
+                store.append([memory_id for memory_id, _ in rows], np.vstack([v for _, v in rows]))
+            except ValueError:
+                # 其他進程先寫入了不同維度的段
+                deleted += [memory_id for memory_id, _ in rows]
+        if deleted:
+            store.delete(deleted)
+
+    def invalidate(self, workspace_id: Optional[UUID] = None) -> None:
+        """丟棄一個或全部工作區的進程內視圖（段文件保留）"""
+        with self._lock:
+            if workspace_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(workspace_id, None)
+
+    def persist(self) -> List[UUID]:
+        """寫入緩衝中的寫入，並把刪除位圖同步到磁盤
+
+        Returns:
+            已同步的工作區 ID 列表
+        """
+        self.flush_writes()
+        with self._lock:
+            stores = list(self._stores.items())
+        flushed = []
+        for workspace_id, store in stores:
+            if store.segments:
+                store.flush()
+                flushed.append(workspace_id)
+        return flushed
+
+    def workspaces_on_disk(self) -> List[UUID]:
+        """返回磁盤上有段目錄的工作區"""
+        if not os.path.isdir(self.directory):
+            return []
+        workspaces = []
+        for name in os.listdir(self.directory):
+            try:
+                workspaces.append(UUID(hex=name))
+            except ValueError:
+                continue
+        return workspaces
+
+    def merge_pending(self, force: bool = False) -> List[UUID]:
+        """合併所有需要合併的工作區（包括其他進程寫入的工作區）
+
+        Args:
+            force: 是否強制把每個工作區合併為一個段
+
+        Returns:
+            已合併的工作區 ID 列表
+        """
+        merged = []
+        for workspace_id in self.workspaces_on_disk():
+            store = self._existing(workspace_id)
+            if store is not None and store.merge(force):
+                merged.append(workspace_id)
+        return merged
+
+    async def _loop(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.to_thread(self.merge_pending)
+            except Exception:
+                logger.exception("向量段合併失敗")
+            await asyncio.sleep(self.merge_interval)
+
+    def start(self) -> None:
+        """在當前事件循環中啟動後台合併協程"""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """停止後台合併協程（進行中的合併在線程中完成），並寫入緩衝中的寫入"""
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush_writes)
+
+    def stats(self) -> Dict:
+        """返回進程內視圖和磁盤段統計"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+            stores = list(self._stores.values())
+        store_stats = [store.stats() for store in stores]
+        return {
+            "workspaces": len(indexes),
+            "vectors": sum(len(index) for index in indexes),
+            "ann_workspaces": 0,
+            "bytes": sum(index.nbytes for index in indexes),
+            "builds": self._builds,
+            "evictions": 0,
+            "segment_dir": self.directory,
+            "segments": sum(s["segments"] for s in store_stats),
+            "segment_rows": sum(s["rows"] for s in store_stats),
+            "segment_disk_bytes": sum(s["disk_bytes"] for s in store_stats),
+            "merges": sum(s["merges"] for s in store_stats),
+            "pending_writes": self._pending_rows,
+            "write_flushes": self._flushes,
+            "write_failures": self._failures,
+        }
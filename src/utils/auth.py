@@ -3,30 +3,41 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer
 from starlette.requests import Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 from src.db.database import get_db
 from src.models.models import Agent
+from src.utils.auth_cache import AgentSnapshot, agent_auth_cache
+from src.utils.timing import get_stage_timer
 
 security = HTTPBearer()
 
 
 async def get_current_agent(
     request: Request,
-    db: Session = Depends(get_db)
-) -> Agent:
+    db: AsyncSession = Depends(get_db)
+) -> AgentSnapshot:
     """驗證並獲取當前Agent
 
+    已解析的令牌在 agent_auth_cache 中緩存，命中時不訪問數據庫。
+
     Args:
         request: HTTP 請求
         db: 數據庫會話
 
     Returns:
-        Agent: 當前認證的Agent
+        AgentSnapshot: 當前認證的Agent（不綁定數據庫會話）
 
     Raises:
         HTTPException: 如果認證失敗
     """
+    with get_stage_timer(request).stage("auth"):
+        return await _authenticate(request, db)
+
+
+async def _authenticate(request: Request, db: AsyncSession) -> AgentSnapshot:
+    """解析 Bearer 令牌並查詢 Agent，優先讀取緩存"""
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(
@@ -45,12 +56,16 @@ async def get_current_agent(
             detail="無效的認證令牌"
         )
 
-    agent = db.query(Agent).filter(Agent.id == agent_id).first()
+    hit, snapshot = agent_auth_cache.lookup(token)
+    if not hit:
+        agent = await db.scalar(select(Agent).where(Agent.id == agent_id))
+        snapshot = AgentSnapshot.from_agent(agent) if agent else None
+        agent_auth_cache.put(token, agent_id, snapshot)
 
-    if not agent:
+    if snapshot is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Agent 不存在"
         )
 
-    return agent
+    return snapshot
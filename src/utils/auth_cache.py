@@ -0,0 +1,217 @@
+"""Agent 認證緩存 - 按令牌緩存已解析的 Agent，省去每個請求的數據庫查詢"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Set, Tuple
+from uuid import UUID
+import os
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from src.models.models import Agent
+
+# 影響認證結果的 Agent 列，變更時清除緩存
+INVALIDATING_COLUMNS = ("name", "workspace_id")
+
+# session.info 中等待提交後清除的 Agent ID
+_PENDING_INVALIDATIONS = "agent_auth_invalidations"
+
+
+@dataclass(frozen=True)
+class AgentSnapshot:
+    """認證後的 Agent 快照，不綁定數據庫會話"""
+    id: UUID
+    name: str
+    workspace_id: UUID
+
+    @classmethod
+    def from_agent(cls, agent: Agent) -> "AgentSnapshot":
+        """從 ORM 對象創建快照"""
+        return cls(id=agent.id, name=agent.name, workspace_id=agent.workspace_id)
+
+
+class AgentAuthCache:
+    """有界 TTL 緩存：令牌 -> AgentSnapshot
+
+    - 未知令牌緩存為 None（負緩存），使用較短的 TTL，避免無效令牌反復查庫
+    - 超過 max_entries 時按 LRU 淘汰
+    - Agent 改名、刪除或移動工作區時按 agent_id 清除對應令牌
+      （通過 ORM 事件；繞過 ORM 的批量 UPDATE/DELETE 需要調用 invalidate）
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+        max_entries: int = 10000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """初始化緩存
+
+        Args:
+            ttl: 已知 Agent 的緩存秒數
+            negative_ttl: 未知令牌的緩存秒數
+            max_entries: 最多緩存的令牌數
+            clock: 單調時鐘（測試時可替換）
+
+        Raises:
+            ValueError: 如果 max_entries 無效
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries 必須大於 0")
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # 令牌 -> (過期時間, agent_id, 快照或 None)
+        self._entries: "OrderedDict[str, Tuple[float, UUID, Optional[AgentSnapshot]]]" = OrderedDict()
+        self._tokens_by_agent: Dict[UUID, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def lookup(self, token: str) -> Tuple[bool, Optional[AgentSnapshot]]:
+        """查詢緩存
+
+        Args:
+            token: Bearer 令牌
+
+        Returns:
+            (是否命中, 快照)；命中負緩存時快照為 None
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self._misses += 1
+                return False, None
+            expires_at, agent_id, snapshot = entry
+            if expires_at <= self.clock():
+                self._remove(token, agent_id)
+                self._misses += 1
+                return False, None
+            self._entries.move_to_end(token)
+            if snapshot is None:
+                self._negative_hits += 1
+            else:
+                self._hits += 1
+            return True, snapshot
+
+    def put(self, token: str, agent_id: UUID, snapshot: Optional[AgentSnapshot]) -> None:
+        """寫入緩存
+
+        Args:
+            token: Bearer 令牌
+            agent_id: 令牌解析出的 Agent ID
+            snapshot: Agent 快照，Agent 不存在時為 None
+        """
+        ttl = self.ttl if snapshot is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (self.clock() + ttl, agent_id, snapshot)
+            self._entries.move_to_end(token)
+            self._tokens_by_agent.setdefault(agent_id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                old_token, (_, old_agent_id, _) = next(iter(self._entries.items()))
+                self._remove(old_token, old_agent_id)
+                self._evictions += 1
+
+    def invalidate(self, agent_id: UUID) -> None:
+        """清除某個 Agent 的所有令牌（包括負緩存）"""
+        with self._lock:
+            tokens = self._tokens_by_agent.pop(agent_id, ())
+            for token in tokens:
+                self._entries.pop(token, None)
+            self._invalidations += len(tokens)
+
+    def clear(self) -> None:
+        """清空緩存"""
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_agent.clear()
+
+    def _remove(self, token: str, agent_id: UUID) -> None:
+        """刪除一個令牌（調用方持有鎖）"""
+        self._entries.pop(token, None)
+        tokens = self._tokens_by_agent.get(agent_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_agent[agent_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """返回命中率和容量統計"""
+        with self._lock:
+            lookups = self._hits + self._negative_hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "negative_ttl_seconds": self.negative_ttl,
+                "hits": self._hits,
+                "negative_hits": self._negative_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "hit_rate": (self._hits + self._negative_hits) / lookups if lookups else 0.0,
+            }
+
+
+agent_auth_cache = AgentAuthCache(
+    ttl=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60")),
+    negative_ttl=float(os.getenv("AUTH_CACHE_NEGATIVE_TTL_SECONDS", "5")),
+    max_entries=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+)
+
+
+def _invalidate(agent: Agent) -> None:
+    """立即清除緩存，並在事務提交後再清除一次
+
+    flush 與 commit 之間的並發請求仍可能讀到舊行並寫回緩存，
+    提交後的第二次清除保證緩存不會比數據庫更舊。
+    """
+    agent_auth_cache.invalidate(agent.id)
+    session = object_session(agent)
+    if session is not None:
+        session.info.setdefault(_PENDING_INVALIDATIONS, set()).add(agent.id)
+
+
+@event.listens_for(Agent, "after_insert")
+def _agent_inserted(mapper, connection, agent: Agent) -> None:
+    """新 Agent 清除可能存在的負緩存"""
+    _invalidate(agent)
+
+
+@event.listens_for(Agent, "after_update")
+def _agent_updated(mapper, connection, agent: Agent) -> None:
+    """改名或移動工作區時清除緩存"""
+    state = inspect(agent)
+    if any(state.attrs[column].history.has_changes() for column in INVALIDATING_COLUMNS):
+        _invalidate(agent)
+
+
+@event.listens_for(Agent, "after_delete")
+def _agent_deleted(mapper, connection, agent: Agent) -> None:
+    """刪除 Agent 時清除緩存"""
+    _invalidate(agent)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    for agent_id in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        agent_auth_cache.invalidate(agent_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session) -> None:
+    session.info.pop(_PENDING_INVALIDATIONS, None)
@@ -1,8 +1,79 @@
 """嵌入工具函數 - 改進版本"""
 
-from typing import List, Optional
+from typing import List, Optional, Sequence, Union
+import struct
 import numpy as np
 
+# 二進制向量格式：8 字節頭部 + 小端 float32 數據
+# 頭部：魔數 b"AV"、格式版本、dtype 代碼、uint32 維度
+VECTOR_MAGIC = b"AV"
+VECTOR_FORMAT_VERSION = 1
+VECTOR_DTYPE_FLOAT32 = ord("f")
+VECTOR_HEADER = struct.Struct("<2sBBI")
+
+
+def pack_vector(embedding: Union[Sequence[float], np.ndarray]) -> bytes:
+    """把嵌入向量打包為帶頭部的小端 float32 字節串
+
+    Args:
+        embedding: 嵌入向量（列表或 numpy 數組）
+
+    Returns:
+        bytes: 頭部 + float32 數據
+
+    Raises:
+        ValueError: 如果向量不是一維
+    """
+    arr = np.asarray(embedding, dtype="<f4")
+    if arr.ndim != 1:
+        raise ValueError("嵌入向量必須是一維")
+    header = VECTOR_HEADER.pack(
+        VECTOR_MAGIC, VECTOR_FORMAT_VERSION, VECTOR_DTYPE_FLOAT32, arr.shape[0]
+    )
+    return header + arr.tobytes()
+
+
+def unpack_vector(data: bytes) -> np.ndarray:
+    """把 pack_vector 的結果零拷貝解析為只讀 numpy 數組
+
+    Args:
+        data: pack_vector 生成的字節串
+
+    Returns:
+        np.ndarray: float32 向量（與 data 共享內存）
+
+    Raises:
+        ValueError: 如果頭部無效或長度不匹配
+    """
+    if len(data) < VECTOR_HEADER.size:
+        raise ValueError("無效的向量數據")
+    magic, version, dtype_code, dim = VECTOR_HEADER.unpack_from(data)
+    if magic != VECTOR_MAGIC or dtype_code != VECTOR_DTYPE_FLOAT32:
+        raise ValueError("無效的向量數據")
+    if version != VECTOR_FORMAT_VERSION:
+        raise ValueError(f"不支持的向量格式版本: {version}")
+    if len(data) != VECTOR_HEADER.size + dim * 4:
+        raise ValueError("向量數據長度與維度不匹配")
+    return np.frombuffer(data, dtype="<f4", count=dim, offset=VECTOR_HEADER.size)
+
+
+def format_pgvector(embedding: Union[Sequence[float], np.ndarray]) -> str:
+    """把嵌入向量格式化為 pgvector 的文本輸入格式 '[x1,x2,...]'
+
+    Args:
+        embedding: 嵌入向量（列表或 numpy 數組）
+
+    Returns:
+        str: pgvector 文本，float32 精度可無損往返
+
+    Raises:
+        ValueError: 如果向量不是一維
+    """
+    arr = np.asarray(embedding, dtype=np.float32)
+    if arr.ndim != 1:
+        raise ValueError("嵌入向量必須是一維")
+    return "[" + ",".join(repr(float(x)) for x in arr) + "]"
+
 
 def validate_embedding(embedding: List[float], expected_dim: Optional[int] = None) -> bool:
     """驗證嵌入向量的有效性
@@ -14,7 +85,7 @@ def validate_embedding(embedding: List[float], expected_dim: Optional[int] = Non
     Returns:
         bool: 嵌入是否有效
     """
-    if not embedding or not isinstance(embedding, list):
+    if not isinstance(embedding, (list, np.ndarray)) or len(embedding) == 0:
         return False
 
     if expected_dim is not None and len(embedding) != expected_dim:
@@ -116,3 +187,48 @@ def cosine_similarity_batch(
             similarities.append(similarity)
 
     return similarities
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行 L2 規範化矩陣，零向量行保持為零
+
+    Args:
+        matrix: 形狀為 (n, d) 的矩陣
+
+    Returns:
+        np.ndarray: 規範化後的 float32 矩陣
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """選出分數最高的 k 個下標，按分數降序排列
+
+    使用 argpartition 代替全排序；分數相同時按下標升序，
+    與對列表做穩定降序排序的結果一致。
+
+    Args:
+        scores: 一維分數數組
+        k: 返回數量
+
+    Returns:
+        np.ndarray: 下標數組
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < n:
+        partitioned = np.argpartition(-scores, k - 1)[:k]
+        kth = scores[partitioned].min()
+        above = np.nonzero(scores > kth)[0]
+        ties = np.nonzero(scores == kth)[0][:k - len(above)]
+        selected = np.concatenate([above, ties])
+    else:
+        selected = np.arange(n)
+
+    order = np.lexsort((selected, -scores[selected]))
+    return selected[order]
@@ -0,0 +1,44 @@
+"""鍵集分頁工具函數"""
+
+from datetime import datetime
+from typing import Tuple
+from uuid import UUID
+import base64
+import json
+
+
+def encode_cursor(created_at: datetime, memory_id: UUID) -> str:
+    """把最後一條記錄的 (created_at, id) 編碼為不透明游標
+
+    Args:
+        created_at: 創建時間
+        memory_id: 記憶 ID
+
+    Returns:
+        str: URL 安全的 base64 字符串
+    """
+    payload = json.dumps(
+        {"t": created_at.isoformat(), "id": memory_id.hex},
+        separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """解析 encode_cursor 生成的游標
+
+    Args:
+        cursor: 游標字符串
+
+    Returns:
+        (created_at, memory_id)
+
+    Raises:
+        ValueError: 如果游標格式無效
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), UUID(payload["id"])
+    except (ValueError, KeyError, TypeError, UnicodeError) as e:
+        raise ValueError("無效的分頁游標") from e
@@ -0,0 +1,165 @@
+"""計時工具函數"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import bisect
+import threading
+import time
+
+from starlette.requests import Request
+
+# 延遲直方圖的桶上界（毫秒），最後一個桶為 +Inf
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class StageTimer:
+    """按階段累計耗時（毫秒），使用高精度單調時鐘"""
+
+    def __init__(self):
+        self.stages: "OrderedDict[str, float]" = OrderedDict()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """記錄 with 塊的耗時，同名階段累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def as_dict(self) -> Dict[str, float]:
+        """返回各階段耗時（毫秒，保留三位小數）"""
+        return {name: round(ms, 3) for name, ms in self.stages.items()}
+
+    def total(self, *names: str) -> float:
+        """返回指定階段（默認全部）的耗時之和（毫秒）"""
+        if not names:
+            return sum(self.stages.values())
+        return sum(self.stages.get(name, 0.0) for name in names)
+
+    def server_timing(self, total_ms: Optional[float] = None) -> str:
+        """生成 Server-Timing 響應頭的值
+
+        Args:
+            total_ms: 整個請求的耗時（可選），作為 total 條目追加
+
+        Returns:
+            str: 如 "auth;dur=0.412, scoring;dur=1.250, total;dur=3.100"
+        """
+        entries = [f"{name};dur={ms:.3f}" for name, ms in self.stages.items()]
+        if total_ms is not None:
+            entries.append(f"total;dur={total_ms:.3f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def timed(timer: Optional[StageTimer], name: str) -> Iterator[None]:
+    """timer 為 None 時不計時的 stage 包裝"""
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def get_stage_timer(request: Request) -> StageTimer:
+    """FastAPI 依賴：返回請求級階段計時器
+
+    計時中間件會預先在 request.state 上放置計時器，
+    未經過中間件時（如單獨掛載路由的測試）新建一個。
+    """
+    timer = getattr(request.state, "timer", None)
+    if timer is None:
+        timer = StageTimer()
+        request.state.timer = timer
+    return timer
+
+
+class LatencyHistogram:
+    """固定桶的延遲直方圖"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        """記錄一次耗時（毫秒）"""
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位數（毫秒）"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def stats(self) -> Dict:
+        """返回計數、均值、分位數和累積桶計數"""
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum_ms, 3),
+            "mean_ms": round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class LatencyRecorder:
+    """按路由和階段聚合延遲直方圖"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, timer: StageTimer, total_ms: float) -> None:
+        """記錄一次請求的各階段耗時和總耗時
+
+        Args:
+            route: 路由標識，如 "POST /memories/search"
+            timer: 請求的階段計時器
+            total_ms: 請求總耗時（毫秒）
+        """
+        with self._lock:
+            stages = self._histograms.setdefault(route, {})
+            for name, ms in list(timer.stages.items()) + [("total", total_ms)]:
+                histogram = stages.get(name)
+                if histogram is None:
+                    histogram = stages[name] = LatencyHistogram(self.buckets)
+                histogram.observe(ms)
+
+    def stats(self) -> Dict:
+        """返回 {路由: {階段: 直方圖統計}}"""
+        with self._lock:
+            return {
+                route: {name: histogram.stats() for name, histogram in stages.items()}
+                for route, stages in self._histograms.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+latency_recorder = LatencyRecorder()
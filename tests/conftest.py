@@ -1,7 +1,16 @@
 """Pytest 配置和 fixtures"""
 
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
 import pytest
 import asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.db.database import Base
 
 
 @pytest.fixture(scope="session")
@@ -10,3 +19,66 @@ def event_loop():
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
     loop.close()
+
+
+class SqliteTestDatabase:
+    """臨時 SQLite 數據庫文件上的同步和異步會話工廠
+
+    API 走異步會話、測試數據用同步會話寫入，兩個引擎共享同一個文件。
+    每個請求可能運行在不同的事件循環上，異步引擎不復用連接（NullPool）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+        self.AsyncSessionLocal = async_sessionmaker(self.async_engine, expire_on_commit=False)
+        Base.metadata.create_all(bind=self.engine)
+
+    async def get_db(self):
+        """替代 get_db 的依賴"""
+        async with self.AsyncSessionLocal() as db:
+            yield db
+
+
+@pytest.fixture(scope="module")
+def test_db(tmp_path_factory) -> Iterator[SqliteTestDatabase]:
+    """每個測試模塊一個臨時數據庫"""
+    database = SqliteTestDatabase(str(tmp_path_factory.mktemp("db") / "test.db"))
+    yield database
+    database.engine.dispose()
+
+
+@contextmanager
+def override_dependencies(overrides: Dict) -> Iterator[None]:
+    """臨時覆蓋 app.dependency_overrides，退出時恢復原值"""
+    from src.main import app
+
+    previous = {dep: app.dependency_overrides.get(dep) for dep in overrides}
+    app.dependency_overrides.update(overrides)
+    try:
+        yield
+    finally:
+        for dep, value in previous.items():
+            if value is None:
+                app.dependency_overrides.pop(dep, None)
+            else:
+                app.dependency_overrides[dep] = value
+
+
+@pytest.fixture
+def overrides() -> Dict:
+    """client 額外的依賴覆蓋；測試模塊重寫此 fixture 以替換其他依賴"""
+    return {}
+
+
+@pytest.fixture
+def client(test_db, overrides):
+    """get_db 指向 test_db 的測試客戶端"""
+    from fastapi.testclient import TestClient
+    from src.db.database import get_db
+    from src.main import app
+
+    with override_dependencies({get_db: test_db.get_db, **overrides}):
+        yield TestClient(app)
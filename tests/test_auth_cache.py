@@ -0,0 +1,118 @@
+"""Agent 認證緩存測試"""
+
+import pytest
+from datetime import datetime
+from sqlalchemy import text
+from uuid import uuid4
+from src.models.models import Agent
+from src.utils.auth_cache import AgentAuthCache, AgentSnapshot, agent_auth_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def create_agent(test_db, agent_id=None):
+    db = test_db.SessionLocal()
+    agent = Agent(id=agent_id or uuid4(), name=f"cache_agent_{uuid4().hex[:8]}", workspace_id=uuid4())
+    db.add(agent)
+    db.commit()
+    db.refresh(agent)
+    db.close()
+    return agent
+
+
+def snapshot(agent_id=None):
+    return AgentSnapshot(id=agent_id or uuid4(), name="a", workspace_id=uuid4())
+
+
+def test_ttl_and_negative_ttl():
+    """已知 Agent 和未知令牌分別按各自的 TTL 過期"""
+    clock = FakeClock()
+    cache = AgentAuthCache(ttl=60, negative_ttl=5, clock=clock)
+    known, unknown = snapshot(), uuid4()
+    cache.put("known", known.id, known)
+    cache.put("unknown", unknown, None)
+
+    assert cache.lookup("known") == (True, known)
+    assert cache.lookup("unknown") == (True, None)
+
+    clock.now = 10
+    assert cache.lookup("known") == (True, known)
+    assert cache.lookup("unknown") == (False, None)
+
+    clock.now = 61
+    assert cache.lookup("known") == (False, None)
+    assert len(cache) == 0
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_lru_eviction_and_invalidate():
+    """超過容量時淘汰最久未用的令牌；invalidate 清除 Agent 的所有令牌"""
+    cache = AgentAuthCache(max_entries=2)
+    first, second, third = snapshot(), snapshot(), snapshot()
+    cache.put("1", first.id, first)
+    cache.put("2", second.id, second)
+    cache.lookup("1")
+    cache.put("3", third.id, third)
+
+    assert cache.lookup("2") == (False, None)
+    assert cache.stats()["evictions"] == 1
+
+    cache.put("1-alias", first.id, first)
+    cache.invalidate(first.id)
+    assert cache.lookup("1") == (False, None)
+    assert cache.lookup("1-alias") == (False, None)
+    assert cache.lookup("3") == (True, third)
+
+
+def test_orm_events_invalidate(test_db):
+    """改名、移動工作區和刪除時清除緩存，無關列的更新不清除"""
+    agent = create_agent(test_db)
+    token = str(agent.id)
+    db = test_db.SessionLocal()
+    stored = db.get(Agent, agent.id)
+
+    changes = [
+        (lambda: setattr(stored, "updated_at", datetime(2030, 1, 1)), True),
+        (lambda: setattr(stored, "name", f"renamed_{uuid4().hex[:8]}"), False),
+        (lambda: setattr(stored, "workspace_id", uuid4()), False),
+        (lambda: db.delete(stored), False),
+    ]
+    for change, still_cached in changes:
+        agent_auth_cache.put(token, agent.id, AgentSnapshot.from_agent(stored))
+        change()
+        db.commit()
+        hit, _ = agent_auth_cache.lookup(token)
+        assert hit == still_cached
+    db.close()
+
+
+def test_requests_use_cache(client, test_db):
+    """命中緩存時不查詢數據庫；Agent 被刪除後返回 401"""
+    agent = create_agent(test_db)
+    headers = {"Authorization": f"Bearer {agent.id}"}
+    assert client.get("/memories", headers=headers).status_code == 200
+
+    # 繞過 ORM 刪除，緩存不會收到通知
+    with test_db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM agent WHERE id = :id"), {"id": agent.id.hex})
+    assert client.get("/memories", headers=headers).status_code == 200
+
+    agent_auth_cache.invalidate(agent.id)
+    assert client.get("/memories", headers=headers).status_code == 401
+
+
+def test_new_agent_clears_negative_entry(client, test_db):
+    """未知令牌被負緩存，Agent 創建後立即可用"""
+    agent_id = uuid4()
+    headers = {"Authorization": f"Bearer {agent_id}"}
+    assert client.get("/memories", headers=headers).status_code == 401
+    assert agent_auth_cache.lookup(str(agent_id)) == (True, None)
+
+    create_agent(test_db, agent_id)
+    assert client.get("/memories", headers=headers).status_code == 200
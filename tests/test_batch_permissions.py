@@ -0,0 +1,136 @@
+"""批量權限判定測試"""
+
+import pytest
+from sqlalchemy import event
+from uuid import uuid4
+from src.models.models import Agent, Memory
+from src.core.permissions import PermissionManager
+from src.services.model_registry import get_embedding_service
+from src.services.vector_index import VectorIndexManager, get_vector_index_manager
+
+
+class FixedEmbeddingService:
+    async def get_embeddings(self, text):
+        return [1.0, 0.0]
+
+
+@pytest.fixture
+def data(test_db):
+    """owner 的私有、共享和公開記憶，以及 reader 自己的私有記憶"""
+    db = test_db.SessionLocal()
+    workspace_id = uuid4()
+    owner = Agent(id=uuid4(), name=f"owner_{uuid4().hex[:8]}", workspace_id=workspace_id)
+    reader = Agent(id=uuid4(), name=f"reader_{uuid4().hex[:8]}", workspace_id=workspace_id)
+    db.add_all([owner, reader])
+
+    def memory(creator, name, visibility):
+        return Memory(
+            id=uuid4(), workspace_id=workspace_id, created_by_agent_id=creator.id,
+            type="knowledge", category="test", content=name,
+            visibility=visibility, embeddings=[1.0, 0.0]
+        )
+
+    memories = {
+        "private": memory(owner, "private", "private"),
+        "shared": memory(owner, "shared", "shared"),
+        "public": memory(owner, "public", "public"),
+        "own": memory(reader, "own", "private"),
+    }
+    memories["shared"].shared_with_agents.append(reader)
+    db.add_all(memories.values())
+    db.commit()
+    ids = {name: m.id for name, m in memories.items()}
+    yield {"db": db, "owner": owner.id, "reader": reader.id, "ids": ids}
+    db.close()
+
+
+@pytest.fixture
+def overrides():
+    return {
+        get_vector_index_manager: lambda: VectorIndexManager(),
+        get_embedding_service: FixedEmbeddingService,
+    }
+
+
+@pytest.mark.asyncio
+async def test_can_read_many(data):
+    """一次判定多條記憶：所有者、共享對象、公開記憶可讀，不存在的記憶不可讀"""
+    ids = data["ids"]
+    missing = uuid4()
+    access = await PermissionManager.can_read_many(
+        data["reader"], list(ids.values()) + [missing], data["db"]
+    )
+
+    assert access == {
+        ids["private"]: False,
+        ids["shared"]: True,
+        ids["public"]: True,
+        ids["own"]: True,
+        missing: False,
+    }
+
+
+@pytest.mark.asyncio
+async def test_can_write_many(data):
+    """只有所有者可寫"""
+    ids = data["ids"]
+    access = await PermissionManager.can_write_many(data["reader"], ids.values(), data["db"])
+
+    assert [name for name, memory_id in ids.items() if access[memory_id]] == ["own"]
+
+
+@pytest.mark.asyncio
+async def test_filter_readable_single_query(test_db, data):
+    """filter_readable 保持順序，並且只用一條查詢檢查共享關係"""
+    db = data["db"]
+    memories = [db.get(Memory, memory_id) for memory_id in data["ids"].values()]
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(test_db.engine, "before_cursor_execute", listener)
+    try:
+        readable = await PermissionManager.filter_readable(data["reader"], memories, db)
+    finally:
+        event.remove(test_db.engine, "before_cursor_execute", listener)
+
+    assert [m.content for m in readable] == ["shared", "public", "own"]
+    assert len(statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_async_session(test_db, data):
+    """異步會話同樣可用"""
+    async with test_db.AsyncSessionLocal() as db:
+        access = await PermissionManager.can_read_many(
+            data["reader"], [data["ids"]["private"], data["ids"]["shared"]], db
+        )
+
+    assert list(access.values()) == [False, True]
+
+
+def test_lookup_endpoint(client, data):
+    """批量讀取區分可讀、無權限和不存在的記憶"""
+    ids = data["ids"]
+    missing = uuid4()
+    response = client.post(
+        "/memories/lookup",
+        json={"ids": [str(ids["private"]), str(ids["shared"]), str(missing), str(ids["own"])]},
+        headers={"Authorization": f"Bearer {data['reader']}"}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [m["id"] for m in body["memories"]] == [str(ids["shared"]), str(ids["own"])]
+    assert body["forbidden"] == [str(ids["private"])]
+    assert body["not_found"] == [str(missing)]
+
+
+def test_search_excludes_unreadable(client, data):
+    """搜索結果不包含同一工作區內其他 Agent 的私有記憶"""
+    response = client.post(
+        "/memories/search",
+        json={"query": "q", "similarity_threshold": 0.0, "include_public": False},
+        headers={"Authorization": f"Bearer {data['reader']}"}
+    )
+
+    contents = sorted(r["content"] for r in response.json()["results"])
+    assert contents == ["own", "public", "shared"]
@@ -0,0 +1,148 @@
+"""批量創建記憶測試"""
+
+import pytest
+import numpy as np
+from uuid import uuid4, UUID
+from src.api import memories as memories_api
+from src.models.models import Agent, Memory
+from src.services.model_registry import get_embedding_service
+from src.services.vector_index import VectorIndexManager, get_vector_index_manager
+
+
+class RecordingEmbeddingService:
+    """記錄每次 batch_embeddings 調用的嵌入服務，含 "fail" 的批次拋出異常"""
+    def __init__(self):
+        self.batches = []
+
+    async def batch_embeddings(self, texts, batch_size=32):
+        self.batches.append(list(texts))
+        if any("fail" in text for text in texts):
+            raise RuntimeError("encode failed")
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+
+@pytest.fixture
+def embedding_service():
+    return RecordingEmbeddingService()
+
+
+@pytest.fixture
+def index_manager():
+    return VectorIndexManager()
+
+
+@pytest.fixture
+def overrides(embedding_service, index_manager):
+    """替換嵌入服務和索引管理器"""
+    return {
+        get_embedding_service: lambda: embedding_service,
+        get_vector_index_manager: lambda: index_manager,
+    }
+
+
+@pytest.fixture
+def agent(test_db):
+    db = test_db.SessionLocal()
+    agent = Agent(id=uuid4(), name=f"bulk_agent_{uuid4().hex[:8]}", workspace_id=uuid4())
+    db.add(agent)
+    db.commit()
+    db.refresh(agent)
+    db.close()
+    return agent
+
+
+def test_bulk_create(client, test_db, agent, embedding_service, monkeypatch):
+    """批量創建：按長度分批嵌入，空內容單獨報錯"""
+    monkeypatch.setattr(memories_api, "BULK_EMBEDDING_BATCH_SIZE", 4)
+    monkeypatch.setattr(memories_api, "BULK_INSERT_CHUNK_SIZE", 3)
+    items = [
+        {"type": "history", "category": "chat", "content": "x" * (10 - i)}
+        for i in range(10)
+    ]
+    items[5]["content"] = "   "
+
+    response = client.post(
+        "/memories/bulk", json={"items": items},
+        headers={"Authorization": f"Bearer {agent.id}"}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 9
+    assert body["failed"] == 1
+    assert body["results"][5]["error"] is not None
+    assert all(r["embedded"] for i, r in enumerate(body["results"]) if i != 5)
+
+    # 每批內文本按長度升序
+    assert [len(batch) for batch in embedding_service.batches] == [4, 4, 1]
+    flattened = [len(text) for batch in embedding_service.batches for text in batch]
+    assert flattened == sorted(flattened)
+
+    db = test_db.SessionLocal()
+    saved = db.query(Memory).filter(Memory.workspace_id == agent.workspace_id).all()
+    assert len(saved) == 9
+    by_id = {str(m.id): m for m in saved}
+    first = by_id[body["results"][0]["id"]]
+    assert first.content == "x" * 10
+    assert np.allclose(first.embeddings, [10.0, 1.0, 0.5])
+    db.close()
+
+
+def test_bulk_embedding_failure_keeps_rows(client, agent):
+    """嵌入失敗的批次仍然保存記憶，但標記未嵌入"""
+    response = client.post(
+        "/memories/bulk",
+        json={"items": [
+            {"type": "history", "category": "chat", "content": "ok"},
+            {"type": "history", "category": "chat", "content": "please fail"},
+        ]},
+        headers={"Authorization": f"Bearer {agent.id}"}
+    )
+
+    results = response.json()["results"]
+    assert all(r["id"] is not None for r in results)
+    assert [r["embedded"] for r in results] == [False, False]
+
+
+def test_bulk_updates_resident_index(client, test_db, agent, index_manager):
+    """已載入的工作區索引同步新記憶"""
+    db = test_db.SessionLocal()
+    index = index_manager.get(agent.workspace_id, db)
+    db.close()
+
+    response = client.post(
+        "/memories/bulk",
+        json={"items": [{"type": "history", "category": "chat", "content": "indexed"}]},
+        headers={"Authorization": f"Bearer {agent.id}"}
+    )
+
+    assert UUID(response.json()["results"][0]["id"]) in index
+
+
+def test_bulk_limit(client, agent, monkeypatch):
+    """超過單次上限返回 413"""
+    monkeypatch.setattr(memories_api, "MAX_BULK_ITEMS", 2)
+    items = [{"type": "history", "category": "chat", "content": "x"}] * 3
+
+    response = client.post(
+        "/memories/bulk", json={"items": items},
+        headers={"Authorization": f"Bearer {agent.id}"}
+    )
+
+    assert response.status_code == 413
+
+
+def test_insert_chunks_isolates_bad_rows(test_db, agent):
+    """某塊插入失敗時逐行重試，只跳過出錯的行"""
+    duplicate = uuid4()
+    rows = [
+        {"id": memory_id, "workspace_id": agent.workspace_id, "content": f"row {i}"}
+        for i, memory_id in enumerate([uuid4(), duplicate, uuid4(), duplicate, uuid4()])
+    ]
+
+    db = test_db.SessionLocal()
+    errors = memories_api.insert_in_chunks(db, rows, chunk_size=2)
+
+    assert list(errors) == [3]
+    assert db.query(Memory).filter(Memory.workspace_id == agent.workspace_id).count() == 4
+    db.close()
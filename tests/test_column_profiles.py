@@ -0,0 +1,71 @@
+"""Memory 列載入配置測試"""
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.exc import InvalidRequestError
+from uuid import uuid4
+from src.models.models import Agent, Memory, MEMORY_LIGHT, MEMORY_VECTOR
+from src.services.vector_index import VectorIndexManager, get_vector_index_manager
+
+
+@pytest.fixture
+def overrides():
+    return {get_vector_index_manager: lambda: VectorIndexManager()}
+
+
+@pytest.fixture
+def memory(test_db):
+    db = test_db.SessionLocal()
+    agent = Agent(id=uuid4(), name=f"profile_{uuid4().hex[:8]}", workspace_id=uuid4())
+    memory = Memory(
+        id=uuid4(), workspace_id=agent.workspace_id, created_by_agent_id=agent.id,
+        type="knowledge", category="test", content="profile", embeddings=[1.0, 0.0]
+    )
+    db.add_all([agent, memory])
+    db.commit()
+    ids = {"agent": agent.id, "memory": memory.id}
+    db.close()
+    return ids
+
+
+def test_profiles_select_only_their_columns(test_db, memory):
+    """light 不讀取嵌入，vector 不讀取內容；訪問未載入的列直接報錯"""
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(test_db.engine, "before_cursor_execute", listener)
+    db = test_db.SessionLocal()
+    try:
+        light = db.scalar(select(Memory).options(*MEMORY_LIGHT).where(Memory.id == memory["memory"]))
+        assert light.content == "profile"
+        with pytest.raises(InvalidRequestError):
+            light.embeddings
+        db.expunge_all()
+
+        vector = db.scalar(select(Memory).options(*MEMORY_VECTOR).where(Memory.id == memory["memory"]))
+        assert vector.embeddings.tolist() == [1.0, 0.0]
+        with pytest.raises(InvalidRequestError):
+            vector.content
+    finally:
+        db.close()
+        event.remove(test_db.engine, "before_cursor_execute", listener)
+
+    # vector 配置多一條語句：從 memory_embedding 預載入當前模型的向量
+    light_sql, vector_sql, vectors_sql = statements
+    assert "embedding" not in light_sql.replace("embedding_status", "")
+    assert "content" not in vector_sql
+    assert "memory_embedding" in vectors_sql and "content" not in vectors_sql
+
+
+def test_routes_work_with_light_profile(client, memory):
+    """單條讀取、列表、共享查詢和刪除只需要 light 配置中的列"""
+    headers = {"Authorization": f"Bearer {memory['agent']}"}
+    memory_id = memory["memory"]
+
+    response = client.get(f"/memories/{memory_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["content"] == "profile"
+
+    assert client.get("/memories", headers=headers).json()["memories"][0]["id"] == str(memory_id)
+    assert client.get(f"/memories/{memory_id}/shared-with", headers=headers).status_code == 200
+    assert client.delete(f"/memories/{memory_id}", headers=headers).status_code == 200
+    assert client.get("/memories", headers=headers).json()["memories"] == []
@@ -0,0 +1,93 @@
+"""數據庫連接池配置和指標測試"""
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from src.main import app
+from src.db.pool import (
+    configure_engine, pool_options, pool_stats,
+    TimedQueuePool, TimedAsyncAdaptedQueuePool,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE
+)
+
+
+def test_pool_options():
+    """文件數據庫使用可配置的連接池，內存數據庫保持默認，pool_size=0 關閉連接池"""
+    options = pool_options("sqlite:///./app.db", pool_size=3, max_overflow=2, pool_timeout=1)
+    assert options["poolclass"] is TimedQueuePool
+    assert (options["pool_size"], options["max_overflow"], options["pool_timeout"]) == (3, 2, 1)
+    assert options["connect_args"] == {"check_same_thread": False}
+
+    async_options = pool_options("sqlite+aiosqlite:///./app.db", is_async=True)
+    assert async_options["poolclass"] is TimedAsyncAdaptedQueuePool
+    assert "connect_args" not in async_options
+
+    assert "poolclass" not in pool_options("sqlite:///:memory:")
+    assert pool_options("postgresql://u:p@db/app", pool_size=0)["poolclass"] is NullPool
+    assert pool_options("postgresql://u:p@db/app")["pool_pre_ping"] is True
+
+
+def test_sqlite_pragmas(tmp_path):
+    """新連接啟用 WAL、synchronous=NORMAL、mmap 和 busy_timeout"""
+    url = f"sqlite:///{tmp_path / 'pragmas.db'}"
+    engine = configure_engine(create_engine(url, **pool_options(url)))
+
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == SQLITE_BUSY_TIMEOUT_MS
+        assert conn.execute(text("PRAGMA mmap_size")).scalar() == SQLITE_MMAP_SIZE
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_async_sqlite_pragmas(tmp_path):
+    """異步引擎的連接同樣設置 SQLite 參數"""
+    url = f"sqlite+aiosqlite:///{tmp_path / 'pragmas.db'}"
+    engine = create_async_engine(url, **pool_options(url, is_async=True))
+    configure_engine(engine.sync_engine)
+
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+        assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == SQLITE_BUSY_TIMEOUT_MS
+    await engine.dispose()
+
+
+def test_pool_gauges(tmp_path):
+    """佔用、溢出、等待時間和超時次數"""
+    url = f"sqlite:///{tmp_path / 'gauges.db'}"
+    engine = create_engine(
+        url, **pool_options(url, pool_size=1, max_overflow=1, pool_timeout=0.05)
+    )
+
+    first = engine.connect()
+    second = engine.connect()
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 2
+    assert stats["overflow"] == 1
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    stats = pool_stats(engine)
+    assert stats["timeouts"] == 1
+    assert stats["wait"]["count"] == 3
+    assert stats["wait"]["max_ms"] >= 50
+
+    first.close()
+    second.close()
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 0
+    assert stats["overflow"] == 0
+    engine.dispose()
+
+
+def test_db_pool_endpoint():
+    """/metrics/db-pool 返回同步和異步引擎的指標"""
+    response = TestClient(app).get("/metrics/db-pool")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"sync", "async"}
+    assert "pool_class" in body["sync"]
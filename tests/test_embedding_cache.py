@@ -0,0 +1,91 @@
+"""嵌入緩存測試"""
+
+import pytest
+import numpy as np
+from src.services.embedding_cache import EmbeddingCache, cache_key
+from src.services.embedding_service import EmbeddingService
+
+
+def test_cache_key_normalizes_text():
+    """空白差異不影響緩存鍵，模型名稱會影響"""
+    assert cache_key("m", "機器  學習 ") == cache_key("m", "機器 學習")
+    assert cache_key("m", "機器學習") != cache_key("other", "機器學習")
+
+
+def test_cache_hit_and_miss():
+    """命中和未命中計數"""
+    cache = EmbeddingCache(max_entries=10)
+
+    assert cache.get("m", "text") is None
+    cache.put("m", "text", [1.0, 2.0])
+    vector = cache.get("m", "text")
+
+    assert vector.dtype == np.float32
+    assert vector.tolist() == [1.0, 2.0]
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_lru_eviction():
+    """超出容量時淘汰最久未使用的項"""
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("m", "a", [1.0])
+    cache.put("m", "b", [2.0])
+    cache.get("m", "a")
+    cache.put("m", "c", [3.0])
+
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """磁盤層在新實例中仍然可讀"""
+    path = str(tmp_path / "embeddings.db")
+    cache = EmbeddingCache(max_entries=10, disk_path=path)
+    cache.put("m", "persisted", [0.5, 0.25])
+    cache.close()
+
+    reopened = EmbeddingCache(max_entries=10, disk_path=path)
+    vector = reopened.get("m", "persisted")
+
+    assert vector.tolist() == [0.5, 0.25]
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_disk_writes_are_batched(tmp_path):
+    """put 只寫內存和緩衝，後台線程成批落盤；未落盤的寫入被淘汰後仍可讀"""
+    path = str(tmp_path / "embeddings.db")
+    cache = EmbeddingCache(max_entries=1, disk_path=path)
+    cache.put("m", "a", [1.0])
+    cache.put("m", "b", [2.0])
+
+    assert cache.get("m", "a").tolist() == [1.0]
+    cache.flush()
+    stats = cache.stats()
+    assert stats["disk_pending"] == 0
+    assert stats["disk_writes"] == 2
+    cache.close()
+
+    reopened = EmbeddingCache(max_entries=10, disk_path=path)
+    assert reopened.get("m", "b").tolist() == [2.0]
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_service_uses_cache_without_encoding():
+    """緩存命中時嵌入服務不調用模型"""
+    cache = EmbeddingCache(max_entries=10)
+    service = EmbeddingService(model_name="all-MiniLM-L6-v2", cache=cache)
+    cache.put("all-MiniLM-L6-v2", "第一個", [1.0, 0.0])
+    cache.put("all-MiniLM-L6-v2", "第二個", [0.0, 1.0])
+
+    single = await service.get_embeddings("第一個")
+    batch = await service.batch_embeddings(["第一個", "第二個"])
+
+    assert single == [1.0, 0.0]
+    assert batch == [[1.0, 0.0], [0.0, 1.0]]
+    # 模型從未被載入
+    assert service._model is None
@@ -0,0 +1,104 @@
+"""嵌入推理執行器測試"""
+
+import pytest
+import asyncio
+import threading
+import time
+from src.services import embedding_executor
+from src.services.embedding_executor import EmbeddingExecutor
+from src.services.embedding_service import EmbeddingService
+
+
+@pytest.fixture
+def executor():
+    """創建線程池執行器"""
+    executor = EmbeddingExecutor("all-MiniLM-L6-v2", mode="thread", pool_size=2)
+    yield executor
+    executor.shutdown()
+
+
+def test_invalid_mode_raises_error():
+    """無效模式應引發錯誤"""
+    with pytest.raises(ValueError):
+        EmbeddingExecutor("all-MiniLM-L6-v2", mode="gpu")
+
+    with pytest.raises(ValueError):
+        EmbeddingExecutor("all-MiniLM-L6-v2", mode="thread", pool_size=0)
+
+
+def test_initial_stats(executor):
+    """初始統計為空閒"""
+    stats = executor.stats()
+
+    assert stats["mode"] == "thread"
+    assert stats["pool_size"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["saturation"] == 0.0
+
+
+@pytest.mark.asyncio
+async def test_executor_embeddings_match_inline(executor):
+    """執行器結果與內聯結果一致"""
+    inline_service = EmbeddingService()
+    pooled_service = EmbeddingService(executor=executor)
+
+    text = "執行器一致性測試"
+    inline = await inline_service.get_embeddings(text)
+    pooled = await pooled_service.get_embeddings(text)
+
+    assert len(pooled) == 384
+    assert max(abs(a - b) for a, b in zip(inline, pooled)) < 1e-5
+
+
+@pytest.mark.asyncio
+async def test_event_loop_not_blocked(executor):
+    """大批量嵌入期間事件循環保持響應"""
+    service = EmbeddingService(executor=executor)
+    await service.warmup()
+
+    texts = [f"大批量測試文本 {i}" for i in range(256)]
+    batch_task = asyncio.create_task(service.batch_embeddings(texts))
+
+    # 批量嵌入運行期間，事件循環上的短任務應立即完成
+    await asyncio.sleep(0)
+    start_time = time.perf_counter()
+    await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start_time
+
+    embeddings = await batch_task
+
+    assert elapsed < 0.1
+    assert len(embeddings) == 256
+    assert executor.stats()["completed"] > 0
+
+
+@pytest.mark.asyncio
+async def test_warmup_loads_model_once_per_worker(monkeypatch):
+    """預熱啟動全部工作者，每個工作者在初始化時只載入一次模型"""
+    loads = []
+
+    class StubModel:
+        def encode(self, texts):
+            return [0.0]
+
+    def load(model_name):
+        models = getattr(embedding_executor._worker_state, "models", None)
+        if models is None:
+            models = embedding_executor._worker_state.models = {}
+        if model_name not in models:
+            loads.append(threading.get_ident())
+            models[model_name] = StubModel()
+        return models[model_name]
+
+    monkeypatch.setattr(embedding_executor, "_get_worker_model", load)
+    executor = EmbeddingExecutor("stub", mode="thread", pool_size=4)
+    try:
+        await executor.warmup()
+        await executor.warmup()
+        await asyncio.gather(*[executor.encode("text") for _ in range(16)])
+    finally:
+        executor.shutdown()
+
+    assert len(loads) == 4
+    assert len(set(loads)) == 4
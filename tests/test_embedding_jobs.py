@@ -0,0 +1,255 @@
+"""後台嵌入流水線測試"""
+
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from uuid import uuid4
+from src.db.migrations import run_migrations
+from src.models.models import Agent, Memory, EmbeddingJob
+from src.services import embedding_jobs
+from src.services.embedding_jobs import (
+    EmbeddingWorker, enqueue_embedding, pending_unscored_count,
+    EMBEDDING_READY, EMBEDDING_PENDING, EMBEDDING_FAILED,
+    JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_DEAD
+)
+from src.services.vector_index import VectorIndexManager, get_vector_index_manager
+
+
+class FlakyEmbeddingService:
+    """內容包含 "bad" 的批次拋出異常"""
+    def __init__(self):
+        self.calls = 0
+
+    async def batch_embeddings(self, texts, batch_size=32):
+        self.calls += 1
+        if any("bad" in text for text in texts):
+            raise RuntimeError("encode failed")
+        return [[1.0, float(len(text))] for text in texts]
+
+
+@pytest.fixture
+def db(test_db):
+    session = test_db.SessionLocal()
+    yield session
+    session.query(EmbeddingJob).delete()
+    session.query(Memory).delete()
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def service():
+    return FlakyEmbeddingService()
+
+
+@pytest.fixture
+def index_manager():
+    return VectorIndexManager()
+
+
+@pytest.fixture
+def overrides(index_manager):
+    return {get_vector_index_manager: lambda: index_manager}
+
+
+@pytest.fixture
+def worker(test_db, service):
+    return EmbeddingWorker(
+        test_db.AsyncSessionLocal, lambda: service, batch_size=8, max_attempts=2, retry_backoff=0.0
+    )
+
+
+def add_pending(db, content, workspace_id=None):
+    memory = Memory(
+        workspace_id=workspace_id or uuid4(),
+        type="knowledge",
+        category="test",
+        content=content
+    )
+    db.add(memory)
+    enqueue_embedding(db, memory)
+    db.commit()
+    return memory
+
+
+def test_enqueue_is_idempotent(db):
+    """同一記憶已有排隊任務時不重複添加"""
+    memory = add_pending(db, "hello")
+    enqueue_embedding(db, memory)
+    db.commit()
+
+    assert memory.embedding_status == EMBEDDING_PENDING
+    assert db.query(EmbeddingJob).filter(EmbeddingJob.memory_id == memory.id).count() == 1
+
+
+@pytest.mark.asyncio
+async def test_worker_fills_vectors(db, worker, service):
+    """一批任務只調用一次 batch_embeddings 並寫入向量"""
+    workspace_id = uuid4()
+    memories = [add_pending(db, f"text {i}", workspace_id) for i in range(5)]
+    assert pending_unscored_count(db, workspace_id) == 5
+
+    assert await worker.drain() == 5
+    assert service.calls == 1
+
+    db.expire_all()
+    for memory in memories:
+        assert memory.embedding_status == EMBEDDING_READY
+        assert memory.embeddings.tolist() == [1.0, float(len(memory.content))]
+    assert pending_unscored_count(db, workspace_id) == 0
+    assert worker.stats(db)["jobs"][JOB_DONE] == 5
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_then_dead_letters(db, worker):
+    """壞數據不拖累整批；重試耗盡後進入死信"""
+    good = add_pending(db, "good")
+    bad = add_pending(db, "bad")
+
+    await worker.run_once()
+    db.expire_all()
+    assert good.embedding_status == EMBEDDING_READY
+    bad_job = db.query(EmbeddingJob).filter(EmbeddingJob.memory_id == bad.id).one()
+    assert bad_job.status == JOB_QUEUED
+    assert bad_job.attempts == 1
+    assert "encode failed" in bad_job.last_error
+
+    await worker.drain()
+    db.expire_all()
+    assert bad_job.status == JOB_DEAD
+    assert bad.embedding_status == EMBEDDING_FAILED
+
+
+@pytest.mark.asyncio
+async def test_retry_waits_for_backoff(test_db, db, service):
+    """退避期間任務不會被領取"""
+    worker = EmbeddingWorker(test_db.AsyncSessionLocal, lambda: service, retry_backoff=60.0)
+    add_pending(db, "bad")
+
+    assert await worker.run_once() == 1
+    assert await worker.run_once() == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed(db, worker):
+    """租約超時的 running 任務被重新領取，已刪除記憶的任務直接完成"""
+    memory = add_pending(db, "stuck")
+    deleted = add_pending(db, "deleted")
+    deleted.is_deleted = True
+    db.query(EmbeddingJob).update({
+        EmbeddingJob.status: JOB_RUNNING,
+        EmbeddingJob.locked_at: datetime.utcnow() - timedelta(hours=1)
+    })
+    db.commit()
+
+    assert await worker.drain() == 2
+    db.expire_all()
+    assert memory.embedding_status == EMBEDDING_READY
+    assert worker.stats(db)["jobs"][JOB_RUNNING] == 0
+
+
+def test_claim_skips_jobs_taken_by_another_worker(test_db, db, worker):
+    """選出候選後任務已被其他工作者領取時，條件 UPDATE 不會重複領取"""
+    add_pending(db, "contested")
+    other = test_db.SessionLocal()
+    racing = test_db.SessionLocal()
+    execute = racing.execute
+
+    def claim_first(*args, **kwargs):
+        if not getattr(claim_first, "done", False):
+            claim_first.done = True
+            assert len(worker.claim(other)) == 1
+        return execute(*args, **kwargs)
+
+    racing.execute = claim_first
+    try:
+        assert worker.claim(racing) == []
+    finally:
+        other.close()
+        racing.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_updates_resident_index(test_db, db, service):
+    """嵌入完成後同步已載入的工作區索引"""
+    index_manager = VectorIndexManager()
+    workspace_id = uuid4()
+    index = index_manager.get(workspace_id, db)
+    memory = add_pending(db, "indexed", workspace_id)
+    worker = EmbeddingWorker(test_db.AsyncSessionLocal, lambda: service, index_manager=index_manager)
+
+    await worker.drain()
+
+    assert memory.id in index
+
+
+def test_write_behind_create(client, db, monkeypatch):
+    """寫後模式下創建記憶立即返回 pending 並加入任務"""
+    monkeypatch.setattr(embedding_jobs, "EMBEDDING_WRITE_MODE", "async")
+    agent = Agent(id=uuid4(), name=f"jobs_agent_{uuid4().hex[:8]}", workspace_id=uuid4())
+    db.add(agent)
+    db.commit()
+
+    response = client.post(
+        "/memories",
+        json={"type": "knowledge", "category": "test", "content": "later"},
+        headers={"Authorization": f"Bearer {agent.id}"}
+    )
+
+    assert response.status_code == 201
+    assert response.json()["embedding_status"] == EMBEDDING_PENDING
+    assert db.query(EmbeddingJob).filter(EmbeddingJob.status == JOB_QUEUED).count() == 1
+    assert pending_unscored_count(db, agent.workspace_id) == 1
+
+
+@pytest.mark.asyncio
+async def test_write_behind_update_waits_for_worker(client, db, test_db, service, index_manager, monkeypatch):
+    """寫後模式下更新記憶先把舊向量移出索引，嵌入任務完成後再寫回"""
+    monkeypatch.setattr(embedding_jobs, "EMBEDDING_WRITE_MODE", "async")
+    agent = Agent(id=uuid4(), name=f"jobs_agent_{uuid4().hex[:8]}", workspace_id=uuid4())
+    memory = Memory(
+        workspace_id=agent.workspace_id, created_by_agent_id=agent.id, type="knowledge",
+        category="test", content="old", embeddings=[1.0, 3.0], embedding_status=EMBEDDING_READY
+    )
+    db.add_all([agent, memory])
+    db.commit()
+    index = index_manager.get(agent.workspace_id, db)
+    assert memory.id in index
+
+    response = client.put(
+        f"/memories/{memory.id}",
+        json={"content": "rewritten"},
+        headers={"Authorization": f"Bearer {agent.id}"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["embedding_status"] == EMBEDDING_PENDING
+    assert memory.id not in index
+
+    worker = EmbeddingWorker(test_db.AsyncSessionLocal, lambda: service, index_manager=index_manager)
+    await worker.drain()
+
+    assert memory.id in index
+
+
+def test_migration_backfills_status():
+    """遷移添加 embedding_status 並回填；缺少嵌入的未刪除記憶加入嵌入任務"""
+    legacy = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    with legacy.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE memory (id VARCHAR(32) PRIMARY KEY, content VARCHAR, "
+            "is_deleted BOOLEAN, embeddings BLOB)"
+        ))
+        conn.execute(text(
+            "INSERT INTO memory (id, content, is_deleted, embeddings) VALUES "
+            "('a', 'with', 0, x'00'), ('b', 'without', 0, NULL), ('c', 'deleted', 1, NULL)"
+        ))
+
+    assert "0002_embedding_status" in run_migrations(legacy)
+
+    with legacy.connect() as conn:
+        rows = dict(conn.execute(text("SELECT id, embedding_status FROM memory ORDER BY id")).fetchall())
+        jobs = conn.execute(text("SELECT memory_id, status, attempts FROM embedding_job")).fetchall()
+    assert rows == {"a": EMBEDDING_READY, "b": EMBEDDING_PENDING, "c": EMBEDDING_FAILED}
+    assert [tuple(job) for job in jobs] == [("b", JOB_QUEUED, 0)]
@@ -0,0 +1,225 @@
+"""HNSW 索引測試"""
+
+import pytest
+import numpy as np
+from uuid import uuid4, UUID
+from src.services.hnsw_index import HNSWIndex
+from src.services.vector_index import WorkspaceVectorIndex, VectorIndexManager
+
+
+def exact_top_k(vectors, query, k):
+    """精確餘弦相似度前 k 個下標"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return np.argsort(-scores)[:k].tolist()
+
+
+@pytest.fixture
+def dataset():
+    """500 個 16 維隨機向量"""
+    rng = np.random.default_rng(3)
+    return rng.standard_normal((500, 16)).astype(np.float32)
+
+
+@pytest.fixture
+def index(dataset):
+    """已插入全部向量的 HNSW 索引"""
+    index = HNSWIndex(16, M=8, ef_construction=64, ef_search=32)
+    for i, vector in enumerate(dataset):
+        index.add(i, vector)
+    return index
+
+
+def test_search_recall(index, dataset):
+    """近似結果與精確結果高度重合"""
+    rng = np.random.default_rng(4)
+    recall = 0.0
+    for query in rng.standard_normal((20, 16)):
+        found = [label for label, _ in index.search(query, 10)]
+        recall += len(set(found) & set(exact_top_k(dataset, query, 10))) / 10
+
+    assert recall / 20 >= 0.9
+
+
+def test_search_returns_similarity(index, dataset):
+    """返回相似度按降序排列，自身相似度為 1"""
+    results = index.search(dataset[7], 5)
+
+    assert results[0][0] == 7
+    assert abs(results[0][1] - 1.0) < 1e-5
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_tombstone_delete(index, dataset):
+    """刪除的標籤不再出現在結果中"""
+    assert index.mark_deleted(7) is True
+    assert index.mark_deleted(7) is False
+
+    results = index.search(dataset[7], 10)
+
+    assert 7 not in [label for label, _ in results]
+    assert len(results) == 10
+    assert len(index) == 499
+
+
+def test_update_existing_label(index):
+    """重複插入同一標籤會替換舊向量"""
+    new_vector = np.ones(16, dtype=np.float32)
+    index.add(3, new_vector)
+
+    assert index.search(new_vector, 1)[0][0] == 3
+    assert len(index) == 500
+
+
+def test_save_and_load(index, dataset, tmp_path):
+    """持久化後載入結果一致"""
+    index.mark_deleted(11)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+
+    loaded = HNSWIndex.load(path, label_type=int)
+
+    assert len(loaded) == len(index)
+    assert loaded.search(dataset[20], 10) == index.search(dataset[20], 10)
+    assert 11 not in loaded
+
+
+def test_workspace_index_uses_ann(dataset):
+    """掛載 ANN 後工作區索引走近似路徑並同步刪除"""
+    workspace_index = WorkspaceVectorIndex(uuid4())
+    ids = [uuid4() for _ in range(len(dataset))]
+    for memory_id, vector in zip(ids, dataset):
+        workspace_index.upsert(memory_id, vector)
+    workspace_index.attach_ann(HNSWIndex(16, M=8, ef_construction=64))
+
+    shortlist = workspace_index.shortlist(dataset[0].tolist(), 5, 0.0)
+    assert ids[0] in shortlist
+
+    workspace_index.remove(ids[0])
+    assert ids[0] not in workspace_index.shortlist(dataset[0].tolist(), 5, 0.0)
+    assert ids[0] not in workspace_index.ann
+
+
+def test_manager_persists_ann(dataset, tmp_path):
+    """管理器持久化 HNSW 圖，重新掛載時復用並對齊"""
+    workspace_id = uuid4()
+    manager = VectorIndexManager(
+        ann_min_vectors=10,
+        ann_params={"M": 8, "ef_construction": 64},
+        persist_dir=str(tmp_path)
+    )
+    workspace_index = WorkspaceVectorIndex(workspace_id)
+    ids = [uuid4() for _ in range(100)]
+    for memory_id, vector in zip(ids, dataset[:100]):
+        workspace_index.upsert(memory_id, vector)
+    workspace_index.attach_ann(manager._load_ann(workspace_id, 16))
+    manager._indexes[workspace_id] = workspace_index
+
+    assert manager.persist() == [workspace_id]
+
+    reloaded = manager._load_ann(workspace_id, 16)
+    assert set(reloaded.labels()) == set(ids)
+    assert all(isinstance(label, UUID) for label in reloaded.labels())
+
+    # 離線期間刪除的條目在重新掛載時被標記刪除
+    workspace_index.remove(ids[0])
+    workspace_index.ann = None
+    workspace_index.attach_ann(reloaded)
+    assert ids[0] not in reloaded
+
+
+def test_deleted_ratio(index):
+    """更新和刪除都會留下墓碑"""
+    assert index.deleted_ratio == 0.0
+    index.add(3, np.ones(16, dtype=np.float32))
+    index.mark_deleted(4)
+    assert index.deleted_ratio == pytest.approx(2 / 501)
+
+
+def test_attach_ann_does_not_block_index(dataset):
+    """插入圖時不持有索引鎖，期間的寫入在切換前補齊"""
+    import threading
+
+    workspace_index = WorkspaceVectorIndex(uuid4())
+    ids = [uuid4() for _ in range(200)]
+    for memory_id, vector in zip(ids, dataset[:200]):
+        workspace_index.upsert(memory_id, vector)
+    ann = HNSWIndex(16, M=8, ef_construction=32)
+    new_id = uuid4()
+    add = ann.add
+    calls = []
+
+    def add_and_write(label, vector):
+        calls.append(label)
+        if len(calls) == 50:
+            # 另一個線程在構建期間搜索和寫入，索引鎖被持有時會超時
+            def write():
+                workspace_index.shortlist(dataset[0].tolist(), 5, 0.0)
+                workspace_index.remove(ids[0])
+                workspace_index.upsert(new_id, dataset[300])
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join(timeout=5)
+            assert not writer.is_alive()
+        add(label, vector)
+
+    ann.add = add_and_write
+    workspace_index.attach_ann(ann)
+
+    assert workspace_index.ann is ann
+    assert ids[0] not in ann and new_id in ann
+    assert set(ann.labels()) == set(workspace_index.ids)
+
+
+def test_manager_builds_ann_in_background(dataset, tmp_path):
+    """首次訪問時在後台構建圖，完成前走精確路徑，完成後寫入 persist_dir"""
+    workspace_id = uuid4()
+    workspace_index = WorkspaceVectorIndex(workspace_id)
+    ids = [uuid4() for _ in range(200)]
+    for memory_id, vector in zip(ids, dataset[:200]):
+        workspace_index.upsert(memory_id, vector)
+    manager = VectorIndexManager(
+        ann_min_vectors=100, ann_params={"M": 8, "ef_construction": 32},
+        persist_dir=str(tmp_path)
+    )
+    manager.build = lambda workspace_id, db: workspace_index
+
+    index = manager.get(workspace_id, db=None)
+    # 未掛載時 shortlist 精確掃描
+    assert ids[0] in index.shortlist(dataset[0].tolist(), 5, 0.0)
+    manager.wait_ann(timeout=30)
+
+    assert index.ann is not None and len(index.ann) == 200
+    assert (tmp_path / f"{workspace_id}.hnsw.npz").exists()
+    stats = manager.stats()
+    assert (stats["ann_workspaces"], stats["ann_building"], stats["ann_builds"]) == (1, 0, 1)
+    manager.close()
+
+
+def test_manager_rebuilds_graph_with_many_tombstones(dataset):
+    """墓碑比例達到閾值時在後台重建圖"""
+    workspace_id = uuid4()
+    workspace_index = WorkspaceVectorIndex(workspace_id)
+    ids = [uuid4() for _ in range(200)]
+    for memory_id, vector in zip(ids, dataset[:200]):
+        workspace_index.upsert(memory_id, vector)
+    manager = VectorIndexManager(
+        ann_min_vectors=100, ann_params={"M": 8, "ef_construction": 32}, ann_rebuild_ratio=0.2
+    )
+    manager.build = lambda workspace_id, db: workspace_index
+    index = manager.get(workspace_id, db=None)
+    manager.wait_ann(timeout=30)
+    original = index.ann
+
+    for memory_id in ids[:30]:
+        manager.remove(workspace_id, memory_id)
+    assert original.deleted_ratio < 0.2 and index.ann is original
+    for memory_id, vector in zip(ids[30:50], dataset[300:320]):
+        manager._apply(workspace_id, memory_id, vector)
+    manager.wait_ann(timeout=30)
+
+    assert index.ann is not original
+    assert index.ann.deleted_ratio < 0.2
+    assert set(index.ann.labels()) == set(index.ids)
+    manager.close()
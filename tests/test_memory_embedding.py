@@ -0,0 +1,164 @@
+"""向量分表（memory_embedding）和雙讀測試"""
+
+import pytest
+import numpy as np
+from datetime import datetime
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from uuid import uuid4
+from src.db.database import Base
+from src.db.migrations import MIGRATIONS, run_migrations
+from src.api.memories import insert_in_chunks
+from src.models import models
+from src.models.models import (
+    ACTIVE_EMBEDDING_MODEL, Memory, MemoryEmbedding, has_embedding, memory_columns, select_vectors
+)
+from src.utils.embedding import pack_vector, unpack_vector
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def vector_rows(engine):
+    with engine.connect() as conn:
+        return {
+            (row.memory_id, row.model_name): unpack_vector(row.embeddings).tolist()
+            for row in conn.execute(text("SELECT memory_id, model_name, embeddings FROM memory_embedding"))
+        }
+
+
+def test_setter_writes_vector_table(engine, db):
+    """寫入向量進入 memory_embedding，memory 行上的列保持為空"""
+    memory = Memory(id=uuid4(), content="向量", embeddings=[1.0, 2.0])
+    db.add(memory)
+    db.commit()
+
+    assert vector_rows(engine) == {(memory.id.hex, ACTIVE_EMBEDDING_MODEL): [1.0, 2.0]}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT embeddings FROM memory")).scalar() is None
+
+    # 更新原地修改同一行，None 刪除該行
+    memory.embeddings = [3.0, 4.0]
+    db.commit()
+    assert vector_rows(engine) == {(memory.id.hex, ACTIVE_EMBEDDING_MODEL): [3.0, 4.0]}
+    memory.embeddings = None
+    db.commit()
+    assert vector_rows(engine) == {}
+
+
+def test_multiple_models_per_memory(engine, db):
+    """同一條記憶可以有多個模型的向量，embeddings 只返回當前模型的向量"""
+    memory = Memory(id=uuid4(), content="多模型", embeddings=[1.0, 0.0])
+    memory.vectors["next-model"] = MemoryEmbedding(model_name="next-model", embeddings=[0.0, 1.0, 0.0])
+    db.add(memory)
+    db.commit()
+    memory_id = memory.id
+    db.expunge_all()
+
+    loaded = db.get(Memory, memory_id)
+    assert set(loaded.vectors) == {ACTIVE_EMBEDDING_MODEL, "next-model"}
+    assert loaded.embeddings.tolist() == [1.0, 0.0]
+    assert db.scalar(select(func.count()).select_from(Memory).where(has_embedding())) == 1
+
+    # 刪除記憶時一併刪除所有模型的向量
+    db.delete(loaded)
+    db.commit()
+    assert vector_rows(engine) == {}
+
+
+def test_dual_read_falls_back_to_legacy_column(engine, db, monkeypatch):
+    """遷移前寫在 memory 行上的向量在雙讀期間仍可讀取，關閉雙讀後不可見"""
+    memory_id = uuid4()
+    with engine.begin() as conn:
+        # Core 插入按列名取值：embeddings 即遷移前的向量列
+        conn.execute(insert(Memory), [{"id": memory_id, "is_deleted": False, "embeddings": [5.0, 6.0]}])
+
+    def searchable():
+        return db.scalar(select(func.count()).select_from(Memory).where(has_embedding()))
+
+    def built():
+        return db.execute(select_vectors(*memory_columns("vector"))).all()
+
+    assert db.get(Memory, memory_id).embeddings.tolist() == [5.0, 6.0]
+    assert searchable() == 1
+    assert [row.embeddings.tolist() for row in built()] == [[5.0, 6.0]]
+
+    monkeypatch.setattr(models, "EMBEDDING_DUAL_READ", False)
+    db.expunge_all()
+    assert db.get(Memory, memory_id).embeddings is None
+    assert searchable() == 0
+    assert built() == []
+
+
+def test_bulk_insert_writes_vector_rows(engine, db):
+    """批量插入把行字典中的 embeddings 寫入 memory_embedding"""
+    now = datetime.utcnow()
+    rows = [
+        {"id": uuid4(), "content": f"批量 {i}", "is_deleted": False, "created_at": now,
+         "updated_at": now, "embeddings": [float(i), 1.0] if i else None,
+         "embedding_status": "ready" if i else "pending"}
+        for i in range(3)
+    ]
+    assert insert_in_chunks(db, rows) == {}
+
+    assert vector_rows(engine) == {
+        (rows[1]["id"].hex, ACTIVE_EMBEDDING_MODEL): [1.0, 1.0],
+        (rows[2]["id"].hex, ACTIVE_EMBEDDING_MODEL): [2.0, 1.0],
+    }
+
+
+def test_migration_moves_vectors():
+    """遷移按舊的 embedding_model 列複製向量並清空 memory.embeddings"""
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE memory ("
+            "id VARCHAR(32) PRIMARY KEY, workspace_id VARCHAR(32), is_deleted BOOLEAN, "
+            "created_at DATETIME, embeddings BLOB, embedding_status VARCHAR(20), "
+            "embedding_model VARCHAR(50), embedding_updated_at DATETIME)"
+        ))
+        old, unnamed, empty = uuid4(), uuid4(), uuid4()
+        conn.execute(
+            text("INSERT INTO memory (id, is_deleted, embeddings, embedding_model) "
+                 "VALUES (:id, 0, :embeddings, :model)"),
+            [
+                {"id": old.hex, "embeddings": pack_vector([1.0, 0.0]), "model": "old-model"},
+                {"id": unnamed.hex, "embeddings": pack_vector([0.0, 1.0]), "model": None},
+                {"id": empty.hex, "embeddings": None, "model": None},
+            ]
+        )
+
+    assert "0005_split_embeddings" in run_migrations(engine)
+    assert run_migrations(engine) == []
+
+    assert vector_rows(engine) == {
+        (old.hex, "old-model"): [1.0, 0.0],
+        (unnamed.hex, ACTIVE_EMBEDDING_MODEL): [0.0, 1.0],
+    }
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM memory WHERE embeddings IS NOT NULL")).scalar() == 0
+        assert np.asarray(conn.execute(
+            select_vectors(Memory.id).where(Memory.id == unnamed)
+        ).one().embeddings).tolist() == [0.0, 1.0]
+
+
+def test_migrations_until():
+    """until 只執行到指定遷移，pgvector 後端據此在轉換列類型之前完成遷移 0005"""
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    names = [name for name, _ in MIGRATIONS]
+
+    assert run_migrations(engine, until="0002_embedding_status") == names[:2]
+    assert run_migrations(engine, until="0002_embedding_status") == []
+    assert run_migrations(engine) == names[2:]
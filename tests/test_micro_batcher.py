@@ -0,0 +1,103 @@
+"""微批處理測試"""
+
+import pytest
+import asyncio
+import numpy as np
+from src.services.micro_batcher import MicroBatcher, EmbeddingQueueFullError
+
+
+class RecordingEncoder:
+    """記錄每次批量調用的模擬 encode"""
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return np.array([[float(len(t)), float(i)] for i, t in enumerate(texts)])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_batched():
+    """並發請求合併為一次 encode"""
+    encoder = RecordingEncoder()
+    batcher = MicroBatcher(encoder, max_batch_size=32, max_wait_ms=20)
+
+    texts = [f"text-{i}" * (i + 1) for i in range(10)]
+    results = await asyncio.gather(*[batcher.submit(t) for t in texts])
+
+    assert len(encoder.calls) == 1
+    assert encoder.calls[0] == texts
+    # 每個調用者拿到自己對應的那一行
+    for text, result in zip(texts, results):
+        assert result[0] == float(len(text))
+
+    batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_max_batch_size_limit():
+    """單批不超過 max_batch_size"""
+    encoder = RecordingEncoder()
+    batcher = MicroBatcher(encoder, max_batch_size=4, max_wait_ms=20)
+
+    await asyncio.gather(*[batcher.submit(f"t{i}") for i in range(10)])
+
+    assert [len(c) for c in encoder.calls] == [4, 4, 2]
+    assert batcher.stats()["items"] == 10
+
+    batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_max_wait_flushes_partial_batch():
+    """等待超時後發送未滿的批次"""
+    encoder = RecordingEncoder()
+    batcher = MicroBatcher(encoder, max_batch_size=32, max_wait_ms=1)
+
+    result = await asyncio.wait_for(batcher.submit("single"), timeout=1.0)
+
+    assert result[0] == 6.0
+    assert encoder.calls == [["single"]]
+
+    batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_encode_error_propagates():
+    """encode 失敗時所有調用者收到異常"""
+    async def failing_encoder(texts):
+        raise RuntimeError("encode failed")
+
+    batcher = MicroBatcher(failing_encoder, max_wait_ms=5)
+
+    results = await asyncio.gather(
+        batcher.submit("a"), batcher.submit("b"), return_exceptions=True
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_backpressure_when_queue_full():
+    """隊列滿時拒絕新請求"""
+    encoder = RecordingEncoder(delay=0.2)
+    batcher = MicroBatcher(
+        encoder,
+        max_batch_size=1,
+        max_wait_ms=0,
+        max_queue_size=1,
+        enqueue_timeout=0.01
+    )
+
+    tasks = [asyncio.create_task(batcher.submit(f"t{i}")) for i in range(4)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert any(isinstance(r, EmbeddingQueueFullError) for r in results)
+    assert batcher.stats()["rejected"] > 0
+
+    batcher.close()
@@ -0,0 +1,54 @@
+"""嵌入模型註冊表測試"""
+
+import pytest
+from src.services.model_registry import (
+    EmbeddingModelRegistry,
+    model_registry,
+    get_embedding_service,
+)
+
+
+@pytest.fixture
+def registry():
+    """創建獨立的註冊表實例"""
+    return EmbeddingModelRegistry(default_model="all-MiniLM-L6-v2")
+
+
+def test_registry_returns_shared_instance(registry):
+    """同一模型名稱返回同一個實例"""
+    service1 = registry.get("all-MiniLM-L6-v2")
+    service2 = registry.get("all-MiniLM-L6-v2")
+
+    assert service1 is service2
+
+
+def test_registry_default_model(registry):
+    """未指定名稱時使用默認模型"""
+    assert registry.get() is registry.get("all-MiniLM-L6-v2")
+
+
+def test_registry_multiple_models(registry):
+    """支持同時註冊多個模型"""
+    service1 = registry.get("all-MiniLM-L6-v2")
+    service2 = registry.get("paraphrase-MiniLM-L3-v2")
+
+    assert service1 is not service2
+    assert service2.model_name == "paraphrase-MiniLM-L3-v2"
+    assert set(registry.loaded_models()) == {
+        "all-MiniLM-L6-v2",
+        "paraphrase-MiniLM-L3-v2"
+    }
+
+
+def test_registry_clear(registry):
+    """清空後重新創建實例"""
+    service1 = registry.get()
+    registry.clear()
+
+    assert registry.loaded_models() == []
+    assert registry.get() is not service1
+
+
+def test_get_embedding_service_dependency():
+    """依賴返回全局註冊表中的默認服務"""
+    assert get_embedding_service() is model_registry.get()
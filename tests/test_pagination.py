@@ -0,0 +1,124 @@
+"""記憶列表鍵集分頁測試"""
+
+import pytest
+from datetime import datetime, timedelta
+from uuid import uuid4
+from src.api import memories as memories_api
+from src.models.models import Agent, Memory
+from src.utils.pagination import encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def workspace(test_db):
+    """創建 25 條記憶，其中 5 條共享同一創建時間，1 條已刪除"""
+    db = test_db.SessionLocal()
+    agent = Agent(id=uuid4(), name=f"page_agent_{uuid4().hex[:8]}", workspace_id=uuid4())
+    db.add(agent)
+
+    base = datetime(2024, 1, 1)
+    memories = []
+    for i in range(25):
+        memory = Memory(
+            id=uuid4(),
+            workspace_id=agent.workspace_id,
+            created_by_agent_id=agent.id,
+            type="knowledge",
+            category="test",
+            content=f"記憶 {i}",
+            created_at=base + timedelta(minutes=min(i, 20)),
+            is_deleted=(i == 3)
+        )
+        memories.append(memory)
+    db.add_all(memories)
+    db.commit()
+
+    expected = sorted(
+        (m for m in memories if not m.is_deleted),
+        key=lambda m: (m.created_at, m.id.hex),
+        reverse=True
+    )
+    headers = {"Authorization": f"Bearer {agent.id}"}
+    yield headers, [str(m.id) for m in expected]
+    db.close()
+
+
+def test_cursor_roundtrip():
+    """游標編碼後解析得到相同的鍵"""
+    created_at = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    memory_id = uuid4()
+
+    assert decode_cursor(encode_cursor(created_at, memory_id)) == (created_at, memory_id)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_keyset_pages_cover_workspace(client, workspace):
+    """逐頁遍歷不重複、不遺漏，同一時間戳的記憶按 id 排序"""
+    headers, expected = workspace
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 7}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/memories", params=params, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        assert len(body["memories"]) <= 7
+        assert body["total"] is None
+        seen.extend(m["id"] for m in body["memories"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == expected
+
+
+def test_total_only_on_request(client, workspace):
+    """只有 include_total 時才計算總數"""
+    headers, expected = workspace
+    response = client.get(
+        "/memories", params={"limit": 5, "include_total": "true"}, headers=headers
+    )
+
+    assert response.json()["total"] == len(expected)
+
+
+def test_page_size_capped(client, workspace, monkeypatch):
+    """超過最大分頁大小時按上限返回"""
+    headers, _ = workspace
+    monkeypatch.setattr(memories_api, "MAX_PAGE_SIZE", 10)
+
+    body = client.get("/memories", params={"limit": 1000}, headers=headers).json()
+
+    assert body["limit"] == 10
+    assert len(body["memories"]) == 10
+    assert body["next_cursor"] is not None
+
+
+def test_invalid_cursor_rejected(client, workspace):
+    """無效游標返回 400"""
+    headers, _ = workspace
+    response = client.get("/memories", params={"cursor": "garbage"}, headers=headers)
+
+    assert response.status_code == 400
+
+
+def test_client_offset_deprecated(client, workspace):
+    """SDK 的 offset 參數仍可用：發出 DeprecationWarning，結果與游標分頁一致"""
+    from src.client import AgentMemClient
+
+    headers, expected = workspace
+    sdk = AgentMemClient(agent_id=headers["Authorization"].split()[-1])
+    sdk._request = lambda method, endpoint, **kwargs: client.request(
+        method, endpoint, headers=headers, **kwargs
+    ).json()
+
+    with pytest.warns(DeprecationWarning):
+        page = sdk.list_memories(limit=5, offset=12)
+    assert [str(m.id) for m in page] == expected[12:17]
+    with pytest.warns(DeprecationWarning):
+        assert [str(m.id) for m in sdk.list_memories(limit=5, offset=0)] == expected[:5]
+    with pytest.warns(DeprecationWarning), pytest.raises(ValueError):
+        sdk.list_memories(limit=5, offset=5, cursor="abc")
+    assert [str(m.id) for m in sdk.iter_memories(page_size=7)] == expected
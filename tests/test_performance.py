@@ -3,6 +3,7 @@
 import pytest
 import asyncio
 import time
+import numpy as np
 from uuid import uuid4
 from src.services.embedding_service import EmbeddingService
 from src.services.search_service import SearchService
@@ -137,3 +138,329 @@ async def test_batch_embedding_efficiency():
     # 批量應該比單個快
     assert elapsed_batch < elapsed_single
     assert len(batch_embeddings) == 50
+
+
+@pytest.mark.asyncio
+async def test_vectorized_search_latency_10k():
+    """測試：10000 個記憶的矩陣化搜索延遲 <200ms"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10000, 384)).astype(np.float32)
+    memories = [MockMemory(i, f"記憶 {i}", vectors[i]) for i in range(10000)]
+
+    class FixedEmbeddingService:
+        async def get_embeddings(self, text):
+            return vectors[0].tolist()
+
+    search_service = SearchService(FixedEmbeddingService())
+
+    start_time = time.time()
+    results = await search_service.semantic_search(
+        "記憶信息",
+        memories,
+        top_k=10
+    )
+    elapsed = time.time() - start_time
+
+    assert elapsed < 0.2  # 200ms
+    assert results[0][0].id == 0
+
+
+@pytest.mark.asyncio
+async def test_hnsw_recall_vs_latency():
+    """測試：HNSW recall@10 與延遲相對精確搜索的權衡"""
+    from src.services.hnsw_index import HNSWIndex
+    from src.utils.embedding import normalize_rows, top_k_indices
+
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal((20, 64))
+    vectors = (centers[rng.integers(0, 20, 3000)]
+               + 0.5 * rng.standard_normal((3000, 64))).astype(np.float32)
+    queries = (centers[rng.integers(0, 20, 50)]
+               + 0.5 * rng.standard_normal((50, 64))).astype(np.float32)
+
+    index = HNSWIndex(64, M=12, ef_construction=80)
+    for i, vector in enumerate(vectors):
+        index.add(i, vector)
+    matrix = normalize_rows(vectors)
+
+    start_time = time.perf_counter()
+    exact = [
+        set(top_k_indices(matrix @ normalize_rows(q.reshape(1, -1))[0], 10).tolist())
+        for q in queries
+    ]
+    exact_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+
+    print(f"\nexact: {exact_ms:.3f} ms/query")
+    recalls = {}
+    for ef in (10, 32, 64, 128):
+        start_time = time.perf_counter()
+        found = [{label for label, _ in index.search(q, 10, ef=ef)} for q in queries]
+        ann_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+        recalls[ef] = sum(len(f & e) / 10 for f, e in zip(found, exact)) / len(queries)
+        print(f"ef_search={ef}: recall@10={recalls[ef]:.3f}, {ann_ms:.3f} ms/query")
+
+    # ef_search 越大 recall 越高
+    assert recalls[128] >= recalls[10]
+    assert recalls[64] >= 0.9
+
+
+
+@pytest.mark.asyncio
+async def test_pq_recall_vs_memory():
+    """測試：PQ 索引的總內存壓縮比和精確重排後相對 cosine_similarity 排序的 recall@10
+
+    兩邊都計算索引的總內存：完整索引是 float32 矩陣加每條目的 ID 和元數據開銷，
+    PQ 索引（nbytes）是編碼、ID、元數據編碼列、ID 映射和碼本。
+    """
+    from src.services.product_quantizer import ProductQuantizer
+    from src.services.vector_index import (
+        ENTRY_OVERHEAD_BYTES, PQ_DEFAULT_BYTES_RATIO, PQWorkspaceIndex, WorkspaceVectorIndex
+    )
+
+    # 碼本是每個工作區的固定開銷（384 維約 384 KB）
+    dim, n = 384, 20000
+    rng = np.random.default_rng(2)
+    centers = rng.standard_normal((100, dim))
+    vectors = (centers[rng.integers(0, 100, n)]
+               + 0.7 * rng.standard_normal((n, dim))).astype(np.float32)
+    queries = (centers[rng.integers(0, 100, 10)]
+               + 0.7 * rng.standard_normal((10, dim))).astype(np.float32)
+
+    ids = [uuid4() for _ in range(n)]
+    rows = {memory_id: i for i, memory_id in enumerate(ids)}
+    metadata = {"type": "knowledge", "visibility": "private", "created_by_agent_id": uuid4()}
+    full = WorkspaceVectorIndex(uuid4())
+    for memory_id, vector in zip(ids, vectors):
+        full.upsert(memory_id, vector, metadata)
+    start_time = time.perf_counter()
+    quantizer = ProductQuantizer(dim, subvectors=dim // PQ_DEFAULT_BYTES_RATIO).train(vectors)
+    train_s = time.perf_counter() - start_time
+
+    # 完整索引不計擴容留下的空閒行，按它最緊湊的情況比較
+    full_bytes = full.matrix.nbytes + len(full) * ENTRY_OVERHEAD_BYTES
+    pq = PQWorkspaceIndex.from_index(full, quantizer)
+    pq_bytes = pq.nbytes
+    print(f"\ntrain: {train_s:.2f} s, full index: {full_bytes} B, PQ index: {pq_bytes} B "
+          f"({full_bytes / pq_bytes:.1f}x; codes {pq.codes.nbytes} B, codebooks {quantizer.nbytes} B)")
+
+    # 精確排序：逐條 cosine_similarity
+    exact = [
+        set(sorted(range(n), key=lambda i: -SearchService.cosine_similarity(q, vectors[i]))[:10])
+        for q in queries
+    ]
+    recalls = {}
+    for factor in (1, 4, 16):
+        index = PQWorkspaceIndex.from_index(full, quantizer, rerank_factor=factor)
+        start_time = time.perf_counter()
+        found = []
+        for q in queries:
+            candidates = index.shortlist(q, 10, -1.0)
+            rescored = sorted(
+                (rows[memory_id] for memory_id in candidates),
+                key=lambda i: -SearchService.cosine_similarity(q, vectors[i])
+            )
+            found.append(set(rescored[:10]))
+        pq_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+        recalls[factor] = sum(len(f & e) / 10 for f, e in zip(found, exact)) / len(queries)
+        print(f"rerank_factor={factor}: recall@10={recalls[factor]:.3f}, {pq_ms:.3f} ms/query")
+
+    # 默認編碼大小下總內存至少縮小 16 倍（包括 ID、元數據和碼本）；重排候選越多 recall 越高
+    assert full_bytes / pq_bytes >= 16
+    assert recalls[16] >= recalls[4] >= recalls[1]
+    assert recalls[16] >= 0.9
+
+@pytest.mark.asyncio
+async def test_async_session_concurrency(tmp_path):
+    """測試：1 / 16 / 128 並發客戶端下同步會話與異步會話的吞吐量
+
+    每次查詢通過 SQLite 自定義函數 sleep_ms 模擬 5ms 的數據庫往返。
+    同步會話在事件循環內阻塞，並發請求只能排隊；
+    異步會話在等待數據庫時讓出事件循環，吞吐量隨並發增長。
+    """
+    import httpx
+    from fastapi import FastAPI
+    from sqlalchemy import create_engine, event, text
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    io_latency_ms = 5
+    db_path = tmp_path / "concurrency.db"
+    sync_engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+
+    def register_sleep(dbapi_connection, connection_record):
+        dbapi_connection.create_function(
+            "sleep_ms", 1, lambda ms: time.sleep(ms / 1000) or ms
+        )
+
+    event.listen(sync_engine, "connect", register_sleep)
+    event.listen(async_engine.sync_engine, "connect", register_sleep)
+    SyncSession = sessionmaker(bind=sync_engine)
+    AsyncSession = async_sessionmaker(async_engine)
+    query = text("SELECT sleep_ms(:ms)")
+
+    app = FastAPI()
+
+    @app.get("/sync")
+    async def sync_route():
+        # 遷移前的寫法：async 路由裡使用同步會話
+        with SyncSession() as db:
+            return {"value": db.execute(query, {"ms": io_latency_ms}).scalar()}
+
+    @app.get("/async")
+    async def async_route():
+        async with AsyncSession() as db:
+            return {"value": (await db.execute(query, {"ms": io_latency_ms})).scalar()}
+
+    async def throughput(client, path, concurrency, requests_per_client=4):
+        async def worker():
+            for _ in range(requests_per_client):
+                response = await client.get(path)
+                assert response.status_code == 200
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+        return concurrency * requests_per_client / elapsed
+
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        # 預熱，排除首次請求的一次性開銷
+        await throughput(client, "/async", 128, requests_per_client=1)
+        print("\nclients  sync(req/s)  async(req/s)")
+        for concurrency in (1, 16, 128):
+            sync_rps = await throughput(client, "/sync", concurrency)
+            async_rps = await throughput(client, "/async", concurrency)
+            results[concurrency] = (sync_rps, async_rps)
+            print(f"{concurrency:>7}  {sync_rps:>11.1f}  {async_rps:>12.1f}")
+
+    await async_engine.dispose()
+    sync_engine.dispose()
+
+    # 同步會話的吞吐量受限於單次往返時間，不隨並發增長
+    assert results[128][0] < 1000 / io_latency_ms * 1.2
+    # 高並發下異步會話明顯更快
+    assert results[128][1] > results[128][0] * 2
+
+
+@pytest.mark.asyncio
+async def test_batch_permission_check_wide_shares():
+    """測試：記憶共享給數千個 Agent 時，批量權限判定與逐條檢查的耗時"""
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from src.db.database import Base
+    from src.models.models import Agent, Memory, memory_shared_agents
+    from src.core.permissions import PermissionManager
+
+    num_memories, num_agents = 20, 2000
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    workspace_id = uuid4()
+    agent_ids = [uuid4() for _ in range(num_agents)]
+    memory_ids = [uuid4() for _ in range(num_memories)]
+    owner_id = agent_ids[0]
+    reader_id = agent_ids[-1]
+    with engine.begin() as conn:
+        conn.execute(insert(Agent), [
+            {"id": agent_id, "name": f"agent_{i}", "workspace_id": workspace_id}
+            for i, agent_id in enumerate(agent_ids)
+        ])
+        conn.execute(insert(Memory), [
+            {"id": memory_id, "workspace_id": workspace_id, "created_by_agent_id": owner_id,
+             "content": f"記憶 {i}", "visibility": "private", "is_deleted": False}
+            for i, memory_id in enumerate(memory_ids)
+        ])
+        conn.execute(insert(memory_shared_agents), [
+            {"memory_id": memory_id, "agent_id": agent_id}
+            for memory_id in memory_ids for agent_id in agent_ids[1:]
+        ])
+
+    db = sessionmaker(bind=engine)()
+
+    # 原有的逐條寫法：每條記憶兩次查詢，並載入完整的共享列表
+    start_time = time.perf_counter()
+    reader = db.query(Agent).filter(Agent.id == reader_id).first()
+    per_row = {}
+    for memory_id in memory_ids:
+        memory = db.query(Memory).filter(Memory.id == memory_id).first()
+        per_row[memory_id] = reader in memory.shared_with_agents
+    per_row_ms = (time.perf_counter() - start_time) * 1000
+    db.expunge_all()
+
+    start_time = time.perf_counter()
+    batch = await PermissionManager.can_read_many(reader_id, memory_ids, db)
+    batch_ms = (time.perf_counter() - start_time) * 1000
+    db.close()
+
+    print(f"\n{num_memories} memories x {num_agents} shares: "
+          f"per-row {per_row_ms:.1f} ms, can_read_many {batch_ms:.1f} ms")
+    assert batch == per_row
+    assert all(batch.values())
+    assert batch_ms < per_row_ms
+
+
+@pytest.mark.asyncio
+async def test_column_profile_bytes_10k():
+    """測試：10k 條記憶的工作區中，列表頁和索引構建按列配置讀取的字節數
+
+    先按遷移前的行格式（向量在 memory 行上）統計，再執行向量分表遷移後統計。
+    字節數按驅動返回的原始值統計（BLOB/文本長度，數值和時間按 8 字節）。
+    """
+    from datetime import datetime, timedelta
+    from sqlalchemy import create_engine, insert, select
+    from sqlalchemy.pool import StaticPool
+    from src.db.database import Base
+    from src.db.migrations import _split_embeddings
+    from src.models.models import Memory, MEMORY_LIGHT, memory_columns, select_vectors
+    from src.api.memories import MAX_PAGE_SIZE
+
+    num_memories, dim = 10000, 384
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    workspace_id, agent_id = uuid4(), uuid4()
+    rng = np.random.default_rng(0)
+    start = datetime(2024, 1, 1)
+    # Core 插入按列名取值：embeddings 即遷移前的向量列
+    with engine.begin() as conn:
+        conn.execute(insert(Memory), [
+            {"id": uuid4(), "workspace_id": workspace_id, "created_by_agent_id": agent_id,
+             "type": "knowledge", "category": "test", "content": f"記憶內容 {i} " * 10,
+             "visibility": "private", "is_deleted": False, "embedding_status": "ready",
+             "created_at": start + timedelta(seconds=i),
+             "embeddings": rng.standard_normal(dim).astype(np.float32)}
+            for i in range(num_memories)
+        ])
+
+    def bytes_read(statement):
+        sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+        total = 0
+        with engine.connect() as conn:
+            for row in conn.exec_driver_sql(sql):
+                total += sum(
+                    len(value) if isinstance(value, (bytes, str)) else 8
+                    for value in row if value is not None
+                )
+        return total
+
+    live = (Memory.workspace_id == workspace_id, Memory.is_deleted == False)
+    page = select(Memory).where(*live).order_by(
+        Memory.created_at.desc(), Memory.id.desc()
+    ).limit(MAX_PAGE_SIZE)
+    full_page = bytes_read(page)
+    full_build = bytes_read(select(Memory).where(*live, Memory.legacy_embeddings != None))
+
+    with engine.begin() as conn:
+        _split_embeddings(conn)
+    split_page = bytes_read(page)
+    light_page = bytes_read(page.options(*MEMORY_LIGHT))
+    vector_build = bytes_read(select_vectors(*memory_columns("vector")).where(*live))
+
+    print(f"\nlist page ({MAX_PAGE_SIZE} of {num_memories}): full {full_page / 1024:.1f} KiB, "
+          f"split {split_page / 1024:.1f} KiB, light {light_page / 1024:.1f} KiB")
+    print(f"index build ({num_memories}): "
+          f"full {full_build / 1024:.1f} KiB, vector {vector_build / 1024:.1f} KiB")
+    # 列表頁不再讀取嵌入：每行少 dim * 4 字節
+    assert full_page - split_page >= MAX_PAGE_SIZE * dim * 4
+    assert light_page <= split_page
+    assert vector_build < full_build
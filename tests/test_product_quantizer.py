@@ -0,0 +1,186 @@
+"""乘積量化索引測試"""
+
+import pytest
+import numpy as np
+from uuid import uuid4
+from src.services.product_quantizer import ProductQuantizer
+from src.services.search_service import SearchService
+from src.models.models import Agent, Memory
+from src.services import vector_index
+from src.services.vector_index import (
+    ID_DTYPE, CompactPositions, PQWorkspaceIndex, VectorIndexManager, WorkspaceVectorIndex
+)
+from src.utils.embedding import normalize_rows, top_k_indices
+
+DIM = 32
+
+
+@pytest.fixture
+def dataset():
+    """圍繞 20 個中心的 1000 個 32 維向量"""
+    rng = np.random.default_rng(5)
+    centers = rng.standard_normal((20, DIM))
+    return (centers[rng.integers(0, 20, 1000)] + 0.3 * rng.standard_normal((1000, DIM))).astype(np.float32)
+
+
+@pytest.fixture
+def quantizer(dataset):
+    return ProductQuantizer(DIM, subvectors=8, iterations=10).train(dataset)
+
+
+def test_encode_and_decode(quantizer, dataset):
+    """編碼為每個子空間一個字節，重建向量接近原向量"""
+    codes = quantizer.encode(dataset)
+    assert codes.shape == (1000, 8) and codes.dtype == np.uint8
+
+    decoded = quantizer.decode(codes)
+    cosine = (normalize_rows(decoded) * normalize_rows(dataset)).sum(axis=1)
+    assert cosine.mean() > 0.9
+
+
+def test_adc_matches_reconstruction(quantizer, dataset):
+    """ADC 分數等於查詢與重建向量的內積"""
+    codes = quantizer.encode(dataset[:50])
+    query = np.random.default_rng(1).standard_normal(DIM)
+
+    expected = quantizer.decode(codes) @ normalize_rows(query.reshape(1, -1))[0]
+    assert np.allclose(quantizer.adc_scores(query, codes), expected, atol=1e-5)
+
+
+def test_uneven_subspaces_and_small_samples():
+    """維度不能整除子空間數、樣本少於聚類數時仍可訓練"""
+    vectors = np.random.default_rng(2).standard_normal((10, 10)).astype(np.float32)
+    quantizer = ProductQuantizer(10, subvectors=3).train(vectors)
+
+    assert [codebook.shape for codebook in quantizer.codebooks] == [(10, 4), (10, 3), (10, 3)]
+    assert quantizer.decode(quantizer.encode(vectors)).shape == (10, 10)
+    with pytest.raises(ValueError):
+        ProductQuantizer(10, subvectors=3).encode(vectors)
+    with pytest.raises(ValueError):
+        ProductQuantizer(10, subvectors=11)
+
+
+def test_save_and_load(quantizer, dataset, tmp_path):
+    path = str(tmp_path / "pq.npz")
+    quantizer.save(path)
+    loaded = ProductQuantizer.load(path)
+
+    assert loaded.subvectors == quantizer.subvectors
+    assert np.array_equal(loaded.encode(dataset), quantizer.encode(dataset))
+
+
+def full_index(dataset):
+    index = WorkspaceVectorIndex(uuid4())
+    ids = [uuid4() for _ in dataset]
+    for memory_id, vector in zip(ids, dataset):
+        index.upsert(memory_id, vector, {"type": "knowledge", "visibility": "private"})
+    return index, ids
+
+
+def test_workspace_index_shortlist_recall(quantizer, dataset):
+    """PQ 索引的候選包含精確前 10（重排後 recall@10 >= 0.9），總內存（含 ID、元數據和碼本）小於完整索引的 1/3"""
+    index, ids = full_index(dataset)
+    compressed = PQWorkspaceIndex.from_index(index, quantizer, rerank_factor=8)
+    matrix = normalize_rows(dataset)
+
+    recall = 0.0
+    queries = np.random.default_rng(3).standard_normal((20, DIM))
+    for query in queries:
+        exact = {ids[i] for i in top_k_indices(matrix @ normalize_rows(query.reshape(1, -1))[0], 10)}
+        candidates = compressed.shortlist(query, 10, -1.0)
+        assert len(candidates) == 80
+        rescored = sorted(candidates, key=lambda i: -SearchService.cosine_similarity(query, dataset[ids.index(i)]))
+        recall += len(exact & set(rescored[:10])) / 10
+    assert recall / len(queries) >= 0.9
+    assert index.matrix.nbytes / compressed.codes.nbytes == 16
+    # 每行 65 字節：8 字節編碼、16 字節 ID、20 字節 ID 映射、4 個 int32 元數據編碼和權限列，
+    # 另有取值字典的少量固定開銷
+    assert (compressed.nbytes - quantizer.nbytes) / len(compressed) < 70
+    assert compressed.nbytes < index.nbytes / 3
+
+
+def test_workspace_index_updates(quantizer, dataset):
+    """新寫入用已有碼本編碼，刪除把最後一行移到被刪除的位置"""
+    index, ids = full_index(dataset[:10])
+    compressed = PQWorkspaceIndex.from_index(index, quantizer)
+    new_id = uuid4()
+    compressed.upsert(new_id, dataset[500], {"type": "preference", "visibility": "public"})
+    compressed.remove(ids[0])
+
+    assert len(compressed) == 10
+    assert compressed.ids == [new_id] + ids[1:]
+    assert ids[0] not in compressed and new_id in compressed
+    assert np.array_equal(compressed.codes[0], quantizer.encode(dataset[500:501])[0])
+    assert compressed.selectivity({"type": "preference"}) == pytest.approx(0.1)
+    assert compressed.shortlist(dataset[500], 1, 0.5, filters={"type": "preference"}) == [new_id]
+    with pytest.raises(ValueError):
+        compressed.upsert(uuid4(), np.ones(DIM + 1))
+
+
+def test_compact_positions():
+    """排序數組、小字典和批次中的條目查找一致，刪除後重新加入的 ID 指向新行"""
+    positions = CompactPositions()
+    bulk = [uuid4() for _ in range(3000)]
+    positions.extend(np.array([m.bytes for m in bulk], dtype=ID_DTYPE), np.arange(3000))
+    added = [uuid4() for _ in range(CompactPositions.MIN_RECENT + 1)]
+    for row, memory_id in enumerate(added, 3000):
+        positions[memory_id] = row
+
+    assert len(positions) == 3000 + len(added)
+    assert positions.get(bulk[10]) == 10 and positions.get(added[-1]) == 3000 + len(added) - 1
+    assert positions.pop(bulk[10]) == 10 and bulk[10] not in positions
+    positions[bulk[10]] = 7
+    positions[bulk[11]] = 8
+    assert (positions.get(bulk[10]), positions.get(bulk[11])) == (7, 8)
+    assert positions.get(uuid4()) is None and positions.pop(uuid4()) is None
+    assert positions.nbytes < len(positions) * 32
+
+
+@pytest.fixture
+def pq_workspace(test_db, dataset):
+    """數據庫中 1000 條帶向量的記憶"""
+    db = test_db.SessionLocal()
+    workspace_id = uuid4()
+    owner = Agent(id=uuid4(), name=f"pq_{workspace_id.hex[:8]}", workspace_id=workspace_id)
+    db.add(owner)
+    db.add_all([
+        Memory(
+            id=uuid4(), workspace_id=workspace_id, created_by_agent_id=owner.id,
+            type="knowledge", category="pq", content=f"pq {i}", visibility="private",
+            embeddings=vector.tolist()
+        )
+        for i, vector in enumerate(dataset)
+    ])
+    db.commit()
+    yield workspace_id, db
+    db.close()
+
+
+def test_manager_compresses_and_persists_codebooks(pq_workspace, tmp_path, monkeypatch):
+    """向量數達到 pq_min_vectors 的工作區從數據庫流式編碼為 PQ 索引（不構建完整索引），
+    碼本寫入 persist_dir 後不再重新訓練"""
+    workspace_id, db = pq_workspace
+    manager = VectorIndexManager(
+        pq_min_vectors=500, pq_params={"subvectors": 8, "iterations": 5},
+        persist_dir=str(tmp_path), ann_min_vectors=100
+    )
+
+    def no_full_build(workspace_id, db):
+        raise AssertionError("PQ 工作區不應先構建完整索引")
+
+    monkeypatch.setattr(VectorIndexManager, "build", staticmethod(no_full_build))
+    monkeypatch.setattr(vector_index, "PQ_BUILD_CHUNK_SIZE", 128)
+    compressed = manager.get(workspace_id, db)
+    assert isinstance(compressed, PQWorkspaceIndex) and compressed.ann is None
+    assert len(compressed) == 1000 and compressed.codes.shape == (1000, 8)
+    assert compressed.selectivity({"category": "pq"}) == 1.0
+    assert manager.stats()["pq_workspaces"] == 1
+    assert manager.persist() == [workspace_id]
+
+    def no_training(self, vectors):
+        raise AssertionError("碼本應從磁盤載入")
+
+    monkeypatch.setattr(ProductQuantizer, "train", no_training)
+    manager.invalidate()
+    reloaded = manager.get(workspace_id, db)
+    assert np.array_equal(reloaded.codes, compressed.codes)
@@ -0,0 +1,124 @@
+"""查詢規劃器測試"""
+
+import pytest
+import numpy as np
+from uuid import uuid4
+from src.services.query_planner import (
+    QueryPlanner, STRATEGY_SCAN, STRATEGY_EXACT, STRATEGY_ANN
+)
+from src.services.search_service import SearchService
+from src.services.vector_index import WorkspaceVectorIndex
+from src.services.hnsw_index import HNSWIndex
+from src.utils.timing import StageTimer
+
+
+class FixedEmbeddingService:
+    """返回固定查詢向量的嵌入服務"""
+    def __init__(self, vector):
+        self.vector = vector
+
+    async def get_embeddings(self, text):
+        return list(self.vector)
+
+
+class IndexedMemory:
+    """search_index 讀取的最小記憶對象"""
+    def __init__(self, memory_id, embeddings, type):
+        self.id = memory_id
+        self.embeddings = embeddings
+        self.type = type
+
+
+@pytest.fixture
+def planner():
+    return QueryPlanner()
+
+
+def test_small_workspace_uses_exact(planner):
+    """小工作區即使有 ANN 索引也精確評分"""
+    plan = planner.plan(1000, 1.0, 10, ann_ef=50)
+
+    assert plan.strategy == STRATEGY_EXACT
+    assert plan.estimated_costs[STRATEGY_EXACT] < plan.estimated_costs[STRATEGY_ANN]
+
+
+def test_large_workspace_uses_ann(planner):
+    """大工作區在掛載 ANN 索引時走近似搜索"""
+    assert planner.plan(200000, 1.0, 10, ann_ef=50).strategy == STRATEGY_ANN
+    # 未掛載 ANN 索引時只能精確評分
+    plan = planner.plan(200000, 1.0, 10)
+    assert plan.strategy == STRATEGY_EXACT
+    assert plan.to_dict()["estimated_costs"][STRATEGY_ANN] is None
+
+
+def test_tight_filter_uses_scan(planner):
+    """過濾條件很嚴格時直接掃描"""
+    plan = planner.plan(200000, 0.001, 10, filtered=True, ann_ef=50)
+
+    assert plan.strategy == STRATEGY_SCAN
+    assert plan.estimated_rows == 200
+    # 選擇率低時 ANN 需要放大 ef，代價高於掃描
+    assert plan.estimated_costs[STRATEGY_ANN] > plan.estimated_costs[STRATEGY_SCAN]
+
+
+def test_large_limit_avoids_ann(planner):
+    """limit 接近工作區規模時 ANN 不可用"""
+    plan = planner.plan(60000, 1.0, 60000, ann_ef=50)
+
+    assert plan.strategy == STRATEGY_EXACT
+
+
+def test_index_selectivity_tracks_updates():
+    """取值計數隨增刪改同步"""
+    index = WorkspaceVectorIndex(uuid4())
+    ids = [uuid4() for _ in range(4)]
+    for i, memory_id in enumerate(ids):
+        index.upsert(memory_id, [1.0, float(i)], {"type": "fact" if i == 0 else "knowledge"})
+
+    assert index.selectivity({"type": "fact"}) == 0.25
+    assert index.selectivity() == 1.0
+
+    index.upsert(ids[1], [1.0, 1.0], {"type": "fact"})
+    assert index.selectivity({"type": "fact"}) == 0.5
+
+    index.remove(ids[0])
+    assert index.selectivity({"type": "fact"}) == pytest.approx(1 / 3)
+    assert index.filter_mask({"type": "fact"}).tolist() == [False, True, False]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_ann", [False, True])
+async def test_filtered_index_search(use_ann):
+    """精確和 ANN 路徑都只返回滿足過濾條件的記憶"""
+    rng = np.random.default_rng(11)
+    index = WorkspaceVectorIndex(uuid4())
+    memories = {}
+    for i in range(300):
+        memory = IndexedMemory(
+            uuid4(), rng.standard_normal(16).astype(np.float32),
+            "fact" if i % 10 == 0 else "knowledge"
+        )
+        memories[memory.id] = memory
+        index.upsert(memory.id, memory.embeddings, {"type": memory.type})
+    if use_ann:
+        index.attach_ann(HNSWIndex(16, M=8, ef_construction=64))
+
+    expected = [m for m in memories.values() if m.type == "fact"][:1]
+    search_service = SearchService(FixedEmbeddingService(expected[0].embeddings))
+    timer = StageTimer()
+
+    results = await search_service.search_index(
+        "query",
+        index,
+        lambda ids: [memories[i] for i in ids],
+        top_k=5,
+        similarity_threshold=-1.0,
+        use_ann=use_ann,
+        filters={"type": "fact"},
+        timer=timer
+    )
+
+    assert len(results) == 5
+    assert results[0][0] is expected[0]
+    assert all(memory.type == "fact" for memory, _ in results)
+    assert set(timer.as_dict()) == {"query_embedding", "scoring", "db_fetch", "top_k"}
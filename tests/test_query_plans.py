@@ -0,0 +1,170 @@
+"""熱點查詢的執行計劃回歸測試
+
+對 memories/search API 使用的查詢運行 EXPLAIN，任何一條退化為
+memory 或 memory_embedding 表的全表掃描即失敗。SQLite 總是運行；設置 TEST_POSTGRES_URL
+時同時檢查 PostgreSQL（關閉 enable_seqscan，小表上也能看出是否有可用索引）。
+"""
+
+import os
+import re
+import pytest
+from datetime import datetime
+from sqlalchemy import Column, and_, bindparam, create_engine, func, or_, select, text
+from sqlalchemy.sql import visitors
+from sqlalchemy.pool import StaticPool
+from uuid import uuid4
+from src.db.database import Base
+from src.db.migrations import HOT_PATH_COLUMNS, run_migrations
+from src.models.models import (
+    HOT_PATH_INDEXES, MEMORY_LIGHT, Memory, has_embedding, memory_columns, memory_shared_agents,
+    select_vectors
+)
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+def hot_queries():
+    """與 API 中的查詢形狀一致的語句：{名稱: (語句, 是否要求不排序)}"""
+    workspace_id, agent_id, memory_id = uuid4(), uuid4(), uuid4()
+    live = and_(Memory.workspace_id == workspace_id, Memory.is_deleted == False)
+    searchable = and_(live, has_embedding())
+    newest_first = (Memory.created_at.desc(), Memory.id.desc())
+    after_cursor = or_(
+        Memory.created_at < datetime(2024, 1, 1),
+        and_(Memory.created_at == datetime(2024, 1, 1), Memory.id < memory_id)
+    )
+    return {
+        "list_first_page": (
+            select(Memory).options(*MEMORY_LIGHT).where(live)
+            .order_by(*newest_first).limit(51),
+            True
+        ),
+        "list_after_cursor": (
+            select(Memory).options(*MEMORY_LIGHT).where(live, after_cursor)
+            .order_by(*newest_first).limit(51),
+            True
+        ),
+        "list_total": (select(func.count(Memory.id)).where(live), False),
+        "search_scan": (
+            select(Memory).where(searchable, or_(
+                Memory.created_by_agent_id == agent_id,
+                Memory.visibility == "public",
+                Memory.id.in_([memory_id])
+            )),
+            False
+        ),
+        "index_build": (
+            select_vectors(*memory_columns("vector")).where(live),
+            False
+        ),
+        "stats_searchable": (select(func.count(Memory.id)).where(searchable), False),
+        "stats_status": (
+            select(Memory.embedding_status, func.count(Memory.id))
+            .where(live, Memory.embedding_status.in_(["pending", "failed"]))
+            .group_by(Memory.embedding_status),
+            False
+        ),
+        "pending_unscored": (
+            select(func.count(Memory.id)).where(
+                live, Memory.embedding_status == "pending", ~has_embedding()
+            ),
+            False
+        ),
+        "shared_with_me": (
+            select(Memory).options(*MEMORY_LIGHT)
+            .join(memory_shared_agents, memory_shared_agents.c.memory_id == Memory.id)
+            .where(memory_shared_agents.c.agent_id == agent_id, Memory.is_deleted == False)
+            .order_by(*newest_first).limit(51),
+            False
+        ),
+    }
+
+
+def compile_literal(statement, engine):
+    return str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def sqlite_plan(engine, statement):
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + compile_literal(statement, engine))
+        return [row[-1] for row in rows]
+
+
+def postgres_plan(engine, statement):
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_seqscan = off"))
+        rows = conn.exec_driver_sql("EXPLAIN " + compile_literal(statement, engine))
+        return [row[0] for row in rows]
+
+
+@pytest.fixture(scope="module")
+def sqlite_engine():
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.mark.parametrize("name", list(hot_queries()))
+def test_sqlite_hot_paths_use_indexes(sqlite_engine, name):
+    statement, ordered = hot_queries()[name]
+    plan = sqlite_plan(sqlite_engine, statement)
+
+    full_scans = [line for line in plan if re.match(r"SCAN (TABLE )?memory(_embedding)?\b", line)]
+    assert not full_scans, f"{name}: {plan}"
+    if ordered:
+        assert not any("TEMP B-TREE" in line for line in plan), f"{name}: {plan}"
+
+
+def test_migration_creates_hot_path_indexes():
+    """已有數據庫通過遷移獲得同樣的索引（包括部分索引條件）"""
+    engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    names = [index.name for index in HOT_PATH_INDEXES]
+
+    def index_sql(conn):
+        return dict(conn.execute(
+            text("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name IN :names")
+            .bindparams(bindparam("names", expanding=True)),
+            {"names": names}
+        ).fetchall())
+
+    with engine.begin() as conn:
+        expected = index_sql(conn)
+        for name in names:
+            conn.execute(text(f"DROP INDEX {name}"))
+
+    assert "0004_hot_path_indexes" in run_migrations(engine)
+    with engine.connect() as conn:
+        assert index_sql(conn) == expected
+    assert len(expected) == len(names)
+
+
+def test_hot_path_columns_match_indexes():
+    """遷移檢查的列正好是熱點索引的鍵列和部分索引條件引用的列"""
+    columns = set()
+    for index in HOT_PATH_INDEXES:
+        columns.update(column.name for column in index.columns)
+        for options in index.dialect_options.values():
+            if options.get("where") is not None:
+                columns.update(
+                    element.name for element in visitors.iterate(options["where"])
+                    if isinstance(element, Column)
+                )
+    assert HOT_PATH_COLUMNS == columns
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="未設置 TEST_POSTGRES_URL")
+@pytest.mark.parametrize("name", list(hot_queries()))
+def test_postgres_hot_paths_use_indexes(name):
+    engine = create_engine(POSTGRES_URL)
+    Base.metadata.create_all(bind=engine)
+    statement, ordered = hot_queries()[name]
+    plan = postgres_plan(engine, statement)
+    engine.dispose()
+
+    assert not any(
+        re.search(r"Seq Scan on memory(_embedding)?\b", line) for line in plan
+    ), f"{name}: {plan}"
+    if ordered:
+        assert not any(line.strip().startswith("Sort") or "-> Sort" in line for line in plan), \
+            f"{name}: {plan}"
@@ -2,8 +2,10 @@
 
 import pytest
 import asyncio
+import numpy as np
 from src.services.embedding_service import EmbeddingService
 from src.services.search_service import SearchService
+from src.utils.embedding import top_k_indices
 
 
 @pytest.fixture
@@ -138,3 +140,56 @@ async def test_zero_norm_vectors(search_service):
 
     similarity = SearchService.cosine_similarity(vec, zero_vec)
     assert similarity == 0.0
+
+
+class FixedEmbeddingService:
+    """返回固定查詢向量的嵌入服務"""
+    def __init__(self, vector):
+        self.vector = vector
+
+    async def get_embeddings(self, text):
+        return list(self.vector)
+
+
+def reference_search(query_vec, memories, top_k, similarity_threshold):
+    """逐條計算並全排序的參考實現"""
+    results = []
+    for memory in memories:
+        if memory.embeddings is not None and len(memory.embeddings) > 0:
+            score = SearchService.cosine_similarity(query_vec, memory.embeddings)
+            if score >= similarity_threshold:
+                results.append((memory, score))
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results[:top_k]
+
+
+@pytest.mark.asyncio
+async def test_vectorized_search_matches_reference():
+    """矩陣化搜索與逐條計算結果一致"""
+    rng = np.random.default_rng(42)
+    query_vec = rng.standard_normal(64).tolist()
+    vectors = rng.standard_normal((2000, 64)).astype(np.float32)
+    # 加入零向量、重複向量和空嵌入
+    vectors[10] = 0.0
+    vectors[20] = vectors[30]
+    memories = [MockMemory(i, f"m{i}", vectors[i].tolist()) for i in range(2000)]
+    memories.append(MockMemory(2000, "no embedding", None))
+
+    search_service = SearchService(FixedEmbeddingService(query_vec))
+    for top_k, threshold in [(10, 0.0), (50, 0.1), (5000, -1.0)]:
+        results = await search_service.semantic_search(
+            "query", memories, top_k=top_k, similarity_threshold=threshold
+        )
+        expected = reference_search(query_vec, memories, top_k, threshold)
+
+        assert [r[0].id for r in results] == [e[0].id for e in expected]
+        assert [r[1] for r in results] == [e[1] for e in expected]
+
+
+def test_top_k_indices_ties_keep_input_order():
+    """分數相同時保持原始順序"""
+    scores = np.array([0.5, 0.9, 0.5, 0.5, 0.1], dtype=np.float32)
+
+    assert top_k_indices(scores, 3).tolist() == [1, 0, 2]
+    assert top_k_indices(scores, 10).tolist() == [1, 0, 2, 3, 4]
+    assert top_k_indices(scores, 0).tolist() == []
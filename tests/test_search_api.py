@@ -1,31 +1,36 @@
 """搜索 API 測試"""
 
+import os
+import tempfile
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
 from uuid import uuid4
 from src.main import app
 from src.db.database import Base, get_db
 from src.models.models import Agent, Memory
 
-# 使用內存 SQLite 數據庫進行測試
-SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
+# API 走異步會話、測試數據用同步會話寫入，兩個引擎共享同一個臨時 SQLite 文件
+SQLALCHEMY_TEST_DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "search_api.db")
 
 engine = create_engine(
-    SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False}
+    f"sqlite:///{SQLALCHEMY_TEST_DATABASE_PATH}", connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{SQLALCHEMY_TEST_DATABASE_PATH}", poolclass=NullPool
+)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
 
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -0,0 +1,187 @@
+"""權限感知搜索範圍測試"""
+
+import pytest
+from uuid import uuid4
+from src.main import app
+from src.api import search as search_api
+from src.models.models import Agent, Memory
+from src.services.access_sets import AccessSetManager, get_access_set_manager
+from src.services.model_registry import get_embedding_service
+from src.services.vector_index import (
+    PUBLIC_SCOPE, VectorIndexManager, WorkspaceVectorIndex, get_vector_index_manager
+)
+
+
+class FixedEmbeddingService:
+    async def get_embeddings(self, text):
+        return [1.0, 0.0]
+
+
+@pytest.fixture
+def data(test_db):
+    """兩個工作區：reader 和 teammate 在 home，outsider 在 other"""
+    db = test_db.SessionLocal()
+    home, other = uuid4(), uuid4()
+    reader = Agent(id=uuid4(), name=f"reader_{uuid4().hex[:8]}", workspace_id=home)
+    teammate = Agent(id=uuid4(), name=f"teammate_{uuid4().hex[:8]}", workspace_id=home)
+    outsider = Agent(id=uuid4(), name=f"outsider_{uuid4().hex[:8]}", workspace_id=other)
+    db.add_all([reader, teammate, outsider])
+
+    def memory(creator, content, visibility):
+        return Memory(
+            id=uuid4(), workspace_id=creator.workspace_id, created_by_agent_id=creator.id,
+            type="knowledge", category="test", content=content,
+            visibility=visibility, embeddings=[1.0, 0.0]
+        )
+
+    memories = {
+        "own": memory(reader, "own", "private"),
+        "teammate_private": memory(teammate, "teammate_private", "private"),
+        "teammate_shared": memory(teammate, "teammate_shared", "shared"),
+        "outsider_private": memory(outsider, "outsider_private", "private"),
+        "outsider_shared": memory(outsider, "outsider_shared", "shared"),
+        "outsider_public": memory(outsider, "outsider_public", "public"),
+    }
+    memories["teammate_shared"].shared_with_agents.append(reader)
+    memories["outsider_shared"].shared_with_agents.append(reader)
+    db.add_all(memories.values())
+    db.commit()
+    yield {
+        "db": db,
+        "reader": reader.id,
+        "teammate": teammate.id,
+        "outsider": outsider.id,
+        "ids": {name: m.id for name, m in memories.items()},
+    }
+    db.close()
+
+
+@pytest.fixture
+def overrides():
+    index_manager = VectorIndexManager()
+    access_sets = AccessSetManager()
+    return {
+        get_vector_index_manager: lambda: index_manager,
+        get_access_set_manager: lambda: access_sets,
+        get_embedding_service: FixedEmbeddingService,
+    }
+
+
+def search(client, agent_id, **options):
+    response = client.post(
+        "/memories/search",
+        json={"query": "q", "similarity_threshold": 0.0, **options},
+        headers={"Authorization": f"Bearer {agent_id}"}
+    )
+    assert response.status_code == 200
+    # 同一數據庫中前面測試創建的公開記憶也可搜到，按內容去重比較
+    return {r["content"] for r in response.json()["results"]}
+
+
+def test_access_mask():
+    """所有者、公開和共享集合中的行可讀，刪除行後掩碼隨最後一行移動"""
+    index = WorkspaceVectorIndex(uuid4())
+    me, other = uuid4(), uuid4()
+    ids = [uuid4() for _ in range(4)]
+    index.upsert(ids[0], [1.0, 0.0], {"created_by_agent_id": me, "visibility": "private"})
+    index.upsert(ids[1], [1.0, 0.0], {"created_by_agent_id": other, "visibility": "private"})
+    index.upsert(ids[2], [1.0, 0.0], {"created_by_agent_id": other, "visibility": "public"})
+    index.upsert(ids[3], [1.0, 0.0], {"created_by_agent_id": other, "visibility": "shared"})
+
+    assert index.access_mask(me).tolist() == [True, False, True, False]
+    assert index.access_mask(me, {ids[3]}).tolist() == [True, False, True, True]
+    assert index.access_mask(uuid4()).tolist() == [False, False, True, False]
+
+    index.remove(ids[0])
+    assert index.access_mask(me, {ids[3]}).tolist() == [True, False, True]
+
+
+def test_search_scope(client, data):
+    """自己的、共享給自己的（跨工作區）和所有公開記憶可搜到，其他私有記憶不可"""
+    assert search(client, data["reader"]) == {
+        "outsider_public", "outsider_shared", "own", "teammate_shared"
+    }
+    assert search(client, data["reader"], include_shared=False, include_public=False) == {
+        "own", "teammate_shared"
+    }
+
+
+def test_share_and_revoke_update_scope(client, data):
+    """共享和撤銷即時更新已緩存的訪問集合"""
+    reader, outsider, ids = data["reader"], data["outsider"], data["ids"]
+    headers = {"Authorization": f"Bearer {outsider}"}
+    assert "outsider_private" not in search(client, reader)
+
+    response = client.post(
+        f"/memories/{ids['outsider_private']}/share",
+        json={"agent_id": str(reader)},
+        headers=headers
+    )
+    assert response.status_code == 200
+    assert "outsider_private" in search(client, reader)
+
+    response = client.delete(
+        f"/memories/{ids['outsider_shared']}/share/{reader}",
+        headers=headers
+    )
+    assert response.status_code == 200
+    assert "outsider_shared" not in search(client, reader)
+
+
+def test_revoke_applies_to_other_processes(client, data, monkeypatch):
+    """其他進程緩存的訪問集合仍含已撤銷的 ID 時，搜索結果在 SQL 中確認後排除"""
+    reader, ids = data["reader"], data["ids"]
+    stale = AccessSetManager()
+    stale.get(reader, data["db"])
+    for owner, name in [(data["teammate"], "teammate_shared"), (data["outsider"], "outsider_shared")]:
+        response = client.delete(
+            f"/memories/{ids[name]}/share/{reader}",
+            headers={"Authorization": f"Bearer {owner}"}
+        )
+        assert response.status_code == 200
+
+    # 模擬另一個進程：它的緩存沒有收到撤銷
+    monkeypatch.setattr(search_api, "ID_CHUNK_SIZE", 1)
+    app.dependency_overrides[get_access_set_manager] = lambda: stale
+    assert ids["teammate_shared"] in stale.get(reader, data["db"]).shared
+    assert search(client, reader) == {"outsider_public", "own"}
+
+
+def test_revoke_during_build_is_not_overwritten(data):
+    """構建期間的撤銷使構建結果不寫入緩存，下一次讀取重新構建"""
+    reader, memory_id = data["reader"], data["ids"]["teammate_shared"]
+    manager = AccessSetManager()
+    build = AccessSetManager.build
+
+    def build_then_revoke(agent_id, db):
+        access = build(agent_id, db)
+        manager.revoke(agent_id, memory_id)
+        return access
+
+    manager.build = build_then_revoke
+    assert memory_id in manager.get(reader, data["db"]).shared
+    assert manager.stats()["agents"] == 0
+
+    manager.build = build
+    manager.get(reader, data["db"])
+    assert manager.stats()["agents"] == 1
+
+
+def test_public_index_follows_updates(data):
+    """公開索引隨可見性變更和刪除增量維護"""
+    db = data["db"]
+    manager = VectorIndexManager()
+    public_index = manager.get(PUBLIC_SCOPE, db)
+    memory = db.get(Memory, data["ids"]["outsider_public"])
+    assert memory.id in public_index
+
+    memory.visibility = "private"
+    manager.upsert(memory)
+    assert memory.id not in public_index
+
+    memory.visibility = "public"
+    manager.upsert(memory)
+    assert memory.id in public_index
+
+    manager.remove(memory.workspace_id, memory.id)
+    assert memory.id not in public_index
@@ -0,0 +1,128 @@
+"""共享關聯表的主鍵、索引和「共享給我」接口測試"""
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.pool import StaticPool
+from uuid import uuid4
+from datetime import datetime, timedelta
+from src.db.migrations import run_migrations
+from src.models.models import Agent, Memory, memory_shared_agents
+
+
+@pytest.fixture
+def agents(test_db):
+    """owner 在一個工作區創建 5 條記憶並共享給另一工作區的 reader"""
+    db = test_db.SessionLocal()
+    owner = Agent(id=uuid4(), name=f"owner_{uuid4().hex[:8]}", workspace_id=uuid4())
+    reader = Agent(id=uuid4(), name=f"reader_{uuid4().hex[:8]}", workspace_id=uuid4())
+    db.add_all([owner, reader])
+    start = datetime(2024, 1, 1)
+    memories = [
+        Memory(
+            id=uuid4(), workspace_id=owner.workspace_id, created_by_agent_id=owner.id,
+            type="knowledge", category="test", content=f"memory {i}",
+            visibility="shared", created_at=start + timedelta(minutes=i)
+        )
+        for i in range(5)
+    ]
+    for memory in memories:
+        memory.shared_with_agents.append(reader)
+    memories[2].is_deleted = True
+    db.add_all(memories)
+    db.commit()
+    ids = {"owner": owner.id, "reader": reader.id, "memories": [m.id for m in memories]}
+    db.close()
+    return ids
+
+
+def test_shared_with_me_pagination(client, agents):
+    """按創建時間倒序分頁，不包含已刪除的記憶"""
+    headers = {"Authorization": f"Bearer {agents['reader']}"}
+    contents, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/memories/shared-with-me", params=params, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        contents += [m["content"] for m in body["memories"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert contents == ["memory 4", "memory 3", "memory 1", "memory 0"]
+
+    # owner 沒有被共享任何記憶
+    response = client.get(
+        "/memories/shared-with-me", headers={"Authorization": f"Bearer {agents['owner']}"}
+    )
+    assert response.json()["memories"] == []
+
+
+def test_duplicate_share_is_idempotent(client, test_db, agents):
+    """重複共享只保留一行，撤銷後行被刪除"""
+    memory_id = agents["memories"][0]
+    headers = {"Authorization": f"Bearer {agents['owner']}"}
+    for _ in range(2):
+        response = client.post(
+            f"/memories/{memory_id}/share", json={"agent_id": str(agents["reader"])}, headers=headers
+        )
+        assert response.status_code == 200
+
+    def share_rows():
+        with test_db.engine.connect() as conn:
+            return conn.execute(
+                select(memory_shared_agents).where(memory_shared_agents.c.memory_id == memory_id)
+            ).fetchall()
+
+    assert len(share_rows()) == 1
+    response = client.get(f"/memories/{memory_id}/shared-with", headers=headers)
+    assert response.json()["shared_with"] == [str(agents["reader"])]
+
+    response = client.delete(f"/memories/{memory_id}/share/{agents['reader']}", headers=headers)
+    assert response.status_code == 200
+    assert share_rows() == []
+
+
+def test_shared_with_me_uses_reverse_index(test_db, agents):
+    """按 agent_id 查詢共享行時使用反向索引而不是全表掃描"""
+    with test_db.engine.connect() as conn:
+        plan = " ".join(
+            str(row[-1]) for row in conn.execute(
+                text("EXPLAIN QUERY PLAN SELECT memory_id FROM memory_shared_agents WHERE agent_id = :id"),
+                {"id": agents["reader"].hex}
+            )
+        )
+    assert "ix_memory_shared_agents_agent_id" in plan
+
+
+def test_migration_deduplicates_shares():
+    """遷移去除重複行和空行，添加複合主鍵和反向索引"""
+    legacy = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+    with legacy.begin() as conn:
+        conn.execute(text("CREATE TABLE memory (id VARCHAR(32) PRIMARY KEY, embeddings BLOB)"))
+        conn.execute(text("CREATE TABLE agent (id VARCHAR(32) PRIMARY KEY)"))
+        conn.execute(text(
+            "CREATE TABLE memory_shared_agents (memory_id VARCHAR(32), agent_id VARCHAR(32))"
+        ))
+        conn.execute(text(
+            "INSERT INTO memory_shared_agents VALUES "
+            "('m1', 'a1'), ('m1', 'a1'), ('m1', 'a2'), ('m2', 'a1'), ('m2', NULL)"
+        ))
+
+    assert "0003_key_shared_agents" in run_migrations(legacy)
+
+    with legacy.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT memory_id, agent_id FROM memory_shared_agents ORDER BY memory_id, agent_id"
+        )).fetchall()
+    assert [tuple(row) for row in rows] == [("m1", "a1"), ("m1", "a2"), ("m2", "a1")]
+
+    inspector = inspect(legacy)
+    assert inspector.get_pk_constraint("memory_shared_agents")["constrained_columns"] == [
+        "memory_id", "agent_id"
+    ]
+    assert "ix_memory_shared_agents_agent_id" in {
+        index["name"] for index in inspector.get_indexes("memory_shared_agents")
+    }
@@ -0,0 +1,76 @@
+"""階段計時和延遲直方圖測試"""
+
+import time
+from fastapi.testclient import TestClient
+from src.main import app
+from src.utils.timing import StageTimer, LatencyHistogram, LatencyRecorder, latency_recorder
+
+client = TestClient(app)
+
+
+def test_stage_timer_accumulates():
+    """同名階段累加，Server-Timing 按記錄順序輸出"""
+    timer = StageTimer()
+    with timer.stage("auth"):
+        time.sleep(0.002)
+    with timer.stage("scoring"):
+        pass
+    with timer.stage("auth"):
+        time.sleep(0.002)
+
+    stages = timer.as_dict()
+    assert list(stages) == ["auth", "scoring"]
+    assert stages["auth"] >= 4.0
+    assert timer.total("auth", "missing") == timer.stages["auth"]
+    assert timer.server_timing(10.0).startswith("auth;dur=")
+    assert timer.server_timing(10.0).endswith("total;dur=10.000")
+
+
+def test_histogram_quantiles():
+    """分位數按桶上界估算"""
+    histogram = LatencyHistogram(buckets=(1, 10, 100))
+    for ms in [0.5] * 50 + [5] * 45 + [50] * 4 + [500]:
+        histogram.observe(ms)
+
+    stats = histogram.stats()
+    assert stats["count"] == 100
+    assert stats["p50_ms"] == 1.0
+    assert stats["p95_ms"] == 10.0
+    assert stats["p99_ms"] == 100.0
+    assert stats["max_ms"] == 500.0
+    assert stats["buckets"] == {"1": 50, "10": 95, "100": 99, "+Inf": 100}
+
+
+def test_recorder_groups_by_route_and_stage():
+    """每個路由的每個階段和總耗時各有一個直方圖"""
+    recorder = LatencyRecorder()
+    timer = StageTimer()
+    timer.stages["auth"] = 0.3
+    recorder.record("POST /memories/search", timer, 2.0)
+    recorder.record("POST /memories/search", timer, 3.0)
+
+    stats = recorder.stats()["POST /memories/search"]
+    assert set(stats) == {"auth", "total"}
+    assert stats["total"]["count"] == 2
+    assert stats["total"]["sum_ms"] == 5.0
+
+
+def test_middleware_sets_server_timing_and_records_route():
+    """中間件寫入 Server-Timing 頭並按路由模板聚合"""
+    latency_recorder.clear()
+
+    response = client.get("/health")
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+    # 認證失敗的請求也記錄 auth 階段
+    response = client.post(
+        "/memories/search",
+        json={"query": "test"},
+        headers={"Authorization": "Bearer invalid"}
+    )
+    assert response.status_code == 401
+    assert response.headers["Server-Timing"].startswith("auth;dur=")
+
+    stats = client.get("/metrics/latency").json()
+    assert stats["GET /health"]["total"]["count"] == 1
+    assert stats["POST /memories/search"]["auth"]["count"] == 1
@@ -0,0 +1,375 @@
+"""向量搜索後端測試
+
+同一組用例在五種後端上運行：進程內索引、PQ 壓縮的進程內索引、磁盤向量段、SQLite 上的 pgvector 替身
+（register_sqlite_functions 註冊的余弦距離函數），以及設置 TEST_POSTGRES_URL 時
+真實的 PostgreSQL + pgvector。結果都與 cosine_similarity 的精確排序比較。
+"""
+
+import os
+import tempfile
+import pytest
+import numpy as np
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from uuid import uuid4
+from src.db.database import Base, to_async_url
+from src.db.migrations import migration_lock
+from src.models import models
+from src.models.models import Agent, Memory, MemoryEmbedding, active_vectors
+from src.services.access_sets import AccessScope
+from src.services.search_service import SearchService
+from src.services.vector_backends import (
+    InProcessBackend, PgvectorBackend, PgvectorIndex, get_vector_backend, register_sqlite_functions
+)
+from src.services.vector_index import PUBLIC_SCOPE, VectorIndexManager
+from src.services.vector_segments import SegmentIndexManager
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+DIM = 8
+# 每次運行的記憶使用獨立分類，共享的 PostgreSQL 測試庫中的舊數據不影響結果
+CATEGORY = f"backend_{uuid4().hex[:8]}"
+
+
+@pytest.fixture(scope="module")
+def test_db(test_db):
+    """在測試庫的同步和異步引擎上註冊 pgvector 替身的余弦距離函數"""
+    register_sqlite_functions(test_db.engine)
+    register_sqlite_functions(test_db.async_engine.sync_engine)
+    # create_all 打開的連接沒有註冊函數
+    test_db.engine.dispose()
+    return test_db
+
+
+def seed(bind):
+    """在 bind 上創建測試數據，返回 ID 和向量
+
+    owner 的工作區內：owner 的私有記憶、reader 的私有記憶、共享給 owner 的記憶、
+    reader 的公開記憶、已刪除的記憶、只有其他模型向量的記憶；另一個工作區有一條公開記憶。
+    """
+    rng = np.random.default_rng(7)
+    workspace_id, other_workspace = uuid4(), uuid4()
+    owner = Agent(id=uuid4(), name=f"owner_{uuid4().hex[:8]}", workspace_id=workspace_id)
+    reader = Agent(id=uuid4(), name=f"reader_{uuid4().hex[:8]}", workspace_id=workspace_id)
+    stranger = Agent(id=uuid4(), name=f"stranger_{uuid4().hex[:8]}", workspace_id=other_workspace)
+
+    def memory(agent, visibility="private", type="knowledge", is_deleted=False):
+        return Memory(
+            id=uuid4(), workspace_id=agent.workspace_id, created_by_agent_id=agent.id,
+            type=type, category=CATEGORY, content=f"{agent.name} {visibility}",
+            visibility=visibility, is_deleted=is_deleted,
+            embeddings=rng.standard_normal(DIM).astype(np.float32)
+        )
+
+    memories = {
+        "own": [memory(owner) for _ in range(6)] + [memory(owner, type="preference")],
+        "hidden": [memory(reader) for _ in range(4)],
+        "shared": [memory(reader, visibility="shared")],
+        "public": [memory(reader, visibility="public")],
+        "deleted": [memory(owner, is_deleted=True)],
+        "elsewhere": [memory(stranger, visibility="public")],
+    }
+    other_model_only = Memory(
+        id=uuid4(), workspace_id=workspace_id, created_by_agent_id=owner.id,
+        type="knowledge", category=CATEGORY, content="other model", visibility="private"
+    )
+    other_model_only.vectors["other-model"] = MemoryEmbedding(
+        model_name="other-model", embeddings=rng.standard_normal(DIM).astype(np.float32)
+    )
+    memories["shared"][0].shared_with_agents.append(owner)
+    # 其他模型的向量與當前模型並存，不影響評分
+    memories["own"][0].vectors["other-model"] = MemoryEmbedding(
+        model_name="other-model", embeddings=np.ones(DIM, dtype=np.float32)
+    )
+
+    db = sessionmaker(bind=bind)()
+    db.add_all([owner, reader, stranger, other_model_only])
+    db.add_all([m for group in memories.values() for m in group])
+    db.commit()
+    data = {
+        "workspace": workspace_id,
+        "owner": owner.id,
+        "ids": {name: [m.id for m in group] for name, group in memories.items()},
+        "vectors": {
+            m.id: np.asarray(m.embeddings) for group in memories.values() for m in group
+        },
+        "types": {m.id: m.type for group in memories.values() for m in group},
+        "query": rng.standard_normal(DIM).astype(np.float32),
+    }
+    db.close()
+    return data
+
+
+@pytest.fixture(scope="module")
+def postgres():
+    """PostgreSQL 測試庫的異步會話工廠（pgvector 存儲）"""
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setattr(models, "VECTOR_BACKEND", "pgvector")
+    backend = PgvectorBackend(index_type="hnsw", dim=DIM)
+    sync_engine = create_engine(POSTGRES_URL)
+    with migration_lock(sync_engine) as conn:
+        backend.prepare_schema(conn)
+        Base.metadata.create_all(bind=conn)
+        backend.prepare_index(conn)
+    data = seed(sync_engine)
+    sync_engine.dispose()
+    pg_async = create_async_engine(to_async_url(POSTGRES_URL), poolclass=NullPool)
+    yield backend, async_sessionmaker(pg_async, expire_on_commit=False), data
+    monkeypatch.undo()
+
+
+@pytest.fixture(scope="module")
+def sqlite_data(test_db):
+    return seed(test_db.engine)
+
+
+BACKENDS = [
+    "inprocess",
+    "inprocess_pq",
+    "segments",
+    "pgvector_stand_in",
+    pytest.param(
+        "pgvector_postgres",
+        marks=pytest.mark.skipif(not POSTGRES_URL, reason="未設置 TEST_POSTGRES_URL")
+    ),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def setup(request):
+    """(後端, 異步會話工廠, 測試數據)"""
+    if request.param == "pgvector_postgres":
+        return request.getfixturevalue("postgres")
+    data = request.getfixturevalue("sqlite_data")
+    if request.param == "inprocess":
+        backend = InProcessBackend(VectorIndexManager())
+    elif request.param == "inprocess_pq":
+        backend = InProcessBackend(VectorIndexManager(pq_min_vectors=1))
+    elif request.param == "segments":
+        backend = InProcessBackend(SegmentIndexManager(tempfile.mkdtemp()))
+    else:
+        backend = PgvectorBackend(index_type="none")
+    return backend, request.getfixturevalue("test_db").AsyncSessionLocal, data
+
+
+async def search(setup, workspace_id, scope=None, threshold=-1.0, top_k=5, filters=None):
+    backend, session_factory, data = setup
+    search_service = SearchService(embedding_service=None)
+    async with session_factory() as db:
+        index = await backend.open(db, workspace_id)
+
+        async def load_memories(memory_ids):
+            memories = (await db.scalars(select(Memory).options(active_vectors()).where(
+                Memory.id.in_(memory_ids), Memory.is_deleted == False
+            ))).all()
+            return [m for m in memories if scope is None or scope.allows(m)]
+
+        results = await search_service.search_index(
+            "", index, load_memories, top_k=top_k, similarity_threshold=threshold,
+            filters=filters or {"category": CATEGORY}, query_embedding=data["query"], scope=scope
+        )
+    return [(m.id, score) for m, score in results]
+
+
+def expected(data, candidates, threshold=-1.0, top_k=5):
+    scored = [
+        (memory_id, SearchService.cosine_similarity(data["query"], data["vectors"][memory_id]))
+        for memory_id in candidates
+    ]
+    scored = [r for r in scored if r[1] >= threshold]
+    return sorted(scored, key=lambda r: -r[1])[:top_k]
+
+
+def assert_same(results, reference):
+    assert [memory_id for memory_id, _ in results] == [memory_id for memory_id, _ in reference]
+    assert np.allclose([s for _, s in results], [s for _, s in reference], atol=1e-6)
+
+
+def readable(data):
+    ids = data["ids"]
+    return ids["own"] + ids["shared"] + ids["public"]
+
+
+@pytest.mark.asyncio
+async def test_scoped_search_matches_exact_ranking(setup):
+    """只返回可讀記憶，排序與精確余弦相似度一致"""
+    data = setup[2]
+    scope = AccessScope(data["owner"], frozenset(data["ids"]["shared"]))
+    results = await search(setup, data["workspace"], scope=scope, top_k=20)
+
+    assert_same(results, expected(data, readable(data), top_k=20))
+
+
+@pytest.mark.asyncio
+async def test_top_k_and_threshold(setup):
+    """top_k 和相似度閾值在兩種後端上一致"""
+    data = setup[2]
+    scope = AccessScope(data["owner"], frozenset(data["ids"]["shared"]))
+    reference = expected(data, readable(data), top_k=20)
+    threshold = reference[len(reference) // 2][1]
+
+    assert_same(await search(setup, data["workspace"], scope=scope, top_k=2),
+                expected(data, readable(data), top_k=2))
+    assert_same(await search(setup, data["workspace"], scope=scope, threshold=threshold, top_k=20),
+                expected(data, readable(data), threshold=threshold, top_k=20))
+
+
+@pytest.mark.asyncio
+async def test_metadata_filters(setup):
+    """元數據過濾與權限同時生效"""
+    data = setup[2]
+    scope = AccessScope(data["owner"])
+    results = await search(
+        setup, data["workspace"], scope=scope, top_k=20,
+        filters={"category": CATEGORY, "type": "preference"}
+    )
+    candidates = [i for i in data["ids"]["own"] + data["ids"]["public"]
+                  if data["types"][i] == "preference"]
+
+    assert_same(results, expected(data, candidates, top_k=20))
+
+
+@pytest.mark.asyncio
+async def test_public_scope_spans_workspaces(setup):
+    """公開索引包含所有工作區的公開記憶"""
+    data = setup[2]
+    results = await search(setup, PUBLIC_SCOPE, top_k=20)
+
+    assert_same(results, expected(data, data["ids"]["public"] + data["ids"]["elsewhere"], top_k=20))
+
+
+def test_postgres_statement_uses_index_expression():
+    """PostgreSQL 上的候選查詢與 ANN 索引使用同樣的表達式和部分索引條件"""
+    backend = PgvectorBackend(index_type="hnsw", dim=DIM)
+    index = PgvectorIndex(backend, db=None, workspace_id=uuid4())
+    statement = index.statement([0.0] * DIM, top_k=5, similarity_threshold=0.3, scope=AccessScope(uuid4()))
+    sql = str(statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True}
+    ))
+
+    assert f"CAST(memory_embedding.embeddings AS vector({DIM})) <=> CAST(" in sql
+    assert f"memory_embedding.model_name = '{models.ACTIVE_EMBEDDING_MODEL}'" in sql
+    assert "ORDER BY (" in sql and "LIMIT" in sql
+
+    ddl = backend.index_ddl(DIM)
+    assert f"USING hnsw ((embeddings::vector({DIM})) vector_cosine_ops)" in ddl
+    assert f"WHERE model_name = '{models.ACTIVE_EMBEDDING_MODEL}'" in ddl
+    assert backend.session_settings(100) == ["SET LOCAL hnsw.ef_search = 100"]
+
+    # 選擇性高的條件使用精確計劃：排序表達式不帶維度轉換，不匹配 ANN 索引
+    exact = str(index.statement([0.0] * DIM, top_k=5, similarity_threshold=0.3, exact=True).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True}
+    ))
+    assert "CAST(" not in exact and "memory_embedding.embeddings <=>" in exact
+
+    backend.extension_version = "0.8.0"
+    assert backend.session_settings(100) == [
+        "SET LOCAL hnsw.ef_search = 100", "SET LOCAL hnsw.iterative_scan = relaxed_order"
+    ]
+    backend.extension_version = "0.7.4"
+    assert backend.session_settings(100) == ["SET LOCAL hnsw.ef_search = 100"]
+    with pytest.raises(ValueError):
+        PgvectorBackend(iterative_scan="ordered")
+
+
+SMALL_TENANT = 5
+
+
+@pytest.fixture(scope="module", params=[
+    "pgvector_stand_in",
+    pytest.param(
+        "pgvector_postgres",
+        marks=pytest.mark.skipif(not POSTGRES_URL, reason="未設置 TEST_POSTGRES_URL")
+    ),
+])
+def crowded(request):
+    """40 個各有 100 條記憶的工作區，和一個只有 SMALL_TENANT 條記憶的工作區
+
+    大工作區的向量聚集在查詢方向附近，全局最近鄰都不屬於小租戶。
+    返回 (後端, 異步會話工廠, 測試數據)。
+    """
+    if request.param == "pgvector_postgres":
+        backend, session_factory, _ = request.getfixturevalue("postgres")
+        bind = create_engine(POSTGRES_URL)
+    else:
+        test_db = request.getfixturevalue("test_db")
+        backend, session_factory, bind = PgvectorBackend(index_type="none"), test_db.AsyncSessionLocal, test_db.engine
+
+    rng = np.random.default_rng(11)
+    query = rng.standard_normal(DIM).astype(np.float32)
+
+    def memory(workspace_id, vector):
+        return Memory(
+            id=uuid4(), workspace_id=workspace_id, type="knowledge", category=CATEGORY,
+            content="crowded", embeddings=vector.astype(np.float32)
+        )
+
+    crowd = [
+        memory(workspace_id, query + 0.1 * rng.standard_normal(DIM))
+        for workspace_id in [uuid4() for _ in range(40)] for _ in range(100)
+    ]
+    small_workspace = uuid4()
+    small = [memory(small_workspace, rng.standard_normal(DIM)) for _ in range(SMALL_TENANT)]
+    db = sessionmaker(bind=bind)()
+    db.add_all(crowd + small)
+    db.commit()
+    data = {
+        "workspace": small_workspace,
+        "ids": [m.id for m in small],
+        "vectors": {m.id: np.asarray(m.embeddings) for m in small},
+        "query": query,
+    }
+    db.close()
+    if request.param == "pgvector_postgres":
+        bind.dispose()
+    return backend, session_factory, data
+
+
+@pytest.mark.asyncio
+async def test_small_tenant_recall_among_many_workspaces(crowded, monkeypatch):
+    """全局 ANN 索引的最近鄰都屬於其他工作區時，小租戶仍能取回全部記憶"""
+    backend, _, data = crowded
+    results = await search(crowded, data["workspace"], top_k=SMALL_TENANT)
+    assert_same(results, expected(data, data["ids"], top_k=SMALL_TENANT))
+
+    # 不走精確計劃時依靠迭代索引掃描（pgvector >= 0.8）
+    if backend.supports_iterative_scan:
+        monkeypatch.setattr(backend, "exact_max_rows", 0)
+        results = await search(crowded, data["workspace"], top_k=SMALL_TENANT)
+        assert_same(results, expected(data, data["ids"], top_k=SMALL_TENANT))
+
+
+@pytest.mark.asyncio
+async def test_selective_filters_use_exact_plan(crowded):
+    """過濾後行數不超過 exact_max_rows 時判定為選擇性高"""
+    backend, session_factory, data = crowded
+    async with session_factory() as db:
+        small = PgvectorIndex(PgvectorBackend(exact_max_rows=SMALL_TENANT), db, data["workspace"])
+        assert await small.is_selective({"category": CATEGORY})
+        tight = PgvectorIndex(PgvectorBackend(exact_max_rows=SMALL_TENANT - 1), db, data["workspace"])
+        assert not await tight.is_selective({"category": CATEGORY})
+        assert not await PgvectorIndex(PgvectorBackend(exact_max_rows=0), db, data["workspace"]).is_selective()
+
+
+@pytest.fixture
+def overrides():
+    return {get_vector_backend: lambda: PgvectorBackend(index_type="none")}
+
+
+def test_search_api_with_pgvector_stand_in(client, sqlite_data):
+    """搜索 API 通過 pgvector 後端下推 top-k，explain 返回 pushdown 計劃"""
+    response = client.post(
+        "/memories/search",
+        json={"query": "記憶", "similarity_threshold": -1.0, "limit": 20,
+              "category": CATEGORY, "explain": True},
+        headers={"Authorization": f"Bearer {sqlite_data['owner']}"}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["plan"]["strategy"] == "pushdown"
+    returned = {r["memory_id"] for r in body["results"]}
+    visible = readable(sqlite_data) + sqlite_data["ids"]["elsewhere"]
+    assert returned == {str(memory_id) for memory_id in visible}
@@ -0,0 +1,223 @@
+"""常駐向量索引測試"""
+
+import pytest
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from uuid import uuid4
+from src.db.database import Base
+from src.models.models import Agent, Memory
+from src.services.search_service import SearchService
+from src.services.vector_index import WorkspaceVectorIndex, VectorIndexManager
+
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
+
+engine = create_engine(
+    SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+class FixedEmbeddingService:
+    """返回固定查詢向量的嵌入服務"""
+    def __init__(self, vector):
+        self.vector = vector
+
+    async def get_embeddings(self, text):
+        return list(self.vector)
+
+
+@pytest.fixture
+def db_session():
+    """創建測試數據庫會話"""
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = TestingSessionLocal(bind=connection)
+
+    yield session
+
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def workspace(db_session):
+    """創建包含 200 個帶嵌入記憶的工作區"""
+    rng = np.random.default_rng(7)
+    workspace_id = uuid4()
+    agent = Agent(id=uuid4(), name=f"index_agent_{workspace_id.hex[:8]}", workspace_id=workspace_id)
+    db_session.add(agent)
+
+    memories = []
+    for i in range(200):
+        memory = Memory(
+            id=uuid4(),
+            workspace_id=workspace_id,
+            created_by_agent_id=agent.id,
+            type="knowledge",
+            category="test",
+            content=f"記憶 {i}",
+            embeddings=rng.standard_normal(32).tolist()
+        )
+        memories.append(memory)
+    db_session.add_all(memories)
+    db_session.commit()
+
+    return workspace_id, memories
+
+
+def test_index_upsert_and_remove():
+    """插入、更新和刪除向量"""
+    index = WorkspaceVectorIndex(uuid4())
+    ids = [uuid4() for _ in range(3)]
+    for i, memory_id in enumerate(ids):
+        index.upsert(memory_id, [float(i + 1), 1.0], {"type": "knowledge"})
+
+    assert len(index) == 3
+    assert np.allclose(np.linalg.norm(index.matrix, axis=1), 1.0)
+
+    # 刪除把最後一行移到被刪除的位置
+    assert index.remove(ids[0]) is True
+    assert index.remove(ids[0]) is False
+    assert index.ids == [ids[2], ids[1]]
+    assert np.allclose(index.matrix[0], np.array([3.0, 1.0]) / np.sqrt(10))
+
+    index.upsert(ids[1], [0.0, 5.0])
+    assert np.allclose(index.matrix[1], [0.0, 1.0])
+    assert index.remove(ids[1]) is True
+    assert index.ids == [ids[2]]
+
+    with pytest.raises(ValueError):
+        index.upsert(uuid4(), [1.0, 2.0, 3.0])
+
+
+def test_manager_builds_from_db(db_session, workspace):
+    """首次訪問時從數據庫構建索引"""
+    workspace_id, memories = workspace
+    manager = VectorIndexManager()
+
+    index = manager.get(workspace_id, db_session)
+
+    assert len(index) == 200
+    assert manager.get(workspace_id, db_session) is index
+    assert manager.stats()["builds"] == 1
+
+
+def test_manager_incremental_updates(db_session, workspace):
+    """增刪改同步到已載入的索引"""
+    workspace_id, memories = workspace
+    manager = VectorIndexManager()
+    index = manager.get(workspace_id, db_session)
+
+    memories[0].is_deleted = True
+    manager.upsert(memories[0])
+    manager.remove(workspace_id, memories[1].id)
+    new_memory = Memory(
+        id=uuid4(),
+        workspace_id=workspace_id,
+        is_deleted=False,
+        embeddings=np.ones(32, dtype=np.float32)
+    )
+    manager.upsert(new_memory)
+
+    assert memories[0].id not in index
+    assert memories[1].id not in index
+    assert new_memory.id in index
+    assert len(index) == 199
+
+
+def test_manager_evicts_cold_workspaces():
+    """超出預算時淘汰最久未使用的工作區"""
+    index_bytes = WorkspaceVectorIndex(uuid4())
+    index_bytes.upsert(uuid4(), np.ones(64))
+    manager = VectorIndexManager(memory_budget_bytes=index_bytes.nbytes * 2)
+
+    workspaces = [uuid4() for _ in range(3)]
+    for workspace_id in workspaces:
+        index = WorkspaceVectorIndex(workspace_id)
+        index.upsert(uuid4(), np.ones(64))
+        manager._indexes[workspace_id] = index
+        manager._evict()
+
+    assert workspaces[0] not in manager._indexes
+    assert manager.stats()["evictions"] >= 1
+
+
+def test_manager_saves_evicted_outside_lock(db_session, workspace, tmp_path):
+    """淘汰的索引在釋放管理器鎖之後才寫入 persist_dir"""
+    workspace_id, _ = workspace
+    manager = VectorIndexManager(memory_budget_bytes=1, persist_dir=str(tmp_path))
+    cold_id = uuid4()
+    cold = WorkspaceVectorIndex(cold_id)
+    cold.upsert(uuid4(), np.ones(64))
+    manager._indexes[cold_id] = cold
+    saved = []
+    manager._save_trained = lambda evicted_id, index: saved.append(
+        (evicted_id, manager._lock.locked())
+    )
+
+    manager.get(workspace_id, db_session)
+
+    assert saved == [(cold_id, False)]
+    assert list(manager._indexes) == [workspace_id]
+
+
+@pytest.mark.asyncio
+async def test_index_search_matches_full_scan(db_session, workspace):
+    """索引搜索與全量掃描結果一致"""
+    workspace_id, memories = workspace
+    manager = VectorIndexManager()
+    index = manager.get(workspace_id, db_session)
+    query_vec = memories[5].embeddings.tolist()
+    search_service = SearchService(FixedEmbeddingService(query_vec))
+
+    def load_memories(memory_ids):
+        return db_session.query(Memory).filter(Memory.id.in_(memory_ids)).all()
+
+    indexed = await search_service.search_index(
+        "query", index, load_memories, top_k=10, similarity_threshold=0.0
+    )
+    full_scan = await search_service.semantic_search(
+        "query", memories, top_k=10, similarity_threshold=0.0
+    )
+
+    assert [r[0].id for r in indexed] == [r[0].id for r in full_scan]
+    assert [r[1] for r in indexed] == [r[1] for r in full_scan]
+    assert indexed[0][0].id == memories[5].id
+
+
+def test_manager_replays_writes_during_build(db_session, workspace, monkeypatch):
+    """構建讀取數據庫之後、放入緩存之前到達的寫入不會丟失"""
+    workspace_id, memories = workspace
+    manager = VectorIndexManager()
+    created = Memory(
+        id=uuid4(), workspace_id=workspace_id, is_deleted=False, visibility="private",
+        embeddings=np.ones(32, dtype=np.float32)
+    )
+    updated = memories[2]
+    build = VectorIndexManager.build
+
+    def build_then_write(workspace_id, db):
+        index = build(workspace_id, db)
+        # 模擬構建期間其他請求提交的寫入
+        manager.upsert(created)
+        manager.remove(workspace_id, memories[1].id)
+        updated.embeddings = -np.ones(32, dtype=np.float32)
+        manager.upsert(updated)
+        return index
+
+    monkeypatch.setattr(VectorIndexManager, "build", staticmethod(build_then_write))
+    index = manager.get(workspace_id, db_session)
+
+    assert created.id in index
+    assert memories[1].id not in index
+    assert np.allclose(index.matrix[index._positions[updated.id]], -1 / np.sqrt(32))
+    assert len(index) == 200
+    assert manager._pending == {}
+
+    # 構建完成後的寫入直接應用到緩存中的索引
+    manager.remove(workspace_id, created.id)
+    assert created.id not in index
@@ -0,0 +1,353 @@
+"""磁盤向量段測試"""
+
+import asyncio
+import os
+import time
+import pytest
+import numpy as np
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from uuid import uuid4
+from src.db.database import Base
+from src.models.models import Agent, Memory
+from src.services.access_sets import AccessScope
+from src.services.vector_index import PUBLIC_SCOPE, VectorIndexManager
+from src.services.vector_segments import (
+    ID_DTYPE, Segment, SegmentIndexManager, SegmentStore
+)
+from src.utils.embedding import normalize_rows
+
+DIM = 16
+
+engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def db_session():
+    """創建測試數據庫會話"""
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = TestingSessionLocal(bind=connection)
+
+    yield session
+
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def workspace(db_session):
+    """創建兩個 Agent 共 60 條記憶的工作區，其中部分公開"""
+    rng = np.random.default_rng(11)
+    workspace_id = uuid4()
+    owner = Agent(id=uuid4(), name=f"seg_owner_{workspace_id.hex[:8]}", workspace_id=workspace_id)
+    other = Agent(id=uuid4(), name=f"seg_other_{workspace_id.hex[:8]}", workspace_id=workspace_id)
+    db_session.add_all([owner, other])
+
+    memories = [
+        Memory(
+            id=uuid4(),
+            workspace_id=workspace_id,
+            created_by_agent_id=(owner if i % 2 else other).id,
+            type="preference" if i % 3 == 0 else "knowledge",
+            category="segments",
+            content=f"記憶 {i}",
+            visibility="public" if i % 5 == 0 else "private",
+            embeddings=rng.standard_normal(DIM).tolist()
+        )
+        for i in range(60)
+    ]
+    db_session.add_all(memories)
+    db_session.commit()
+    return workspace_id, owner.id, memories
+
+
+def random_rows(n, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((n, DIM)))
+
+
+def test_segment_file_is_memory_mapped(tmp_path):
+    """段文件映射為只讀矩陣和 ID 視圖，刪除位在同一文件的其他映射中立即可見"""
+    ids = [uuid4() for _ in range(10)]
+    matrix = random_rows(10)
+    path = str(tmp_path / "0000000000.seg")
+    Segment.write(path, [(np.array([i.bytes for i in ids], dtype=ID_DTYPE), matrix)])
+
+    segment = Segment(path)
+    assert (segment.rows, segment.dim) == (10, DIM)
+    assert np.shares_memory(segment.matrix, segment._raw) and isinstance(segment._raw, np.memmap)
+    assert not segment.matrix.flags.writeable
+    assert np.array_equal(segment.matrix, matrix)
+    assert segment.ids.tolist() == [i.bytes.rstrip(b"\0") for i in ids]
+
+    other = Segment(path)
+    segment.delete(3)
+    assert other.live_mask().tolist() == [i != 3 for i in range(10)]
+
+
+def test_stores_share_segments(tmp_path):
+    """兩個 SegmentStore（模擬兩個工作進程）映射同一目錄"""
+    writer, reader = SegmentStore(str(tmp_path)), SegmentStore(str(tmp_path))
+    ids = [uuid4() for _ in range(4)]
+    writer.append(ids, random_rows(4))
+
+    assert reader.refresh()
+    assert reader.stats()["live_rows"] == 4
+
+    # 刪除只修改共享映射中的位圖，讀取方不需要重新載入清單
+    writer.delete([ids[0]])
+    assert not reader.refresh()
+    assert reader.stats()["live_rows"] == 3
+
+    # 更新追加新段並標記舊行
+    writer.append([ids[1]], random_rows(1, seed=1))
+    assert reader.refresh()
+    stats = reader.stats()
+    assert (stats["segments"], stats["rows"], stats["live_rows"]) == (2, 5, 3)
+    with pytest.raises(ValueError):
+        writer.append([uuid4()], normalize_rows(np.ones((1, DIM + 1))))
+
+
+def test_merge_reclaims_deleted_rows(tmp_path):
+    """合併把小段合成一個段並刪除舊文件，保留每個 ID 最新的向量"""
+    store = SegmentStore(str(tmp_path), max_segments=3)
+    ids = [uuid4() for _ in range(20)]
+    store.append(ids, random_rows(20))
+    for i in range(4):
+        store.append([ids[i]], random_rows(1, seed=100 + i))
+    store.delete(ids[10:15])
+    latest = {ids[i]: random_rows(1, seed=100 + i)[0] for i in range(4)}
+
+    assert store.plan_merge() == 0
+    old_files = [segment.path for segment in store.segments]
+    assert store.merge()
+    assert [segment.source for segment in store.segments] == ["merge"]
+    assert not any(os.path.exists(path) for path in old_files)
+    assert store.stats()["rows"] == store.stats()["live_rows"] == 15
+
+    segment = store.segments[0]
+    rows = dict(zip(segment.ids.tolist(), segment.matrix))
+    for memory_id, vector in latest.items():
+        assert np.array_equal(rows[memory_id.bytes.rstrip(b"\0")], vector)
+    assert not store.merge()
+
+
+def test_merge_keeps_writes_made_while_writing(tmp_path, monkeypatch):
+    """合併在文件鎖外寫入新段，期間其他進程的刪除和追加在換入清單後保留"""
+    store = SegmentStore(str(tmp_path), max_segments=1)
+    other = SegmentStore(str(tmp_path))
+    ids = [uuid4() for _ in range(10)]
+    store.append(ids[:5], random_rows(5))
+    store.append(ids[5:], random_rows(5, seed=1))
+    added = uuid4()
+    write = Segment.write
+
+    def write_then_race(path, parts):
+        rows = write(path, parts)
+        if os.path.basename(path).startswith("merge-"):
+            # 持有文件鎖時這些寫入會阻塞
+            other.delete([ids[0]])
+            other.append([ids[1], added], random_rows(2, seed=2))
+        return rows
+
+    monkeypatch.setattr(Segment, "write", staticmethod(write_then_race))
+    assert store.merge()
+    assert [segment.source for segment in store.segments] == ["merge", "append"]
+    assert store.live_keys() == {
+        memory_id.bytes.rstrip(b"\0") for memory_id in ids[2:] + [ids[1], added]
+    }
+
+    # 位置表指向追加段中 ids[1] 的最新行，而不是合併段中已刪除的舊行
+    store.delete([ids[1]])
+    assert ids[1].bytes.rstrip(b"\0") not in store.live_keys()
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+
+
+def test_merge_only_small_tail_segments(tmp_path):
+    """段數超限時只合併最大段之後的小段"""
+    store = SegmentStore(str(tmp_path), max_segments=3)
+    store.append([uuid4() for _ in range(50)], random_rows(50))
+    for i in range(4):
+        store.append([uuid4()], random_rows(1, seed=i))
+    base = store.segments[0].name
+
+    assert store.plan_merge() == 1
+    assert store.merge()
+    assert [segment.name for segment in store.segments][0] == base
+    assert [segment.rows for segment in store.segments] == [50, 4]
+
+
+def test_shortlist_matches_in_memory_index(db_session, workspace, tmp_path):
+    """段上的過濾、權限和候選與進程內索引一致"""
+    workspace_id, owner_id, memories = workspace
+    segments = SegmentIndexManager(str(tmp_path)).get(workspace_id, db_session)
+    in_memory = VectorIndexManager().get(workspace_id, db_session)
+    query = np.random.default_rng(3).standard_normal(DIM).tolist()
+    shared = frozenset([memories[0].id])
+
+    assert len(segments) == len(in_memory) == 60
+    for filters in (None, {"type": "preference"}, {"category": "missing"}):
+        assert segments.selectivity(filters) == pytest.approx(in_memory.selectivity(filters))
+        for scope in (None, AccessScope(owner_id, shared)):
+            assert set(segments.shortlist(query, 5, 0.0, filters=filters, scope=scope)) == \
+                set(in_memory.shortlist(query, 5, 0.0, filters=filters, scope=scope))
+    assert segments.access_mask(owner_id, shared).sum() == in_memory.access_mask(owner_id, shared).sum()
+
+
+def test_writes_visible_to_other_managers(db_session, workspace, tmp_path):
+    """一個進程的更新和刪除在另一個進程的下次搜索中生效，包括更新後的元數據"""
+    workspace_id, owner_id, memories = workspace
+    writer = SegmentIndexManager(str(tmp_path))
+    reader = SegmentIndexManager(str(tmp_path))
+    writer.get(workspace_id, db_session)
+    index = reader.get(workspace_id, db_session)
+
+    target, removed = memories[1], memories[3]
+    target.embeddings = [1.0] + [0.0] * (DIM - 1)
+    target.type = "preference"
+    db_session.commit()
+    writer.upsert(target)
+    removed.is_deleted = True
+    db_session.commit()
+    writer.remove(workspace_id, removed.id)
+    writer.flush_writes()
+
+    index = reader.get(workspace_id, db_session)
+    assert len(index) == 59
+    assert removed.id not in index
+    query = [1.0] + [0.0] * (DIM - 1)
+    assert index.shortlist(query, 1, 0.99, filters={"type": "preference"}) == [target.id]
+
+    # 變為公開後進入公開段
+    reader.get(PUBLIC_SCOPE, db_session)
+    target.visibility = "public"
+    db_session.commit()
+    writer.upsert(target)
+    writer.flush_writes()
+    assert target.id in reader.get(PUBLIC_SCOPE, db_session)
+
+
+def test_writes_are_buffered_and_batched(db_session, workspace, tmp_path):
+    """upsert 和 remove 只進入緩衝，一次落盤把整批寫入追加為一個段"""
+    workspace_id, owner_id, memories = workspace
+    manager = SegmentIndexManager(str(tmp_path), flush_interval=60)
+    manager.get(workspace_id, db_session)
+    for memory in memories[:5]:
+        manager.upsert(memory)
+    manager.upsert(memories[0])
+    manager.remove(workspace_id, memories[5].id)
+
+    stats = manager.stats()
+    assert (stats["segments"], stats["pending_writes"]) == (1, 12)
+    # 工作區和公開範圍各一份；公開範圍還沒有段，跳過
+    assert manager.flush_writes() == 6
+    stats = manager.stats()
+    assert (stats["segments"], stats["segment_rows"], stats["pending_writes"]) == (2, 65, 0)
+    assert len(manager.get(workspace_id, db_session)) == 59
+
+
+def test_search_reads_own_buffered_writes(db_session, workspace, tmp_path):
+    """get 先寫入該工作區緩衝中的寫入，寫請求之後的搜索立即可見；其他工作區的緩衝保留"""
+    workspace_id, owner_id, memories = workspace
+    manager = SegmentIndexManager(str(tmp_path), flush_interval=60)
+    index = manager.get(workspace_id, db_session)
+    manager.get(PUBLIC_SCOPE, db_session)
+
+    target = memories[1]
+    target.embeddings = [1.0] + [0.0] * (DIM - 1)
+    target.type = "preference"
+    db_session.commit()
+    manager.upsert(target)
+    manager.remove(workspace_id, memories[3].id)
+
+    index = manager.get(workspace_id, db_session)
+    assert memories[3].id not in index
+    query = [1.0] + [0.0] * (DIM - 1)
+    assert index.shortlist(query, 1, 0.99, filters={"type": "preference"}) == [target.id]
+    assert manager.stats()["pending_writes"] == 2
+
+
+def test_failed_flush_keeps_writes(db_session, workspace, tmp_path, monkeypatch):
+    """寫入失敗的批次放回緩衝（之後又緩衝的寫入優先），下次落盤時寫入"""
+    workspace_id, owner_id, memories = workspace
+    manager = SegmentIndexManager(str(tmp_path), flush_interval=60)
+    manager.get(workspace_id, db_session)
+    manager.remove(workspace_id, memories[0].id)
+    manager.remove(workspace_id, memories[1].id)
+
+    def broken(self, *args, **kwargs):
+        raise OSError("磁盤已滿")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(SegmentStore, "delete", broken)
+        assert manager.flush_writes(workspace_id) == 0
+    # 工作區的兩條放回緩衝，公開範圍的兩條未取出
+    assert manager.stats()["write_failures"] == 1
+    assert manager.stats()["pending_writes"] == 4
+    manager.upsert(memories[1])
+
+    assert len(manager.get(workspace_id, db_session)) == 59
+    assert memories[1].id in manager.get(workspace_id, db_session)
+
+
+def test_writer_thread_flushes_buffer(db_session, workspace, tmp_path):
+    """寫入線程在 flush_rows 或 flush_interval 到達後自動落盤"""
+    workspace_id, owner_id, memories = workspace
+    manager = SegmentIndexManager(str(tmp_path), flush_interval=60, flush_rows=4)
+    manager.get(workspace_id, db_session)
+    manager.remove(workspace_id, memories[0].id)
+    manager.remove(workspace_id, memories[1].id)
+
+    for _ in range(200):
+        if manager.stats()["write_flushes"]:
+            break
+        time.sleep(0.01)
+    assert manager.stats()["pending_writes"] == 0
+    assert len(manager.get(workspace_id, db_session)) == 58
+
+
+def test_reopen_reads_metadata_without_vectors(db_session, workspace, tmp_path):
+    """段已存在時，新進程打開工作區只讀取元數據列"""
+    workspace_id, owner_id, memories = workspace
+    SegmentIndexManager(str(tmp_path)).get(workspace_id, db_session)
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        index = SegmentIndexManager(str(tmp_path)).get(workspace_id, db_session)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert len(index) == 60
+    assert statements
+    assert not any("memory_embedding.embeddings" in statement for statement in statements)
+
+
+@pytest.mark.asyncio
+async def test_background_merge(db_session, workspace, tmp_path):
+    """後台合併協程合併寫入產生的小段"""
+    workspace_id, owner_id, memories = workspace
+    manager = SegmentIndexManager(str(tmp_path), max_segments=2, merge_interval=0.01)
+    manager.get(workspace_id, db_session)
+    for memory in memories[:5]:
+        manager.upsert(memory)
+        manager.flush_writes()
+    assert manager.stats()["segments"] == 6
+
+    manager.start()
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if manager.stats()["merges"]:
+            break
+    await manager.stop()
+
+    assert manager.stats()["merges"] >= 1
+    assert len(manager.get(workspace_id, db_session)) == 60
@@ -0,0 +1,151 @@
+"""二進制向量存儲測試"""
+
+import pytest
+import json
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from uuid import uuid4
+from src.db.database import Base
+from src.db.migrations import run_migrations
+from src.models.models import Agent, Memory
+from src.utils.embedding import pack_vector, unpack_vector, VECTOR_HEADER
+
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
+
+
+def test_pack_unpack_roundtrip():
+    """打包後解析得到相同向量"""
+    vector = [0.1 * i for i in range(384)]
+    data = pack_vector(vector)
+
+    assert len(data) == VECTOR_HEADER.size + 384 * 4
+    restored = unpack_vector(data)
+    assert restored.dtype == np.float32
+    assert np.allclose(restored, vector, atol=1e-6)
+
+
+def test_unpack_is_zero_copy():
+    """解析結果與原始字節共享內存且只讀"""
+    data = pack_vector(np.ones(8, dtype=np.float32))
+    restored = unpack_vector(data)
+
+    assert restored.base is not None
+    assert not restored.flags.writeable
+
+
+def test_unpack_rejects_corrupt_data():
+    """損壞數據應引發錯誤"""
+    data = pack_vector([1.0, 2.0, 3.0])
+
+    with pytest.raises(ValueError):
+        unpack_vector(data[:-4])
+
+    with pytest.raises(ValueError):
+        unpack_vector(b"XX" + data[2:])
+
+
+def test_binary_storage_smaller_than_json():
+    """二進制存儲至少比 JSON 小 4 倍"""
+    vector = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+    json_size = len(json.dumps(vector.tolist()))
+
+    assert json_size / len(pack_vector(vector)) > 4
+
+
+def test_memory_embeddings_roundtrip():
+    """Memory.embeddings 以二進制寫入並讀回 numpy 數組"""
+    engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+
+    agent = Agent(id=uuid4(), name="vector_agent", workspace_id=uuid4())
+    memory = Memory(
+        id=uuid4(),
+        workspace_id=agent.workspace_id,
+        created_by_agent_id=agent.id,
+        type="knowledge",
+        category="test",
+        content="向量存儲",
+        embeddings=[0.5, -0.25, 1.0]
+    )
+    session.add_all([agent, memory])
+    session.commit()
+    session.expire_all()
+
+    saved = session.query(Memory).filter(Memory.id == memory.id).first()
+    assert isinstance(saved.embeddings, np.ndarray)
+    assert saved.embeddings.tolist() == [0.5, -0.25, 1.0]
+    session.close()
+
+
+def test_migration_converts_json_rows():
+    """遷移把遺留 JSON 行轉換為二進制"""
+    engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE memory ("
+            "id VARCHAR(32) PRIMARY KEY, workspace_id VARCHAR(32), "
+            "created_by_agent_id VARCHAR(32), type VARCHAR, category VARCHAR, "
+            "content VARCHAR, visibility VARCHAR, is_deleted BOOLEAN, "
+            "created_at DATETIME, updated_at DATETIME, embeddings JSON, "
+            "embedding_model VARCHAR(50), embedding_updated_at DATETIME)"
+        ))
+        memory_id = uuid4()
+        conn.execute(
+            text("INSERT INTO memory (id, content, is_deleted, embeddings) "
+                 "VALUES (:id, 'legacy', 0, :embeddings)"),
+            {"id": memory_id.hex, "embeddings": json.dumps([1.0, 2.0, 3.0])}
+        )
+
+    assert "0001_pack_embeddings" in run_migrations(engine)
+    # 再次執行不會重複遷移
+    assert run_migrations(engine) == []
+
+    # 轉換後的向量由 0005 移到 memory_embedding
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT embeddings FROM memory")).scalar() is None
+        raw = conn.execute(text("SELECT embeddings FROM memory_embedding")).scalar()
+    assert unpack_vector(raw).tolist() == [1.0, 2.0, 3.0]
+
+
+def test_concurrent_migrations_run_once(tmp_path):
+    """多個工作進程同時啟動時遷移只執行一次，不會重複 ALTER TABLE"""
+    import threading
+
+    url = f"sqlite:///{tmp_path / 'workers.db'}"
+    with create_engine(url).begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE memory ("
+            "id VARCHAR(32) PRIMARY KEY, workspace_id VARCHAR(32), "
+            "created_by_agent_id VARCHAR(32), type VARCHAR, category VARCHAR, "
+            "content VARCHAR, visibility VARCHAR, is_deleted BOOLEAN, "
+            "created_at DATETIME, updated_at DATETIME, embeddings JSON)"
+        ))
+        conn.execute(
+            text("INSERT INTO memory (id, content, is_deleted, embeddings) "
+                 "VALUES (:id, 'legacy', 0, :embeddings)"),
+            {"id": uuid4().hex, "embeddings": json.dumps([1.0, 2.0, 3.0])}
+        )
+
+    # 每個線程一個引擎，模擬各自擁有連接池的工作進程
+    engines = [create_engine(url) for _ in range(4)]
+    barrier = threading.Barrier(len(engines))
+    results, errors = [], []
+
+    def worker(worker_engine):
+        barrier.wait()
+        try:
+            results.append(run_migrations(worker_engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(e,)) for e in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(len(executed) for executed in results)[:-1] == [0, 0, 0]
+    assert "0001_pack_embeddings" in max(results, key=len)
@@ -46,7 +46,7 @@ def fetch_memories_list(client: AgentMemClient, limit: int = 100) -> List[Memory
     TTL: 60 秒
     """
     try:
-        return client.list_memories(limit=limit, offset=0)
+        return client.list_memories(limit=limit)
     except Exception:
         return []
 